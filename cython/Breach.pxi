@@ -0,0 +1,285 @@
+# coding: utf-8
+
+"""
+Least-cost depression breaching
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef bint is_pit(float[:, :] elevations, float nodata, Py_ssize_t i, Py_ssize_t j) nogil:
+    """
+    True if pixel (i, j) has no lower neighbor,
+    and is neither on raster edge nor next to nodata
+    """
+
+    cdef:
+
+        Py_ssize_t height = elevations.shape[0], width = elevations.shape[1]
+        Py_ssize_t ik, jk
+        int x
+        float z = elevations[i, j]
+
+    for x in range(8):
+
+        ik = i + ci[x]
+        jk = j + cj[x]
+
+        if not ingrid(height, width, ik, jk) or elevations[ik, jk] == nodata:
+            return False
+
+        if elevations[ik, jk] < z:
+            return False
+
+    return True
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef bint is_outlet(float[:, :] elevations, float nodata, Py_ssize_t i, Py_ssize_t j, bint edges) nogil:
+    """
+    True if pixel (i, j) is next to nodata,
+    or on raster edge when `edges` is True
+    """
+
+    cdef:
+
+        Py_ssize_t height = elevations.shape[0], width = elevations.shape[1]
+        Py_ssize_t ik, jk
+        int x
+
+    for x in range(8):
+
+        ik = i + ci[x]
+        jk = j + cj[x]
+
+        if not ingrid(height, width, ik, jk):
+            if edges:
+                return True
+            continue
+
+        if elevations[ik, jk] == nodata:
+            return True
+
+    return False
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def breach_depressions(
+    float[:, :] elevations,
+    float nodata,
+    float max_depth=float('inf'),
+    Py_ssize_t max_length=-1,
+    float epsilon=1e-3,
+    Py_ssize_t padding=0):
+    """
+    Breach depressions along least-cost paths (Lindsay, 2016).
+
+    Pits are processed in order of increasing elevation.
+    From each pit, a least-cost search finds the nearest pixel
+    either lower than the pit, or next to nodata (outlet),
+    the cost of a pixel being its elevation
+    above the breach path at that pixel.
+    The path found is then carved so that elevations decrease
+    by `epsilon` at each step from the pit.
+    Pits requiring a breach deeper than `max_depth`
+    or longer than `max_length` are left unchanged,
+    to be resolved by depression filling.
+
+    With `padding` > 0, `elevations` is a tile padded with
+    `padding` pixels from neighboring tiles :
+    pits in the padding are left to the neighboring tiles,
+    and raster edges are not outlets,
+    so that breach paths only end on lower pixels
+    or next to nodata (tileset exterior).
+    Breach paths do not depend on tiling
+    when `padding` is greater than `max_length`.
+
+    Parameters
+    ----------
+
+    elevations: array-like, dtype=float32
+        Elevation raster (DEM), ndim=2, modified in place
+
+    nodata: float
+        No-data value in `elevations`
+
+    max_depth: float
+        Maximum breach depth, in elevation units
+
+    max_length: int
+        Maximum breach length, in pixels,
+        or -1 for no limit
+
+    epsilon: float
+        Elevation drop between successive pixels
+        of breach paths
+
+    padding: int
+        Width of tile padding, in pixels,
+        or 0 if raster edges are outlets
+
+    Returns
+    -------
+
+    breached: int
+        Number of breached pits
+
+    unresolved: int
+        Number of pits left unchanged
+    """
+
+    cdef:
+
+        Py_ssize_t height = elevations.shape[0], width = elevations.shape[1]
+        Py_ssize_t i, j, ik, jk, c, ck, p
+        long breached = 0, unresolved = 0
+        int x, k
+        float z, target, cost
+        float infinity = np.inf
+        bint found
+        ZPriorityQueue pits
+        ZCell pit
+        ShortestQueue queue
+        ShortestEntry entry
+        vector[Py_ssize_t] touched
+        vector[Py_ssize_t] path
+        float[:] costs
+        int[:] steps
+        Py_ssize_t[:] backlink
+
+    costs = np.full(height*width, infinity, dtype=np.float32)
+    steps = np.zeros(height*width, dtype=np.int32)
+    backlink = np.full(height*width, -1, dtype=np.intp)
+
+    with nogil:
+
+        for i in range(padding, height-padding):
+            for j in range(padding, width-padding):
+
+                if elevations[i, j] != nodata and is_pit(elevations, nodata, i, j):
+                    pits.push(ZCell(-elevations[i, j], Cell(i, j)))
+
+        while not pits.empty():
+
+            pit = pits.top()
+            pits.pop()
+
+            i = pit.second.first
+            j = pit.second.second
+
+            # pit may have been breached by a previous path
+
+            if not is_pit(elevations, nodata, i, j):
+                continue
+
+            # least-cost search for the nearest lower pixel or outlet
+
+            z = elevations[i, j]
+            c = i*width + j
+            costs[c] = 0
+            touched.push_back(c)
+            queue.push(ShortestEntry(0, Cell(i, j)))
+            found = False
+
+            while not queue.empty():
+
+                entry = queue.top()
+                queue.pop()
+
+                ik = entry.second.first
+                jk = entry.second.second
+                ck = ik*width + jk
+
+                if -entry.first > costs[ck]:
+                    continue
+
+                k = steps[ck]
+
+                if ck != c:
+
+                    if (
+                        elevations[ik, jk] <= z - k*epsilon
+                        or is_outlet(elevations, nodata, ik, jk, padding == 0)
+                    ):
+
+                        found = True
+                        break
+
+                if max_length >= 0 and k >= max_length:
+                    continue
+
+                for x in range(8):
+
+                    i = ik + ci[x]
+                    j = jk + cj[x]
+
+                    if not ingrid(height, width, i, j) or elevations[i, j] == nodata:
+                        continue
+
+                    target = z - (k+1)*epsilon
+                    cost = max[float](elevations[i, j] - target, 0)
+
+                    if cost > max_depth:
+                        continue
+
+                    cost += costs[ck]
+                    p = i*width + j
+
+                    if cost < costs[p]:
+
+                        if costs[p] == infinity:
+                            touched.push_back(p)
+
+                        costs[p] = cost
+                        steps[p] = k+1
+                        backlink[p] = ck
+                        queue.push(ShortestEntry(-cost, Cell(i, j)))
+
+            if found:
+
+                # carve path from pit to lower pixel or outlet
+
+                path.clear()
+                p = ck
+
+                while p != c:
+                    path.push_back(p)
+                    p = backlink[p]
+
+                for k in range(1, path.size()+1):
+
+                    p = path[path.size()-k]
+                    target = z - k*epsilon
+
+                    if elevations[p // width, p % width] <= target:
+                        break
+
+                    elevations[p // width, p % width] = target
+
+                breached += 1
+
+            else:
+
+                unresolved += 1
+
+            # reset search state
+
+            while not queue.empty():
+                queue.pop()
+
+            for p in touched:
+                costs[p] = infinity
+                steps[p] = 0
+                backlink[p] = -1
+
+            touched.clear()
+
+    return breached, unresolved
@@ -0,0 +1,121 @@
+# coding: utf-8
+
+"""
+Priority queue for shortest path kernels,
+either a binary heap or a monotone bucket queue
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+ctypedef deque[ShortestEntry] ShortestBucket
+
+cdef cppclass ShortestFrontier:
+    """
+    Drop-in replacement for ShortestQueue,
+    with entries (-distance, cell).
+
+    With quantum = 0, entries are kept in one binary heap.
+
+    With quantum > 0, entries are kept in buckets
+    of width `quantum` in distance (Dial's algorithm),
+    and buckets are consumed in order of increasing distance,
+    in first-in first-out order within a bucket,
+    so that push and pop take constant time
+    and cells reached first at nearly equal distance
+    are also settled first.
+    Entries pushed below the current bucket,
+    as when a kernel resets the distance of a settled cell,
+    move the current bucket back.
+
+    Cells are settled at their exact shortest distance
+    when `quantum` is lower than or equal to the minimum step length,
+    otherwise within `quantum` of their shortest distance.
+    Among origins at nearly equal distance,
+    a cell may be reached from another origin
+    than with a binary heap.
+    """
+
+    ShortestQueue heap
+    vector[ShortestBucket] buckets
+    size_t current
+    size_t count
+    float quantum
+
+    __init__():
+
+        this.current = 0
+        this.count = 0
+        this.quantum = 0
+
+    void set_quantum(float quantum) nogil:
+
+        this.quantum = quantum
+
+    bint empty() nogil:
+
+        if this.quantum > 0:
+            return this.count == 0
+
+        return this.heap.empty()
+
+    void push(ShortestEntry entry) nogil:
+
+        cdef:
+            size_t bucket = 0
+            double d = -entry.first
+
+        if this.quantum > 0:
+
+            if d > 0:
+                bucket = <size_t>(d / this.quantum)
+
+            if bucket < this.current:
+                this.current = bucket
+
+            if bucket >= this.buckets.size():
+                this.buckets.resize(bucket + 1)
+
+            this.buckets[bucket].push_back(entry)
+            this.count += 1
+
+        else:
+
+            this.heap.push(entry)
+
+    void advance() nogil:
+        """
+        Move to the first non-empty bucket,
+        releasing memory of exhausted buckets
+        """
+
+        while this.buckets[this.current].empty():
+            this.buckets[this.current].shrink_to_fit()
+            this.current += 1
+
+    ShortestEntry top() nogil:
+
+        if this.quantum > 0:
+
+            this.advance()
+            return this.buckets[this.current].front()
+
+        return this.heap.top()
+
+    void pop() nogil:
+
+        if this.quantum > 0:
+
+            this.advance()
+            this.buckets[this.current].pop_front()
+            this.count -= 1
+
+        else:
+
+            this.heap.pop()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batch LineString Burning
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from libc.math cimport isinf, rint, fabs
+
+cdef enum BurnRule:
+    BURN_REPLACE = 0
+    BURN_MIN = 1
+    BURN_MAX = 2
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void burn_pixel(
+    float[:, :] elevations,
+    Py_ssize_t i,
+    Py_ssize_t j,
+    double z,
+    int rule,
+    float nodata) nogil:
+
+    cdef:
+
+        Py_ssize_t height = elevations.shape[0], width = elevations.shape[1]
+        float current
+
+    if not ingrid(height, width, i, j) or isinf(z):
+        return
+
+    current = elevations[i, j]
+
+    if rule == BURN_REPLACE or current == nodata:
+        elevations[i, j] = <float> z
+    elif rule == BURN_MIN:
+        if z < current:
+            elevations[i, j] = <float> z
+    elif rule == BURN_MAX:
+        if z > current:
+            elevations[i, j] = <float> z
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def burn_lines(
+    float[:, :] elevations,
+    double[:, :] coordinates,
+    long long[:] offsets,
+    float delta=0.0,
+    int rule=0,
+    float nodata=-99999.0):
+    """
+    Burn linestrings into elevation raster,
+    interpolating z along each segment.
+
+    Pixels are visited following the same stepping
+    as `rasterize.rasterize_linestringz`.
+
+    Parameters
+    ----------
+
+    elevations: array-like, dtype=float32, ndim=2
+        Elevation raster, modified in place
+
+    coordinates: array-like, shape (n, 3), dtype=float64
+        (px, py, z) vertices of all linestrings, in pixel coordinates
+        (px = column, py = row). Vertices with infinite z are not burnt,
+        and segments with an infinite z end are burnt at constant z
+
+    offsets: array-like, shape (lines+1,), dtype=int64
+        Linestring k spans coordinates[offsets[k]:offsets[k+1]]
+
+    delta: float
+        Value subtracted from interpolated z before burning
+
+    rule: int
+        0 (replace) overwrites elevations,
+        1 (min) only lowers elevations,
+        2 (max) only raises elevations.
+        Nodata pixels are always overwritten.
+
+    nodata: float
+        No-data value in `elevations`
+
+    Returns
+    -------
+
+    Number of burnt vertices (pixel visits)
+    """
+
+    cdef:
+
+        Py_ssize_t lines = offsets.shape[0] - 1
+        Py_ssize_t k, v, n, steps
+        double x, y, z, dx, dy, dz, count
+        double ax, ay, az, bx, by, bz
+        long long visits = 0
+
+    with nogil:
+
+        for k in range(lines):
+            for v in range(offsets[k], offsets[k+1]-1):
+
+                ax = coordinates[v, 0]
+                ay = coordinates[v, 1]
+                az = coordinates[v, 2]
+                bx = coordinates[v+1, 0]
+                by = coordinates[v+1, 1]
+                bz = coordinates[v+1, 2]
+
+                x = ax
+                y = ay
+                z = az
+
+                dx = fabs(bx - ax)
+                dy = fabs(by - ay)
+
+                if isinf(az) or isinf(bz):
+                    dz = 0.0
+                else:
+                    dz = bz - az
+
+                if dx > 0 or dy > 0:
+
+                    if dx > dy:
+                        count = dx
+                        dx = 1.0
+                        dy = dy / count
+                        dz = dz / count
+                    else:
+                        count = dy
+                        dy = 1.0
+                        dx = dx / count
+                        dz = dz / count
+
+                    if ax > bx:
+                        dx = -dx
+                    if ay > by:
+                        dy = -dy
+
+                    steps = <Py_ssize_t> ceil(count)
+
+                    for n in range(steps):
+
+                        burn_pixel(
+                            elevations,
+                            <Py_ssize_t> rint(y),
+                            <Py_ssize_t> rint(x),
+                            z - delta,
+                            rule,
+                            nodata)
+
+                        visits += 1
+                        x = x + dx
+                        y = y + dy
+                        z = z + dz
+
+                else:
+
+                    burn_pixel(
+                        elevations,
+                        <Py_ssize_t> rint(y),
+                        <Py_ssize_t> rint(x),
+                        z - delta,
+                        rule,
+                        nodata)
+
+                    visits += 1
+
+    return visits
@@ -26,7 +26,8 @@ def continuity_analysis(
         LandCoverClass max_class=0,
         float min_distance=0.0,
         float max_distance=0.0,
-        float jitter=0.4):
+        float jitter=0.4,
+        float quantum=0.0):
     """
     Assign to each input cell the maximum value on the shortest path
     to the nearest origin (reference) cell.
@@ -98,6 +99,16 @@ def continuity_analysis(
         Amplitude of jitter to add to grid locations
         in order to avoid grid artefacts.
         Disable jitter with jitter = 0
+
+    quantum: float
+
+        Distance quantum of the priority queue.
+        With quantum > 0, use a monotone bucket queue
+        with buckets of width `quantum`,
+        instead of a binary heap (quantum = 0, default).
+        Cells are settled in order of distance within `quantum`,
+        so values propagated from nearly equidistant origins
+        may differ from the binary heap.
     """
 
     cdef:
@@ -109,14 +120,15 @@ def continuity_analysis(
 
         Cell ij, ijk
         ShortestEntry entry
-        ShortestQueue queue
+        ShortestFrontier queue
         # unsigned char[:, :] state
-        map[Cell, Cell] ancestors
+        signed char[:, :] ancestors
         float[:, :] jitteri, jitterj
         bint withcost = False
 
     height = landcover.shape[0]
     width = landcover.shape[1]
+    ancestors = np.full((height, width), -1, dtype=np.int8)
 
     assert state.shape[0] == height and state.shape[1] == width
     assert out.shape[0] == height and out.shape[1] == width
@@ -132,6 +144,8 @@ def continuity_analysis(
         jitteri = np.float32(np.random.normal(0, jitter, (height, width)))
         jitterj = np.float32(np.random.normal(0, jitter, (height, width)))
 
+    queue.set_quantum(quantum)
+
     with nogil:
 
         if jitter > 0:
@@ -192,11 +206,11 @@ def continuity_analysis(
             if distance[i, j] < dist:
                 continue
 
-            if ancestors.count(ij) > 0:
+            if ancestors[i, j] >= 0:
 
-                ijk = ancestors[ij]
-                ik = ijk.first
-                jk = ijk.second
+                k = ancestors[i, j]
+                ik = i - ci[k]
+                jk = j - cj[k]
                 
                 out[i, j] = max[LandCoverClass](landcover[i, j], out[ik, jk])
                 
@@ -207,8 +221,6 @@ def continuity_analysis(
                     distance[i, j] = distance[ik, jk] + 1
                 else:
                     distance[i, j] = distance[ik, jk] + 1.4142135623730951 # sqrt(2)
-                
-                ancestors.erase(ij)
 
             # else:
 
@@ -273,7 +285,7 @@ def continuity_analysis(
                     queue.push(entry)
                     state[ik, jk] = 1 # seen
                     distance[ik, jk] = dist
-                    ancestors[ijk] = ij
+                    ancestors[ik, jk] = k
 
                 elif state[ik, jk] == 1:
 
@@ -283,4 +295,4 @@ def continuity_analysis(
                         entry = ShortestEntry(-dist, ijk)
                         queue.push(entry)
                         distance[ik, jk] = dist
-                        ancestors[ijk] = ij
+                        ancestors[ik, jk] = k
@@ -76,11 +76,12 @@ def continuity_mask(
         ShortestEntry entry
         ShortestQueue queue
         # unsigned char[:, :] state
-        map[Cell, Cell] ancestors
+        signed char[:, :] ancestors
         float[:, :] jitteri, jitterj
 
     height = state.shape[0]
     width = state.shape[1]
+    ancestors = np.full((height, width), -1, dtype=np.int8)
     # state = np.zeros((height, width), dtype=np.uint8)
 
     # assert heights.shape[0] == height and heights.shape[1] == width
@@ -158,11 +159,11 @@ def continuity_mask(
             if distance[i, j] < dist:
                 continue
 
-            if ancestors.count(ij) > 0:
+            if ancestors[i, j] >= 0:
 
-                ijk = ancestors[ij]
-                ik = ijk.first
-                jk = ijk.second
+                k = ancestors[i, j]
+                ik = i - ci[k]
+                jk = j - cj[k]
                 
                 # out[i, j] = 1
                 
@@ -170,8 +171,6 @@ def continuity_mask(
                     distance[i, j] = distance[ik, jk] + 1
                 else:
                     distance[i, j] = distance[ik, jk] + 1.4142135623730951 # sqrt(2)
-                
-                ancestors.erase(ij)
             
             state[i, j] = 2 # settled
 
@@ -216,7 +215,7 @@ def continuity_mask(
                     queue.push(entry)
                     state[ik, jk] = 1 # seen
                     distance[ik, jk] = dist
-                    ancestors[ijk] = ij
+                    ancestors[ik, jk] = k
 
                 elif state[ik, jk] == 1:
 
@@ -226,4 +225,4 @@ def continuity_mask(
                         entry = ShortestEntry(-dist, ijk)
                         queue.push(entry)
                         distance[ik, jk] = dist
-                        ancestors[ijk] = ij
+                        ancestors[ik, jk] = k
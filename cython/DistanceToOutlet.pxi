@@ -138,3 +138,215 @@ def distance_to_outlet(D8Flow[:, :] flow, float[:, :] distance, float conversion
 
                                 stack.push(Cell(ik, jk))
                                 seen[ik, jk] = True
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t downstream_order(
+    D8Flow[:, :] flow,
+    Py_ssize_t[:] downstream,
+    unsigned char[:] inflow,
+    Py_ssize_t[:] queue) nogil:
+    """
+    Fill `queue` with flat pixel indices in topological order,
+    from sources to outlets, and `downstream` with flat downstream indices,
+    as decoded by `flat_flow_graph`.
+    `inflow` must be initialized to 0.
+
+    Returns the number of ordered pixels.
+    """
+
+    cdef:
+
+        Py_ssize_t size = flow.shape[0]*flow.shape[1]
+        Py_ssize_t c, d, head = 0, tail = 0
+
+    flat_flow_graph(flow, downstream, inflow)
+
+    for c in range(size):
+        if inflow[c] == 0:
+            queue[tail] = c
+            tail += 1
+
+    while head < tail:
+
+        c = queue[head]
+        head += 1
+        d = downstream[c]
+
+        if d < 0:
+            continue
+
+        inflow[d] -= 1
+
+        if inflow[d] == 0:
+            queue[tail] = d
+            tail += 1
+
+    return tail
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def tile_exit_distance(D8Flow[:, :] flow, float distance=1.0):
+    """
+    Connect every border pixel to its local tile exit,
+    in one reverse topological pass over the flow raster.
+
+    The exit of a pixel is the last pixel within the raster
+    on its flow path, ie. either a pixel without downstream pixel
+    (no-flow pixel or outlet) or a pixel flowing outside of the raster.
+
+    Parameters
+    ----------
+
+    flow: array-like
+        D8 Flow direction raster (ndim=2), nodata=-1
+
+    distance: float
+        Pixel size
+
+    Returns
+    -------
+
+    links: array, shape (n, 4), dtype=int32
+        (i, j, ti, tj) border pixel (i, j) and its target (ti, tj) :
+        border pixels flowing outside of raster
+        target the (out of range) pixel they flow to,
+        other border pixels target their local exit pixel
+
+    lengths: array, shape (n,), dtype=float32
+        Flow path length from (i, j) to (ti, tj)
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t size = height*width
+        Py_ssize_t i, j, c, d, n, count
+        int k
+        float diagonal = distance * sqrt(2)
+        D8Flow direction
+        Py_ssize_t[:] downstream
+        Py_ssize_t[:] queue
+        Py_ssize_t[:] exits
+        float[:] lengths
+        unsigned char[:] inflow
+        vector[int] links
+        vector[float] link_lengths
+
+    downstream = np.zeros(size, dtype=np.intp)
+    queue = np.zeros(size, dtype=np.intp)
+    exits = np.full(size, -1, dtype=np.intp)
+    lengths = np.zeros(size, dtype=np.float32)
+    inflow = np.zeros(size, dtype=np.uint8)
+
+    with nogil:
+
+        count = downstream_order(flow, downstream, inflow, queue)
+
+        for n in range(count-1, -1, -1):
+
+            c = queue[n]
+            d = downstream[c]
+
+            if d < 0:
+                exits[c] = c
+            else:
+                exits[c] = exits[d]
+                lengths[c] = lengths[d] + step_length(flow[c // width, c % width], distance, diagonal)
+
+        for c in range(size):
+
+            i = c // width
+            j = c % width
+
+            if not (i == 0 or i == height-1 or j == 0 or j == width-1):
+                continue
+
+            direction = flow[i, j]
+
+            if direction <= 0 or direction >= 256 or d8_index[direction] < 0:
+                continue
+
+            k = d8_index[direction]
+
+            if not ingrid(height, width, i + ci[k], j + cj[k]):
+
+                links.push_back(i)
+                links.push_back(j)
+                links.push_back(i + ci[k])
+                links.push_back(j + cj[k])
+                if (k % 2) == 0:
+                    link_lengths.push_back(distance)
+                else:
+                    link_lengths.push_back(diagonal)
+
+            elif exits[c] >= 0:
+
+                links.push_back(i)
+                links.push_back(j)
+                links.push_back(exits[c] // width)
+                links.push_back(exits[c] % width)
+                link_lengths.push_back(lengths[c])
+
+    return (
+        np.array(links, dtype=np.int32).reshape(-1, 4),
+        np.array(link_lengths, dtype=np.float32)
+    )
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def flow_distance(D8Flow[:, :] flow, float[:, ::1] out, float distance=1.0):
+    """
+    Propagate distance to outlet upstream,
+    in one reverse topological pass over the flow raster.
+
+    Parameters
+    ----------
+
+    flow: array-like
+        D8 Flow direction raster (ndim=2), nodata=-1
+
+    out: array-like, dtype=float32, C-contiguous
+        Same shape as flow, modified in place.
+        Values of exit pixels (pixels without downstream pixel
+        within the raster) are taken as known distances,
+        other values are overwritten.
+
+    distance: float
+        Pixel size, in output distance unit
+
+    Returns
+    -------
+
+    Distance to outlet raster, dtype=np.float32
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t size = height*width
+        Py_ssize_t c, d, n, count
+        float diagonal = distance * sqrt(2)
+        float[:] values
+        Py_ssize_t[:] downstream
+        Py_ssize_t[:] queue
+        unsigned char[:] inflow
+
+    values = np.asarray(out).reshape(size)
+    downstream = np.zeros(size, dtype=np.intp)
+    queue = np.zeros(size, dtype=np.intp)
+    inflow = np.zeros(size, dtype=np.uint8)
+
+    with nogil:
+
+        count = downstream_order(flow, downstream, inflow, queue)
+
+        for n in range(count-1, -1, -1):
+
+            c = queue[n]
+            d = downstream[c]
+
+            if d >= 0:
+                values[c] = values[d] + step_length(flow[c // width, c % width], distance, diagonal)
+
+    return np.asarray(out)
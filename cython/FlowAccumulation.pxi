@@ -125,6 +125,199 @@ def flow_accumulation(short[:,:] flow, ContributingArea[:, :] out=None):
 
     return np.asarray(out)
 
+#: D8 direction value (1, 2, 4, ..., 128) -> direction index (0-7),
+#: -1 for any other value
+cdef signed char[256] d8_index
+
+cdef void init_d8_index():
+
+    cdef int v, k
+
+    for v in range(256):
+        d8_index[v] = -1
+
+    for k in range(8):
+        d8_index[1 << k] = k
+
+init_d8_index()
+
+cdef inline float step_length(D8Flow direction, float distance, float diagonal) nogil:
+    """
+    Length of one step along D8 flow direction `direction`,
+    which must be a valid direction :
+    cardinal directions have even indices, diagonals odd indices
+    """
+
+    if d8_index[direction] % 2 == 0:
+        return distance
+
+    return diagonal
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t flat_flow_graph(
+    D8Flow[:, :] flow,
+    Py_ssize_t[:] downstream,
+    unsigned char[:] inflow) nogil:
+    """
+    Decode D8 flow direction into flat downstream indices,
+    using a direction to offset lookup table,
+    and count inflow degree of each pixel.
+
+    `downstream` is set to -1 for pixels without a downstream pixel
+    within the raster. `inflow` must be initialized to 0.
+
+    Returns the number of pixels flowing outside of raster.
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t i, j, c = 0, ik, jk, d
+        Py_ssize_t noutlets = 0
+        Py_ssize_t[8] offset
+        D8Flow direction
+        int k
+
+    for k in range(8):
+        offset[k] = ci[k]*width + cj[k]
+
+    for i in range(height):
+        for j in range(width):
+
+            direction = flow[i, j]
+            downstream[c] = -1
+
+            if direction > 0 and direction < 256:
+
+                k = d8_index[direction]
+
+                if k >= 0:
+
+                    ik = i + ci[k]
+                    jk = j + cj[k]
+
+                    if ingrid(height, width, ik, jk):
+                        d = c + offset[k]
+                        downstream[c] = d
+                        inflow[d] += 1
+                    else:
+                        noutlets += 1
+
+            c += 1
+
+    return noutlets
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def flow_accumulation_fast(
+    D8Flow[:, :] flow,
+    float[:, ::1] out=None,
+    bint upstream_length=False,
+    float distance=1.0):
+    """
+    Flow accumulation from D8 flow direction,
+    optionally with upstream length (longest flow path length),
+    in one traversal of the flow raster.
+
+    Pixels are processed in topological order
+    from a preallocated flat index queue,
+    with the GIL released.
+
+    Parameters
+    ----------
+
+    flow: array-like
+        D8 Flow direction raster (ndim=2), nodata=-1
+
+    out: array-like, dtype=float32, C-contiguous
+        Same shape as flow, local contributions,
+        modified in place, or None to count pixels
+
+    upstream_length: bool
+        Also calculate the length of the longest flow path
+        upstream of each pixel
+
+    distance: float
+        Pixel size, used to scale upstream length
+
+    Returns
+    -------
+
+    Flow accumulation raster, dtype=np.float32, nodata=0,
+    or (accumulation, upstream length) tuple
+    if `upstream_length` is True
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t size = height*width
+        Py_ssize_t c, d, head = 0, tail = 0
+        float step
+        float diagonal = distance * sqrt(2)
+        float[:] acc
+        float[:] length
+        unsigned char[:] inflow
+        Py_ssize_t[:] downstream
+        Py_ssize_t[:] queue
+
+    if out is None:
+        out = np.ones((height, width), dtype=np.float32)
+
+    acc = np.asarray(out).reshape(size)
+
+    if upstream_length:
+        lengths = np.zeros((height, width), dtype=np.float32)
+        length = lengths.reshape(size)
+    else:
+        length = np.zeros(0, dtype=np.float32)
+
+    inflow = np.zeros(size, dtype=np.uint8)
+    downstream = np.zeros(size, dtype=np.intp)
+    queue = np.zeros(size, dtype=np.intp)
+
+    with nogil:
+
+        flat_flow_graph(flow, downstream, inflow)
+
+        for c in range(size):
+            if inflow[c] == 0:
+                queue[tail] = c
+                tail += 1
+
+        # every pixel enters the queue at most once,
+        # so the queue never wraps around
+
+        while head < tail:
+
+            c = queue[head]
+            head += 1
+            d = downstream[c]
+
+            if d < 0:
+                continue
+
+            acc[d] = acc[d] + acc[c]
+
+            if upstream_length:
+
+                step = step_length(flow[c // width, c % width], distance, diagonal)
+
+                if length[c] + step > length[d]:
+                    length[d] = length[c] + step
+
+            inflow[d] -= 1
+
+            if inflow[d] == 0:
+                queue[tail] = d
+                tail += 1
+
+    if upstream_length:
+        return np.asarray(out), lengths
+
+    return np.asarray(out)
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def outlets(short[:, :] flow):
@@ -179,3 +372,296 @@ def outlets(short[:, :] flow):
                     targets.push_back(Cell(ik, jk))
 
     return outlets, targets
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t flow_order(D8Flow[:, :] flow, unsigned char[:, :] inflow, Py_ssize_t[:] order) nogil:
+    """
+    Sort pixels in topological order, from sources to outlets,
+    according to D8 flow direction.
+
+    `order` is filled with flat pixel indices (i*width + j)
+    and doubles as the processing queue.
+    `inflow` must be initialized to 0.
+
+    Returns the number of ordered pixels,
+    which is less than the number of pixels
+    if flow contains cycles.
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t i, j, ik, jk, c
+        Py_ssize_t head = 0, tail = 0
+        int x
+        D8Flow direction
+
+    for i in range(height):
+        for j in range(width):
+
+            direction = flow[i, j]
+
+            if direction == -1 or direction == 0:
+                continue
+
+            x = ilog2(direction)
+            ik = i + ci[x]
+            jk = j + cj[x]
+
+            if ingrid(height, width, ik, jk):
+                inflow[ik, jk] += 1
+
+    for i in range(height):
+        for j in range(width):
+            if inflow[i, j] == 0:
+                order[tail] = i*width + j
+                tail += 1
+
+    while head < tail:
+
+        c = order[head]
+        head += 1
+        i = c // width
+        j = c % width
+
+        direction = flow[i, j]
+
+        if direction == -1 or direction == 0:
+            continue
+
+        x = ilog2(direction)
+        ik = i + ci[x]
+        jk = j + cj[x]
+
+        if not ingrid(height, width, ik, jk):
+            continue
+
+        inflow[ik, jk] -= 1
+
+        if inflow[ik, jk] == 0:
+            order[tail] = ik*width + jk
+            tail += 1
+
+    return tail
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def flow_accumulation_multiband(D8Flow[:, :] flow, float[:, :, :] out):
+    """
+    Multiband flow accumulation from D8 flow direction.
+    All bands are accumulated in the same traversal of the flow raster.
+
+    Parameters
+    ----------
+
+    flow: array-like
+        D8 Flow direction raster (ndim=2), nodata=-1
+
+    out: array-like, dtype=float32, shape (bands, height, width)
+        Local contributions to accumulate, modified in place
+
+    Returns
+    -------
+
+    Accumulated values, dtype=float32, shape (bands, height, width)
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t bands = out.shape[0]
+        Py_ssize_t i, j, ik, jk, c, k, count, b
+        int x
+        D8Flow direction
+        unsigned char[:, :] inflow
+        Py_ssize_t[:] order
+
+    inflow = np.zeros((height, width), dtype=np.uint8)
+    order = np.zeros(height*width, dtype=np.intp)
+
+    with nogil:
+
+        count = flow_order(flow, inflow, order)
+
+        for k in range(count):
+
+            c = order[k]
+            i = c // width
+            j = c % width
+
+            direction = flow[i, j]
+
+            if direction == -1 or direction == 0:
+                continue
+
+            x = ilog2(direction)
+            ik = i + ci[x]
+            jk = j + cj[x]
+
+            if ingrid(height, width, ik, jk):
+                for b in range(bands):
+                    out[b, ik, jk] = out[b, ik, jk] + out[b, i, j]
+
+    return np.asarray(out)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def tile_outlet_graph(D8Flow[:, :] flow, float[:, :, :] acc=None):
+    """
+    Connect tile border pixels to tile outlets,
+    and calculate local contributions accumulated at each tile outlet.
+
+    Parameters
+    ----------
+
+    flow: array-like
+        D8 Flow direction raster (ndim=2), nodata=-1
+
+    acc: array-like, dtype=float32, shape (bands, height, width)
+        Local contributions to accumulate, modified in place,
+        or None to count pixels
+
+    Returns
+    -------
+
+    outlets: array, shape (n, 4), dtype=int32
+        (i, j, ti, tj) outlet pixels flowing outside of raster,
+        with target pixel (ti, tj) outside of raster range
+
+    areas: array, shape (n, bands), dtype=float32
+        Local accumulated values at each outlet pixel
+
+    links: array, shape (m, 4), dtype=int32
+        (i, j, oi, oj) border pixel (i, j) connected to
+        the pixel (oi, oj) where its flow path leaves the tile
+        or stops ; border pixels connected to themselves are omitted
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t bands
+        Py_ssize_t i, j, ik, jk, c, d, k, b
+        Py_ssize_t count, noutlets = 0, nlinks = 0
+        int x
+        D8Flow direction
+        unsigned char[:, :] inflow
+        Py_ssize_t[:] order
+        Py_ssize_t[:] exits
+        int[:, :] outlets
+        float[:, :] areas
+        int[:, :] links
+
+    if acc is None:
+        acc = np.ones((1, height, width), dtype=np.float32)
+
+    bands = acc.shape[0]
+    inflow = np.zeros((height, width), dtype=np.uint8)
+    order = np.zeros(height*width, dtype=np.intp)
+    exits = np.full(height*width, -1, dtype=np.intp)
+
+    with nogil:
+
+        count = flow_order(flow, inflow, order)
+
+        for k in range(count):
+
+            c = order[k]
+            i = c // width
+            j = c % width
+
+            direction = flow[i, j]
+
+            if direction == -1 or direction == 0:
+                continue
+
+            x = ilog2(direction)
+            ik = i + ci[x]
+            jk = j + cj[x]
+
+            if ingrid(height, width, ik, jk):
+                for b in range(bands):
+                    acc[b, ik, jk] = acc[b, ik, jk] + acc[b, i, j]
+            else:
+                noutlets += 1
+
+        # Reverse topological order :
+        # downstream exit is known before upstream pixels
+
+        for k in range(count-1, -1, -1):
+
+            c = order[k]
+            i = c // width
+            j = c % width
+            exits[c] = c
+
+            direction = flow[i, j]
+
+            if direction == -1 or direction == 0:
+                continue
+
+            x = ilog2(direction)
+            ik = i + ci[x]
+            jk = j + cj[x]
+
+            if ingrid(height, width, ik, jk) and exits[ik*width + jk] >= 0:
+                exits[c] = exits[ik*width + jk]
+
+        for i in range(height):
+            for j in range(width):
+                if (i == 0 or i == height-1 or j == 0 or j == width-1):
+                    c = i*width + j
+                    if exits[c] >= 0 and exits[c] != c:
+                        nlinks += 1
+
+    outlets = np.zeros((noutlets, 4), dtype=np.int32)
+    areas = np.zeros((noutlets, bands), dtype=np.float32)
+    links = np.zeros((nlinks, 4), dtype=np.int32)
+
+    with nogil:
+
+        k = 0
+
+        for i in range(height):
+            for j in range(width):
+
+                direction = flow[i, j]
+
+                if direction == -1 or direction == 0:
+                    continue
+
+                x = ilog2(direction)
+                ik = i + ci[x]
+                jk = j + cj[x]
+
+                if not ingrid(height, width, ik, jk) and k < noutlets:
+
+                    outlets[k, 0] = i
+                    outlets[k, 1] = j
+                    outlets[k, 2] = ik
+                    outlets[k, 3] = jk
+
+                    for b in range(bands):
+                        areas[k, b] = acc[b, i, j]
+
+                    k += 1
+
+        k = 0
+
+        for i in range(height):
+            for j in range(width):
+                if (i == 0 or i == height-1 or j == 0 or j == width-1):
+
+                    c = i*width + j
+                    d = exits[c]
+
+                    if d >= 0 and d != c:
+
+                        links[k, 0] = i
+                        links[k, 1] = j
+                        links[k, 2] = d // width
+                        links[k, 3] = d % width
+                        k += 1
+
+    return np.asarray(outlets), np.asarray(areas), np.asarray(links)
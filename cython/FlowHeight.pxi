@@ -0,0 +1,262 @@
+# coding: utf-8
+
+"""
+Height and distance to the first drainage pixel
+following flow direction, in one reverse topological pass
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def tile_exit_reference(
+        D8Flow[:, :] flow,
+        float[:, :] elevations,
+        float[:, :] reference,
+        float nodata,
+        float distance=1.0):
+    """
+    Connect every border pixel to the first reference pixel
+    on its flow path within the raster, or to its local tile exit,
+    in one reverse topological pass over the flow raster.
+
+    Parameters
+    ----------
+
+    flow: array-like
+        D8 Flow direction raster (ndim=2), nodata=-1
+
+    elevations: array-like, dtype=float32
+        Digital elevation model, same shape as `flow`
+
+    reference: array-like, dtype=float32
+        Reference elevation of drainage pixels,
+        `nodata` everywhere else
+
+    nodata: float
+        No data value in `reference`
+
+    distance: float
+        Pixel size
+
+    Returns
+    -------
+
+    links: array, shape (n, 4), dtype=int32
+        (i, j, ti, tj) border pixel (i, j) and its target (ti, tj) :
+        border pixels flowing outside of raster
+        target the (out of range) pixel they flow to,
+        other border pixels target either the first reference pixel
+        or the local exit pixel on their flow path
+
+    lengths: array, shape (n,), dtype=float32
+        Flow path length from (i, j) to (ti, tj)
+
+    peaks: array, shape (n,), dtype=float32
+        Maximum elevation on the flow path from (i, j) to (ti, tj),
+        excluding (ti, tj) if it lies outside of raster
+
+    values: array, shape (n,), dtype=float32
+        Reference elevation of target pixel,
+        or `nodata` if target is not a reference pixel
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t size = height*width
+        Py_ssize_t i, j, c, d, e, n, count
+        int k
+        float diagonal = distance * sqrt(2)
+        D8Flow direction
+        Py_ssize_t[:] downstream
+        Py_ssize_t[:] queue
+        Py_ssize_t[:] exits
+        float[:] lengths
+        float[:] peaks
+        unsigned char[:] inflow
+        vector[int] links
+        vector[float] link_lengths
+        vector[float] link_peaks
+        vector[float] link_values
+
+    downstream = np.zeros(size, dtype=np.intp)
+    queue = np.zeros(size, dtype=np.intp)
+    exits = np.full(size, -1, dtype=np.intp)
+    lengths = np.zeros(size, dtype=np.float32)
+    peaks = np.zeros(size, dtype=np.float32)
+    inflow = np.zeros(size, dtype=np.uint8)
+
+    with nogil:
+
+        count = downstream_order(flow, downstream, inflow, queue)
+
+        for n in range(count-1, -1, -1):
+
+            c = queue[n]
+            d = downstream[c]
+            i = c // width
+            j = c % width
+
+            if d < 0 or reference[i, j] != nodata:
+                exits[c] = c
+                peaks[c] = elevations[i, j]
+            else:
+                exits[c] = exits[d]
+                lengths[c] = lengths[d] + step_length(flow[c // width, c % width], distance, diagonal)
+                peaks[c] = max[float](peaks[d], elevations[i, j])
+
+        for c in range(size):
+
+            i = c // width
+            j = c % width
+
+            if not (i == 0 or i == height-1 or j == 0 or j == width-1):
+                continue
+
+            e = exits[c]
+
+            if e < 0:
+                continue
+
+            if reference[e // width, e % width] != nodata:
+
+                links.push_back(i)
+                links.push_back(j)
+                links.push_back(e // width)
+                links.push_back(e % width)
+                link_lengths.push_back(lengths[c])
+                link_peaks.push_back(peaks[c])
+                link_values.push_back(reference[e // width, e % width])
+                continue
+
+            direction = flow[i, j]
+
+            if direction <= 0 or direction >= 256 or d8_index[direction] < 0:
+                continue
+
+            k = d8_index[direction]
+
+            if not ingrid(height, width, i + ci[k], j + cj[k]):
+
+                links.push_back(i)
+                links.push_back(j)
+                links.push_back(i + ci[k])
+                links.push_back(j + cj[k])
+                if (k % 2) == 0:
+                    link_lengths.push_back(distance)
+                else:
+                    link_lengths.push_back(diagonal)
+                link_peaks.push_back(elevations[i, j])
+                link_values.push_back(nodata)
+
+            else:
+
+                links.push_back(i)
+                links.push_back(j)
+                links.push_back(e // width)
+                links.push_back(e % width)
+                link_lengths.push_back(lengths[c])
+                link_peaks.push_back(peaks[c])
+                link_values.push_back(nodata)
+
+    return (
+        np.array(links, dtype=np.int32).reshape(-1, 4),
+        np.array(link_lengths, dtype=np.float32),
+        np.array(link_peaks, dtype=np.float32),
+        np.array(link_values, dtype=np.float32)
+    )
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def flow_reference(
+        D8Flow[:, :] flow,
+        float[:, :] elevations,
+        float[:, ::1] reference,
+        float[:, ::1] lengths,
+        float[:, ::1] peaks,
+        float nodata,
+        float distance=1.0):
+    """
+    Propagate reference elevation upstream,
+    in one reverse topological pass over the flow raster :
+    every pixel takes the reference elevation
+    of the first reference pixel on its flow path,
+    with the flow path length to that pixel
+    and the maximum elevation along the flow path.
+
+    Parameters
+    ----------
+
+    flow: array-like
+        D8 Flow direction raster (ndim=2), nodata=-1
+
+    elevations: array-like, dtype=float32
+        Digital elevation model, same shape as `flow`
+
+    reference: array-like, dtype=float32, C-contiguous
+        Same shape as flow, modified in place.
+        Pixels with reference elevation different from `nodata`
+        are taken as known, that is drainage pixels
+        and tile exits resolved from neighbor tiles.
+        Pixels flowing to no known pixel are left to `nodata`.
+
+    lengths: array-like, dtype=float32, C-contiguous
+        Same shape as flow, modified in place.
+        Flow path length to reference pixel,
+        read at known pixels.
+
+    peaks: array-like, dtype=float32, C-contiguous
+        Same shape as flow, modified in place.
+        Maximum elevation along flow path to reference pixel,
+        read at known pixels.
+
+    nodata: float
+        No data value in `reference`
+
+    distance: float
+        Pixel size, in output distance unit
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t size = height*width
+        Py_ssize_t c, d, n, count
+        float diagonal = distance * sqrt(2)
+        float[:] values
+        float[:] path_lengths
+        float[:] path_peaks
+        Py_ssize_t[:] downstream
+        Py_ssize_t[:] queue
+        unsigned char[:] inflow
+
+    values = np.asarray(reference).reshape(size)
+    path_lengths = np.asarray(lengths).reshape(size)
+    path_peaks = np.asarray(peaks).reshape(size)
+    downstream = np.zeros(size, dtype=np.intp)
+    queue = np.zeros(size, dtype=np.intp)
+    inflow = np.zeros(size, dtype=np.uint8)
+
+    with nogil:
+
+        count = downstream_order(flow, downstream, inflow, queue)
+
+        for n in range(count-1, -1, -1):
+
+            c = queue[n]
+            d = downstream[c]
+
+            if d < 0 or values[c] != nodata or values[d] == nodata:
+                continue
+
+            values[c] = values[d]
+            path_lengths[c] = path_lengths[d] + step_length(flow[c // width, c % width], distance, diagonal)
+            path_peaks[c] = max[float](path_peaks[d], elevations[c // width, c % width])
@@ -328,3 +328,82 @@ def multiband_raster_acc(float[:, :, :] raster, dict graph_in, float[:, :, :] ou
                 queue.push_back(target)
 
     return np.asarray(out)
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def tree_acc(Py_ssize_t[:] targets, double[:, :] weights, double[:, :] out=None):
+    """
+    Calculate cumulative values over a graph of nodes
+    having at most one downstream node each,
+    such as the graph of tile outlets and inlets.
+
+    Nodes are processed in topological order,
+    so that every node is visited only once.
+
+    Parameters
+    ----------
+
+    targets: array-like, shape (n,), dtype=intp
+        index of the downstream node of each node,
+        or -1 if the node has no downstream node
+
+    weights: array-like, shape (n, bands), dtype=float64
+        contribution of each node to its downstream node,
+        ie. the value accumulated _within_ the tile it belongs to
+
+    out: array-like, shape (n, bands), dtype=float64
+        Optional output array, initialized to 0
+
+    Returns
+    -------
+
+    out: array, shape (n, bands), dtype=float64
+        cumulative upstream value received by each node,
+        not including its own weight
+    """
+
+    cdef:
+
+        Py_ssize_t n = targets.shape[0], bands = weights.shape[1]
+        Py_ssize_t node, target, k
+        Py_ssize_t head = 0, tail = 0
+        Py_ssize_t[:] indegree
+        Py_ssize_t[:] queue
+
+    if out is None:
+        out = np.zeros((n, bands), dtype=np.float64)
+
+    indegree = np.zeros(n, dtype=np.intp)
+    queue = np.zeros(n, dtype=np.intp)
+
+    with nogil:
+
+        for node in range(n):
+            target = targets[node]
+            if target >= 0:
+                indegree[target] += 1
+
+        for node in range(n):
+            if indegree[node] == 0:
+                queue[tail] = node
+                tail += 1
+
+        while head < tail:
+
+            node = queue[head]
+            head += 1
+            target = targets[node]
+
+            if target < 0:
+                continue
+
+            for k in range(bands):
+                out[target, k] += out[node, k] + weights[node, k]
+
+            indegree[target] -= 1
+
+            if indegree[target] == 0:
+                queue[tail] = target
+                tail += 1
+
+    return np.asarray(out)
@@ -110,12 +110,13 @@ def layered_continuity_analysis(
         LayeredShortestEntry entry
         LayeredShortestQueue queue
         # unsigned char[:, :] state
-        map[Cell, Cell] ancestors
+        signed char[:, :] ancestors
         float[:, :] jitteri, jitterj
         bint withcost = False
 
     height = landcover.shape[0]
     width = landcover.shape[1]
+    ancestors = np.full((height, width), -1, dtype=np.int8)
 
     assert state.shape[0] == height and state.shape[1] == width
     assert out.shape[0] == height and out.shape[1] == width
@@ -194,11 +195,11 @@ def layered_continuity_analysis(
             if distance[i, j] < dist:
                 continue
 
-            if ancestors.count(ij) > 0:
+            if ancestors[i, j] >= 0:
 
-                ijk = ancestors[ij]
-                ik = ijk.first
-                jk = ijk.second
+                k = ancestors[i, j]
+                ik = i - ci[k]
+                jk = j - cj[k]
                 
                 out[i, j] = max[LandCoverClass](landcover[i, j], out[ik, jk])
                 
@@ -209,8 +210,6 @@ def layered_continuity_analysis(
                     distance[i, j] = distance[ik, jk] + 1
                 else:
                     distance[i, j] = distance[ik, jk] + 1.4142135623730951 # sqrt(2)
-                
-                ancestors.erase(ij)
 
             # else:
 
@@ -282,7 +281,7 @@ def layered_continuity_analysis(
                     state[ik, jk] = 1 # seen
                     distance[ik, jk] = dist
                     out[ik, jk] = klassk
-                    ancestors[ijk] = ij
+                    ancestors[ik, jk] = k
 
                 elif state[ik, jk] == 1:
 
@@ -294,4 +293,4 @@ def layered_continuity_analysis(
                         queue.push(entry)
                         distance[ik, jk] = dist
                         out[ik, jk] = klassk
-                        ancestors[ijk] = ij
+                        ancestors[ik, jk] = k
@@ -0,0 +1,465 @@
+# coding: utf-8
+
+"""
+Multiple flow direction (MFD) and D-infinity flow partition,
+with compact per-pixel proportions.
+
+Proportions are stored as a (height, width, 8) uint8 array,
+indexed by direction (N, NE, E, SE, S, SW, W, NW),
+and sum up to 255 for each pixel having at least one receiver.
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from libc.math cimport atan2, pow as cpow
+
+#: D-infinity facets, as (cardinal, diagonal) direction pairs
+cdef int[8] facet_cardinal = array.array('i', [ 0, 2, 2, 4, 4, 6, 6, 0 ])
+cdef int[8] facet_diagonal = array.array('i', [ 1, 1, 3, 3, 5, 5, 7, 7 ])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void quantize_proportions(double* weights, unsigned char[:, :, ::1] proportions, Py_ssize_t i, Py_ssize_t j) nogil:
+    """
+    Quantize positive weights into uint8 proportions summing up to 255
+    """
+
+    cdef:
+
+        double total = 0.0
+        int k, kmax = -1, remaining = 255
+        unsigned char p
+
+    for k in range(8):
+        total += weights[k]
+        if weights[k] > 0 and (kmax == -1 or weights[k] > weights[kmax]):
+            kmax = k
+
+    if kmax == -1:
+        return
+
+    for k in range(8):
+        p = <unsigned char> (255.0 * weights[k] / total)
+        proportions[i, j, k] = p
+        remaining -= p
+
+    proportions[i, j, kmax] += remaining
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def flow_partition(
+    float[:, :] elevations,
+    float nodata,
+    D8Flow[:, :] flow=None,
+    float exponent=1.1,
+    float distance=1.0,
+    bint dinf=False):
+    """
+    Partition flow between downslope neighbors
+
+    Parameters
+    ----------
+
+    elevations: array-like, dtype=float32
+        Elevation raster (DEM), ndim=2
+
+    nodata: float
+        No-data value in `elevations`
+
+    flow: array-like, optional
+        D8 flow direction raster, nodata=-1,
+        used for pixels without any downslope neighbor (flats)
+
+    exponent: float
+        MFD slope exponent (Freeman, 1991)
+
+    distance: float
+        Pixel size
+
+    dinf: bool
+        Use D-infinity partition (Tarboton, 1997)
+        instead of MFD
+
+    Returns
+    -------
+
+    proportions: array, shape (height, width, 8), dtype=uint8
+        Flow proportions toward each neighbor,
+        in units of 1/255
+    """
+
+    cdef:
+
+        Py_ssize_t height = elevations.shape[0], width = elevations.shape[1]
+        Py_ssize_t i, j, ik, jk
+        int k, f, kmax
+        float z, zk, z1, z2
+        double s, s1, s2, r, smax, rmax
+        double diagonal = distance * sqrt(2)
+        double quarter = M_PI / 4
+        double[8] weights
+        double[8] dist
+        D8Flow direction
+        bint has_flow = flow is not None
+        unsigned char[:, :, ::1] proportions
+
+    proportions = np.zeros((height, width, 8), dtype=np.uint8)
+
+    for k in range(8):
+        dist[k] = distance if (k % 2) == 0 else diagonal
+
+    with nogil:
+
+        for i in range(height):
+            for j in range(width):
+
+                z = elevations[i, j]
+
+                if z == nodata:
+                    continue
+
+                for k in range(8):
+                    weights[k] = 0.0
+
+                if dinf:
+
+                    smax = 0.0
+                    rmax = 0.0
+                    kmax = -1
+
+                    for f in range(8):
+
+                        ik = i + ci[facet_cardinal[f]]
+                        jk = j + cj[facet_cardinal[f]]
+
+                        if not ingrid(height, width, ik, jk) or elevations[ik, jk] == nodata:
+                            continue
+
+                        z1 = elevations[ik, jk]
+
+                        ik = i + ci[facet_diagonal[f]]
+                        jk = j + cj[facet_diagonal[f]]
+
+                        if not ingrid(height, width, ik, jk) or elevations[ik, jk] == nodata:
+                            continue
+
+                        z2 = elevations[ik, jk]
+
+                        s1 = (z - z1) / distance
+                        s2 = (z1 - z2) / distance
+                        r = atan2(s2, s1)
+                        s = sqrt(s1*s1 + s2*s2)
+
+                        if r < 0:
+                            r = 0.0
+                            s = s1
+                        elif r > quarter:
+                            r = quarter
+                            s = (z - z2) / diagonal
+
+                        if s > smax:
+                            smax = s
+                            rmax = r
+                            kmax = f
+
+                    if kmax >= 0:
+                        weights[facet_cardinal[kmax]] = (quarter - rmax) / quarter
+                        weights[facet_diagonal[kmax]] = rmax / quarter
+
+                else:
+
+                    for k in range(8):
+
+                        ik = i + ci[k]
+                        jk = j + cj[k]
+
+                        if not ingrid(height, width, ik, jk):
+                            continue
+
+                        zk = elevations[ik, jk]
+
+                        if zk != nodata and zk < z:
+                            weights[k] = cpow((z - zk) / dist[k], exponent)
+
+                quantize_proportions(weights, proportions, i, j)
+
+                if has_flow:
+
+                    direction = flow[i, j]
+
+                    if direction > 0 and direction < 256 and d8_index[direction] >= 0:
+
+                        s = 0
+                        for k in range(8):
+                            s += proportions[i, j, k]
+
+                        if s == 0:
+                            proportions[i, j, d8_index[direction]] = 255
+
+    return np.asarray(proportions)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t partition_order(
+    unsigned char[:, :, ::1] proportions,
+    unsigned short[:] inflow,
+    Py_ssize_t[:] order) nogil:
+    """
+    Sort pixels in topological order, from sources to outlets,
+    according to flow proportions.
+    `order` is filled with flat pixel indices (i*width + j)
+    and doubles as the processing queue.
+    `inflow` must be initialized to 0.
+
+    Returns the number of ordered pixels.
+    """
+
+    cdef:
+
+        Py_ssize_t height = proportions.shape[0], width = proportions.shape[1]
+        Py_ssize_t i, j, ik, jk, c, d
+        Py_ssize_t head = 0, tail = 0
+        int k
+
+    for i in range(height):
+        for j in range(width):
+            for k in range(8):
+                if proportions[i, j, k] > 0:
+
+                    ik = i + ci[k]
+                    jk = j + cj[k]
+
+                    if ingrid(height, width, ik, jk):
+                        inflow[ik*width + jk] += 1
+
+    for c in range(height*width):
+        if inflow[c] == 0:
+            order[tail] = c
+            tail += 1
+
+    while head < tail:
+
+        c = order[head]
+        head += 1
+        i = c // width
+        j = c % width
+
+        for k in range(8):
+            if proportions[i, j, k] > 0:
+
+                ik = i + ci[k]
+                jk = j + cj[k]
+
+                if ingrid(height, width, ik, jk):
+
+                    d = ik*width + jk
+                    inflow[d] -= 1
+
+                    if inflow[d] == 0:
+                        order[tail] = d
+                        tail += 1
+
+    return tail
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def partition_accumulation(unsigned char[:, :, ::1] proportions, float[:, ::1] out=None):
+    """
+    Flow accumulation according to flow proportions
+
+    Parameters
+    ----------
+
+    proportions: array, shape (height, width, 8), dtype=uint8
+        Flow proportions, as returned by `flow_partition`
+
+    out: array-like, dtype=float32, C-contiguous
+        Local contributions to accumulate, modified in place,
+        or None to count pixels
+
+    Returns
+    -------
+
+    Flow accumulation raster, dtype=np.float32
+    """
+
+    cdef:
+
+        Py_ssize_t height = proportions.shape[0], width = proportions.shape[1]
+        Py_ssize_t i, j, ik, jk, c, n, count
+        int k
+        float value
+        unsigned short[:] inflow
+        Py_ssize_t[:] order
+
+    if out is None:
+        out = np.ones((height, width), dtype=np.float32)
+
+    inflow = np.zeros(height*width, dtype=np.uint16)
+    order = np.zeros(height*width, dtype=np.intp)
+
+    with nogil:
+
+        count = partition_order(proportions, inflow, order)
+
+        for n in range(count):
+
+            c = order[n]
+            i = c // width
+            j = c % width
+            value = out[i, j] / 255.0
+
+            for k in range(8):
+                if proportions[i, j, k] > 0:
+
+                    ik = i + ci[k]
+                    jk = j + cj[k]
+
+                    if ingrid(height, width, ik, jk):
+                        out[ik, jk] += value * proportions[i, j, k]
+
+    return np.asarray(out)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def partition_outflow(unsigned char[:, :, ::1] proportions, float[:, ::1] acc):
+    """
+    Find flow leaving the raster from accumulated values
+
+    Parameters
+    ----------
+
+    proportions: array, shape (height, width, 8), dtype=uint8
+        Flow proportions, as returned by `flow_partition`
+
+    acc: array-like, dtype=float32
+        Accumulated values, as returned by `partition_accumulation`
+
+    Returns
+    -------
+
+    outlets: array, shape (n, 4), dtype=int32
+        (i, j, ti, tj) outlet pixels flowing outside of raster,
+        with target pixel (ti, tj) outside of raster range
+
+    areas: array, shape (n, 1), dtype=float32
+        Outflow from (i, j) to (ti, tj)
+    """
+
+    cdef:
+
+        Py_ssize_t height = proportions.shape[0], width = proportions.shape[1]
+        Py_ssize_t i, j, ik, jk, n = 0
+        int k
+        int[:, :] outlets
+        float[:, :] areas
+
+    for i in range(height):
+        for j in range(width):
+            if i == 0 or i == height-1 or j == 0 or j == width-1:
+                for k in range(8):
+                    if proportions[i, j, k] > 0 and not ingrid(height, width, i + ci[k], j + cj[k]):
+                        n += 1
+
+    outlets = np.zeros((n, 4), dtype=np.int32)
+    areas = np.zeros((n, 1), dtype=np.float32)
+    n = 0
+
+    with nogil:
+
+        for i in range(height):
+            for j in range(width):
+                if i == 0 or i == height-1 or j == 0 or j == width-1:
+                    for k in range(8):
+
+                        ik = i + ci[k]
+                        jk = j + cj[k]
+
+                        if proportions[i, j, k] > 0 and not ingrid(height, width, ik, jk):
+
+                            outlets[n, 0] = i
+                            outlets[n, 1] = j
+                            outlets[n, 2] = ik
+                            outlets[n, 3] = jk
+                            areas[n, 0] = acc[i, j] * proportions[i, j, k] / 255.0
+                            n += 1
+
+    return np.asarray(outlets), np.asarray(areas)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def partition_reference(unsigned char[:, :, ::1] proportions, float[:, ::1] reference, float nodata):
+    """
+    Propagate reference elevation upstream from seed pixels,
+    as the flow-weighted average of downstream reference values.
+
+    Parameters
+    ----------
+
+    proportions: array, shape (height, width, 8), dtype=uint8
+        Flow proportions, as returned by `flow_partition`
+
+    reference: array-like, dtype=float32, C-contiguous
+        Reference elevation, defined on seed pixels
+        (eg. drainage pixels) and `nodata` elsewhere,
+        modified in place
+
+    nodata: float
+        No-data value in `reference`
+
+    Returns
+    -------
+
+    Reference elevation raster, dtype=np.float32,
+    `nodata` for pixels that do not drain to any seed pixel
+    """
+
+    cdef:
+
+        Py_ssize_t height = proportions.shape[0], width = proportions.shape[1]
+        Py_ssize_t i, j, ik, jk, c, n, count
+        int k
+        double value, total
+        unsigned short[:] inflow
+        Py_ssize_t[:] order
+
+    inflow = np.zeros(height*width, dtype=np.uint16)
+    order = np.zeros(height*width, dtype=np.intp)
+
+    with nogil:
+
+        count = partition_order(proportions, inflow, order)
+
+        for n in range(count-1, -1, -1):
+
+            c = order[n]
+            i = c // width
+            j = c % width
+
+            if reference[i, j] != nodata:
+                continue
+
+            value = 0.0
+            total = 0.0
+
+            for k in range(8):
+                if proportions[i, j, k] > 0:
+
+                    ik = i + ci[k]
+                    jk = j + cj[k]
+
+                    if ingrid(height, width, ik, jk) and reference[ik, jk] != nodata:
+                        value += reference[ik, jk] * proportions[i, j, k]
+                        total += proportions[i, j, k]
+
+            if total > 0:
+                reference[i, j] = value / total
+
+    return np.asarray(reference)
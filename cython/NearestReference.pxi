@@ -0,0 +1,250 @@
+# coding: utf-8
+
+"""
+Nearest reference pixel assignment,
+with an exact Euclidean feature transform
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from libc.math cimport INFINITY
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline double midpoint_distance(
+    double[:, :] refpixels,
+    Py_ssize_t a,
+    double i,
+    double j) nogil:
+    """
+    Squared distance from (i, j) to the midpoint
+    of reference pixels a and a+1
+    """
+
+    cdef double di, dj
+
+    di = 0.5*(refpixels[a, 0] + refpixels[a+1, 0]) - i
+    dj = 0.5*(refpixels[a, 1] + refpixels[a+1, 1]) - j
+
+    return di*di + dj*dj
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def nearest_reference(
+    double[:, :] refpixels,
+    float[:, :] domain,
+    float nodata):
+    """
+    Nearest reference value and signed distance
+    for every pixel of `domain`.
+
+    The nearest reference pixel of each domain pixel
+    is found with an exact Euclidean feature transform
+    (Felzenszwalb & Huttenlocher, 2012), computed row by row
+    from the nearest reference pixel in every column
+    holding reference pixels, so that reference pixels
+    outside of the domain grid are taken into account.
+    Then, the nearest pixel pair, among the pairs (k-1, k) and (k, k+1)
+    of consecutive reference pixels of the same axis,
+    is used as the reference segment [AB] of the domain pixel.
+
+    Parameters
+    ----------
+
+    refpixels: array-like, shape (n, 4), dtype=float64
+        (i, j, z, axis) reference pixels,
+        ordered along reference linestrings,
+        possibly outside of domain grid
+
+    domain: array-like, ndims=2, dtype=float32
+        Domain raster, pixels to process are `domain != nodata`
+
+    nodata: float
+        No-data value in `domain`
+
+    Returns
+    -------
+
+    nearest_axes: array, same shape as `domain`, dtype=uint32
+        Axis of reference segment,
+        0 outside of domain
+
+    values: array, same shape as `domain`, dtype=float32
+        Reference z interpolated between A and B
+        at the projection of the pixel on [AB],
+        0 outside of domain
+
+    distance: array, same shape as `domain`, dtype=float32
+        Distance in pixels to segment [AB],
+        signed by the side of line (AB) the pixel lies on,
+        0 outside of domain
+    """
+
+    cdef:
+
+        Py_ssize_t height = domain.shape[0], width = domain.shape[1]
+        Py_ssize_t n = refpixels.shape[0]
+        Py_ssize_t i, j, c, p, end, k, v0, count, seed, a, b
+        double q, r, s, d, dmin, abi, abj, aci, acj, l2, pos, pi, pj, dist, cross
+
+        int[:] cols, col_ptr, seed_rows, seeds, cursor, gseed, envelope
+        double[:] gdist, bounds
+
+        unsigned int[:, :] nearest_axes
+        float[:, :] values, distance
+
+    nearest_axes = np.zeros((height, width), dtype='uint32')
+    values = np.zeros((height, width), dtype='float32')
+    distance = np.zeros((height, width), dtype='float32')
+
+    if n == 0:
+        return np.asarray(nearest_axes), np.asarray(values), np.asarray(distance)
+
+    # Bucket reference pixels by column,
+    # in order of increasing row within each column
+
+    pixels = np.asarray(refpixels)
+    ri = np.int32(np.rint(pixels[:, 0]))
+    rj = np.int32(np.rint(pixels[:, 1]))
+
+    unique_cols, column = np.unique(rj, return_inverse=True)
+    order = np.lexsort((ri, column))
+    count = unique_cols.shape[0]
+
+    cols = np.int32(unique_cols)
+    seeds = np.int32(order)
+    seed_rows = np.int32(ri[order])
+    ptr = np.zeros(count+1, dtype='int32')
+    ptr[1:] = np.cumsum(np.bincount(column, minlength=count))
+    col_ptr = ptr
+    cursor = np.copy(ptr[:-1])
+    gseed = np.zeros(count, dtype='int32')
+    gdist = np.zeros(count, dtype='float64')
+    envelope = np.zeros(count, dtype='int32')
+    bounds = np.zeros(count+1, dtype='float64')
+
+    with nogil:
+
+        for i in range(height):
+
+            # 1. nearest reference pixel in each column,
+            #    rows are visited in increasing order,
+            #    so column cursors only move forward
+
+            for c in range(count):
+
+                p = cursor[c]
+                end = col_ptr[c+1]
+
+                while p+1 < end and seed_rows[p+1] <= i:
+                    p += 1
+
+                cursor[c] = p
+                d = seed_rows[p] - i
+                gseed[c] = seeds[p]
+                gdist[c] = d*d
+
+                if p+1 < end:
+                    d = seed_rows[p+1] - i
+                    if d*d < gdist[c]:
+                        gseed[c] = seeds[p+1]
+                        gdist[c] = d*d
+
+            # 2. lower envelope of parabolas (j - cols[c])^2 + gdist[c]
+
+            k = 0
+            envelope[0] = 0
+            bounds[0] = -INFINITY
+            bounds[1] = INFINITY
+
+            for c in range(1, count):
+
+                q = cols[c]
+
+                while True:
+
+                    v0 = envelope[k]
+                    r = cols[v0]
+                    s = ((gdist[c] + q*q) - (gdist[v0] + r*r)) / (2*(q - r))
+
+                    if s <= bounds[k]:
+                        k -= 1
+                    else:
+                        break
+
+                k += 1
+                envelope[k] = c
+                bounds[k] = s
+                bounds[k+1] = INFINITY
+
+            # 3. nearest reference segment of each domain pixel
+
+            k = 0
+
+            for j in range(width):
+
+                while bounds[k+1] < j:
+                    k += 1
+
+                if domain[i, j] == nodata:
+                    continue
+
+                seed = gseed[envelope[k]]
+                a = seed
+                b = seed
+                dmin = INFINITY
+
+                if seed > 0 and refpixels[seed-1, 3] == refpixels[seed, 3]:
+                    dmin = midpoint_distance(refpixels, seed-1, i, j)
+                    a = seed-1
+
+                if seed+1 < n and refpixels[seed+1, 3] == refpixels[seed, 3]:
+                    if midpoint_distance(refpixels, seed, i, j) < dmin:
+                        a = seed
+                        b = seed+1
+                    else:
+                        b = a+1
+
+                elif a < seed:
+                    b = seed
+
+                # distance from pixel C to segment [AB]
+
+                abi = refpixels[b, 0] - refpixels[a, 0]
+                abj = refpixels[b, 1] - refpixels[a, 1]
+                aci = i - refpixels[a, 0]
+                acj = j - refpixels[a, 1]
+                l2 = abi*abi + abj*abj
+
+                if l2 > 0:
+
+                    pos = (aci*abi + acj*abj) / l2
+                    pos = min[double](max[double](pos, 0.0), 1.0)
+                    cross = abi*acj - abj*aci
+
+                else:
+
+                    pos = 0.0
+                    cross = 1.0
+
+                pi = aci - pos*abi
+                pj = acj - pos*abj
+                dist = sqrt(pi*pi + pj*pj)
+
+                if cross < 0:
+                    dist = -dist
+                elif cross == 0:
+                    dist = 0
+
+                distance[i, j] = dist
+                values[i, j] = refpixels[a, 2] + pos*(refpixels[b, 2] - refpixels[a, 2])
+                nearest_axes[i, j] = <unsigned int> refpixels[a, 3]
+
+    return np.asarray(nearest_axes), np.asarray(values), np.asarray(distance)
@@ -0,0 +1,131 @@
+# coding: utf-8
+
+"""
+Priority-flood depression filling and flow direction,
+for whole rasters small enough to fit in memory
+(eg. coarse levels of a DEM pyramid)
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+ctypedef pair[float, long long] FloodKey
+ctypedef pair[FloodKey, Py_ssize_t] FloodEntry
+ctypedef priority_queue[FloodEntry] FloodQueue
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def priority_flood(float[:, :] elevations, float nodata):
+    """
+    Fill depressions and calculate D8 flow direction
+    in one priority-flood pass (Barnes et al., 2014).
+
+    Pixels are processed from the raster boundary
+    (raster edges and pixels next to nodata)
+    in order of increasing filled elevation,
+    and each pixel flows to the pixel it was reached from.
+    Flats, including filled depressions, drain toward their spill point
+    along shortest paths, as ties are processed first-in first-out.
+
+    Parameters
+    ----------
+
+    elevations: array-like, dtype=float32
+        Elevation raster (DEM), ndim=2
+
+    nodata: float
+        No-data value in `elevations`
+
+    Returns
+    -------
+
+    filled: array, dtype=float32
+        Depression-filled elevations
+
+    flow: array, dtype=int16
+        D8 flow direction, nodata=-1.
+        Boundary pixels flow outside of raster or toward nodata.
+    """
+
+    cdef:
+
+        Py_ssize_t height = elevations.shape[0], width = elevations.shape[1]
+        Py_ssize_t i, j, ik, jk, c
+        long long counter = 0
+        int x, outward
+        float z
+        FloodQueue queue
+        FloodEntry entry
+        float[:, :] filled
+        D8Flow[:, :] flow
+        unsigned char[:, :] closed
+
+    filled_array = np.array(elevations, dtype=np.float32)
+    flow_array = np.full((height, width), -1, dtype=np.int16)
+    filled = filled_array
+    flow = flow_array
+    closed = np.zeros((height, width), dtype=np.uint8)
+
+    with nogil:
+
+        for i in range(height):
+            for j in range(width):
+
+                if elevations[i, j] == nodata:
+                    continue
+
+                outward = -1
+
+                for x in range(8):
+
+                    ik = i + ci[x]
+                    jk = j + cj[x]
+
+                    if not ingrid(height, width, ik, jk) or elevations[ik, jk] == nodata:
+                        outward = x
+                        break
+
+                if outward >= 0:
+
+                    flow[i, j] = 1 << outward
+                    closed[i, j] = 1
+                    queue.push(FloodEntry(FloodKey(-elevations[i, j], -counter), i*width + j))
+                    counter += 1
+
+        while not queue.empty():
+
+            entry = queue.top()
+            queue.pop()
+
+            c = entry.second
+            i = c // width
+            j = c % width
+            z = filled[i, j]
+
+            for x in range(8):
+
+                ik = i + ci[x]
+                jk = j + cj[x]
+
+                if not ingrid(height, width, ik, jk) or closed[ik, jk]:
+                    continue
+
+                if elevations[ik, jk] == nodata:
+                    continue
+
+                closed[ik, jk] = 1
+
+                if filled[ik, jk] < z:
+                    filled[ik, jk] = z
+
+                flow[ik, jk] = 1 << ((x + 4) % 8)
+                queue.push(FloodEntry(FloodKey(-filled[ik, jk], -counter), ik*width + jk))
+                counter += 1
+
+    return filled_array, flow_array
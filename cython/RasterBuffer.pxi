@@ -19,7 +19,9 @@ def raster_buffer(
         float[:, :] data,
         float nodata,
         float buffer_width,
-        float fill=0.0):
+        float fill=0.0,
+        bint track_ancestors=True,
+        float quantum=0.0):
     """
     Expand data area on no-data by a buffer of given width (expressed in pixels).
     Perform shortest path expansion from data pixels.
@@ -45,6 +47,24 @@ def raster_buffer(
         Fill value for expanded pixels,
         obviously different from `nodata`.
 
+    track_ancestors: bool
+
+        Keep track of the ancestor of each discovered pixel,
+        in order to reset distance to the exact (unjittered) path length
+        when the pixel is settled.
+        Otherwise, distance is the jittered path length,
+        which saves one byte per pixel.
+
+    quantum: float
+
+        Distance quantum of the priority queue.
+        With quantum > 0, use a monotone bucket queue
+        with buckets of width `quantum`,
+        instead of a binary heap (quantum = 0, default).
+        Cells are settled in order of distance within `quantum`,
+        so values propagated from nearly equidistant origins
+        may differ from the binary heap.
+
     Returns
     -------
 
@@ -63,9 +83,9 @@ def raster_buffer(
 
         Cell ij, ijk
         ShortestEntry entry
-        ShortestQueue queue
+        ShortestFrontier queue
         unsigned char[:, :] seen
-        map[Cell, Cell] ancestors
+        signed char[:, :] ancestors
         float[:, :] distance
         float[:, :] jitteri, jitterj
 
@@ -74,9 +94,14 @@ def raster_buffer(
     distance = np.zeros((height, width), dtype=np.float32)
     seen = np.zeros((height, width), dtype=np.uint8)
 
+    if track_ancestors:
+        ancestors = np.full((height, width), -1, dtype=np.int8)
+
     jitteri = np.float32(np.random.normal(0, 0.4, (height, width)))
     jitterj = np.float32(np.random.normal(0, 0.4, (height, width)))
 
+    queue.set_quantum(quantum)
+
     with nogil:
 
         for i in range(height):
@@ -133,11 +158,11 @@ def raster_buffer(
             if distance[i, j] < d:
                 continue
 
-            if ancestors.count(ij) > 0:
+            if track_ancestors and ancestors[i, j] >= 0:
 
-                ijk = ancestors[ij]
-                ik = ijk.first
-                jk = ijk.second
+                k = ancestors[i, j]
+                ik = i - ci[k]
+                jk = j - cj[k]
                 
                 if data[i, j] == nodata:
                     data[i, j] = fill
@@ -146,8 +171,10 @@ def raster_buffer(
                     distance[i, j] = distance[ik, jk] + 1
                 else:
                     distance[i, j] = distance[ik, jk] + 1.4142135 # sqrt(2) float32
-                
-                ancestors.erase(ij)
+
+            elif data[i, j] == nodata:
+
+                data[i, j] = fill
             
             seen[i, j] = 2 # settled
 
@@ -190,7 +217,9 @@ def raster_buffer(
                     queue.push(entry)
                     seen[ik, jk] = 1 # discovered
                     distance[ik, jk] = d
-                    ancestors[ijk] = ij
+
+                    if track_ancestors:
+                        ancestors[ik, jk] = k
 
                 elif seen[ik, jk] == 1:
 
@@ -200,6 +229,8 @@ def raster_buffer(
                         entry = ShortestEntry(-d, ijk)
                         queue.push(entry)
                         distance[ik, jk] = d
-                        ancestors[ijk] = ij
+
+                        if track_ancestors:
+                            ancestors[ik, jk] = k
 
     return np.asarray(distance)
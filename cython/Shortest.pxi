@@ -22,7 +22,8 @@ def shortest_value(
         A reference,
         float[:, :] distance=None,
         float max_distance=0.0,
-        float jitter=0.4):
+        float jitter=0.4,
+        float quantum=0.0):
     """
     Shortest path exploration of data domain from reference cells :
 
@@ -73,6 +74,16 @@ def shortest_value(
         in order to avoid grid artefacts.
         Disable jitter with jitter = 0
 
+    quantum: float
+
+        Distance quantum of the priority queue.
+        With quantum > 0, use a monotone bucket queue
+        with buckets of width `quantum`,
+        instead of a binary heap (quantum = 0, default).
+        Cells are settled in order of distance within `quantum`,
+        so values propagated from nearly equidistant origins
+        may differ from the binary heap.
+
     Returns
     -------
 
@@ -94,14 +105,15 @@ def shortest_value(
 
         Cell ij, ijk
         ShortestEntry entry
-        ShortestQueue queue
+        ShortestFrontier queue
         unsigned char[:, :] seen
-        map[Cell, Cell] ancestors
+        signed char[:, :] ancestors
         float[:, :] jitteri, jitterj
 
     height = values.shape[0]
     width = values.shape[1]
     seen = np.zeros((height, width), dtype=np.uint8)
+    ancestors = np.full((height, width), -1, dtype=np.int8)
 
     if jitter > 0:
 
@@ -117,6 +129,8 @@ def shortest_value(
     if distance is None:
         distance = np.zeros((height, width), dtype=np.float32)
 
+    queue.set_quantum(quantum)
+
     with nogil:
 
         # Sequential scan
@@ -180,11 +194,11 @@ def shortest_value(
             if distance[i, j] < d:
                 continue
 
-            if ancestors.count(ij) > 0:
+            if ancestors[i, j] >= 0:
 
-                ijk = ancestors[ij]
-                ik = ijk.first
-                jk = ijk.second
+                k = ancestors[i, j]
+                ik = i - ci[k]
+                jk = j - cj[k]
                 
                 if values[i, j] != nodata:
                     values[i, j] = values[ik, jk]
@@ -193,8 +207,6 @@ def shortest_value(
                     distance[i, j] = distance[ik, jk] + 1
                 else:
                     distance[i, j] = distance[ik, jk] + 1.4142135 # sqrt(2) float32
-                
-                ancestors.erase(ij)
             
             seen[i, j] = 2 # settled
 
@@ -249,7 +261,7 @@ def shortest_value(
                     queue.push(entry)
                     seen[ik, jk] = 1 # discovered
                     distance[ik, jk] = d
-                    ancestors[ijk] = ij
+                    ancestors[ik, jk] = k
 
                 elif seen[ik, jk] == 1:
 
@@ -259,6 +271,6 @@ def shortest_value(
                         entry = ShortestEntry(-d, ijk)
                         queue.push(entry)
                         distance[ik, jk] = d
-                        ancestors[ijk] = ij
+                        ancestors[ik, jk] = k
 
     return np.asarray(values)
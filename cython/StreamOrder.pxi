@@ -0,0 +1,319 @@
+# coding: utf-8
+
+"""
+Raster stream order :
+Strahler, Shreve and Hack order and upstream length
+from D8 flow direction and flow accumulation.
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+cdef inline bint main_first(float acc, D8Flow direction, float main_acc, D8Flow main_direction) nogil:
+    """
+    Return True if upstream branch (acc, direction)
+    takes precedence over current main branch
+    """
+
+    return acc > main_acc or (acc == main_acc and direction > main_direction)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def stream_order(
+    D8Flow[:, :] flow,
+    float[:, :] acc,
+    float min_acc,
+    float distance=1.0,
+    int[:, :] inlets=None,
+    float[:, :] inlet_values=None,
+    int[:, :] exits=None,
+    unsigned short[:] exit_hack=None):
+    """
+    Calculate Strahler, Shreve and Hack stream order
+    and upstream length of stream pixels,
+    ie. pixels with flow accumulation >= `min_acc`.
+
+    Strahler order, Shreve magnitude and upstream length
+    are calculated from sources to outlets,
+    while choosing the main upstream branch of each pixel
+    as the one with the largest flow accumulation.
+    Ties are broken on the flow direction of upstream pixels,
+    so that the main branch does not depend on processing order.
+    Hack order is then calculated from outlets to sources,
+    in reverse order of the same topological sort.
+
+    Parameters
+    ----------
+
+    flow: array-like
+        D8 Flow direction raster (ndim=2), nodata=-1
+
+    acc: array-like, dtype=float32
+        Flow accumulation raster, same shape as `flow`
+
+    min_acc: float
+        Minimum flow accumulation of stream pixels
+
+    distance: float
+        Pixel size
+
+    inlets: array-like, shape (n, 2), dtype=int32, optional
+        (i, j) stream pixels receiving flow from outside of raster
+
+    inlet_values: array-like, shape (n, 5), dtype=float32, optional
+        (strahler, shreve, length, acc, direction) of the upstream pixel
+        flowing into each inlet, with `length` measured
+        down to the inlet pixel
+
+    exits: array-like, shape (m, 2), dtype=int32, optional
+        (i, j) stream pixels flowing outside of raster,
+        with known Hack order
+
+    exit_hack: array-like, shape (m,), dtype=uint16, optional
+        Hack order of `exits`
+
+    Returns
+    -------
+
+    strahler: array, dtype=uint8
+    shreve: array, dtype=uint32
+    hack: array, dtype=uint16
+    length: array, dtype=float32
+        Stream order rasters, 0 outside of stream pixels
+
+    inlet_main: array, shape (n,), dtype=uint8
+        1 if inlet record is the main upstream branch
+        of its inlet pixel, 0 otherwise
+
+    outlets: array, shape (k, 4), dtype=int32
+        (i, j, ti, tj) stream pixels flowing outside of raster,
+        with target pixel (ti, tj) outside of raster range
+
+    outlet_values: array, shape (k, 5), dtype=float32
+        (strahler, shreve, length, acc, direction) of outlets,
+        with `length` measured down to the target pixel
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t size = height*width
+        Py_ssize_t i, j, c, d, n, count, ninlets = 0, nexits = 0
+        int k
+        unsigned char order
+        float diagonal = distance * sqrt(2)
+        float step
+        D8Flow direction
+
+        Py_ssize_t[:] downstream
+        Py_ssize_t[:] queue
+        unsigned char[:] inflow
+
+        unsigned char[:] strahler
+        unsigned int[:] shreve
+        unsigned short[:] hack
+        float[:] length
+
+        unsigned char[:] max_order
+        unsigned char[:] max_count
+        Py_ssize_t[:] main
+        float[:] main_acc
+        D8Flow[:] main_direction
+        unsigned char[:] inlet_main
+
+        vector[int] outlets
+        vector[float] outlet_values
+
+    downstream = np.zeros(size, dtype=np.intp)
+    queue = np.zeros(size, dtype=np.intp)
+    inflow = np.zeros(size, dtype=np.uint8)
+
+    strahler_array = np.zeros((height, width), dtype=np.uint8)
+    shreve_array = np.zeros((height, width), dtype=np.uint32)
+    hack_array = np.zeros((height, width), dtype=np.uint16)
+    length_array = np.zeros((height, width), dtype=np.float32)
+
+    strahler = strahler_array.reshape(size)
+    shreve = shreve_array.reshape(size)
+    hack = hack_array.reshape(size)
+    length = length_array.reshape(size)
+
+    max_order = np.zeros(size, dtype=np.uint8)
+    max_count = np.zeros(size, dtype=np.uint8)
+    main = np.full(size, -1, dtype=np.intp)
+    main_acc = np.zeros(size, dtype=np.float32)
+    main_direction = np.zeros(size, dtype=np.int16)
+
+    if inlets is not None:
+        ninlets = inlets.shape[0]
+
+    if exits is not None:
+        nexits = exits.shape[0]
+
+    inlet_main = np.zeros(ninlets, dtype=np.uint8)
+
+    with nogil:
+
+        count = downstream_order(flow, downstream, inflow, queue)
+
+        # upstream contributions from outside of raster
+
+        for n in range(ninlets):
+
+            i = inlets[n, 0]
+            j = inlets[n, 1]
+
+            if not ingrid(height, width, i, j):
+                continue
+
+            c = i*width + j
+            order = <unsigned char> inlet_values[n, 0]
+
+            if order > max_order[c]:
+                max_order[c] = order
+                max_count[c] = 1
+            elif order == max_order[c]:
+                max_count[c] += 1
+
+            shreve[c] += <unsigned int> inlet_values[n, 1]
+
+            if inlet_values[n, 2] > length[c]:
+                length[c] = inlet_values[n, 2]
+
+            direction = <D8Flow> inlet_values[n, 4]
+
+            if main_first(inlet_values[n, 3], direction, main_acc[c], main_direction[c]):
+                main_acc[c] = inlet_values[n, 3]
+                main_direction[c] = direction
+                main[c] = -2 - n
+
+        # sources to outlets
+
+        for n in range(count):
+
+            c = queue[n]
+
+            if acc[c // width, c % width] < min_acc:
+                continue
+
+            if max_order[c] == 0:
+                strahler[c] = 1
+            elif max_count[c] > 1:
+                strahler[c] = max_order[c] + 1
+            else:
+                strahler[c] = max_order[c]
+
+            if shreve[c] == 0:
+                shreve[c] = 1
+
+            d = downstream[c]
+
+            if d < 0 or acc[d // width, d % width] < min_acc:
+                continue
+
+            if strahler[c] > max_order[d]:
+                max_order[d] = strahler[c]
+                max_count[d] = 1
+            elif strahler[c] == max_order[d]:
+                max_count[d] += 1
+
+            shreve[d] += shreve[c]
+            step = step_length(flow[c // width, c % width], distance, diagonal)
+
+            if length[c] + step > length[d]:
+                length[d] = length[c] + step
+
+            direction = flow[c // width, c % width]
+
+            if main_first(acc[c // width, c % width], direction, main_acc[d], main_direction[d]):
+                main_acc[d] = acc[c // width, c % width]
+                main_direction[d] = direction
+                main[d] = c
+
+        for n in range(ninlets):
+
+            i = inlets[n, 0]
+            j = inlets[n, 1]
+
+            if ingrid(height, width, i, j) and main[i*width + j] == -2 - n:
+                inlet_main[n] = 1
+
+        # outlets to sources
+
+        for n in range(nexits):
+
+            i = exits[n, 0]
+            j = exits[n, 1]
+
+            if ingrid(height, width, i, j):
+                hack[i*width + j] = exit_hack[n]
+
+        for n in range(count-1, -1, -1):
+
+            c = queue[n]
+
+            if strahler[c] == 0:
+                continue
+
+            d = downstream[c]
+
+            if d >= 0 and strahler[d] > 0:
+
+                if main[d] == c:
+                    hack[c] = hack[d]
+                else:
+                    hack[c] = hack[d] + 1
+
+            elif hack[c] == 0:
+
+                hack[c] = 1
+
+        # stream pixels flowing outside of raster
+
+        for c in range(size):
+
+            if strahler[c] == 0:
+                continue
+
+            i = c // width
+            j = c % width
+            direction = flow[i, j]
+
+            if direction <= 0 or direction >= 256 or d8_index[direction] < 0:
+                continue
+
+            k = d8_index[direction]
+
+            if ingrid(height, width, i + ci[k], j + cj[k]):
+                continue
+
+            if (k % 2) == 0:
+                step = distance
+            else:
+                step = diagonal
+
+            outlets.push_back(i)
+            outlets.push_back(j)
+            outlets.push_back(i + ci[k])
+            outlets.push_back(j + cj[k])
+            outlet_values.push_back(strahler[c])
+            outlet_values.push_back(shreve[c])
+            outlet_values.push_back(length[c] + step)
+            outlet_values.push_back(acc[i, j])
+            outlet_values.push_back(direction)
+
+    return (
+        strahler_array,
+        shreve_array,
+        hack_array,
+        length_array,
+        np.asarray(inlet_main),
+        np.array(outlets, dtype=np.int32).reshape(-1, 4),
+        np.array(outlet_values, dtype=np.float32).reshape(-1, 5)
+    )
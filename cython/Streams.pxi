@@ -111,3 +111,138 @@ def stream_to_feature(
                 break
 
         yield np.array(segment), head
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def stream_segments(
+    short[:, :] streams,
+    D8Flow[:, :] flow):
+    """
+    Extract Stream Segments as flat arrays
+
+    Parameters
+    ----------
+
+    streams: array-like
+        Rasterized stream network, same shape as `flow`,
+        with stream cells >= 1
+
+    flow: array-like
+        D8 Flow direction raster (ndim=2)
+
+    Returns
+    -------
+
+    pixels: array, shape (n, 2), dtype=int32
+        (i, j) pixel coordinates of all segments' vertices,
+        segment k spanning pixels[offsets[k]:offsets[k+1]]
+
+    offsets: array, shape (segments+1,), dtype=int64
+        Start index of each segment in `pixels`
+
+    heads: array, shape (segments,), dtype=uint8
+        1 if segment starts at a stream head, 0 otherwise
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t i, j, k, n
+        int x, di, dj
+        D8Flow direction
+
+        char[:, :] inflow
+        char inflowij
+
+        CellStack stack
+        Cell c
+
+        vector[int] vertices
+        vector[long long] starts
+        vector[unsigned char] head_flags
+        unsigned char head
+
+        D8Flow FLOW_NODATA = -1
+        D8Flow NO_FLOW = 0
+
+    inflow = np.zeros((height, width), dtype=np.int8)
+
+    with nogil:
+
+        for i in range(height):
+            for j in range(width):
+
+                direction = flow[i, j]
+
+                if direction != FLOW_NODATA and streams[i, j] > 0:
+
+                    inflowij = 0
+
+                    for x in range(8):
+
+                        di = ci[x]
+                        dj = cj[x]
+
+                        if ingrid(height, width, i+di, j+dj) \
+                            and streams[i+di, j+dj] > 0 \
+                            and (flow[i+di, j+dj] == upward[x]):
+
+                            inflowij += 1
+
+                    if inflowij != 1:
+                        stack.push(Cell(i, j))
+
+                    inflow[i, j] = inflowij
+
+        while not stack.empty():
+
+            c = stack.top()
+            stack.pop()
+            i = c.first
+            j = c.second
+
+            starts.push_back(vertices.size() // 2)
+            head = inflow[i, j] == 0
+            head_flags.push_back(head)
+            vertices.push_back(i)
+            vertices.push_back(j)
+            direction = flow[i, j]
+
+            while not (direction == FLOW_NODATA or direction == NO_FLOW):
+
+                x = ilog2(direction)
+                i = i + ci[x]
+                j = j + cj[x]
+
+                vertices.push_back(i)
+                vertices.push_back(j)
+
+                if ingrid(height, width, i, j) and inflow[i, j] == 1:
+                    direction = flow[i, j]
+                else:
+                    break
+
+        starts.push_back(vertices.size() // 2)
+
+    n = starts.size() - 1
+    pixels = np.zeros((vertices.size() // 2, 2), dtype=np.int32)
+    offsets = np.zeros(n+1, dtype=np.int64)
+    heads = np.zeros(n, dtype=np.uint8)
+
+    cdef int[:, :] _pixels = pixels
+    cdef long long[:] _offsets = offsets
+    cdef unsigned char[:] _heads = heads
+
+    with nogil:
+
+        for k in range(<Py_ssize_t> (vertices.size() // 2)):
+            _pixels[k, 0] = vertices[2*k]
+            _pixels[k, 1] = vertices[2*k+1]
+
+        for k in range(n+1):
+            _offsets[k] = starts[k]
+
+        for k in range(n):
+            _heads[k] = head_flags[k]
+
+    return pixels, offsets, heads
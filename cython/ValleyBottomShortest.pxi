@@ -66,7 +66,9 @@ def valley_bottom_shortest(
         float max_dz=0.0,
         float min_distance=0.0,
         float max_distance=0.0,
-        float jitter=0.4):
+        float jitter=0.4,
+        bint track_ancestors=True,
+        float quantum=0.0):
     """
     Valley Bottom, based on shortest distance space exploration
 
@@ -139,6 +141,26 @@ def valley_bottom_shortest(
         in order to avoid grid artefacts.
         Disable jitter with jitter = 0
 
+    track_ancestors: bool
+
+        Keep track of the ancestor of each discovered cell,
+        in order to copy its reference elevation
+        and to reset distance to the exact (unjittered) path length
+        when the cell is settled.
+        Otherwise, reference elevation is copied on discovery,
+        and distance is the jittered path length,
+        which saves one byte per cell.
+
+    quantum: float
+
+        Distance quantum of the priority queue.
+        With quantum > 0, use a monotone bucket queue
+        with buckets of width `quantum`,
+        instead of a binary heap (quantum = 0, default).
+        Cells are settled in order of distance within `quantum`,
+        so values propagated from nearly equidistant origins
+        may differ from the binary heap.
+
     References
     ----------
 
@@ -154,9 +176,9 @@ def valley_bottom_shortest(
 
         Cell ij, ijk
         ShortestEntry entry
-        ShortestQueue queue
+        ShortestFrontier queue
         # unsigned char[:, :] state
-        map[Cell, Cell] ancestors
+        signed char[:, :] ancestors
         float[:, :] jitteri, jitterj
         bint copyref = False
 
@@ -164,6 +186,9 @@ def valley_bottom_shortest(
     width = elevations.shape[1]
     # state = np.zeros((height, width), dtype=np.uint8)
 
+    if track_ancestors:
+        ancestors = np.full((height, width), -1, dtype=np.int8)
+
     assert reference.shape[0] == height and reference.shape[1] == width
     assert state.shape[0] == height and state.shape[1] == width
     assert distance.shape[0] == height and distance.shape[1] == width
@@ -181,6 +206,8 @@ def valley_bottom_shortest(
     if distance is None:
         distance = np.zeros((height, width), dtype=np.float32)
 
+    queue.set_quantum(quantum)
+
     with nogil:
 
         # Clamp jitter
@@ -240,11 +267,11 @@ def valley_bottom_shortest(
             if distance[i, j] < dist:
                 continue
 
-            if ancestors.count(ij) > 0:
+            if track_ancestors and ancestors[i, j] >= 0:
 
-                ijk = ancestors[ij]
-                ik = ijk.first
-                jk = ijk.second
+                k = ancestors[i, j]
+                ik = i - ci[k]
+                jk = j - cj[k]
                 
                 # if state[i, j] != 255:
                 reference[i, j] = reference[ik, jk]
@@ -253,8 +280,6 @@ def valley_bottom_shortest(
                     distance[i, j] = distance[ik, jk] + 1
                 else:
                     distance[i, j] = distance[ik, jk] + 1.4142135 # sqrt(2) float32
-                
-                ancestors.erase(ij)
             
             state[i, j] = 2 # settled
 
@@ -309,7 +334,11 @@ def valley_bottom_shortest(
                     queue.push(entry)
                     state[ik, jk] = 1 # discovered
                     distance[ik, jk] = dist
-                    ancestors[ijk] = ij
+
+                    if track_ancestors:
+                        ancestors[ik, jk] = k
+                    else:
+                        reference[ik, jk] = reference[i, j]
 
                 elif state[ik, jk] == 1:
 
@@ -319,6 +348,10 @@ def valley_bottom_shortest(
                         entry = ShortestEntry(-dist, ijk)
                         queue.push(entry)
                         distance[ik, jk] = dist
-                        ancestors[ijk] = ij
+
+                        if track_ancestors:
+                            ancestors[ik, jk] = k
+                        else:
+                            reference[ik, jk] = reference[i, j]
 
     return np.asarray(reference)
@@ -99,3 +99,80 @@ def watershed(short[:, :] flow, A[:, :] values, A fill_value=0):
                     cell = Cell(ik, jk)
                     stack.push(cell)
                     visited[ik, jk] = True
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def watershed_labels(D8Flow[:, :] flow, Label[:, ::1] labels):
+    """
+    Multi-outlet watershed labelling
+
+    Fills unlabelled (0) pixels in `labels`
+    with the label of the first labelled pixel found downstream,
+    in one pass over pixels in reverse topological order.
+    Any number of outlets (seed pixels) can be labelled at once,
+    nested outlets delineate nested sub-watersheds.
+
+    Raster `labels` will be modified in place.
+
+    Parameters
+    ----------
+
+    flow: array-like, dtype=int16, nodata=-1 (ndim=2)
+        D8 flow direction raster
+
+    labels: array-like, dtype=uint32, C-contiguous, same shape as `flow`
+        Seed labels, 0 elsewhere
+
+    Returns
+    -------
+
+    Label raster, dtype=uint32, nodata=0
+    """
+
+    cdef:
+
+        Py_ssize_t height = flow.shape[0], width = flow.shape[1]
+        Py_ssize_t size = height*width
+        Py_ssize_t c, d, n, head = 0, tail = 0
+        Label[:] flat
+        unsigned char[:] inflow
+        Py_ssize_t[:] downstream
+        Py_ssize_t[:] order
+
+    flat = np.asarray(labels).reshape(size)
+    inflow = np.zeros(size, dtype=np.uint8)
+    downstream = np.zeros(size, dtype=np.intp)
+    order = np.zeros(size, dtype=np.intp)
+
+    with nogil:
+
+        flat_flow_graph(flow, downstream, inflow)
+
+        for c in range(size):
+            if inflow[c] == 0:
+                order[tail] = c
+                tail += 1
+
+        while head < tail:
+
+            c = order[head]
+            head += 1
+            d = downstream[c]
+
+            if d >= 0:
+
+                inflow[d] -= 1
+
+                if inflow[d] == 0:
+                    order[tail] = d
+                    tail += 1
+
+        for n in range(tail-1, -1, -1):
+
+            c = order[n]
+            d = downstream[c]
+
+            if flat[c] == 0 and d >= 0:
+                flat[c] = flat[d]
+
+    return np.asarray(labels)
@@ -107,12 +107,15 @@ include "Filters.pxi"
 include "WatershedGraph.pxi"
 include "Flats.pxi"
 include "FlowAccumulation.pxi"
+include "MultipleFlow.pxi"
 include "GraphAcc.pxi"
 include "Streams.pxi"
 include "Raster.pxi"
+include "Burn.pxi"
 include "NoFlow.pxi"
 include "Watershed.pxi"
 include "ValleyBottomFlow.pxi"
+include "BucketQueue.pxi"
 include "ValleyBottomShortest.pxi"
 include "Shortest.pxi"
 include "RasterBuffer.pxi"
@@ -125,3 +128,8 @@ include "LayeredContinuityAnalysis.pxi"
 include "Margin.pxi"
 include "Boundary.pxi"
 include "DistanceToOutlet.pxi"
+include "FlowHeight.pxi"
+include "StreamOrder.pxi"
+include "PriorityFlood.pxi"
+include "Breach.pxi"
+include "NearestReference.pxi"
@@ -17,9 +17,9 @@ import os
 from multiprocessing import Pool
 import numpy as np
 import click
-import rasterio as rio
 from ..cli import starcall
 from ..config import DatasetParameter
+from ..tileio import ReadRaster, WriteRaster
 
 class Parameters:
 
@@ -71,14 +71,10 @@ def AggregateTile(
 
         def copy(raster, output):
 
-            with rio.open(raster) as ds:
+            data, profile = ReadRaster(raster)
+            profile.update(compress='deflate')
 
-                data = ds.read(1)
-                profile = ds.profile.copy()
-                profile.update(compress='deflate')
-
-            with rio.open(output, 'w', **profile) as dst:
-                dst.write(data, 1)
+            WriteRaster(output, data, profile, out.height.storage)
 
         if raster1.exists() and not (output.exists() and raster1.samefile(output)):
             copy(raster1, output)
@@ -95,31 +91,25 @@ def AggregateTile(
     #         aggregate = ds.read(1)
     #         profile = ds.profile.copy()
 
-    with rio.open(raster1) as ds:
-        
-        data1 = ds.read(1)
-        nodata1 = ds.nodata
-
-    with rio.open(raster2) as ds:
+    data1, profile1 = ReadRaster(raster1)
+    nodata1 = profile1['nodata']
 
-        data2 = ds.read(1)
-        nodata2 = ds.nodata
-        profile = ds.profile.copy()
-        profile.update(compress='deflate')
+    data2, profile = ReadRaster(raster2)
+    nodata2 = profile['nodata']
+    profile.update(compress='deflate')
 
-        lower = (
-            (data1 != nodata1) &
-            (
-                (data2 != nodata2) &
-                (np.abs(data1) < np.abs(data2)) |
-                (data2 == nodata2)
-            )
+    lower = (
+        (data1 != nodata1) &
+        (
+            (data2 != nodata2) &
+            (np.abs(data1) < np.abs(data2)) |
+            (data2 == nodata2)
         )
+    )
 
     data2[lower] = data1[lower]
 
-    with rio.open(output, 'w', **profile) as dst:
-        dst.write(data2, 1)
+    WriteRaster(output, data2, profile, out.height.storage)
 
 def AggregateHeightMap(
         src1: Parameters,
@@ -9,6 +9,7 @@ import rasterio as rio
 
 from ..cli import starcall
 from ..config import DatasetParameter
+from ..tileio import ReadRaster, WriteRaster
 
 from ..corridor.ValleyBottomFeatures import (
     MASK_EXTERIOR,
@@ -137,14 +138,10 @@ def CopyTiles(
         raster = source.select(dataset).tilename(row=row, col=col, **kwargs)
         out = destination.select(dataset).tilename(row=row, col=col, **kwargs)
 
-        with rio.open(raster) as ds:
+        data, profile = ReadRaster(raster)
+        profile.update(compress='deflate')
 
-            data = ds.read(1)
-            profile = ds.profile.copy()
-            profile.update(compress='deflate')
-
-            with rio.open(out, 'w', **profile) as dst:
-                dst.write(data, 1)
+        WriteRaster(out, data, profile, destination.select(dataset).storage)
 
 def CopyDatasets(
         source: Parameters,
@@ -250,19 +247,13 @@ def CombineTiles(
         raster2 = src2.select(dataset).tilename(row=row, col=col, **kwargs)
         out = output.select(dataset).tilename(row=row, col=col, **kwargs)
 
-        with rio.open(raster1) as ds:
-            data1 = ds.read(1)
-
-        with rio.open(raster2) as ds:
-
-            data2 = ds.read(1)
-            profile = ds.profile.copy()
-            profile.update(compress='deflate')
+        data1, _ = ReadRaster(raster1)
+        data2, profile = ReadRaster(raster2)
+        profile.update(compress='deflate')
 
-            data2[copy_mask] = data1[copy_mask]
+        data2[copy_mask] = data1[copy_mask]
 
-        with rio.open(out, 'w', **profile) as dst:
-            dst.write(data2, 1)
+        WriteRaster(out, data2, profile, output.select(dataset).storage)
 
 def Combine(
         src1: Parameters,
@@ -20,7 +20,7 @@ def flow_accumulation(flow: np.ndarray, out: Optional[np.ndarray] = None) -> np.
             nodata=-1
 
         out:
-            output float32 array
+            output float32 C-contiguous array
             initialized to 0
 
     Returns:
@@ -28,7 +28,43 @@ def flow_accumulation(flow: np.ndarray, out: Optional[np.ndarray] = None) -> np.
         float32 accumulation raster
     """
 
-    return fct.speedup.flow_accumulation(flow, out)
+    return fct.speedup.flow_accumulation_fast(flow, out)
+
+def flow_accumulation_with_length(
+        flow: np.ndarray,
+        out: Optional[np.ndarray] = None,
+        distance: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Flow accumulation and upstream length (longest flow path)
+    from D8 flow direction, in one traversal.
+
+    Arguments:
+
+        flow:
+            D8 flow direction raster,
+            ndim=2,
+            dtype='int16',
+            nodata=-1
+
+        out:
+            output float32 C-contiguous array
+            initialized with local contributions,
+            or None to count pixels
+
+        distance:
+            pixel size
+
+    Returns:
+
+        - float32 accumulation raster
+        - float32 upstream length raster,
+          in the same unit as `distance`
+    """
+
+    return fct.speedup.flow_accumulation_fast(
+        flow, out,
+        upstream_length=True,
+        distance=distance)
 
 def outlets(flow: np.ndarray) -> Tuple[List, List]:
     """
@@ -12,6 +12,7 @@ from ..config import (
     LiteralParameter
 )
 from ..cli import starcall
+from ..tileio import ReadRaster, WriteRaster
 
 from ..corridor.ValleyBottomFeatures import (
     MASK_FLOOPLAIN_RELIEF,
@@ -82,15 +83,11 @@ def ClearOutDownstreamTile(row: int, col: int, params: Parameters, **kwargs):
 
     if os.path.exists(other_measure_raster) and os.path.exists(other_distance_raster):
 
-        with rio.open(other_measure_raster) as ds:
+        other_measure, other_measure_profile = ReadRaster(other_measure_raster)
+        other_measure_nodata = other_measure_profile['nodata']
 
-            other_measure = ds.read(1)
-            other_measure_nodata = ds.nodata
-
-        with rio.open(other_distance_raster) as ds:
-
-            other_distance = ds.read(1)
-            other_distance_nodata = ds.nodata
+        other_distance, other_distance_profile = ReadRaster(other_distance_raster)
+        other_distance_nodata = other_distance_profile['nodata']
 
         with rio.open(other_valley_bottom_raster) as ds:
 
@@ -102,54 +99,46 @@ def ClearOutDownstreamTile(row: int, col: int, params: Parameters, **kwargs):
 
             del other_valley_bottom
 
-        with rio.open(data_raster) as ds:
-
-            data = ds.read(1)
-            profile = ds.profile.copy()
-
-            if side == 'left':
+        data, profile = ReadRaster(data_raster)
 
-                other_side = (
-                    (other_distance != other_distance_nodata) &
-                    (other_distance < 0)
-                )
+        if side == 'left':
 
-            else:
+            other_side = (
+                (other_distance != other_distance_nodata) &
+                (other_distance < 0)
+            )
 
-                other_side = (
-                    (other_distance != other_distance_nodata) &
-                    (other_distance > 0)
-                )
+        else:
 
             other_side = (
-                other_side &
-                (other_measure != other_measure_nodata) &
-                (other_measure >= measure_min) &
-                (other_measure <= measure_max)
+                (other_distance != other_distance_nodata) &
+                (other_distance > 0)
             )
 
-            out_of_measure = (
-                other_valley_mask &
-                (other_measure != other_measure_nodata) &
-                (
-                    (other_measure < measure_min) |
-                    (other_measure > measure_max)
-                )
+        other_side = (
+            other_side &
+            (other_measure != other_measure_nodata) &
+            (other_measure >= measure_min) &
+            (other_measure <= measure_max)
+        )
+
+        out_of_measure = (
+            other_valley_mask &
+            (other_measure != other_measure_nodata) &
+            (
+                (other_measure < measure_min) |
+                (other_measure > measure_max)
             )
+        )
 
-            data[other_side | out_of_measure] = ds.nodata
+        data[other_side | out_of_measure] = profile['nodata']
 
     else:
 
-        with rio.open(data_raster) as ds:
-
-            data = ds.read(1)
-            profile = ds.profile.copy()
+        data, profile = ReadRaster(data_raster)
 
     profile.update(compress='deflate')
-
-    with rio.open(output, 'w', **profile) as dst:
-        dst.write(data, 1)
+    WriteRaster(output, data, profile, params.output.storage)
 
 def ClearOutDownstream(
         params: Parameters,
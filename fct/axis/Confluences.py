@@ -2,8 +2,8 @@ from collections import Counter, defaultdict
 import numpy as np
 import click
 import fiona
-import rasterio as rio
 from ..config import DatasetParameter
+from ..tileio import OpenRaster
 
 class Parameters:
 
@@ -75,7 +75,7 @@ def Confluences(axis: int, params: Parameters = None):
 
     confluences = np.array(list(lookup_confluences()), dtype='float32')
 
-    with rio.open(params.measure.filename()) as ds:
+    with OpenRaster(params.measure.filename()) as ds:
 
         measures = np.array(list(ds.sample(confluences[:, :2], 1)), dtype='float32')
         measures = measures.squeeze()
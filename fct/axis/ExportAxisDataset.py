@@ -17,7 +17,7 @@ from ..config import (
     DatasetParameter
 )
 from ..metadata import set_metadata
-from ..tileio import buildvrt
+from ..tileio import buildvrt, ReadRaster, WriteRaster
 from ..cli import starcall
 
 class Parameters:
@@ -157,17 +157,11 @@ def ExportRasterTile(axis, params, src, dst, row, col, **kwargs):
     with rio.open(maskfile) as ds:
         mask = ds.read(1)
 
-    with rio.open(rasterfile) as ds:
-
-        data = ds.read(1)
-        profile = ds.profile.copy()
+    data, profile = ReadRaster(rasterfile)
+    data[mask == 0] = profile['nodata']
 
     profile.update(compress='deflate')
-
-    with rio.open(output, 'w', **profile) as dst:
-        
-        data[mask == 0] = ds.nodata
-        dst.write(data, 1)
+    WriteRaster(output, data, profile, config.dataset(dst).storage)
 
 def ExportRasters(axis, params, rastermap, processes=1):
     
@@ -29,7 +29,7 @@ from ..corridor.ValleyBottomFeatures import (
     MASK_SLOPE,
     MASK_HOLE
 )
-from ..tileio import border
+from ..tileio import border, OpenRaster
 from .. import (
     transform,
     speedup
@@ -149,7 +149,7 @@ def BoundaryPoints(axis, params, **kwargs):
                 points = np.array(points, dtype='int32')
                 coordinates = transform.pixeltoworld(points, ds.transform)
 
-            with rio.open(distance_raster) as ds:
+            with OpenRaster(distance_raster) as ds:
 
                 distance = ds.read(1)
                 # groups = distance[points[:, 0], points[:, 1]] >= 0
@@ -214,7 +214,7 @@ def FixOrientation(axis, medialaxis, params):
 
     measure_raster = params.measure.filename(axis=axis)
 
-    with rio.open(measure_raster) as ds:
+    with OpenRaster(measure_raster) as ds:
 
         points = [
             medialaxis.interpolate((k+1)/201, normalized=True)
@@ -17,6 +17,17 @@ import fiona
 
 Tile = namedtuple('Tile', ('gid', 'row', 'col', 'x0', 'y0', 'bounds', 'tileset'))
 DataSource = namedtuple('DataSource', ('name', 'filename', 'resolution'))
+Storage = namedtuple('Storage', ('dtype', 'scale', 'offset', 'nodata'))
+
+#: no-data value of scaled-integer storage types
+STORAGE_NODATA = {
+    'int8': -128,
+    'uint8': 255,
+    'int16': -32768,
+    'uint16': 65535,
+    'int32': -2147483648,
+    'uint32': 4294967295
+}
 
 def strip(s):
     # return re.sub(' {2,}', ' ', s.strip())
@@ -32,6 +43,31 @@ def from_srs(srs):
 
     return 0
 
+def storage_codec(properties):
+    """
+    Return Storage codec from `storage` dataset properties,
+    or None if dataset values are stored as is.
+
+    Values are stored as integers `round((value - offset) / precision)`
+    of type `dtype` (default int16),
+    with no-data encoded as the minimum (signed types)
+    or maximum (unsigned types) integer of `dtype`
+    """
+
+    if not properties:
+        return None
+
+    dtype = properties.get('dtype', 'int16')
+
+    if dtype not in STORAGE_NODATA:
+        raise ValueError('Unsupported storage type: %s' % dtype)
+
+    return Storage(
+        dtype,
+        float(properties['precision']),
+        float(properties.get('offset', 0.0)),
+        STORAGE_NODATA[dtype])
+
 class Workspace:
     """
     Shared parameters and output dataset definitions
@@ -421,6 +457,7 @@ class Dataset():
         self._tilename = tilename
         self._subdir = subdir
         self._ext = ext
+        self._storage = storage_codec(properties.get('storage'))
 
         if filename == '':
             self._filename = name.upper() + ext
@@ -455,6 +492,14 @@ class Dataset():
     def properties(self):
         return self._properties
 
+    @property
+    def storage(self):
+        """
+        Return scaled-integer Storage codec,
+        or None if dataset values are stored as is
+        """
+        return self._storage
+
     def subdir(self, **kwargs):
         """
         Return storage subdirectory
@@ -187,6 +187,18 @@ class DatasetResolver():
 
         return self.key
 
+    @property
+    def storage(self):
+        """
+        Return dataset's scaled-integer storage codec,
+        or None if values are stored as is
+        """
+
+        if self.none:
+            return None
+
+        return config.dataset(self.key).storage
+
     def arguments(self, kwargs=None):
 
         kwargs = kwargs if kwargs is not None else dict()
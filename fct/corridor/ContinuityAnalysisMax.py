@@ -14,10 +14,7 @@ LandCover Lateral Continuity Analysis
 """
 
 import os
-from operator import itemgetter
-import itertools
-import logging
-from multiprocessing import Pool
+from functools import partial
 import numpy as np
 
 import click
@@ -25,16 +22,16 @@ import rasterio as rio
 from rasterio.windows import Window
 
 from .. import speedup
-from ..cli import starcall
 from ..config import (
     config,
     LiteralParameter,
     DatasetParameter
 )
-from .. import transform as fct
-from ..tileio import (
-    PadRaster,
-    border
+from ..tileio import PadRaster, ReadRaster
+from ..spillover import (
+    SpilloverTile,
+    IterateSpillovers,
+    border_pixels
 )
 from .ValleyBottomFeatures import MASK_EXTERIOR
 
@@ -89,97 +86,124 @@ class Parameters:
         self.jitter = 0.4
         self.tmp_suffix = '.tmp'
 
-def ContinuityTile(row, col, seeds, params, **kwargs):
+class ContinuityState(SpilloverTile):
     """
-    Tile Implementation
+    Landcover continuity exploration state of one tile,
+    padded with `params.padding` pixels from neighboring tiles
     """
 
-    tileset = config.tileset()
+    fields = [
+        ('value', 'uint8'),
+        ('distance', 'float32')
+    ]
 
-    output = str(params.output.tilename(row=row, col=col, **kwargs))
-    output_state = str(params.state.tilename(row=row, col=col, **kwargs))
-    output_distance = str(params.output_distance.tilename(row=row, col=col, **kwargs))
+    def __init__(self, row, col, params, **kwargs):
 
-    padding = params.padding
-    tile = tileset.tileindex[row, col]
+        super().__init__(row, col)
+        self.params = params
+        self.kwargs = kwargs
 
-    landcover, profile = PadRaster(
-        row, col,
-        params.landcover,
-        padding=padding)
+    def load(self):
 
-    transform = profile['transform']
-    nodata = profile['nodata']
-    height, width = landcover.shape
+        row = self.row
+        col = self.col
+        params = self.params
+        kwargs = self.kwargs
+        padding = params.padding
+        tile = config.tileset().tileindex[row, col]
 
-    if not params.infrastructures:
-        # Remove infrastructures
-        infrastructure_mask = (landcover == 8)
-        landcover[infrastructure_mask] = 2
+        if not os.path.exists(params.landcover.tilename(row=row, col=col)):
+            return False
 
-    def BoundlessRaster(row, col, dataset):
-        """
-        Read tile with some padding,
-        handling the case if the tile does not exist.
-        """
+        landcover, profile = PadRaster(
+            row, col,
+            params.landcover,
+            padding=padding)
 
-        filename = dataset.tilename(row=row, col=col, **kwargs)
+        nodata = profile['nodata']
+        height, width = landcover.shape
 
-        if os.path.exists(filename):
+        if not params.infrastructures:
+            # Remove infrastructures
+            self.infrastructure_mask = (landcover == 8)
+            landcover[self.infrastructure_mask] = 2
 
-            raster, profile = PadRaster(row, col, dataset, padding=padding, **kwargs)
-            nodata = profile['nodata']
+        def BoundlessRaster(row, col, dataset):
+            """
+            Read tile with some padding,
+            handling the case if the tile does not exist.
+            """
 
-        else:
+            filename = dataset.tilename(row=row, col=col, **kwargs)
+
+            if os.path.exists(filename):
+
+                raster, profile = PadRaster(row, col, dataset, padding=padding, **kwargs)
+                nodata = profile['nodata']
+
+            else:
 
-            filename = dataset.filename(**kwargs)
-            assert os.path.exists(filename)
+                filename = dataset.filename(**kwargs)
+                assert os.path.exists(filename)
 
-            with rio.open(filename) as ds:
+                with rio.open(filename) as ds:
+                    i0, j0 = ds.index(tile.x0, tile.y0)
 
-                i0, j0 = ds.index(tile.x0, tile.y0)
                 window = Window(j0 - padding, i0 - padding, width, height)
-                raster = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
-                nodata = ds.nodata
+                raster, raster_profile = ReadRaster(filename, window=window, boundless=True)
+                nodata = raster_profile['nodata']
 
-        return raster, nodata
+            return raster, nodata
 
-    nearest_distance, nearest_distance_nodata = BoundlessRaster(row, col, params.distance)
+        nearest_distance, nearest_distance_nodata = BoundlessRaster(row, col, params.distance)
+        output = params.output.tilename(row=row, col=col, **kwargs)
 
-    if os.path.exists(output):
+        if os.path.exists(output):
 
-        out, _ = PadRaster(row, col, params.output, padding=padding, **kwargs)
-        distance, _ = PadRaster(row, col, params.output_distance, padding=padding)
-        state, _ = PadRaster(row, col, params.state, padding=padding)
+            out, _ = PadRaster(row, col, params.output, padding=padding, **kwargs)
+            distance, _ = PadRaster(row, col, params.output_distance, padding=padding)
+            state, _ = PadRaster(row, col, params.state, padding=padding)
 
-    else:
+        else:
+
+            out = np.full_like(landcover, nodata)
+            distance = np.zeros_like(nearest_distance, dtype='float32')
+            state = np.uint8(np.abs(nearest_distance) < 1)
+
+        state[landcover == nodata] = 255
 
-        out = np.full_like(landcover, nodata)
-        distance = np.zeros_like(nearest_distance, dtype='float32')
-        state = np.uint8(np.abs(nearest_distance) < 1)
+        self.landcover = landcover
+        self.out = out
+        self.distance = distance
+        self.state = state
+        self.distance_nodata = nearest_distance_nodata
+        self.profile = profile
+        self.nodata = nodata
+        self.transform = profile['transform']
+        self.height = height
+        self.width = width
 
-    state[landcover == nodata] = 255
+        return True
 
-    if seeds:
+    def seed(self, seeds):
 
-        coordxy = itemgetter(0, 1)
-        pixels = fct.worldtopixel(
-            np.array([coordxy(seed) for seed in seeds], dtype='float32'),
-            transform)
-        intile = np.array([0 <= i < height and 0 <= j < width for i, j in pixels])
+        pixels, intile = self.seed_pixels(seeds)
+        seed_value = seeds['value'][intile]
+        seed_distance = seeds['distance'][intile]
 
-        seed_value = np.array([seed[2] for seed in seeds], dtype='uint8')
-        seed_distance = np.array([seed[3] for seed in seeds], dtype='float32')
+        # when several seeds hit the same pixel,
+        # apply best seed last
 
-        pixels = pixels[intile]
-        seed_value = seed_value[intile]
-        seed_distance = seed_distance[intile]
+        order = np.lexsort((-seed_distance, -seed_value.astype('int32')))
+        pixels = pixels[order]
+        seed_value = seed_value[order]
+        seed_distance = seed_distance[order]
 
-        recorded_value = out[pixels[:, 0], pixels[:, 1]]
-        recorded_distance = distance[pixels[:, 0], pixels[:, 1]]
+        recorded_value = self.out[pixels[:, 0], pixels[:, 1]]
+        recorded_distance = self.distance[pixels[:, 0], pixels[:, 1]]
 
         shortest = (
-            (recorded_distance == nearest_distance_nodata) |
+            (recorded_distance == self.distance_nodata) |
             (recorded_distance == 0) |
             (seed_value < recorded_value) |
             (
@@ -189,225 +213,99 @@ def ContinuityTile(row, col, seeds, params, **kwargs):
         )
 
         pixels = pixels[shortest]
-        out[pixels[:, 0], pixels[:, 1]] = seed_value[shortest]
-        distance[pixels[:, 0], pixels[:, 1]] = seed_distance[shortest]
-        state[pixels[:, 0], pixels[:, 1]] = 1
-
-    # Continuity analysis on shortest path
-
-    del nearest_distance
-    # cost = params.costf(landcover)
-    control = np.copy(out)
-
-    # unlock previously resolved cells
-    state[state == 2] = 6
-
-    speedup.layered_continuity_analysis(
-        landcover,
-        # nearest_height,
-        out,
-        distance,
-        state,
-        max_class=params.class_max,
-        min_distance=params.distance_min,
-        max_distance=params.distance_max,
-        # max_height=params.height_max,
-        jitter=params.jitter)
-
-    def extract_spillovers():
-
-        spillovers = [
-            (i, j) for i, j in border(height, width)
-            if control[i, j] != out[i, j]
-        ]
-
-        if spillovers:
-
-            xy = fct.pixeltoworld(np.array(spillovers, dtype='int32'), transform)
-
-            def attributes(k, ij):
-                """
-                Returns (row, col, x, y, height, distance)
-                """
-
-                i, j = ij
-
-                if i == 0:
-                    prow = row - 1
-                elif i == height-1:
-                    prow = row + 1
-                else:
-                    prow = row
-
-                if j == 0:
-                    pcol = col - 1
-                elif j == width-1:
-                    pcol = col + 1
-                else:
-                    pcol = col
-
-                return (prow, pcol) + tuple(xy[k]) + (out[i, j], distance[i, j])
-
-            spillovers = [
-                attributes(k, ij)
-                for k, ij in enumerate(spillovers)
-            ]
-
-        return spillovers
-
-    spillovers = extract_spillovers()
+        self.out[pixels[:, 0], pixels[:, 1]] = seed_value[shortest]
+        self.distance[pixels[:, 0], pixels[:, 1]] = seed_distance[shortest]
+        self.state[pixels[:, 0], pixels[:, 1]] = 1
 
-    # restore unresolved cells' state
-    state[state == 1] = 2
+        return int(np.sum(shortest))
 
-    if not params.infrastructures:
-        # Restore infrastructures
-        out[infrastructure_mask & (out != nodata)] = 8
+    def run(self):
 
-    out[(landcover == 0) & (out == 1)] = 0
+        params = self.params
+        landcover = self.landcover
+        out = self.out
+        distance = self.distance
+        state = self.state
+        nodata = self.nodata
 
-    # Crop out nodata and padded border
+        # Continuity analysis on shortest path
 
-    out[landcover == nodata] = nodata
-    out = out[padding:-padding, padding:-padding]
-    state = state[padding:-padding, padding:-padding]
-    distance = distance[padding:-padding, padding:-padding]
-
-    # Output
-
-    height, width = out.shape
-    transform = transform * transform.translation(padding, padding)
-
-    tmp_suffix = params.tmp_suffix
-    output += tmp_suffix
-    output_state += tmp_suffix
-    output_distance += tmp_suffix
-
-    profile.update(
-        driver='GTiff',
-        height=height,
-        width=width,
-        transform=transform,
-        compress='deflate')
-
-    with rio.open(output, 'w', **profile) as dst:
-        dst.write(out, 1)
-
-    with rio.open(output_state, 'w', **profile) as dst:
-        dst.write(state, 1)
-
-    profile.update(dtype='float32', nodata=nearest_distance_nodata)
-
-    with rio.open(output_distance, 'w', **profile) as dst:
-        dst.write(distance, 1)
-
-    return spillovers, (output, output_state, output_distance)
-
-def ContinuityIteration(params, spillovers, ntiles, processes=1, **kwargs):
-    """
-    Iteration over spillovers' destination tiles
-    """
+        control = np.copy(out)
 
-    tile = itemgetter(0, 1)
-    coordxy = itemgetter(2, 3)
-    values = itemgetter(4, 5)
+        # unlock previously resolved cells
+        state[state == 2] = 6
 
-    spillovers = sorted(spillovers, key=tile)
-    tiles = itertools.groupby(spillovers, key=tile)
+        speedup.layered_continuity_analysis(
+            landcover,
+            out,
+            distance,
+            state,
+            max_class=params.class_max,
+            min_distance=params.distance_min,
+            max_distance=params.distance_max,
+            jitter=params.jitter)
 
-    g_spillover = list()
-    tmpfiles = list()
+        pixels = border_pixels(self.height, self.width)
+        pixels = pixels[control[pixels[:, 0], pixels[:, 1]] != out[pixels[:, 0], pixels[:, 1]]]
 
-    if processes == 1:
+        spillovers = self.spillovers(
+            pixels,
+            value=out[pixels[:, 0], pixels[:, 1]],
+            distance=distance[pixels[:, 0], pixels[:, 1]])
 
-        for (row, col), seeds in tiles:
-            seeds = [coordxy(seed) + values(seed) for seed in seeds]
-            t_spillover, tmps = ContinuityTile(row, col, seeds, params)
-            g_spillover.extend(t_spillover)
-            tmpfiles.extend(tmps)
+        # restore unresolved cells' state
+        state[state == 1] = 2
 
-        for tmpfile in tmpfiles:
-            os.rename(tmpfile, tmpfile.replace('.tif' + params.tmp_suffix, '.tif'))
+        if not params.infrastructures:
+            # Restore infrastructures
+            out[self.infrastructure_mask & (out != nodata)] = 8
 
-    else:
+        out[(landcover == 0) & (out == 1)] = 0
+        out[landcover == nodata] = nodata
 
-        def arguments():
-
-            for (row, col), seeds in tiles:
-
-                seeds = [coordxy(seed) + values(seed) for seed in seeds]
-                yield (
-                    ContinuityTile,
-                    row,
-                    col,
-                    seeds,
-                    params,
-                    kwargs
-                )
-
-        with Pool(processes=processes) as pool:
-
-            pooled = pool.imap_unordered(starcall, arguments())
-
-            with click.progressbar(pooled, length=ntiles) as iterator:
-                for t_spillover, tmps in iterator:
-                    g_spillover.extend(t_spillover)
-                    tmpfiles.extend(tmps)
-
-        for tmpfile in tmpfiles:
-            os.rename(tmpfile, tmpfile.replace('.tif' + params.tmp_suffix, '.tif'))
-
-    return g_spillover
-
-def ContinuityFirstIteration(params, processes, **kwargs):
-    """
-    First tile iteration with empty seed list.
-    """
-
-    tilefile = params.tiles.filename(**kwargs)
-    # config.tileset().filename(ax_tiles, **kwargs)
-
-    def length():
+        return spillovers
 
-        with open(tilefile) as fp:
-            return sum(1 for line in fp)
+    def save(self, suffix=''):
 
-    def arguments():
+        params = self.params
+        kwargs = self.kwargs
+        row = self.row
+        col = self.col
+        padding = params.padding
 
-        with open(tilefile) as fp:
-            for line in fp:
+        output = str(params.output.tilename(row=row, col=col, **kwargs)) + suffix
+        output_state = str(params.state.tilename(row=row, col=col, **kwargs)) + suffix
+        output_distance = str(params.output_distance.tilename(row=row, col=col, **kwargs)) + suffix
 
-                row, col = tuple(int(x) for x in line.split(','))
+        # Crop out padded border
 
-                yield (
-                    ContinuityTile,
-                    row,
-                    col,
-                    [],
-                    params,
-                    kwargs
-                )
+        out = self.out[padding:-padding, padding:-padding]
+        state = self.state[padding:-padding, padding:-padding]
+        distance = self.distance[padding:-padding, padding:-padding]
 
-    g_spillover = list()
-    tmpfiles = list()
+        height, width = out.shape
+        transform = self.transform * self.transform.translation(padding, padding)
+        profile = self.profile.copy()
 
-    with Pool(processes=processes) as pool:
+        profile.update(
+            driver='GTiff',
+            height=height,
+            width=width,
+            transform=transform,
+            compress='deflate')
 
-        pooled = pool.imap_unordered(starcall, arguments())
+        with rio.open(output, 'w', **profile) as dst:
+            dst.write(out, 1)
 
-        with click.progressbar(pooled, length=length()) as iterator:
-            for t_spillover, tmps in iterator:
-                g_spillover.extend(t_spillover)
-                tmpfiles.extend(tmps)
+        with rio.open(output_state, 'w', **profile) as dst:
+            dst.write(state, 1)
 
-        # with click.progressbar(pooled, length=len(arguments)) as bar:
-        #     for t_spillover in bar:
-        #         g_spillover.extend(t_spillover)
+        profile.update(dtype='float32', nodata=self.distance_nodata)
 
-    for tmpfile in tmpfiles:
-        os.rename(tmpfile, tmpfile.replace('.tif' + params.tmp_suffix, '.tif'))
+        with rio.open(output_distance, 'w', **profile) as dst:
+            dst.write(distance, 1)
 
-    return g_spillover
+        return [output, output_state, output_distance]
 
 def ContinuityAnalysisMax(
         params,
@@ -418,26 +316,17 @@ def ContinuityAnalysisMax(
     Calculate landcover continuity from river channel
     """
 
-    logger = logging.getLogger(__name__)
-
-    count = 1
-    tile = itemgetter(0, 1)
-    g_tiles = set()
-
-    click.echo('Iteration %02d --' % count)
-    seeds = ContinuityFirstIteration(params, processes=processes, **kwargs)
-
-    while seeds:
-
-        count += 1
-
-        if count > maxiter:
-            logger.warning('Stopping after %d iterations', maxiter)
-            break
-
-        seeds = [s for s in seeds if tile(s) in config.tileset().tileindex]
-        tiles = {tile(s) for s in seeds}
-        g_tiles.update(tiles)
-        click.echo('Iteration %02d -- %d spillovers, %d tiles' % (count, len(seeds), len(tiles)))
+    tilefile = params.tiles.filename(**kwargs)
+    # config.tileset().filename(ax_tiles, **kwargs)
 
-        seeds = ContinuityIteration(params, seeds, len(tiles), processes=processes, **kwargs)
+    with open(tilefile) as fp:
+        tiles = [tuple(int(x) for x in line.split(',')) for line in fp]
+
+    IterateSpillovers(
+        partial(ContinuityState, params=params, **kwargs),
+        ContinuityState.empty_seeds(),
+        tiles=tiles,
+        processes=processes,
+        maxiter=maxiter,
+        tileindex=config.tileset().tileindex,
+        suffix=params.tmp_suffix)
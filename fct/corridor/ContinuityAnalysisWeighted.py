@@ -29,6 +29,7 @@ from ..config import (
     DatasetParameter,
     LiteralParameter
 )
+from ..tileio import OpenRaster
 
 class Parameters:
     """
@@ -96,7 +97,7 @@ def ContinuityAnalysisTile(
     tile_index = tileset.tileindex
     tile = tile_index[row, col]
 
-    with rio.open(nearest_distance_raster) as ds2:
+    with OpenRaster(nearest_distance_raster) as ds2:
 
         i, j = ds2.index(tile.x0, tile.y0)
         window2 = Window(j - padding, i - padding, width, height)
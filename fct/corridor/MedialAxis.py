@@ -36,6 +36,7 @@ from .. import (
     transform,
     speedup
 )
+from ..tileio import OpenRaster
 
 class Parameters:
     """
@@ -148,7 +149,7 @@ def BoundaryPoints(params, **kwargs):
                 nearest = ds.read(1)
                 axes = np.unique(nearest[nearest != ds.nodata])
 
-            with rio.open(distance_raster) as ds:
+            with OpenRaster(distance_raster) as ds:
                 
                 distance = ds.read(1)
                 distance_nodata = ds.nodata
@@ -243,7 +244,7 @@ def FixOrientation(medialaxis, params):
 
     measure_raster = params.measure.filename()
 
-    with rio.open(measure_raster) as ds:
+    with OpenRaster(measure_raster) as ds:
 
         points = [
             medialaxis.interpolate((k+1)/201, normalized=True)
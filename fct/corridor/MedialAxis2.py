@@ -42,6 +42,7 @@ from .. import (
     transform,
     speedup
 )
+from ..tileio import OpenRaster
 
 class Parameters:
     """
@@ -172,7 +173,7 @@ def BoundaryPoints(params, **kwargs):
                 nearest = ds.read(1)
                 axes = np.unique(nearest[nearest != ds.nodata])
 
-            with rio.open(distance_raster) as ds:
+            with OpenRaster(distance_raster) as ds:
                 
                 distance = ds.read(1)
                 distance_nodata = ds.nodata
@@ -267,7 +268,7 @@ def FixOrientation(medialaxis, params):
 
     measure_raster = params.measure.filename()
 
-    with rio.open(measure_raster) as ds:
+    with OpenRaster(measure_raster) as ds:
 
         points = [
             medialaxis.interpolate((k+1)/201, normalized=True)
@@ -395,7 +396,7 @@ def MedialAxis(params):
                 nearest = nearest.squeeze()
                 valid = (nearest == axis)
 
-            with rio.open(measure_raster) as ds:
+            with OpenRaster(measure_raster) as ds:
 
                 measures = np.array(list(ds.sample(midpoints, 1)), dtype='float32')
                 measures = measures.squeeze()
@@ -514,7 +515,7 @@ def SimplifyMedialAxis(params: Parameters, vbw: xr.Dataset = None):
 
             measure_raster = params.measure.filename()
 
-            with rio.open(measure_raster) as ds:
+            with OpenRaster(measure_raster) as ds:
                 measures = np.array(list(ds.sample(coords, 1)), dtype='float32')
                 measures = measures.squeeze()
 
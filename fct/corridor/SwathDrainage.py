@@ -22,6 +22,7 @@ from ..config import (
     LiteralParameter
 )
 from ..metadata import set_metadata
+from ..tileio import ReadRaster
 
 
 SwathDrainageDict = Dict[Tuple[int, float], float]
@@ -77,8 +78,7 @@ def calculate_swaths(measure_raster: str, swath_length: float):
     Transform measure raster into swath identifiers
     """
 
-    with rio.open(measure_raster) as ds:
-        measure = ds.read(1)
+    measure, _ = ReadRaster(measure_raster)
 
     measure_min = np.floor(np.min(measure) / swath_length) * swath_length
     measure_max = np.ceil(np.max(measure) / swath_length) * swath_length
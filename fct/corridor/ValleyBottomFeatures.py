@@ -22,6 +22,7 @@ from ..config import (
 )
 from .. import speedup
 from ..cli import starcall
+from ..tileio import OpenRaster
 
 from .SwathDrainage import (
     calculate_swaths,
@@ -195,7 +196,7 @@ def ClassifyValleyBottomTile(
         axis = ds.read(1)
         axis_nodata = ds.nodata
 
-    with rio.open(distance_raster) as ds:
+    with OpenRaster(distance_raster) as ds:
         distance = np.abs(ds.read(1))
 
     if isinstance(params.thresholds, Callable):
@@ -206,7 +207,7 @@ def ClassifyValleyBottomTile(
 
         resolve_thresholds = make_resolve_thresholds_fun(params.thresholds)
 
-    with rio.open(height_raster) as ds:
+    with OpenRaster(height_raster) as ds:
 
         height = ds.read(1)
         out = np.full_like(height, MASK_EXTERIOR, dtype='uint8')
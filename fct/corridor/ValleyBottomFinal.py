@@ -14,8 +14,7 @@ Valley bottom extraction procedure - shortest path exploration
 """
 
 import os
-import itertools
-from operator import itemgetter
+from functools import partial
 from multiprocessing import Pool
 
 import numpy as np
@@ -30,11 +29,12 @@ from ..config import (
     DatasetParameter
 )
 from ..cli import starcall
-from .. import transform as fct
 from .. import speedup
-from ..tileio import (
-    PadRaster,
-    border
+from ..tileio import PadRaster
+from ..spillover import (
+    SpilloverTile,
+    IterateSpillovers,
+    border_pixels
 )
 
 from .ValleyBottomFeatures import (
@@ -109,224 +109,145 @@ class Parameters:
         self.jitter = 0.4
         self.tmp_suffix = '.tmp'
 
-def ValleyBottomConnectedTile(row, col, seeds, params, **kwargs):
-
-    if not params.mask.tilename(row=row, col=col, **kwargs).exists():
-        return list(), tuple()
-
-    mask, profile = PadRaster(row, col, params.mask, padding=1, **kwargs)
-    transform = profile['transform']
-    # nodata = profile['nodata'] # MASK_EXTERIOR
-    height, width = mask.shape
-
-    output_mask = str(params.output_mask.tilename(row=row, col=col, **kwargs))
-    output_distance = str(params.output_distance.tilename(row=row, col=col, **kwargs))
-
-    if os.path.exists(output_mask):
-
-        domain, _ = PadRaster(row, col, params.output_mask, padding=1, **kwargs)
-        distance, _ = PadRaster(row, col, params.output_distance, padding=1, **kwargs)
-
-    else:
-
-        drainage_distance, _ = PadRaster(row, col, params.distance, padding=1, **kwargs)
-
-        domain = np.full_like(mask, DOMAIN_EXTERIOR, dtype='uint8')
-        domain[(mask == MASK_VALLEY_BOTTOM) | (mask == MASK_FLOOPLAIN_RELIEF)] = DOMAIN_INTERIOR
-        domain[(mask != MASK_EXTERIOR) & (np.abs(drainage_distance) < 1)] = DOMAIN_REFERENCE
-
-        distance = np.zeros_like(mask, dtype='float32')
-
-    # apply seed values
-
-    if seeds:
-
-        coord = itemgetter(0, 1)
-        pixels = fct.worldtopixel(np.array([coord(seed) for seed in seeds], dtype='float32'), transform)
-        intile = np.array([0 <= i < height and 0 <= j < width for i, j in pixels])
-        seed_distance = np.array([seed[2] for seed in seeds], dtype='float32')
-
-        pixels = pixels[intile]
-        seed_distance = seed_distance[intile]
-
-        recorded_distance = distance[pixels[:, 0], pixels[:, 1]]
-        shortest = (recorded_distance == DISTANCE_NODATA) | (seed_distance < recorded_distance)
-        pixels = pixels[shortest]
-
-        domain[pixels[:, 0], pixels[:, 1]] = DOMAIN_REFERENCE
-        distance[pixels[:, 0], pixels[:, 1]] = seed_distance[shortest]
-
-    # calculate connected subdomain
-
-    connected = speedup.shortest_value(
-        domain,
-        np.copy(domain),
-        DOMAIN_EXTERIOR,
-        DOMAIN_REFERENCE,
-        distance,
-        params.distance_max,
-        params.jitter)
-
-    distance[connected == DOMAIN_EXTERIOR] = DISTANCE_NODATA
-
-    # extract spillovers
+class ValleyBottomConnectedState(SpilloverTile):
+    """
+    Connected valley bottom exploration state of one tile,
+    padded with a one-pixel border from neighboring tiles
+    """
 
-    spillovers = [
-        (i, j) for i, j in border(height, width)
-        if domain[i, j] == DOMAIN_INTERIOR and connected[i, j] == DOMAIN_REFERENCE
+    fields = [
+        ('distance', 'float32')
     ]
 
-    if spillovers:
+    def __init__(self, row, col, params, **kwargs):
 
-        xy = fct.pixeltoworld(np.array(spillovers, dtype='int32'), transform)
+        super().__init__(row, col)
+        self.params = params
+        self.kwargs = kwargs
 
-        def attributes(k, ij):
-            """
-            Returns (row, col, x, y, height, distance)
-            """
+    def load(self):
 
-            i, j = ij
+        row = self.row
+        col = self.col
+        params = self.params
+        kwargs = self.kwargs
 
-            if i == 0:
-                prow = row - 1
-            elif i == height-1:
-                prow = row + 1
-            else:
-                prow = row
+        if not params.mask.tilename(row=row, col=col, **kwargs).exists():
+            return False
 
-            if j == 0:
-                pcol = col - 1
-            elif j == width-1:
-                pcol = col + 1
-            else:
-                pcol = col
+        mask, profile = PadRaster(row, col, params.mask, padding=1, **kwargs)
+        output_mask = str(params.output_mask.tilename(row=row, col=col, **kwargs))
 
-            return (prow, pcol) + tuple(xy[k]) + (distance[i, j],)
+        if os.path.exists(output_mask):
 
-        spillovers = [
-            attributes(k, ij)
-            for k, ij in enumerate(spillovers)
-        ]
-
-    # write output
-
-    connected = connected[1:-1, 1:-1]
-    distance = distance[1:-1, 1:-1]
-
-    output_mask += params.tmp_suffix
-    output_distance += params.tmp_suffix
+            domain, _ = PadRaster(row, col, params.output_mask, padding=1, **kwargs)
+            distance, _ = PadRaster(row, col, params.output_distance, padding=1, **kwargs)
 
-    height, width = connected.shape
-    transform = transform * transform.translation(1, 1)
-    profile.update(
-        dtype='uint8',
-        nodata=DOMAIN_EXTERIOR,
-        height=height,
-        width=width,
-        transform=transform,
-        compress='deflate')
-
-    with rio.open(output_mask, 'w', **profile) as dst:
-        dst.write(connected, 1)
-
-    profile.update(dtype='float32', nodata=DISTANCE_NODATA)
+        else:
 
-    with rio.open(output_distance, 'w', **profile) as dst:
-        dst.write(distance, 1)
+            drainage_distance, _ = PadRaster(row, col, params.distance, padding=1, **kwargs)
 
-    # return spillovers and destination filenames
+            domain = np.full_like(mask, DOMAIN_EXTERIOR, dtype='uint8')
+            domain[(mask == MASK_VALLEY_BOTTOM) | (mask == MASK_FLOOPLAIN_RELIEF)] = DOMAIN_INTERIOR
+            domain[(mask != MASK_EXTERIOR) & (np.abs(drainage_distance) < 1)] = DOMAIN_REFERENCE
 
-    return spillovers, (output_mask, output_distance)
+            distance = np.zeros_like(mask, dtype='float32')
 
-def ValleyBottomConnectedIteration(params, spillovers, ntiles, processes=1, **kwargs):
-    """
-    Multiprocessing wrapper for ValleyBottomConnectedTile
-    """
+        self.domain = domain
+        self.distance = distance
+        self.profile = profile
+        self.transform = profile['transform']
+        self.height, self.width = mask.shape
 
-    tile = itemgetter(0, 1)
-    values = itemgetter(2, 3, 4)
+        return True
 
-    spillovers = sorted(spillovers, key=tile)
-    tiles = itertools.groupby(spillovers, key=tile)
+    def seed(self, seeds):
 
-    g_spillover = list()
-    tmpfiles = list()
+        pixels, intile = self.seed_pixels(seeds)
+        seed_distance = seeds['distance'][intile]
 
-    def arguments():
+        # when several seeds hit the same pixel,
+        # apply shortest seed last
 
-        for (row, col), seeds in tiles:
+        order = np.argsort(-seed_distance, kind='stable')
+        pixels = pixels[order]
+        seed_distance = seed_distance[order]
 
-            seeds = [values(seed) for seed in seeds]
+        recorded_distance = self.distance[pixels[:, 0], pixels[:, 1]]
+        shortest = (recorded_distance == DISTANCE_NODATA) | (seed_distance < recorded_distance)
+        pixels = pixels[shortest]
 
-            yield (
-                ValleyBottomConnectedTile,
-                row,
-                col,
-                seeds,
-                params,
-                kwargs)
+        self.domain[pixels[:, 0], pixels[:, 1]] = DOMAIN_REFERENCE
+        self.distance[pixels[:, 0], pixels[:, 1]] = seed_distance[shortest]
 
-    with Pool(processes=processes) as pool:
+        return int(np.sum(shortest))
 
-        pooled = pool.imap_unordered(starcall, arguments())
-        with click.progressbar(pooled, length=ntiles) as iterator:
-            for t_spillover, tmps in iterator:
-                g_spillover.extend(t_spillover)
-                tmpfiles.extend(tmps)
+    def run(self):
 
-    for tmpfile in tmpfiles:
-        os.rename(tmpfile, tmpfile.replace('.tif' + params.tmp_suffix, '.tif'))
+        params = self.params
+        domain = self.domain
+        distance = self.distance
 
-    return g_spillover
+        # calculate connected subdomain
 
-def ValleyBottomConnectedFirstIteration(params, processes, **kwargs):
-    """
-    First tile iteration with empty seed list.
-    """
+        connected = speedup.shortest_value(
+            domain,
+            np.copy(domain),
+            DOMAIN_EXTERIOR,
+            DOMAIN_REFERENCE,
+            distance,
+            params.distance_max,
+            params.jitter)
 
-    tilefile = params.tiles.filename(**kwargs)
+        distance[connected == DOMAIN_EXTERIOR] = DISTANCE_NODATA
 
-    def length():
+        # extract spillovers
 
-        with open(tilefile) as fp:
-            return sum(1 for line in fp)
+        pixels = border_pixels(self.height, self.width)
+        pixels = pixels[
+            (domain[pixels[:, 0], pixels[:, 1]] == DOMAIN_INTERIOR) &
+            (connected[pixels[:, 0], pixels[:, 1]] == DOMAIN_REFERENCE)
+        ]
 
-    def arguments():
+        self.domain = connected
 
-        with open(tilefile) as fp:
-            for line in fp:
+        return self.spillovers(
+            pixels,
+            distance=distance[pixels[:, 0], pixels[:, 1]])
 
-                row, col = tuple(int(x) for x in line.split(','))
+    def save(self, suffix=''):
 
-                yield (
-                    ValleyBottomConnectedTile,
-                    row,
-                    col,
-                    [],
-                    params,
-                    kwargs
-                )
+        params = self.params
+        kwargs = self.kwargs
+        row = self.row
+        col = self.col
 
-    g_spillover = list()
-    tmpfiles = list()
+        output_mask = str(params.output_mask.tilename(row=row, col=col, **kwargs)) + suffix
+        output_distance = str(params.output_distance.tilename(row=row, col=col, **kwargs)) + suffix
 
-    with Pool(processes=processes) as pool:
+        connected = self.domain[1:-1, 1:-1]
+        distance = self.distance[1:-1, 1:-1]
 
-        pooled = pool.imap_unordered(starcall, arguments())
+        height, width = connected.shape
+        transform = self.transform * self.transform.translation(1, 1)
+        profile = self.profile.copy()
+        profile.update(
+            dtype='uint8',
+            nodata=DOMAIN_EXTERIOR,
+            height=height,
+            width=width,
+            transform=transform,
+            compress='deflate')
 
-        with click.progressbar(pooled, length=length()) as iterator:
-            for t_spillover, tmps in iterator:
-                g_spillover.extend(t_spillover)
-                tmpfiles.extend(tmps)
+        with rio.open(output_mask, 'w', **profile) as dst:
+            dst.write(connected, 1)
 
-        # with click.progressbar(pooled, length=len(arguments)) as bar:
-        #     for t_spillover in bar:
-        #         g_spillover.extend(t_spillover)
+        profile.update(dtype='float32', nodata=DISTANCE_NODATA)
 
-    for tmpfile in tmpfiles:
-        os.rename(tmpfile, tmpfile.replace('.tif' + params.tmp_suffix, '.tif'))
+        with rio.open(output_distance, 'w', **profile) as dst:
+            dst.write(distance, 1)
 
-    return g_spillover
+        return [output_mask, output_distance]
 
 def ValleyBottomFinalTile(row, col, params, **kwargs):
 
@@ -390,21 +311,17 @@ def ConnectedValleyBottom(params, processes=1, **kwargs):
     excluding terraces, slopes and flat areas not connected to drainage network
     """
 
-    count = 1
-    tile = itemgetter(0, 1)
-    g_tiles = set()
-
-    click.echo('Iteration %02d --' % count)
-    seeds = ValleyBottomConnectedFirstIteration(params, processes=processes, **kwargs)
-
-    while seeds:
+    tilefile = params.tiles.filename(**kwargs)
 
-        count += 1
-        tiles = {tile(s) for s in seeds}
-        g_tiles.update(tiles)
-        click.echo('Iteration %02d -- %d spillovers, %d tiles' % (count, len(seeds), len(tiles)))
+    with open(tilefile) as fp:
+        tiles = [tuple(int(x) for x in line.split(',')) for line in fp]
 
-        seeds = ValleyBottomConnectedIteration(params, seeds, len(tiles), processes, **kwargs)
+    IterateSpillovers(
+        partial(ValleyBottomConnectedState, params=params, **kwargs),
+        ValleyBottomConnectedState.empty_seeds(),
+        tiles=tiles,
+        processes=processes,
+        suffix=params.tmp_suffix)
 
 def TrueValleyBottom(params: Parameters, processes: int = 1, **kwargs):
 
@@ -18,7 +18,6 @@ from multiprocessing import Pool
 
 import numpy as np
 import click
-import rasterio as rio
 
 from ..config import (
     config,
@@ -27,6 +26,7 @@ from ..config import (
 )
 from .. import speedup
 from ..cli import starcall
+from ..tileio import ReadRaster, WriteRaster
 
 ValleyBottomMaskParams = namedtuple('ValleyBottomMaskParams', [
     'height',
@@ -172,36 +172,30 @@ def ValleyBottomMaskTile(axis, row, col, params, **kwargs):
     # with rio.open(dem_raster) as ds:
     #     dem_nodata = (ds.read(1) == ds.nodata)
 
-    with rio.open(distance_raster) as ds:
-        distance = ds.read(1)
+    distance, _ = ReadRaster(distance_raster)
+    hand, profile = ReadRaster(height_raster)
+    nodata = profile['nodata']
 
-    with rio.open(height_raster) as ds:
-
-        hand = ds.read(1)
-
-        mask = np.float32(
-            ~(
-                (hand < -params.max_slope * params.distance_resolution * distance)
-                & (params.distance_resolution * distance > params.min_distance)
-                | (hand > params.max_height)
-            )
+    mask = np.float32(
+        ~(
+            (hand < -params.max_slope * params.distance_resolution * distance)
+            & (params.distance_resolution * distance > params.min_distance)
+            | (hand > params.max_height)
         )
-        
-        mask[hand == ds.nodata] = 0
+    )
 
-        hand[mask == 0] = ds.nodata
-        # hand[dem_nodata] = ds.nodata
+    mask[hand == nodata] = 0
 
-        if params.buffer_width > 0:
+    hand[mask == 0] = nodata
+    # hand[dem_nodata] = nodata
 
-            speedup.raster_buffer(mask, 0, params.buffer_width, 1)
-            hand[(hand == ds.nodata) & (mask == 1)] = params.max_height
+    if params.buffer_width > 0:
 
-        profile = ds.profile.copy()
-        profile.update(compress='deflate')
+        speedup.raster_buffer(mask, 0, params.buffer_width, 1)
+        hand[(hand == nodata) & (mask == 1)] = params.max_height
 
-        with rio.open(output, 'w', **profile) as dst:
-            dst.write(hand, 1)
+    profile.update(compress='deflate')
+    WriteRaster(output, hand, profile, params.output.storage)
 
 def ValleyBottomMask(axis, params, processes=1, **kwargs):
     """
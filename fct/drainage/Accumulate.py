@@ -19,24 +19,34 @@ Sequence :
 
 
 import os
-import glob
-from collections import defaultdict, Counter
-import itertools
-from operator import itemgetter
+from multiprocessing import Pool
 
 import numpy as np
 
 import click
 import rasterio as rio
+from rasterio.transform import Affine, rowcol
 import fiona
 import fiona.crs
 
 from .. import speedup
 from .. import terrain_analysis as ta
+from ..cli import starcall
 from ..config import (
     config,
     DatasetParameter,
-    DatasourceParameter
+    DatasourceParameter,
+    LiteralParameter
+)
+from ..config.descriptors import DatasetResolver
+from .TileGraph import (
+    EDGE_DTYPE,
+    edges_from_outlets,
+    links_from_pixels,
+    write_tile_graph,
+    load_graph,
+    inlet_contributions,
+    group_by_tile
 )
 
 def tileindex():
@@ -53,14 +63,17 @@ class Parameters():
     # exterior = DatasourceParameter('exterior flow')
     exterior_flow = DatasourceParameter('exterior flow')
 
-    elevations = DatasetParameter('filled-resolved elevation raster (DEM)', type='input')
     flow = DatasetParameter('flow direction raster', type='input')
 
-    outlets = DatasetParameter('tile outlets (point) shapefile', type='output')
-    outlets_pattern = DatasetParameter('tile outlets shapefile glob pattern', type=None)
-    inlets = DatasetParameter('tile inlets (point) shapefile', type='output')
-    inlet_areas = DatasetParameter('', type='output')
-    acc = DatasetParameter('accumulation raster (drainage area)', type='output')
+    outlets = DatasetParameter('tile outlets graph records (npz)', type='output')
+    inlets = DatasetParameter('tile inlets (point) shapefile, for QA', type='output')
+    inlet_areas = DatasetParameter('tile inlets contributions (npz)', type='output')
+    acc = DatasetParameter('accumulation raster (drainage area), one band per weight', type='output')
+
+    weights = LiteralParameter(
+        'list of (dataset, band, coefficient) weight rasters to accumulate ; '
+        'dataset None stands for unit pixel weight')
+    acc_nodata = LiteralParameter('no-data value of accumulation raster')
 
     def __init__(self):
         """
@@ -68,455 +81,418 @@ class Parameters():
         """
 
         self.exterior_flow = 'off' # 'exterior-inlets'
-        self.elevations = 'dem'
         self.flow = 'flow'
         self.outlets = 'outlets'
-        self.outlets_pattern = 'outlets-glob'
         self.inlets = 'inlets'
         self.inlet_areas = 'inlet-areas'
         self.acc = 'acc'
 
-def TileOutlets(row, col, params, verbose=False):
+        # drainage area in km^2, for 5 m pixels
+        self.weights = [(None, 1, 25e-6)]
+        self.acc_nodata = 0.0
+
+def ReadWeightsTile(row, col, params, shape):
     """
-    Find tile outlets,
-    ie. pixels connecting to anoter tile according to flow direction.
+    Read weight rasters for tile (row, col),
+    as a (bands, height, width) float32 array.
+    Weight rasters must be aligned with flow tiles ;
+    nodata values have no contribution.
+
+    Returns
+    -------
+
+    values: array (bands, height, width), dtype=float32
+        weight of each pixel
+
+    missing: array (bands, height, width), dtype=bool
+        nodata pixels of weight rasters
     """
 
-    tile_index = tileindex()
+    values = np.zeros((len(params.weights),) + shape, dtype='float32')
+    missing = np.zeros((len(params.weights),) + shape, dtype=np.bool_)
 
-    crs = fiona.crs.from_epsg(config.srid)
-    driver = 'GeoJSON'
-    schema = {
-        'geometry': 'Point',
-        'properties': [
-            ('TILE', 'int'),
-            ('LCA', 'int'),
-            ('TO', 'int'),
-            ('TOX', 'float'),
-            ('TOY', 'float'),
-            ('Z', 'float'),
-            ('TOZ', 'float')
-        ]
-    }
-    options = dict(driver='ESRI Shapefile', crs=crs, schema=schema)
+    for k, (dataset, band, coeff) in enumerate(params.weights):
 
-    # read_tile_index()
+        if dataset is None:
 
-    flow_raster = params.flow.tilename(row=row, col=col)
-    # config.tileset().tilename('flow', row=row, col=col)
+            values[k] = coeff
+            continue
 
-    gid = tile_index[(row, col)].gid
-    tiles = defaultdict(list)
+        rasterfile = DatasetResolver(dataset).tilename(row=row, col=col)
 
-    # def readz(trow, tcol, x, y):
+        if not os.path.exists(rasterfile):
+            continue
 
-    #     with rio.open(config.tileset().tilename('filled', row=trow, col=tcol)) as src:
-    #         return float(next(src.sample([(x, y)], 1)))
+        with rio.open(rasterfile) as ds:
 
-    with rio.open(flow_raster) as ds:
+            data = ds.read(band)
+            values[k] = data * coeff
 
-        height, width = ds.shape
-        flow = ds.read(1)
-        mask = np.ones_like(flow, dtype=np.uint8)
-        outlets, targets = ta.tile_outlets(flow, mask)
-
-        for current, (ti, tj) in enumerate(targets):
-
-            top = (ti < 0)
-            bottom = (ti >= height)
-            left = (tj < 0)
-            right = (tj >= width)
-
-            if top:
-                di = -1
-            elif bottom:
-                di = +1
-            else:
-                di = 0
-
-            if left:
-                dj = -1
-            elif right:
-                dj = +1
-            else:
-                dj = 0
-
-            tiles[(row+di, col+dj)].append(current)
-
-                # target = tile_index[(row+di, col+dj)].gid
-                # (i, j), area = outlets[current]
-                # x, y = ds.xy(i, j)
-                # tx, ty = ds.xy(ti, tj)
-                # outlet_z = readz(row, col, x, y)
-                # target_z = readz(row+di, col+dj, tx, ty)
-
-                # geom = {'type': 'Point', 'coordinates': [x, y]}
-                # props = {
-                #     'TILE': gid,
-                #     'LCA': area,
-                #     'TO': target,
-                #     'TOX': tx,
-                #     'TOY': ty,
-                #     'Z': outlet_z,
-                #     'TOZ': target_z
-                # }
-
-                # dst.write({'geometry': geom, 'properties': props})
-
-        cum_area = 0
-        skipped = 0
-
-        schema = {
-            'geometry': 'Point',
-            'properties': [
-                ('TILE', 'int'),
-                ('LCA', 'int'),
-                ('FROM', 'int'),
-                ('FROMX', 'float'),
-                ('FROMY', 'float')
-            ]
-        }
-        options = dict(driver=driver, crs=crs, schema=schema)
-
-        for trow, tcol in tiles:
-
-            if (trow, tcol) not in tile_index:
-                skipped += len(tiles[(trow, tcol)])
+            if ds.nodata is not None:
+                missing[k] = data == ds.nodata
+                values[k][missing[k]] = 0.0
+
+    return values, missing
+
+def TileExteriorInlets(row, col, params, flow, transform):
+    """
+    Connect exterior flow points falling within tile (row, col)
+    to the tile exit of their flow path.
+    Exterior drained area (AREAKM2) contributes
+    to unit pixel weights only.
+
+    Returns
+    -------
+
+    edges: array of EDGE_DTYPE records
+        exterior -> inlet connections
+
+    weights: array (n, bands)
+        exterior contributions
+
+    links: array (m, 4)
+        (i, j, oi, oj) inlet -> tile exit connections
+    """
+
+    tile = tileindex()[(row, col)]
+    height, width = flow.shape
+    exterior_flow = params.exterior_flow.filename()
+
+    # exterior area in km^2 -> number of pixels of constant weight `coeff`
+    pixel_area = abs(transform.a * transform.e) * 1e-6
+    unit = np.array([
+        coeff / pixel_area if dataset is None else 0.0
+        for dataset, _, coeff in params.weights
+    ])
+
+    edges = list()
+    links = list()
+
+    with fiona.open(exterior_flow) as fs:
+        for feature in fs.filter(bbox=tile.bounds):
+
+            i, j = rowcol(transform, *feature['geometry']['coordinates'])
+
+            if not all([i >= 0, i < height, j >= 0, j < width]):
                 continue
 
-            target = tile_index[(trow, tcol)].gid
-            output = params.outlets.tilename(row=trow, col=tcol, gid=gid)
-            # config.tileset().tilename('outlets', row=trow, col=tcol, gid=gid)
-
-            # if os.path.exists(output):
-            #     mode = 'a'
-            # else:
-            #     mode = 'w'
-
-            with fiona.open(output, 'w', **options) as dst:
-                for idx in tiles[(trow, tcol)]:
-
-                    (i, j), area = outlets[idx]
-                    ti, tj = targets[idx]
-                    x, y = ds.xy(i, j)
-                    tx, ty = ds.xy(ti, tj)
-
-                    cum_area += area
-                
-                    geom = {'type': 'Point', 'coordinates': [tx, ty]}
-                    props = {
-                        'TILE': target,
-                        'LCA': area,
-                        'FROM': gid,
-                        'FROMX': x,
-                        'FROMY': y
-                    }
+            # connect exterior->inlet
 
-                    dst.write({'geometry': geom, 'properties': props})
+            area = feature['properties']['AREAKM2']
+            edges.append((-1, -1, -1, tile.gid, i, j, area))
 
-    if verbose:
-        click.secho('\nSkipped %d outlets' % skipped, fg='yellow')
-        click.secho('Tile (%02d, %02d) Coverage = %.1f %%' % (row, col, (cum_area / (height*width) * 100)), fg='green')
+            # connect inlet->tile outlet
 
-    return cum_area
+            ti, tj = ta.outlet(flow, i, j)
 
-def AggregateOutlets(params):
+            if (ti, tj) != (i, j):
+                links.append((i, j, ti, tj))
+
+    edges = np.array(edges, dtype=EDGE_DTYPE)
+
+    return (
+        edges,
+        np.outer(edges['area'], unit),
+        np.array(links, dtype=np.int32).reshape(-1, 4)
+    )
+
+def TileOutlets(row, col, params, verbose=False):
     """
-    Aggregate ROW_COL_INLETS_ORIGIN.geojson files
-    into one ROW_COL_INLETS.shp shapefile
+    Find tile outlets,
+    ie. pixels connecting to anoter tile according to flow direction,
+    and record outlet -> inlet connections as binary edge records,
+    with local contributions of every weight raster.
     """
 
     tile_index = tileindex()
 
-    crs = fiona.crs.from_epsg(config.srid)
-    driver = 'ESRI Shapefile'
-    schema = {
-        'geometry': 'Point',
-        'properties': [
-            ('TILE', 'int'),
-            ('LCA', 'int'),
-            ('FROM', 'int'),
-            ('FROMX', 'float'),
-            ('FROMY', 'float')
-        ]
-    }
-    options = dict(driver=driver, crs=crs, schema=schema)
+    if (row, col) not in tile_index:
+        return 0
 
-    with click.progressbar(tile_index) as progress:
-        for row, col in progress:
+    flow_raster = params.flow.tilename(row=row, col=col)
+    output = params.outlets.tilename(row=row, col=col)
 
-            output = params.inlets.tilename(row=row, col=col)
-            # config.tileset().tilename('inlets', row=row, col=col)
+    with rio.open(flow_raster) as ds:
 
-            with fiona.open(output, 'w', **options) as dst:
+        flow = ds.read(1)
+        height, width = flow.shape
+        transform = ds.transform
 
-                pattern = str(params.outlets_pattern.tilename(row=row, col=col))
-                # config.tileset().tilename(
-                #     'outlets-glob',
-                #     row=row,
-                #     col=col)
+    values, _ = ReadWeightsTile(row, col, params, flow.shape)
+    outlets, areas, links = speedup.tile_outlet_graph(flow, values)
+    edges, weights, skipped = edges_from_outlets(row, col, outlets, areas, height, width)
 
-                for name in glob.glob(pattern):
-                    with fiona.open(name) as fs:
+    if not params.exterior_flow.none:
 
-                        for feature in fs:
-                            dst.write(feature)
+        exterior_edges, exterior_weights, exterior_links = \
+            TileExteriorInlets(row, col, params, flow, transform)
+        edges = np.concatenate([edges, exterior_edges])
+        weights = np.concatenate([weights, exterior_weights])
+        links = np.concatenate([links, exterior_links])
 
-def CreateOutletsGraph(params, exterior='exterior-inlets'):
-    """
-    DOCME
+    write_tile_graph(output, edges, links_from_pixels(row, col, links), transform, weights)
+
+    cum_area = np.sum(areas[:, 0]) if areas.shape[1] > 0 else 0.0
+
+    if verbose:
+        coverage = cum_area / max(np.sum(values[0][flow != -1]), 1e-12)
+        click.secho('\nSkipped %d outlets' % skipped, fg='yellow')
+        click.secho('Tile (%02d, %02d) Coverage = %.1f %%' % (row, col, coverage * 100), fg='green')
+
+    return cum_area
+
+def CreateOutletsGraph(params):
     """
+    Concatenate tile edge records into one cross-tile graph
+    of outlet -> inlet and inlet -> tile outlet connections
 
-    tile_index = tileindex()
-    elevation_raster = params.elevations.filename()
-    # config.tileset().filename('dem')
+    Returns
+    -------
+
+    edges: array of EDGE_DTYPE records
+    weights: array (n, bands) of edge contributions
+    """
 
     click.secho('Build outlets graph', fg='cyan')
 
-    graph = dict()
-    indegree = Counter()
+    edges, weights, _ = load_graph(params.outlets)
 
-    # provide world/pixel geotransform
-    dem = rio.open(elevation_raster)
+    click.secho('Created graph with %d edges' % len(edges), fg='green')
 
-    with click.progressbar(tile_index) as progress:
-        for row, col in progress:
+    return edges, weights
 
-            tile = tile_index[(row, col)].gid
-            inlet_shapefile = params.inlets.tilename(row=row, col=col)
-            # config.tileset().tilename('inlets', row=row, col=col)
-            flow_raster = params.flow.tilename(row=row, col=col)
-            # config.tileset().tilename('flow', row=row, col=col)
+def InletAreas(params):
+    """
+    Accumulate contributions across tiles
+    and output per tile inlet records
+    with contributions flowing into tile.
+    """
 
-            with rio.open(flow_raster) as ds:
+    tile_index = tileindex()
+    tiles = {tile.gid: tile for tile in tile_index.values()}
 
-                flow = ds.read(1)
-                height, width = flow.shape
+    edges, weights = CreateOutletsGraph(params)
 
-                with fiona.open(inlet_shapefile) as fs:
-                    for feature in fs:
+    click.secho('Accumulate graph', fg='cyan')
 
-                        # connect outlet->inlet
+    inlets, values = inlet_contributions(edges, weights)
 
-                        from_tile = feature['properties']['FROM']
-                        area = feature['properties']['LCA']
-                        from_i, from_j = dem.index(feature['properties']['FROMX'], feature['properties']['FROMY'])
-                        i, j = dem.index(*feature['geometry']['coordinates'])
-                        graph[(from_tile, from_i, from_j)] = (tile, i, j, area)
-                        indegree[(tile, i, j)] += 1
+    click.secho('Write inlet records', fg='cyan')
 
-                        # connect inlet->tile outlet
+    groups = group_by_tile(inlets, values)
 
-                        loci, locj = ds.index(*feature['geometry']['coordinates'])
-                        locti, loctj = ta.outlet(flow, loci, locj)
-                        ti, tj = dem.index(*ds.xy(locti, loctj))
+    with click.progressbar(groups, length=len(tile_index)) as iterator:
+        for tile_gid, i, j, contributions in iterator:
 
-                        if (locti, loctj) == (loci, locj):
-                            continue
-                        
-                        if ti >= 0 and tj >= 0:
-                            graph[(tile, i, j)] = (tile, ti, tj, 0)
-                            indegree[(tile, ti, tj)] += 1
+            if tile_gid in tiles:
 
-                # exterior_flow = params.exterior_flow.filename()
+                tile = tiles[tile_gid]
+                output = params.inlet_areas.tilename(row=tile.row, col=tile.col)
 
-                # if exterior_flow and os.path.exists(exterior_flow):
-                if not params.exterior_flow.none:
+                np.savez(
+                    output,
+                    i=np.int32(i),
+                    j=np.int32(j),
+                    areas=np.float32(contributions))
 
-                    exterior_flow = params.exterior_flow.filename()
+def FlowAccumulationTile(row, col, params, overwrite):
+    """
+    Accumulate weight rasters according to D8 flow direction,
+    including contributions from inlets,
+    with one read of the flow tile.
+    Output has one band per weight raster.
+    """
 
-                    with fiona.open(exterior_flow) as fs:
-                        for feature in fs:
+    flow_raster = params.flow.tilename(row=row, col=col)
+    # config.tileset().tilename('flow', row=row, col=col)
+    inlet_areas = params.inlet_areas.tilename(row=row, col=col)
+    # config.tileset().tilename('inlet-areas', row=row, col=col)
+    output = params.acc.tilename(row=row, col=col)
+    # config.tileset().tilename('acc', row=row, col=col)
 
-                            loci, locj = ds.index(*feature['geometry']['coordinates'])
+    if os.path.exists(output) and not overwrite:
+        click.secho('Output already exists: %s' % output, fg='yellow')
+        return
 
-                            if not all([loci >= 0, loci < height, locj >= 0, locj < width]):
-                                continue
+    with rio.open(flow_raster) as ds:
 
-                            # connect exterior->inlet
+        flow = ds.read(1)
+        flow_nodata = ds.nodata
+        profile = ds.profile.copy()
 
-                            i, j = dem.index(*feature['geometry']['coordinates'])
-                            area = feature['properties']['AREAKM2'] / 25e-6
-                            graph[(-2, i-1, j-1)] = (tile, i, j, area)
-                            indegree[(tile, i, j)] += 1
+    out, missing = ReadWeightsTile(row, col, params, flow.shape)
 
-                            # connect inlet->tile outlet
+    if os.path.exists(inlet_areas):
 
-                            locti, loctj = ta.outlet(flow, loci, locj)
-                            ti, tj = dem.index(*ds.xy(locti, loctj))
+        with np.load(inlet_areas) as data:
 
-                            if (locti, loctj) == (loci, locj):
-                                continue
-                            
-                            if ti >= 0 and tj >= 0:
-                                graph[(tile, i, j)] = (tile, ti, tj, 0)
-                                indegree[(tile, ti, tj)] += 1
+            for k in range(out.shape[0]):
+                np.add.at(out[k], (data['i'], data['j']), data['areas'][:, k])
 
-    dem.close()
+    speedup.flow_accumulation_multiband(flow, out)
 
-    click.secho('Created graph with %d nodes' % len(graph), fg='green')
+    # pixels outside of DEM, or without weight, have no data
+    out[missing] = params.acc_nodata
 
-    return graph, indegree
+    if flow_nodata is not None:
+        out[:, flow == flow_nodata] = params.acc_nodata
 
-    # queue = [pixel for pixel in graph if indegree[pixel] == 0]
-    # areas = defaultdict(lambda: 0)
-    # seen = set()
+    profile.update(
+        compress='deflate',
+        nodata=params.acc_nodata,
+        dtype=np.float32,
+        count=out.shape[0])
 
-    # with click.progressbar(length=len(indegree)) as progress:
-    
-    #     while queue:
+    with rio.open(output, 'w', **profile) as dst:
+        dst.write(out)
 
-    #         tile, i, j = queue.pop(0)
+def FlowAccumulation(params, processes=1, overwrite=True):
+    """
+    Whole-basin flow accumulation of every weight raster :
 
-    #         if (tile, i, j) in seen:
-    #             continue
+    1. find tile outlets and local contributions (parallel)
+    2. resolve inlet contributions over the tile graph
+    3. accumulate tiles with inlet contributions (parallel)
+    """
 
-    #         progress.update(1)
-    #         seen.add((tile, i, j))
+    tile_index = tileindex()
 
-    #         if (tile, i, j) in graph:
+    def arguments(fun, **kwargs):
+        for row, col in tile_index:
+            yield (fun, row, col, params, kwargs)
 
-    #             tile, i, j, area = graph[(tile, i, j)]
-    #             areas[(tile, i, j)] += area*25e-6 # convert to km^2
-    #             indegree[(tile, i, j)] -= 1
+    click.secho('Find tile outlets', fg='cyan')
 
-    #             if indegree[(tile, i, j)] == 0:
-    #                 queue.append((tile, i, j))
+    with Pool(processes=processes) as pool:
 
-    # return areas
+        pooled = pool.imap_unordered(starcall, arguments(TileOutlets))
+        with click.progressbar(pooled, length=len(tile_index)) as iterator:
+            for _ in iterator:
+                pass
 
+    InletAreas(params)
 
-def InletAreasTile(row, col, gid, params, keys, areas):
+    click.secho('Accumulate tiles', fg='cyan')
+
+    with Pool(processes=processes) as pool:
+
+        pooled = pool.imap_unordered(
+            starcall,
+            arguments(FlowAccumulationTile, overwrite=overwrite))
+
+        with click.progressbar(pooled, length=len(tile_index)) as iterator:
+            for _ in iterator:
+                pass
+
+def ExportOutlets(params):
     """
-    Output inlet points,
-    attributed with the total upstream drained area.
+    Export tile outlets graph as a point shapefile, for QA.
+    Points are located at inlet pixels,
+    with origin outlet pixel in properties FROMX, FROMY.
     """
 
+    output = params.outlets.filename()
+    edges, _, transforms = load_graph(params.outlets)
+    edges = edges[(edges['tile'] >= 0) & (edges['tile'] != edges['to_tile'])]
+
     crs = fiona.crs.from_epsg(config.srid)
     driver = 'ESRI Shapefile'
     schema = {
         'geometry': 'Point',
         'properties': [
             ('TILE', 'int'),
-            ('AREAKM2', 'float')
+            ('LCA', 'float'),
+            ('FROM', 'int'),
+            ('FROMX', 'float'),
+            ('FROMY', 'float')
         ]
     }
     options = dict(driver=driver, crs=crs, schema=schema)
 
-    # provide world/pixel geotransform
-    dem_file = params.elevations.filename()
-    # config.tileset().filename('dem')
-    dem = rio.open(dem_file)
+    x, y = tile_xy(edges['to_tile'], edges['ti'], edges['tj'], transforms)
+    fromx, fromy = tile_xy(edges['tile'], edges['i'], edges['j'], transforms)
 
-    cum_areas = defaultdict(lambda: 0.0)
+    def records():
 
-    for key in keys:
-        cum_areas[key[1:]] += areas.get(key[1:], 0)
+        for k, edge in enumerate(edges):
 
-    inlet_shapefile = params.inlets.tilename(row=row, col=col)
-    # config.tileset().tilename('inlets', row=row, col=col)
-    emitted = set()
+            geom = {'type': 'Point', 'coordinates': [float(x[k]), float(y[k])]}
+            props = {
+                'TILE': int(edge['to_tile']),
+                'LCA': float(edge['area']),
+                'FROM': int(edge['tile']),
+                'FROMX': float(fromx[k]),
+                'FROMY': float(fromy[k])
+            }
 
-    output = params.inlet_areas.tilename(row=row, col=col)
-    # config.tileset().tilename('inlet-areas', row=row, col=col)
+            yield {'geometry': geom, 'properties': props}
 
     with fiona.open(output, 'w', **options) as dst:
-        with fiona.open(inlet_shapefile) as fs:
-            for feature in fs:
-
-                x, y = feature['geometry']['coordinates']
-                i, j = dem.index(x, y)
-
-                if (i, j) in emitted:
-                    continue
-
-                assert (i, j) in cum_areas
-                area = cum_areas[i, j]
+        dst.writerecords(records())
 
-                geom = {'type': 'Point', 'coordinates': [x, y]}
-                props = {'TILE': gid, 'AREAKM2': area}
-                feature = {'geometry': geom, 'properties': props}
-                dst.write(feature)
+    click.secho('Saved to : %s' % output, fg='green')
 
-                emitted.add((i, j))
-
-    dem.close()
-
-def InletAreas(params):
+def ExportInletAreas(params):
     """
-    Accumulate areas across tiles
-    and output per tile inlet shapefiles
-    with contributing area flowing into tile.
+    Export inlet contributing areas as a point shapefile, for QA.
     """
 
     tile_index = tileindex()
-    tiles = {tile.gid: tile for tile in tile_index.values()}
+    output = params.inlets.filename()
 
-    graph, indegree = CreateOutletsGraph(params)
-
-    click.secho('Accumulate areas', fg='cyan')
-    areas, res = speedup.graph_acc(graph)
-
-    keys = sorted(graph.keys() | indegree.keys(), key=itemgetter(0))
-    groups = itertools.groupby(keys, key=itemgetter(0))
-
-    click.secho('Write inlet shapefiles', fg='cyan')
-    with click.progressbar(groups, length=len(tile_index)) as progress:
-        for tile_gid, keys in progress:
-
-            if tile_gid in tiles:
-                tile = tiles[tile_gid]
-                InletAreasTile(tile.row, tile.col, tile.gid, params, keys, areas)
-
-def FlowAccumulationTile(row, col, params, overwrite):
-    """
-    Calculate D8 flow direction tile
-    """
+    crs = fiona.crs.from_epsg(config.srid)
+    driver = 'ESRI Shapefile'
+    schema = {
+        'geometry': 'Point',
+        'properties': [
+            ('TILE', 'int'),
+            ('AREAKM2', 'float')
+        ]
+    }
+    options = dict(driver=driver, crs=crs, schema=schema)
 
-    flow_raster = params.flow.tilename(row=row, col=col)
-    # config.tileset().tilename('flow', row=row, col=col)
-    inlet_shapefile = params.inlet_areas.tilename(row=row, col=col)
-    # config.tileset().tilename('inlet-areas', row=row, col=col)
-    output = params.acc.tilename(row=row, col=col)
-    # config.tileset().tilename('acc', row=row, col=col)
+    with fiona.open(output, 'w', **options) as dst:
+        with click.progressbar(tile_index) as iterator:
+            for row, col in iterator:
 
-    if os.path.exists(output) and not overwrite:
-        click.secho('Output already exists: %s' % output, fg='yellow')
-        return
+                inlet_areas = params.inlet_areas.tilename(row=row, col=col)
+                flow_raster = params.flow.tilename(row=row, col=col)
 
-    with rio.open(flow_raster) as ds:
+                if not os.path.exists(inlet_areas):
+                    continue
 
-        flow = ds.read(1)
-        out = np.full_like(flow, 25e-6, dtype='float32')
-        height, width = flow.shape
+                with rio.open(flow_raster) as ds:
+                    transform = ds.transform
 
-        if os.path.exists(inlet_shapefile):
-            with fiona.open(inlet_shapefile) as fs:
-                for feature in fs:
+                with np.load(inlet_areas) as data:
+                    x, y = transform * (data['j'] + 0.5, data['i'] + 0.5)
+                    areas = data['areas'][:, 0]
 
-                    i, j = ds.index(*feature['geometry']['coordinates'])
-                    out[i, j] += feature['properties']['AREAKM2']
+                gid = tile_index[(row, col)].gid
 
-        # with fiona.open(filename('exterior-inlets')) as fs:
-        #     for feature in fs:
-        #         i, j = ds.index(*feature['geometry']['coordinates'])
-        #         if all([i >= 0, i < height, j >= 0, j < width]):
-        #             out[i, j] += feature['properties']['AREAKM2']
+                dst.writerecords(
+                    {
+                        'geometry': {'type': 'Point', 'coordinates': [float(px), float(py)]},
+                        'properties': {'TILE': gid, 'AREAKM2': float(area)}
+                    }
+                    for px, py, area in zip(x, y, areas)
+                )
 
-        speedup.flow_accumulation(flow, out)
+    click.secho('Saved to : %s' % output, fg='green')
 
-        # click.secho('Save to %s' % output, fg='green')
+def tile_xy(tiles, i, j, transforms):
+    """
+    Vectorized conversion of tile pixel coordinates
+    to real world coordinates (pixel centers)
+    """
 
-        if os.path.exists(inlet_shapefile):
-            with fiona.open(inlet_shapefile) as fs:
-                for feature in fs:
+    x = np.full(len(tiles), np.nan)
+    y = np.full(len(tiles), np.nan)
 
-                    x, y = feature['geometry']['coordinates']
-                    i, j = ds.index(x, y)
-                    out[i, j] = feature['properties']['AREAKM2']
+    for gid, gdal_transform in transforms.items():
 
-        profile = ds.profile.copy()
-        profile.update(compress='deflate', nodata=0, dtype=np.float32)
+        transform = Affine.from_gdal(*gdal_transform)
+        mask = (tiles == gid)
+        x[mask], y[mask] = transform * (j[mask] + 0.5, i[mask] + 0.5)
 
-        with rio.open(output, 'w', **profile) as dst:
-            dst.write(out, 1)
+    return x, y
@@ -0,0 +1,149 @@
+# coding: utf-8
+
+"""
+DEM Depression Breaching
+Carve least-cost paths out of depressions,
+as a faster alternative to filling
+
+When `DepressionFill.Parameters().method` is set to 'breach',
+`DepressionFill.BreachDepressions` is run on every tile
+before watershed labeling.
+Each tile is padded with more than `max_breach_length` pixels
+from neighboring tiles, so that breach paths
+starting from the tile may cross tile borders,
+and only end on lower pixels or next to nodata (tileset exterior).
+The breached tile core is saved, and pixels carved in the padding
+are handed off to the neighboring tiles,
+which apply them when their watersheds are labeled.
+Depressions which cannot be breached
+within the configured depth and length,
+as well as rare inconsistencies between breach paths
+carved from neighboring tiles, are resolved by the regular
+watershed spillover resolution of DepressionFill,
+which then leaves fewer flat areas for BorderFlats.
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+
+import numpy as np
+
+from .. import speedup
+from ..config import config
+from ..tileio import PadRaster
+from .TileGraph import NEIGHBORS
+
+def BreachTile(params, row, col, elevations, nodata):
+    """
+    Breach depressions of tile (row, col).
+
+    Parameters
+    ----------
+
+    params: DepressionFill.Parameters
+        Uses `elevations`, `max_breach_depth`,
+        `max_breach_length` and `breach_epsilon`
+
+    elevations: array-like, dtype=float32
+        Tile elevations, possibly burnt,
+        which take precedence over `params.elevations`
+        in the tile core
+
+    nodata: float
+        No-data value in `elevations`
+
+    Returns
+    -------
+
+    breached: array-like
+        Breached tile elevations, same shape as `elevations`
+
+    handoff: dict of arrays (row, col, i, j, z)
+        Pixels carved in neighboring tiles,
+        with pixel coordinates (i, j) in tile (row, col)
+    """
+
+    height, width = elevations.shape
+
+    # breach paths are at most max_breach_length pixels long,
+    # so that pits of the tile never reach padding edges
+    padding = max(int(params.max_breach_length), 0) + 1
+
+    padded, _ = PadRaster(row, col, params.elevations, padding=padding)
+    padded = np.float32(padded)
+    padded[padding:-padding, padding:-padding] = elevations
+    original = np.copy(padded)
+
+    speedup.breach_depressions(
+        padded,
+        nodata,
+        params.max_breach_depth,
+        params.max_breach_length,
+        params.breach_epsilon,
+        padding)
+
+    carved = padded < original
+    carved[padding:-padding, padding:-padding] = False
+    pi, pj = np.nonzero(carved)
+
+    drow = np.where(pi < padding, -1, np.where(pi >= height + padding, 1, 0))
+    dcol = np.where(pj < padding, -1, np.where(pj >= width + padding, 1, 0))
+
+    handoff = dict(
+        row=row + drow,
+        col=col + dcol,
+        i=pi - padding - drow*height,
+        j=pj - padding - dcol*width,
+        z=padded[pi, pj]
+    )
+
+    return padded[padding:-padding, padding:-padding], handoff
+
+def ApplyHandoff(row, col, elevations, handoffs):
+    """
+    Lower elevations of tile (row, col), in place,
+    to pixels carved from neighboring tiles
+
+    Parameters
+    ----------
+
+    handoffs: iterable of dict
+        Handoff records, as returned by `BreachTile`
+    """
+
+    for handoff in handoffs:
+
+        mask = (handoff['row'] == row) & (handoff['col'] == col)
+
+        np.minimum.at(
+            elevations,
+            (handoff['i'][mask], handoff['j'][mask]),
+            handoff['z'][mask])
+
+    return elevations
+
+def ReadHandoffs(row, col, params):
+    """
+    Read handoff records of tiles neighboring tile (row, col)
+    """
+
+    tile_index = config.tileset().tileindex
+
+    for di, dj in NEIGHBORS:
+
+        if (row+di, col+dj) not in tile_index:
+            continue
+
+        filename = params.breach_handoff.tilename(row=row+di, col=col+dj)
+
+        if os.path.exists(filename):
+            with np.load(filename) as data:
+                yield {key: data[key] for key in data.files}
@@ -27,8 +27,8 @@ from shapely.geometry import (
 )
 
 from .. import terrain_analysis as ta
+from .. import speedup
 from ..config import config
-from ..rasterize import rasterize_linestringz
 
 # def DispatchHydrographyToTiles():
 
@@ -50,33 +50,80 @@ from ..rasterize import rasterize_linestringz
 #                 for feature in features:
 #                     fst.write(feature)
 
+#: burn rules, as understood by `speedup.burn_lines`
+BURN_RULES = {
+    'replace': 0,
+    'min': 1,
+    'max': 2
+}
+
+def HydrographyCoordinates(hydrography, transform, bounds):
+    """
+    Read linestrings intersecting `bounds`
+    into a flat (px, py, z) pixel coordinate array
+
+    Returns
+    -------
+
+    coordinates: array (n, 3), dtype=float64
+    offsets: array (lines+1,), dtype=int64
+    """
+
+    geometries = list()
+
+    with fiona.open(hydrography) as fs:
+        for _, feature in fs.items(bbox=bounds):
+
+            geom = np.array(feature['geometry']['coordinates'], dtype=np.float32)
+
+            if geom.ndim == 2 and geom.shape[1] >= 3 and len(geom) > 1:
+                geometries.append(geom[:, :3])
+
+    if not geometries:
+        return np.zeros((0, 3), dtype='float64'), np.zeros(1, dtype='int64')
+
+    offsets = np.zeros(len(geometries)+1, dtype='int64')
+    offsets[1:] = np.cumsum([len(geom) for geom in geometries])
+
+    coordinates = np.float64(np.concatenate(geometries))
+    coordinates[:, :2] = np.fliplr(ta.worldtopixel(np.float32(coordinates), transform, gdal=False))
+
+    return coordinates, offsets
+
 def BurnTile(params, row, col, burn_delta=0.0):
     """
-    DOCME
+    Burn draped hydrography into tile elevations.
+
+    Only linestrings intersecting tile bounds are read,
+    from the hydrography tile if it exists,
+    or from the global hydrography dataset otherwise.
+    All linestrings are then burnt in one call to `speedup.burn_lines`,
+    following `params.burn_rule` ('replace', 'min' or 'max').
     """
 
     elevation_raster = params.elevations.tilename(row=row, col=col)
-    # config.tileset().tilename(dataset, row=row, col=col)
     hydrography = params.hydrography.tilename(row=row, col=col)
-    # config.tileset().tilename('stream-network-draped', row=row, col=col)
+
+    if not os.path.exists(hydrography):
+        hydrography = params.hydrography.filename(tileset=None)
 
     with rio.open(elevation_raster) as ds:
 
-        elevations = ds.read(1)
-        height, width = elevations.shape
+        elevations = np.float32(ds.read(1))
+        nodata = ds.nodata if ds.nodata is not None else -99999.0
 
         if os.path.exists(hydrography):
 
-            with fiona.open(hydrography) as fs:
-                for feature in fs:
+            coordinates, offsets = HydrographyCoordinates(hydrography, ds.transform, ds.bounds)
 
-                    geom = np.array(feature['geometry']['coordinates'], dtype=np.float32)
-                    geom[:, :2] = np.fliplr(ta.worldtopixel(geom, ds.transform, gdal=False))
+            speedup.burn_lines(
+                elevations,
+                coordinates,
+                offsets,
+                burn_delta,
+                BURN_RULES[params.burn_rule],
+                nodata)
 
-                    for a, b in zip(geom[:-1], geom[1:]):
-                        for px, py, z in rasterize_linestringz(a, b):
-                            if all([py >= 0, py < height, px >= 0, px < width, not np.isinf(z)]):
-                                elevations[py, px] = z - burn_delta
         else:
 
             click.secho('File not found: %s' % hydrography, fg='yellow')
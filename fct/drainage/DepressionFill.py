@@ -31,6 +31,7 @@ from ..config import (
 from .. import terrain_analysis as ta
 from .. import speedup
 from .Burn import BurnTile
+from .Breach import BreachTile, ApplyHandoff, ReadHandoffs
 
 def tileindex():
     """
@@ -49,6 +50,8 @@ class Parameters():
     elevations = DatasetParameter('elevation raster (DEM)', type='input')
     hydrography = DatasetParameter('draped stream network', type='input')
 
+    breached = DatasetParameter('breached DEM', type='output')
+    breach_handoff = DatasetParameter('breach paths handed off to neighbor tiles', type='output')
     filled = DatasetParameter('filled DEM', type='output')
     labels = DatasetParameter('watershed labels', type='output')
     graph = DatasetParameter('watershed labels adjacency graph', type='output')
@@ -56,7 +59,12 @@ class Parameters():
     resolved = DatasetParameter('filled-resolved elevation raster', type='output')
 
     offset = LiteralParameter('burn offset in meters')
+    burn_rule = LiteralParameter('burn rule, replace, min or max')
     exterior_data = LiteralParameter('exterior value')
+    method = LiteralParameter('depression removal method, fill or breach')
+    max_breach_depth = LiteralParameter('maximum breach depth in meters')
+    max_breach_length = LiteralParameter('maximum breach length in pixels')
+    breach_epsilon = LiteralParameter('elevation drop between breach path pixels')
 
     def __init__(self):
         """
@@ -65,13 +73,63 @@ class Parameters():
 
         self.elevations = 'dem'
         self.hydrography = 'stream-network-draped'
+        self.breached = 'dem-breached'
+        self.breach_handoff = 'dem-breach-handoff'
         self.filled = 'dem-filled'
         self.labels = 'dem-watershed-labels'
         self.graph = 'dem-watershed-graph'
         self.spillover = 'dem-watershed-spillover'
         self.resolved = 'dem-filled-resolved'
         self.offset = -1.0
+        self.burn_rule = 'replace'
         self.exterior_data = 9000.0
+        self.method = 'fill'
+        self.max_breach_depth = 5.0
+        self.max_breach_length = 50
+        self.breach_epsilon = 0.001
+
+def BreachDepressions(row, col, params, overwrite=True):
+    """
+    Breach depressions of tile (row, col),
+    when `params.method` is 'breach',
+    before watershed labeling.
+    Pixels carved in neighboring tiles are handed off to them.
+    """
+
+    tile_index = tileindex()
+
+    if (row, col) not in tile_index:
+        return
+
+    elevation_raster = params.elevations.tilename(row=row, col=col)
+    output = params.breached.tilename(row=row, col=col)
+    output_handoff = params.breach_handoff.tilename(row=row, col=col)
+
+    if os.path.exists(output) and not overwrite:
+        return
+
+    with rio.open(elevation_raster) as ds:
+
+        profile = ds.profile.copy()
+        nodata = ds.nodata
+
+        if params.offset < 0:
+            elevations = ds.read(1)
+        else:
+            elevations = BurnTile(params, row, col, params.offset)
+
+    breached, handoff = BreachTile(params, row, col, elevations, nodata)
+
+    profile.update(
+        compress='deflate',
+        tiled='yes',
+        dtype='float32'
+    )
+
+    with rio.open(output, 'w', **profile) as dst:
+        dst.write(breached, 1)
+
+    np.savez(output_handoff, **handoff)
 
 def LabelWatersheds(
         row, col,
@@ -126,7 +184,18 @@ def LabelWatersheds(
         profile = ds.profile.copy()
         nodata = ds.nodata
 
-        if offset < 0:
+        if params.method == 'breach':
+
+            step('Read breached DEM')
+
+            # breached by BreachDepressions,
+            # with pixels carved from neighboring tiles
+            with rio.open(params.breached.tilename(row=row, col=col)) as ds2:
+                elevations = ds2.read(1)
+
+            ApplyHandoff(row, col, elevations, ReadHandoffs(row, col, params))
+
+        elif offset < 0:
             elevations = ds.read(1)
         else:
             elevations = BurnTile(params, row, col, offset)
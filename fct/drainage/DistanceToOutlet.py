@@ -1,10 +1,14 @@
 """
 Compute distance to drainage outlet
 for every point in space
+
+Each tile is read once to connect its border pixels
+to their local exit, then distances are resolved
+on the tile graph with array operations,
+and each tile is read once again to propagate distances upstream.
 """
 
-from collections import defaultdict
-import itertools
+import os
 from multiprocessing import Pool
 
 import numpy as np
@@ -14,12 +18,17 @@ import rasterio as rio
 
 from .. import speedup
 from ..cli import starcall
-from ..tileio import border
 from ..config import (
     config,
     DatasetParameter,
     LiteralParameter
 )
+from .TileGraph import (
+    edges_from_outlets,
+    links_from_pixels,
+    resolve_downstream_sum,
+    group_by_tile
+)
 
 class Parameters():
     """
@@ -44,256 +53,140 @@ class Parameters():
 
 def ConnectTile(row: int, col: int, params: Parameters):
     """
-    Connect every border pixel to local tile outlet (inbound pixel)
-    or to other tile (outbound pixel)
-    (t, i, j) -> (to, io, jo, do)
-    """
+    Connect every border pixel to local tile exit (inbound pixel)
+    or to other tile (outbound pixel),
+    with one pass over the flow raster.
+
+    Returns
+    -------
 
-    ci = [ -1, -1,  0,  1,  1,  1,  0, -1 ]
-    cj = [  0,  1,  1,  1,  0, -1, -1, -1 ]
+    Array of EDGE_DTYPE records, with distance in pixels as `area`.
+    Outbound pixels flowing outside of the tileset
+    have a negative `to_tile`.
+    """
 
     flow_raster = params.flow.tilename(row=row, col=col)
-    graph = dict()
-    t = row, col
 
     with rio.open(flow_raster) as ds:
 
         height, width = ds.shape
         flow = ds.read(1)
 
-    def pixel_identifier(i, j):
-
-        tik, tjk = t
-        ik, jk = i, j
-
-        if i < 0:
-            tik = tik - 1
-            ik = ik + height
-        elif i >= height:
-            tik = tik + 1
-            ik = ik - height
-        
-        if j < 0:
-            tjk = tjk - 1
-            jk = jk + width
-        elif j >= width:
-            tjk = tjk + 1
-            jk = jk - width
-
-        assert((0 <= ik < height) and (0 <= jk < width))
-
-        return (tik, tjk), ik, jk
-
-    # def distance_to_outlet(i, j):
-
-    #     distance = 0
-    #     direction = flow[i, j]
-
-    #     while direction != -1 and direction != 0:
-
-    #         n = int(np.log2(direction))
-    #         ik = i + ci[n]
-    #         jk = j + cj[n]
-
-    #         if (0 <= ik < height) and (0 <= jk < width):
-
-    #             # distance in pixels
-    #             distance += np.sqrt((ik-i)**2 + (jk-j)**2)
-    #             i, j = ik, jk
-    #             direction = flow[i, j]
-
-    #         else:
+    links, lengths = speedup.tile_exit_distance(flow)
 
-    #             break
+    inbound = (
+        (links[:, 2] >= 0) & (links[:, 2] < height) &
+        (links[:, 3] >= 0) & (links[:, 3] < width)
+    )
 
-    #     return distance
+    local = links_from_pixels(row, col, links[inbound])
+    local['area'] = lengths[inbound]
 
-    for i, j in border(height, width):
-    # with click.progressbar(border(height, width), length=2*(height+width)) as iterator:
-    #     for i, j in iterator:
+    outbound, _, _ = edges_from_outlets(
+        row, col,
+        links[~inbound],
+        lengths[~inbound],
+        height, width,
+        exterior=True)
 
-        direction = flow[i, j]
-        
-        if direction != -1 and direction != 0:
+    return np.concatenate([local, outbound])
 
-            n = int(np.log2(direction))
-            ik = i + ci[n]
-            jk = j + cj[n]
+def TileList(params: Parameters, **kwargs):
+    """
+    List (row, col) tiles to process,
+    either from `params.tiles` or from the default tileset
+    """
 
-            if (0 <= ik < height) and (0 <= jk < width):
-                
-                # inbound pixel (i, j)
-                tk = t
-                # dk = distance_to_outlet(i, j)
-                ik, jk, dk = speedup.pix_distance_to_outlet(flow, i, j)
-                graph[(t, i, j)] = (tk, ik, jk, dk)
+    if params.tiles.none:
+        return list(config.tileset().tileindex)
 
-            else:
-                
-                # outbound pixel (i, j)
-                dk = np.sqrt((ik-i)**2 + (jk-j)**2)
-                tk, ik, jk = pixel_identifier(ik, jk)
-                # distance in pixels
-                graph[(t, i, j)] = (tk, ik, jk, dk)
+    tilefile = params.tiles.filename(**kwargs)
 
-    return graph
+    with open(tilefile) as fp:
+        return [
+            tuple(int(x) for x in line.split(','))
+            for line in fp
+        ]
 
 def TileFlow(params: Parameters, processes: int = 1, **kwargs):
     """
     Build flow graph between tiles by connecting tiles together
     """
 
-    if params.tiles.none:
-
-        tileset = config.tileset()
-
-        def length():
-
-            return len(tileset)
-
-        def arguments():
-
-            for row, col in tileset.tileindex:
-
-                yield (
-                    ConnectTile,
-                    row,
-                    col,
-                    params,
-                    kwargs
-                )
-
-    else:
-
-        tilefile = params.tiles.filename(**kwargs)
-
-        def length():
-
-            with open(tilefile) as fp:
-                return sum(1 for line in fp)
-
-        def arguments():
-
-            with open(tilefile) as fp:
-                for line in fp:
+    tiles = TileList(params, **kwargs)
 
-                    row, col = tuple(int(x) for x in line.split(','))
+    arguments = [
+        (ConnectTile, row, col, params, kwargs)
+        for row, col in tiles
+    ]
 
-                    yield (
-                        ConnectTile,
-                        row,
-                        col,
-                        params,
-                        kwargs
-                    )
-
-    graph = dict()
+    edges = list()
 
     with Pool(processes=processes) as pool:
 
-        pooled = pool.imap_unordered(starcall, arguments())
-        with click.progressbar(pooled, length=length()) as iterator:
-            for gt in iterator:
-                
-                graph.update(gt)
+        pooled = pool.imap_unordered(starcall, arguments)
+        with click.progressbar(pooled, length=len(arguments)) as iterator:
+            for tile_edges in iterator:
+                edges.append(tile_edges)
 
-    return graph
+    return np.concatenate(edges)
 
-def ResolveTileFlow(graph: dict, params: Parameters):
+def ResolveTileFlow(graph: np.ndarray, params: Parameters):
     """
     Dispatch distance from network outlets
-    """
-
-    distance = defaultdict(lambda: 0.0)
-    reverse_graph = defaultdict(list)
-    conversion = params.conversion
 
-    for (t, i, j), (tk, ik, jk, dk) in graph.items():
+    Parameters
+    ----------
 
-        reverse_graph[(tk, ik, jk)].append((t, i, j, dk))
+    graph: array of EDGE_DTYPE records
+        as returned by `TileFlow`
 
-        if (tk, ik, jk) not in graph:
+    Returns
+    -------
 
-            distance[(tk, ik, jk)] = 0.0
+    nodes: array, dtype=int64
+        tile graph node identifiers
 
-    outlets = set(distance.keys())
-
-    for outlet in outlets:
-
-        stack = [outlet]
+    distance: array, dtype=float64
+        distance from each node to its outlet,
+        in output unit
+    """
 
-        while stack:
+    nodes, distance = resolve_downstream_sum(graph)
 
-            node = stack.pop(0)
+    return nodes, distance * params.conversion
 
-            for t, i, j, d in reverse_graph[node]:
+def DistanceTile(row: int, col: int, i: np.ndarray, j: np.ndarray, d: np.ndarray, params: Parameters):
+    """
+    Dispatch distance from tile exits
 
-                upstream = (t, i, j)
-                distance[upstream] = distance[node] + d*conversion
-                stack.append(upstream)
+    Parameters
+    ----------
 
-    return distance, outlets
+    i, j: arrays
+        pixel coordinates of tile graph nodes within tile
 
-def DistanceTile(row: int, col: int, distance_outlets: dict, params: Parameters):
+    d: array
+        distance to outlet of each node
     """
-    Dispatch distance from tile outlets
-    """
-
-    ci = [ -1, -1,  0,  1,  1,  1,  0, -1 ]
-    cj = [  0,  1,  1,  1,  0, -1, -1, -1 ]
 
     flow_raster = params.flow.tilename(row=row, col=col)
     output = params.output.tilename(row=row, col=col)
     conversion = params.conversion
 
-    if not flow_raster.exists():
+    if not os.path.exists(flow_raster):
         return
 
     with rio.open(flow_raster) as ds:
 
-        height, width = ds.shape
         nodata_flow = ds.nodata
         profile = ds.profile.copy()
         flow = ds.read(1)
 
-    distance = np.zeros_like(flow, dtype='float32')
-    seen = np.zeros_like(flow, dtype='bool')
-    stack = list()
-
-    for (i, j), d in distance_outlets.items():
-        
-        distance[i, j] = d
-        stack.append((i, j))
-        seen[i, j] = True
-
-    speedup.distance_to_outlet(flow, distance, conversion)
-
-    # while stack:
-
-    #     i, j = stack.pop()
-
-    #     for n in range(8):
-            
-    #         ik = i - ci[n]
-    #         jk = j - cj[n]
+    distance = np.zeros(flow.shape, dtype='float32')
+    distance[i, j] = d
 
-    #         if (0 <= ik < height) and (0 <= jk < width):
-
-    #             direction = flow[ik, jk]
-
-    #             if direction != -1 and direction != 0:
-
-    #                 nk = int(np.log2(direction))
-    #                 if nk == n:
-
-    #                     # distance in pixels
-    #                     d = np.sqrt((ik-i)**2 + (j-jk)**2)
-    #                     distance[ik, jk] = distance[i, j] + d*conversion
-
-    #                     if not seen[ik, jk]:
-
-    #                         stack.append((ik, jk))
-    #                         seen[ik, jk] = True
+    speedup.flow_distance(flow, distance, conversion)
 
     nodata = -99999.0
     distance[flow == nodata_flow] = nodata
@@ -302,49 +195,36 @@ def DistanceTile(row: int, col: int, distance_outlets: dict, params: Parameters)
     with rio.open(output, 'w', **profile) as dst:
         dst.write(distance, 1)
 
-def DistanceToOutlet(distance: dict, params: Parameters, processes: int = 1, **kwargs):
+def DistanceToOutlet(nodes: np.ndarray, distance: np.ndarray, params: Parameters, processes: int = 1, **kwargs):
     """
     Compute distance to drainage outlet
-    for every point in space
+    for every point in space,
+    from the tile graph distances returned by `ResolveTileFlow`
     """
 
-    def tile(x):
-        return x[0][0]
-
-    def arguments():
-
-        groups = itertools.groupby(sorted(distance.items(), key=tile), key=tile)
-
-        for t, values in groups:
-
-            row, col = t
-            distance_outlets = {(i, j): d for (t, i, j), d in values}
-
-            yield (
-                DistanceTile,
-                row,
-                col,
-                distance_outlets,
-                params,
-                kwargs
-            )
-
-    def length():
-
-        if params.tiles.none:
-
-            tileset = config.tileset()
-            return len(tileset)
-
-        tilefile = params.tiles.filename(**kwargs)
-
-        with open(tilefile) as fp:
-            return sum(1 for line in fp)
+    tile_index = config.tileset().tileindex
+    selection = set(TileList(params, **kwargs))
+    values = {gid: (i, j, d) for gid, i, j, d in group_by_tile(nodes, distance)}
+
+    empty = np.zeros(0, dtype='int64')
+
+    arguments = [
+        (
+            DistanceTile,
+            row,
+            col,
+            *values.get(tile_index[(row, col)].gid, (empty, empty, empty)),
+            params,
+            kwargs
+        )
+        for row, col in selection
+        if (row, col) in tile_index
+    ]
 
     with Pool(processes=processes) as pool:
 
-        pooled = pool.imap_unordered(starcall, arguments())
-        with click.progressbar(pooled, length=length()) as iterator:
+        pooled = pool.imap_unordered(starcall, arguments)
+        with click.progressbar(pooled, length=len(arguments)) as iterator:
             for _ in iterator:
                 pass
 
@@ -20,12 +20,11 @@ from shapely.geometry import (
     asShape,
     box
 )
-import rasterio as rio
-
 from ..config import (
     config,
     DatasetParameter
 )
+from ..tileio import SampleRasters
 
 class Parameters():
 
@@ -66,28 +65,36 @@ def DrapeNetworkAndAdjustElevations(params):
 
     click.secho('Drape Stream Vectors on DEM', fg='cyan')
 
-    with rio.open(dem_vrt) as ds:
-        with fiona.open(networkfile) as fs:
+    with fiona.open(networkfile) as fs:
+
+        feature_count = len(fs)
+        options = dict(driver=fs.driver, crs=fs.crs, schema=fs.schema)
 
-            feature_count = len(fs)
-            options = dict(driver=fs.driver, crs=fs.crs, schema=fs.schema)
+        with click.progressbar(fs) as progress:
+            
+            for feature in progress:
 
-            with click.progressbar(fs) as progress:
+                a = feature['properties']['NODEA']
+                b = feature['properties']['NODEB']
+                coordinates = np.array(feature['geometry']['coordinates'])
+                feature['geometry']['coordinates'] = coordinates
                 
-                for feature in progress:
+                idx = len(features)
+                graph[a].append((b, idx))
+                indegree[b] += 1
+                features.append(feature)
 
-                    a = feature['properties']['NODEA']
-                    b = feature['properties']['NODEB']
-                    coordinates = np.array(feature['geometry']['coordinates'])
+    # sample all vertices at once,
+    # reading each DEM block only once
+
+    if features:
+
+        vertices = [feature['geometry']['coordinates'] for feature in features]
+        (z, nodata), = SampleRasters(np.concatenate(vertices), dem_vrt)
+        offsets = np.cumsum([len(coordinates) for coordinates in vertices])[:-1]
 
-                    z = np.array(list(ds.sample(coordinates[:, :2], 1)))
-                    coordinates[:, 2] = np.ravel(z)
-                    feature['geometry']['coordinates'] = coordinates
-                    
-                    idx = len(features)
-                    graph[a].append((b, idx))
-                    indegree[b] += 1
-                    features.append(feature)
+        for coordinates, feature_z in zip(vertices, np.split(z, offsets)):
+            coordinates[:, 2] = feature_z
 
     click.secho('Adjust Elevation Profile', fg='cyan')
 
@@ -111,7 +118,7 @@ def DrapeNetworkAndAdjustElevations(params):
 
                     for k, z in enumerate(coordinates[:, 2]):
                                 
-                        if z != ds.nodata and z <= zmin:
+                        if z != nodata and z <= zmin:
                             zmin = z
                         
                         # Clamp z to upstream elevation
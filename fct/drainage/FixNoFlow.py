@@ -13,16 +13,19 @@ Fix Flow Direction for No-Flow pixels
 
 import os
 import itertools
+from multiprocessing import Pool
 import numpy as np
 
 import click
 import rasterio as rio
+from rasterio.transform import Affine
 import fiona
 import fiona.crs
 
 from .. import transform as fct
 from .. import speedup
 from .. import terrain_analysis as ta
+from ..cli import starcall
 
 from ..config import (
     config,
@@ -123,9 +126,12 @@ def DrainageRasterTile(row, col, params):
             coordinates = np.array(feature['geometry']['coordinates'], dtype='float32')
             pixels = fct.worldtopixel(coordinates, ds.transform)
 
-            for i, j in pixels:
-                if 0 <= i < height and 0 <= j < width:
-                    streams[i, j] = 1
+            inside = (
+                (pixels[:, 0] >= 0) & (pixels[:, 0] < height) &
+                (pixels[:, 1] >= 0) & (pixels[:, 1] < width)
+            )
+
+            streams[pixels[inside, 0], pixels[inside, 1]] = 1
 
     profile.update(
         dtype='int16',
@@ -451,6 +457,340 @@ def FixNoFlow(x0, y0, tileset1, tileset2, params, fix=False):
 
     return ds.xy(i, j)
 
+class TileCache():
+    """
+    Spatial index of the raster tiles of one dataset over one tileset,
+    addressed by pixel coordinates (i, j) on a global pixel grid.
+
+    Tiles are read when first accessed, and kept until `evict()`
+    if they are not modified ; modified tiles are written back
+    in bulk with `write()`.
+    """
+
+    def __init__(self, dataset, tileset, transform):
+
+        self.dataset = dataset
+        self.tileset = tileset
+        self.transform = transform
+        self.tile_index = config.tileset(tileset).tileindex
+        self.tiles = dict()
+        self.modified = set()
+        self.accessed = set()
+
+    def locate(self, i, j):
+        """
+        Return tile (row, col) containing global pixel (i, j)
+        """
+
+        x, y = self.transform * (j + 0.5, i + 0.5)
+        return config.tileset(self.tileset).index(x, y)
+
+    def tile(self, i, j):
+        """
+        Return (row, col), (data, i0, j0, profile) of tile
+        containing global pixel (i, j),
+        or (row, col), None if there is no such tile
+        """
+
+        row, col = self.locate(i, j)
+
+        if (row, col) not in self.tiles:
+
+            rasterfile = self.dataset.tilename(tileset=self.tileset, row=row, col=col)
+
+            if (row, col) in self.tile_index and os.path.exists(rasterfile):
+
+                with rio.open(rasterfile) as ds:
+
+                    data = ds.read(1)
+                    profile = ds.profile.copy()
+                    i0 = int(round((ds.transform.f - self.transform.f) / self.transform.e))
+                    j0 = int(round((ds.transform.c - self.transform.c) / self.transform.a))
+
+                self.tiles[row, col] = (data, i0, j0, profile)
+
+            else:
+
+                self.tiles[row, col] = None
+
+        self.accessed.add((row, col))
+
+        return (row, col), self.tiles[row, col]
+
+    def __call__(self, i, j, default=-1):
+        """
+        Return value of global pixel (i, j)
+        """
+
+        _, tile = self.tile(i, j)
+
+        if tile is None:
+            return default
+
+        data, i0, j0, _ = tile
+        return data[i - i0, j - j0]
+
+    def set(self, i, j, value):
+        """
+        Set value of global pixel (i, j)
+        """
+
+        key, tile = self.tile(i, j)
+
+        if tile is not None:
+
+            data, i0, j0, _ = tile
+            data[i - i0, j - j0] = value
+            self.modified.add(key)
+
+    def evict(self):
+        """
+        Release unmodified tiles not accessed since last call,
+        and return the number of released tiles
+        """
+
+        stale = [
+            key for key in self.tiles
+            if key not in self.accessed and key not in self.modified
+        ]
+
+        for key in stale:
+            del self.tiles[key]
+
+        self.accessed = set()
+
+        return len(stale)
+
+    def write(self):
+        """
+        Write modified tiles
+        """
+
+        for row, col in sorted(self.modified):
+
+            data, _, _, profile = self.tiles[row, col]
+            rasterfile = self.dataset.tilename(tileset=self.tileset, row=row, col=col)
+
+            with rio.open(rasterfile, 'w', **profile) as dst:
+                dst.write(data, 1)
+
+        count = len(self.modified)
+        self.modified = set()
+
+        return count
+
+def GlobalTransform(params, tileset):
+    """
+    Return the transform of the global pixel grid of `tileset`,
+    with origin at the upper left corner of the tileset
+    """
+
+    tile_index = config.tileset(tileset).tileindex
+    row, col = next(iter(tile_index))
+
+    with rio.open(params.flow.tilename(tileset=tileset, row=row, col=col)) as ds:
+        xres, yres = ds.transform.a, ds.transform.e
+
+    minx, _, _, maxy = config.tileset(tileset).bounds
+
+    return Affine(xres, 0, minx, 0, yres, maxy)
+
+def NoFlowTile(row, col, params, tileset, transform):
+    """
+    Find no-flow pixels of tile (row, col),
+    and return them as global pixel coordinates
+    """
+
+    flow_raster = params.flow.tilename(tileset=tileset, row=row, col=col)
+    stream_raster = params.drainage_raster.tilename(tileset=tileset, row=row, col=col)
+
+    if not os.path.exists(stream_raster):
+        return np.zeros((0, 2), dtype='int64')
+
+    with rio.open(stream_raster) as ds:
+        streams = ds.read(1)
+
+    with rio.open(flow_raster) as ds:
+
+        flow = ds.read(1)
+        i0 = int(round((ds.transform.f - transform.f) / transform.e))
+        j0 = int(round((ds.transform.c - transform.c) / transform.a))
+
+    pixels = speedup.noflow(np.int16(streams == 1), flow)
+
+    if not pixels:
+        return np.zeros((0, 2), dtype='int64')
+
+    return np.array(pixels, dtype='int64') + (i0, j0)
+
+def ResolveNoFlowPixel(i, j, flow1, acc1, streams1, flow2, streams2, min_drainage):
+    """
+    Connect no-flow pixel (i, j) of drainage 1 to drainage 2,
+    modifying `flow1` in place, following the same walks as `FixNoFlow`
+
+    Returns
+    -------
+
+    Global pixel (i, j) where the fixed flow path reaches drainage 1 again
+
+    Raises ValueError if no common point between drainages is found
+    upstream of (i, j)
+    """
+
+    ci = [ -1, -1,  0,  1,  1,  1,  0, -1 ]
+    cj = [  0,  1,  1,  1,  0, -1, -1, -1 ]
+    upward = [ 16,  32,  64,  128,  1,  2,  4,  8 ]
+
+    i0, j0 = i, j
+
+    # step 1. walk upstream on drainage 1
+    #         until we reach a common point
+    #         between drainage 1 and drainage 2
+
+    while streams2(i, j) != 1:
+
+        max_acck = min_drainage
+        max_ijk = None
+
+        for k in range(8):
+
+            ik, jk = i + ci[k], j + cj[k]
+
+            if flow1(ik, jk) == upward[k]:
+                acck = acc1(ik, jk)
+                if acck > max_acck:
+                    max_acck = acck
+                    max_ijk = (ik, jk)
+
+        if max_ijk is None:
+            raise ValueError('No match for pixel (%d, %d)' % (i0, j0))
+
+        i, j = max_ijk
+
+    # step2. walk downstream on drainage 2
+    #        until we leave drainage 1,
+    # step3. then until we get back on drainage 1 ;
+    #        update drainage 1 to reflect drainage 2
+    #        as we walk downstream
+
+    for on_drainage1 in (True, False):
+
+        while (streams1(i, j) == 1) == on_drainage1:
+
+            direction = flow2(i, j)
+            if direction in (-1, 0):
+                break
+
+            flow1.set(i, j, direction)
+            k = int(np.log2(direction))
+            i, j = i + ci[k], j + cj[k]
+
+    return i, j
+
+def FixNoFlowBatch(params, tileset1, tileset2, processes=1, fix=True):
+    """
+    Find and fix all no-flow pixels of drainage 1 (`tileset1`)
+    from drainage 2 (`tileset2`), in one pass.
+
+    No-flow pixels are found tile by tile with `speedup.noflow`,
+    then resolved in tile order against tile caches of both tilesets,
+    so that each raster tile is read once
+    while the sorted pixel stream goes through its neighborhood,
+    and fixed flow tiles are written in bulk at the end
+    when `fix` is True.
+    Resolved targets are saved to `params.fixed`.
+    """
+
+    transform = GlobalTransform(params, tileset1)
+    tile_index = config.tileset(tileset1).tileindex
+
+    arguments = [
+        (NoFlowTile, row, col, params, dict(tileset=tileset1, transform=transform))
+        for row, col in sorted(tile_index)
+    ]
+
+    click.secho('Find no-flow pixels', fg='cyan')
+
+    with Pool(processes=processes) as pool:
+
+        # imap preserves tile order
+        pooled = pool.imap(starcall, arguments)
+
+        with click.progressbar(pooled, length=len(arguments)) as iterator:
+            pixels = np.concatenate([np.zeros((0, 2), dtype='int64')] + list(iterator))
+
+    click.secho('Found %d not-flowing stream nodes' % len(pixels), fg='cyan')
+
+    flow1 = TileCache(params.flow, tileset1, transform)
+    acc1 = TileCache(params.acc, tileset1, transform)
+    streams1 = TileCache(params.drainage_raster, tileset1, transform)
+    flow2 = TileCache(params.flow, tileset2, transform)
+    streams2 = TileCache(params.drainage_raster, tileset2, transform)
+    caches = (flow1, acc1, streams1, flow2, streams2)
+
+    features = list()
+    unresolved = 0
+    current = None
+
+    click.secho('Resolve no-flow pixels', fg='cyan')
+
+    with click.progressbar(pixels) as iterator:
+        for gid, (i, j) in enumerate(iterator):
+
+            row, col = flow1.locate(i, j)
+
+            if (row, col) != current:
+
+                # the pixel stream leaves the previous tile :
+                # release tiles it did not use
+                for cache in caches:
+                    cache.evict()
+
+                current = (row, col)
+
+            try:
+
+                ti, tj = ResolveNoFlowPixel(
+                    i, j,
+                    flow1, acc1, streams1, flow2, streams2,
+                    params.min_drainage)
+
+            except ValueError:
+
+                unresolved += 1
+                continue
+
+            features.append({
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': transform * (tj + 0.5, ti + 0.5)
+                },
+                'properties': {'GID': gid+1, 'ROW': row, 'COL': col}
+            })
+
+    if unresolved:
+        click.secho('%d no-flow pixels could not be resolved' % unresolved, fg='yellow')
+
+    driver = 'ESRI Shapefile'
+    schema = {
+        'geometry': 'Point',
+        'properties': [
+            ('GID', 'int'),
+            ('ROW', 'int'),
+            ('COL', 'int')
+        ]
+    }
+    crs = fiona.crs.from_epsg(config.srid)
+    options = dict(driver=driver, crs=crs, schema=schema)
+
+    with fiona.open(params.fixed.filename(tileset=tileset1), 'w', **options) as dst:
+        dst.writerecords(features)
+
+    if fix:
+        count = flow1.write()
+        click.secho('Wrote %d fixed flow tiles' % count, fg='green')
+
 def test(params, tileset1='10k', tileset2='10kbis', fix=False):
     """
     TODO finalize
@@ -0,0 +1,401 @@
+# coding: utf-8
+
+"""
+Incremental drainage update after localized DEM edits
+
+Reprocess only the tiles affected by edited DEM tiles
+along the DepressionFill -> BorderFlats -> FlowDirection -> Accumulate chain :
+
+1. relabel watersheds of edited tiles,
+   or, when depressions are breached,
+   breach edited tiles and their neighbors,
+   and relabel these tiles and their own neighbors,
+   and re-dispatch minimum z to tiles whose spillover resolution changed
+2. relabel border flats of changed tiles and of their neighbors
+   when tile borders changed, and re-dispatch flat minimum z
+   to tiles whose flat spillover resolution changed
+3. recalculate flow direction of changed tiles,
+   and of their neighbors when tile borders changed
+4. update tile outlets of tiles whose flow changed,
+   resolve inlet contributions over the tile graph,
+   and re-accumulate tiles whose flow or inlet contributions changed,
+   which patches accumulation downstream of the edits
+
+Spillover graphs and the outlet graph are rebuilt from stored tile records,
+which are small compared to tile rasters.
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+import click
+import rasterio as rio
+
+from ..cli import starcall
+from ..config import config
+from . import (
+    DepressionFill,
+    BorderFlats,
+    FlowDirection,
+    Accumulate
+)
+from .TileGraph import NEIGHBORS
+
+def tileindex():
+    """
+    Return default tileindex
+    """
+    return config.tileset().tileindex
+
+def NeighborTiles(tiles):
+    """
+    Return the set of existing tiles
+    adjacent to any of `tiles`, including `tiles`
+    """
+
+    tile_index = tileindex()
+    neighbors = set(tiles)
+
+    for row, col in tiles:
+        for di, dj in NEIGHBORS:
+            if (row+di, col+dj) in tile_index:
+                neighbors.add((row+di, col+dj))
+
+    return neighbors
+
+def ReadTile(dataset, row, col):
+    """
+    Read first band of raster tile,
+    or return None if tile does not exist
+    """
+
+    rasterfile = dataset.tilename(row=row, col=col)
+
+    if not os.path.exists(rasterfile):
+        return None
+
+    with rio.open(rasterfile) as ds:
+        return ds.read(1)
+
+def TrackedTile(fun, dataset, row, col, params, **kwargs):
+    """
+    Run tile operation `fun(row, col, params, **kwargs)`
+    and compare output tile `dataset` before and after.
+
+    Returns
+    -------
+
+    tile: tuple (row, col)
+
+    changed: bool
+        True if output tile changed
+
+    border_changed: bool
+        True if border pixels of output tile changed,
+        which may affect neighbor tiles
+    """
+
+    before = ReadTile(dataset, row, col)
+    fun(row, col, params, **kwargs)
+    after = ReadTile(dataset, row, col)
+
+    if before is None or after is None or before.shape != after.shape:
+        return (row, col), True, True
+
+    if np.array_equal(before, after):
+        return (row, col), False, False
+
+    border_changed = not (
+        np.array_equal(before[0, :], after[0, :]) and
+        np.array_equal(before[-1, :], after[-1, :]) and
+        np.array_equal(before[:, 0], after[:, 0]) and
+        np.array_equal(before[:, -1], after[:, -1])
+    )
+
+    return (row, col), True, border_changed
+
+def ReadMinimumZ(filename):
+    """
+    Read spillover resolution records (tile, watershed, z)
+    as a dict tile gid -> sorted (watershed, z) array
+    """
+
+    if not os.path.exists(filename):
+        return dict()
+
+    minz = np.load(filename, allow_pickle=True)['minz']
+
+    if len(minz) == 0:
+        return dict()
+
+    minz = np.asarray(minz, dtype='float64')
+    minz = minz[np.lexsort((minz[:, 1], minz[:, 0]))]
+    gids, starts = np.unique(minz[:, 0], return_index=True)
+    ends = np.append(starts[1:], len(minz))
+
+    return {
+        int(gid): minz[start:end, 1:]
+        for gid, start, end in zip(gids, starts, ends)
+    }
+
+def ChangedTiles(before, after):
+    """
+    Return (row, col) tiles whose records differ
+    between `before` and `after` dicts, indexed by tile gid
+    """
+
+    tile_index = tileindex()
+    tiles = {tile.gid: (tile.row, tile.col) for tile in tile_index.values()}
+    changed = set()
+
+    for gid in before.keys() | after.keys():
+
+        if gid not in tiles:
+            continue
+
+        a = before.get(gid)
+        b = after.get(gid)
+
+        if a is None or b is None or not np.array_equal(a, b):
+            changed.add(tiles[gid])
+
+    return changed
+
+def ReadInletAreas(params):
+    """
+    Read all tile inlet contributions,
+    as a dict tile gid -> (n, 2+bands) array of (i, j, areas) records
+    """
+
+    inlets = dict()
+
+    for (row, col), tile in tileindex().items():
+
+        filename = params.inlet_areas.tilename(row=row, col=col)
+
+        if os.path.exists(filename):
+            with np.load(filename) as data:
+                records = np.column_stack([
+                    data['i'],
+                    data['j'],
+                    data['areas']
+                ])
+                inlets[tile.gid] = records[np.lexsort((records[:, 1], records[:, 0]))]
+
+    return inlets
+
+def RemoveInletAreas(params):
+    """
+    Remove tile inlet contributions,
+    so that tiles without inlets anymore
+    do not keep stale records
+    """
+
+    for row, col in tileindex():
+
+        filename = params.inlet_areas.tilename(row=row, col=col)
+
+        if os.path.exists(filename):
+            os.remove(filename)
+
+def Execute(arguments, processes=1):
+    """
+    Run tile operations in parallel
+    and return results as a list
+    """
+
+    results = list()
+
+    if not arguments:
+        return results
+
+    with Pool(processes=processes) as pool:
+
+        pooled = pool.imap_unordered(starcall, arguments)
+
+        with click.progressbar(pooled, length=len(arguments)) as iterator:
+            for result in iterator:
+                results.append(result)
+
+    return results
+
+def TrackedExecute(fun, dataset, tiles, params, processes=1, **kwargs):
+    """
+    Run `fun` on `tiles` through `TrackedTile`
+
+    Returns
+    -------
+
+    changed: set of (row, col) tiles whose output changed
+    border_changed: set of (row, col) tiles whose output border changed
+    """
+
+    arguments = [
+        (TrackedTile, fun, dataset, row, col, params, kwargs)
+        for row, col in sorted(tiles)
+    ]
+
+    changed = set()
+    border_changed = set()
+
+    for tile, tile_changed, tile_border_changed in Execute(arguments, processes):
+
+        if tile_changed:
+            changed.add(tile)
+
+        if tile_border_changed:
+            border_changed.add(tile)
+
+    return changed, border_changed
+
+def IncrementalDrainage(
+        tiles,
+        processes=1,
+        fill=None,
+        flats=None,
+        direction=None,
+        accumulate=None):
+    """
+    Update drainage outputs after editing DEM tiles
+
+    Parameters
+    ----------
+
+    tiles: iterable of (row, col)
+        Edited DEM tiles
+
+    processes: int
+        Number of parallel processes
+
+    fill, flats, direction, accumulate: Parameters
+        DepressionFill, BorderFlats, FlowDirection and Accumulate parameters,
+        defaults to each module's default parameters
+
+    Returns
+    -------
+
+    set of (row, col) tiles whose accumulation was updated
+    """
+
+    fill = fill or DepressionFill.Parameters()
+    flats = flats or BorderFlats.Parameters()
+    direction = direction or FlowDirection.Parameters()
+    accumulate = accumulate or Accumulate.Parameters()
+
+    tile_index = tileindex()
+    edited = {tile for tile in tiles if tile in tile_index}
+
+    if fill.method == 'breach':
+
+        # breaching reads neighbor tiles' elevations,
+        # and hands off carved pixels to neighbor tiles,
+        # so labels depend on edited tiles two tiles away
+
+        breached = NeighborTiles(edited)
+
+        click.secho('Breach depressions of %d tiles' % len(breached), fg='cyan')
+
+        Execute([
+            (DepressionFill.BreachDepressions, row, col, fill, dict(overwrite=True))
+            for row, col in sorted(breached)
+        ], processes)
+
+        relabeled = NeighborTiles(breached)
+
+    else:
+
+        relabeled = edited
+
+    click.secho('Update watersheds of %d tiles' % len(relabeled), fg='cyan')
+
+    Execute([
+        (DepressionFill.LabelWatersheds, row, col, fill, dict(overwrite=True))
+        for row, col in sorted(relabeled)
+    ], processes)
+
+    before = ReadMinimumZ(fill.spillover.filename())
+    DepressionFill.ResolveWatershedSpillover(fill, overwrite=True)
+    after = ReadMinimumZ(fill.spillover.filename())
+
+    affected = relabeled | ChangedTiles(before, after)
+
+    click.secho('Dispatch watershed minimum z to %d tiles' % len(affected), fg='cyan')
+
+    changed, border_changed = TrackedExecute(
+        DepressionFill.DispatchWatershedMinimumZ,
+        fill.resolved,
+        affected,
+        fill,
+        processes,
+        overwrite=True)
+
+    affected = changed | NeighborTiles(border_changed)
+
+    click.secho('Update border flats of %d tiles' % len(affected), fg='cyan')
+
+    Execute([
+        (BorderFlats.LabelBorderFlats, row, col, flats, dict())
+        for row, col in sorted(affected)
+    ], processes)
+
+    before = ReadMinimumZ(flats.flat_spillover.filename())
+    BorderFlats.ResolveFlatSpillover(flats)
+    after = ReadMinimumZ(flats.flat_spillover.filename())
+
+    affected = affected | ChangedTiles(before, after)
+
+    click.secho('Dispatch flat minimum z to %d tiles' % len(affected), fg='cyan')
+
+    changed, border_changed = TrackedExecute(
+        BorderFlats.DispatchFlatMinimumZ,
+        flats.output,
+        affected,
+        flats,
+        processes,
+        overwrite=True)
+
+    affected = changed | NeighborTiles(border_changed)
+
+    click.secho('Update flow direction of %d tiles' % len(affected), fg='cyan')
+
+    changed, _ = TrackedExecute(
+        FlowDirection.FlowDirectionTile,
+        direction.flow,
+        affected,
+        direction,
+        processes,
+        overwrite=True)
+
+    click.secho('Update outlets of %d tiles' % len(changed), fg='cyan')
+
+    Execute([
+        (Accumulate.TileOutlets, row, col, accumulate, dict())
+        for row, col in sorted(changed)
+    ], processes)
+
+    before = ReadInletAreas(accumulate)
+    RemoveInletAreas(accumulate)
+    Accumulate.InletAreas(accumulate)
+    after = ReadInletAreas(accumulate)
+
+    affected = changed | ChangedTiles(before, after)
+
+    click.secho('Update accumulation of %d tiles' % len(affected), fg='cyan')
+
+    Execute([
+        (Accumulate.FlowAccumulationTile, row, col, accumulate, dict(overwrite=True))
+        for row, col in sorted(affected)
+    ], processes)
+
+    return affected
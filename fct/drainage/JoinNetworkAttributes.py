@@ -1,7 +1,9 @@
 # coding: utf-8
 
 """
-DOCME
+Join source attributes, Hack order and axis aggregation
+over a stream network of segments (NODEA -> NODEB),
+using the array network model of `NetworkGraph`
 
 ***************************************************************************
 *                                                                         *
@@ -13,9 +15,7 @@ DOCME
 ***************************************************************************
 """
 
-from collections import Counter, defaultdict
-import itertools
-from heapq import heappop, heapify
+import numpy as np
 
 import click
 import fiona
@@ -24,192 +24,236 @@ from shapely.geometry import asShape
 from shapely.ops import linemerge
 
 from ..config import config
+from .NetworkGraph import (
+    NetworkGraph,
+    endpoint_keys,
+    last_of_groups
+)
 
-def JoinNetworkAttributes(
-        sources_shapefile,
-        network_shapefile,
-        output):
+def ReadNetwork(network_shapefile, skip_secondary=False, precision=None):
     """
-    Join source attributes to network segments,
-    based on network structure and CDENTITEHY hierarchy.
+    Read all segments of network shapefile
 
     Parameters
     ----------
 
-    sourcefile: str, logical name
-        
-        Point dataset representing network sources,
-        with attributes:
-            - NODE (<= GID)
-            - CDENTITEHY
-            - TOPONYME
-            - AXIS
-            - HACK
+    network_shapefile: str
+        LineString dataset of network segments,
+        with NODEA and NODEB attributes
+        unless `precision` is given
 
-    networkfile: str, logicial name
-        LineString dataset representing network segments
-        with attributes:
-            - NODEA
-            - NODEB
-    
-    destination: str, logical name
-        
-        Output dataset
-    """
+    skip_secondary: bool
+        Skip secondary segments (MAIN = 0)
 
+    precision: float
+        If given, identify nodes from segment endpoints
+        snapped to a grid of this cell size
+        (see `NetworkGraph.from_endpoints`),
+        rather than from NODEA and NODEB attributes,
+        and set NODEA and NODEB of features
+        to the matching node ids, starting from 1
 
-    # sources_shapefile = config.tileset().filename(sourcefile)
-    # network_shapefile = config.tileset().filename(networkfile)
-    # output = config.tileset().filename(destination)
+    Returns
+    -------
 
-    # sources_shapefile = config.filename(sourcefile)
-    # network_shapefile = config.filename(networkfile)
-    # output = config.filename(destination)
+    features: list
+        All features, in file order
 
-    graph = dict()
-    rgraph = defaultdict(list)
-    indegree = Counter()
-    axis_increment = 0
+    network: NetworkGraph
+        Graph of segments
 
+    edges: array
+        Index in `features` of each segment of `network`,
+        excluding secondary segments (MAIN = 0)
+        if `skip_secondary` is True
+    """
+
+    features = list()
+    nodea = list()
+    nodeb = list()
+    edges = list()
 
     with fiona.open(network_shapefile) as fs:
         with click.progressbar(fs) as iterator:
             for feature in iterator:
 
-                fid = feature['id']
                 properties = feature['properties']
+                features.append(feature)
 
-                if 'MAIN' in properties and properties['MAIN'] == 0:
+                if skip_secondary and 'MAIN' in properties and properties['MAIN'] == 0:
                     continue
 
-                a = properties['NODEA']
-                b = properties['NODEB']
+                if precision is None:
 
-                graph[a] = (b, fid)
-                indegree[b] += 1
+                    nodea.append(properties['NODEA'])
+                    nodeb.append(properties['NODEB'])
 
-    sources = dict()
+                else:
 
-    with fiona.open(sources_shapefile) as fs:
-        with click.progressbar(fs) as iterator:
-            for feature in iterator:
-
-                properties = feature['properties']
-                node = properties['GID']
-                axis = properties['AXIS']
-                axis_increment = max(axis, axis_increment)
-                sources[node] = properties
+                    coordinates = feature['geometry']['coordinates']
+                    nodea.append(coordinates[0][:2])
+                    nodeb.append(coordinates[-1][:2])
 
-    def greater(c1, h1, c2, h2):
+                edges.append(len(features) - 1)
 
-        if c2 is None or h2 is None:
-            return True
+    edges = np.array(edges, dtype='int64')
 
-        if c1 is None or h1 is None:
-            return False
+    if precision is None:
+        return features, NetworkGraph(nodea, nodeb), edges
 
-        # if c1 == 'Y2--0200':
-        #     return True
+    network = NetworkGraph.from_endpoints(nodea, nodeb, precision)
+    a = network.node_ids(endpoint_keys(nodea, precision))
+    b = network.node_ids(endpoint_keys(nodeb, precision))
 
-        # if c2 == '----0142':
-        #     return True
+    for k, fid in enumerate(edges):
+        features[fid]['properties'].update(NODEA=int(a[k]) + 1, NODEB=int(b[k]) + 1)
 
-        if c1 == c2:
-            return h1 <= h2
+    return features, network, edges
 
-        if c1.count('-') > c2.count('-'):
-            return True
-
-        if c1.count('-') == c2.count('-'):
+def CodeRanks(codes):
+    """
+    Rank CDENTITEHY codes, higher ranks first :
+    codes with more '-', then 'V' codes, then lexicographic order.
+    Missing codes have rank -1.
+    """
 
-            if c1[0] == 'V' and c2[0] != 'V':
-                return True
+    unique = sorted(
+        {code for code in codes if code is not None},
+        key=lambda code: (-code.count('-'), code[0] != 'V', code))
 
-            if c2[0] == 'V' and c1[0] != 'V':
-                return False
+    ranks = {code: len(unique) - k for k, code in enumerate(unique)}
 
-            return c1 < c2
+    return np.array([ranks.get(code, -1) for code in codes], dtype='int64')
 
-        return False
+def JoinNetworkAttributes(
+        sources_shapefile,
+        network_shapefile,
+        output,
+        precision=None):
+    """
+    Join source attributes to network segments,
+    based on network structure and CDENTITEHY hierarchy.
 
-    def resolve_properties(node):
+    Attributes are propagated from sources to outlets,
+    one topological level at a time :
+    at confluences, the upstream branch with the highest ranked
+    CDENTITEHY code, then the lowest HACK order, is continued,
+    and remaining ties are broken on segment order in `networkfile`.
 
-        if node in sources and node not in rgraph:
-            return sources[node]
+    Parameters
+    ----------
 
-        if len(rgraph[node]) == 1:
-            
-            _properties = rgraph[node][0][1]
+    sourcefile: str, logical name
+        
+        Point dataset representing network sources,
+        with attributes:
+            - NODE (<= GID)
+            - CDENTITEHY
+            - TOPONYME
+            - AXIS
+            - HACK
 
-            if node in sources:
+    networkfile: str, logicial name
+        LineString dataset representing network segments
+        with attributes:
+            - NODEA
+            - NODEB
+    
+    destination: str, logical name
+        
+        Output dataset
 
-                _properties = _properties.copy()
+    precision: float
 
-                properties = sources[node]
-                _properties.update({
-                    key: properties[key]
-                    for key in ('CDENTITEHY', 'TOPONYME')
-                })
+        If given, network nodes are identified
+        from segment endpoints snapped to a grid of this cell size,
+        typically the resolution of the DEM streams are derived from,
+        and sources are located at the node in the same cell.
+        NODEA and NODEB are then not required,
+        and are written to the output dataset.
+    """
 
-            return _properties
+    features, network, edges = ReadNetwork(
+        network_shapefile,
+        skip_secondary=True,
+        precision=precision)
 
-        _cdentite = None
-        _hack = None
-        _properties = None
+    with fiona.open(sources_shapefile) as fs:
+        with click.progressbar(fs) as iterator:
 
-        for _, properties in rgraph[node]:
+            sources = list()
+            locations = list()
 
-            if properties is None:
-                continue
+            for feature in iterator:
+                sources.append(feature['properties'])
+                locations.append(feature['geometry']['coordinates'][:2])
 
-            cdentite = properties['CDENTITEHY']
-            hack = properties['HACK']
+    size = len(network)
 
-            if greater(cdentite, hack, _cdentite, _hack):
+    if precision is None:
+        ids = network.node_ids([properties['GID'] for properties in sources])
+    else:
+        ids = network.node_ids(endpoint_keys(locations, precision))
 
-                _cdentite, _hack = cdentite, hack
-                _properties = properties
+    source_of = np.full(size, -1, dtype='int64')
+    source_of[ids[ids >= 0]] = np.flatnonzero(ids >= 0)
 
-        if _properties is None:
-            _properties = {
-                'AXIS': next(axis_increment),
-                'CDENTITEHY': None,
-                'TOPONYME': None,
-                'HACK': None
-            }
+    source_axis = np.array([properties['AXIS'] for properties in sources], dtype='int64')
+    source_hack = np.array([
+        np.nan if properties['HACK'] is None else properties['HACK']
+        for properties in sources
+    ], dtype='float64')
+    ranks = np.append(CodeRanks([properties['CDENTITEHY'] for properties in sources]), -1)
+    axis_increment = max(np.max(source_axis, initial=0), 0)
 
-        if node in sources:
+    # node attributes : axis, hack,
+    # and index of the source giving CDENTITEHY and TOPONYME
 
-            _properties = _properties.copy()
+    axis = np.zeros(size, dtype='int64')
+    hack = np.full(size, np.nan)
+    named = np.full(size, -1, dtype='int64')
 
-            properties = sources[node]
-            _properties.update({
-                key: properties[key]
-                for key in ('CDENTITEHY', 'TOPONYME')
-            })
+    for nodes in network.levels():
 
-        return _properties
+        group, upstream = network.upstream(nodes)
+        has_upstream = np.zeros(len(nodes), dtype='bool')
+        has_upstream[group] = True
 
-    axis_increment = itertools.count(axis_increment+1)
-    queue = [node for node in graph if indegree[node] == 0]
-    features = dict()
+        if group.size:
 
-    while queue:
+            rank = ranks[named[upstream]]
+            valid = (rank >= 0) & ~np.isnan(hack[upstream])
+            order = np.lexsort((
+                network.edge[upstream],
+                -np.nan_to_num(hack[upstream]),
+                rank,
+                valid,
+                group))
+            best = order[last_of_groups(group[order])]
+            chosen = upstream[best]
+            targets = nodes[group[best]]
 
-        node = queue.pop()
-        properties = resolve_properties(node)
+            axis[targets] = axis[chosen]
+            hack[targets] = hack[chosen]
+            named[targets] = named[chosen]
 
-        if node in graph:
+        heads = nodes[~has_upstream]
+        source = source_of[heads]
+        known = source >= 0
 
-            next_node, fid = graph[node]
+        axis[heads[known]] = source_axis[source[known]]
+        hack[heads[known]] = source_hack[source[known]]
+        named[heads[known]] = source[known]
 
-            features[fid] = properties
-            rgraph[next_node].append((node, properties))
+        new = heads[~known]
+        axis[new] = axis_increment + 1 + np.arange(len(new))
+        axis_increment += len(new)
 
-            indegree[next_node] -= 1
+        renamed = nodes[has_upstream & (source_of[nodes] >= 0)]
+        named[renamed] = source_of[renamed]
 
-            if indegree[next_node] == 0:
-                queue.append(next_node)
+    resolved = np.flatnonzero((network.edge >= 0) & (network.level >= 0))
+    properties_of = dict(zip(edges[network.edge[resolved]], resolved))
 
     with fiona.open(network_shapefile) as fs:
 
@@ -218,37 +262,39 @@ def JoinNetworkAttributes(
         schema = fs.schema
         crs = fs.crs
 
+    schema['properties'].update({
+        'CDENTITEHY': 'str:8',
+        'TOPONYME': 'str:254',
+        'AXIS': 'int'
+    })
+
+    if precision is not None:
         schema['properties'].update({
-            'CDENTITEHY': 'str:8',
-            'TOPONYME': 'str:254',
-            'AXIS': 'int'
+            'NODEA': 'int',
+            'NODEB': 'int'
         })
 
-        options = dict(driver=driver, crs=crs, schema=schema)
+    options = dict(driver=driver, crs=crs, schema=schema)
+    records = list()
 
-        with fiona.open(output, 'w', **options) as dst:
-            with click.progressbar(fs) as iterator:
-                for feature in iterator:
+    for fid, feature in enumerate(features):
 
-                    fid = feature['id']
+        if fid not in properties_of:
+            continue
 
-                    if fid not in features:
-                        continue
+        node = properties_of[fid]
+        source = sources[named[node]] if named[node] >= 0 else None
 
-                    properties = features[fid]
+        feature['properties'].update({
+            'CDENTITEHY': source['CDENTITEHY'] if source else None,
+            'TOPONYME': source['TOPONYME'] if source else None,
+            'AXIS': int(axis[node])
+        })
 
-                    if properties is None:
-                        feature['properties'].update({
-                            'CDENTITEHY': None,
-                            'TOPONYME': None,
-                            'AXIS': None
-                        })
-                    else:
-                        feature['properties'].update({
-                            k: properties[k] for k in ('CDENTITEHY', 'TOPONYME', 'AXIS')
-                        })
+        records.append(feature)
 
-                    dst.write(feature)
+    with fiona.open(output, 'w', **options) as dst:
+        dst.writerecords(records)
 
 def UpdateLengthOrder(
         network_shapefile,
@@ -257,6 +303,12 @@ def UpdateLengthOrder(
     Update HACK et LENAXIS fields
     according to network connectivity and AXIS identifier
 
+    Sources are ranked by decreasing length of their axis.
+    Each node belongs to the path of the highest ranked source upstream,
+    and HACK order increments where paths join a higher ranked path.
+    Axes are renumbered in order of their first segment
+    along paths, from the highest ranked path.
+
     Parameters
     ----------
 
@@ -270,73 +322,55 @@ def UpdateLengthOrder(
         Output dataset
     """
 
-    # network_shapefile = config.tileset().filename(joined)
-    # output = config.tileset().filename(destination)
+    features, network, _ = ReadNetwork(network_shapefile)
 
-    # network_shapefile = config.filename(joined)
-    # output = config.filename(destination)
+    axes, edge_axis = np.unique(
+        [feature['properties']['AXIS'] for feature in features],
+        return_inverse=True)
 
-    graph = dict()
-    indegree = Counter()
-    lengths = defaultdict(lambda: 0.0)
-    newids = dict()
-    gid = itertools.count(1)
-
-    with fiona.open(network_shapefile) as fs:
-        with click.progressbar(fs) as iterator:
-            for feature in iterator:
-
-                properties = feature['properties']
-                axis = properties['AXIS']
+    lengths = np.bincount(
+        edge_axis,
+        weights=[asShape(feature['geometry']).length for feature in features],
+        minlength=len(axes))
 
-                a = properties['NODEA']
-                b = properties['NODEB']
+    size = len(network)
+    sources = network.sources()
+    ranking = np.lexsort((
+        network.keys[sources],
+        -lengths[edge_axis[network.edge[sources]]]))
 
-                geometry = asShape(feature['geometry'])
-                lengths[axis] += geometry.length
+    # highest ranked source upstream of each node
 
-                graph[a] = (b, axis)
-                indegree[b] += 1
+    unreached = len(sources)
+    best = np.full(size, unreached, dtype='int64')
+    best[sources[ranking]] = np.arange(len(sources))
 
-    def distance(node):
+    for nodes in network.levels():
 
-        if node in graph:
-            _, axis = graph[node]
-            return lengths[axis]
+        group, upstream = network.upstream(nodes)
+        np.minimum.at(best, nodes[group], best[upstream])
 
-        return 0.0
+    orders = np.zeros(size, dtype='int64')
 
-    orders = dict()
-    queue = [(-distance(node), node) for node in graph if indegree[node] == 0]
-    heapify(queue)
+    for nodes in network.levels(reverse=True):
 
-    def set_order(nodes, k):
+        down = network.down[nodes]
+        outlet = down < 0
+        orders[nodes[outlet]] = 1
 
-        for node in nodes:
-            orders[node] = k
+        nodes = nodes[~outlet]
+        down = down[~outlet]
+        orders[nodes] = orders[down] + (best[nodes] != best[down])
 
-    while queue:
+    walked = np.flatnonzero((network.edge >= 0) & (best < unreached))
+    walked = walked[np.lexsort((network.level[walked], best[walked]))]
+    sequence = edge_axis[network.edge[walked]]
+    _, first = np.unique(sequence, return_index=True)
 
-        _, node = heappop(queue)
-        track = [node]
+    newids = np.zeros(len(axes), dtype='int64')
+    newids[sequence[np.sort(first)]] = np.arange(1, len(first) + 1)
 
-        while node in graph:
-
-            next_node, axis = graph[node]
-
-            if axis not in newids:
-                newids[axis] = next(gid)
-
-            if next_node in orders:
-                set_order(track, orders[next_node] + 1)
-                break
-
-            track.append(next_node)
-            node = next_node
-
-        else:
-
-            set_order(track, 1)
+    nodea = network.node_ids([feature['properties']['NODEA'] for feature in features])
 
     with fiona.open(network_shapefile) as fs:
 
@@ -345,55 +379,60 @@ def UpdateLengthOrder(
         schema = fs.schema
         crs = fs.crs
 
-        schema['properties'].update({
-            'HACK': 'int:3',
-            'LENAXIS': 'float:8.0',
-        })
+    schema['properties'].update({
+        'HACK': 'int:3',
+        'LENAXIS': 'float:8.0',
+    })
 
-        options = dict(driver=driver, crs=crs, schema=schema)
+    options = dict(driver=driver, crs=crs, schema=schema)
 
-        with fiona.open(output, 'w', **options) as dst:
-            with click.progressbar(fs) as iterator:
-                for feature in iterator:
+    for fid, feature in enumerate(features):
 
-                    properties = feature['properties']
-                    a = properties['NODEA']
-                    axis = properties['AXIS']
+        a = nodea[fid]
+        axis = edge_axis[fid]
 
-                    properties.update({
-                        'AXIS': newids[axis],
-                        'HACK': orders[a] if a in orders else None,
-                        'LENAXIS': lengths[axis]
-                    })
+        feature['properties'].update({
+            'AXIS': int(newids[axis]) if newids[axis] > 0 else None,
+            'HACK': int(orders[a]) if best[a] < unreached else None,
+            'LENAXIS': float(lengths[axis])
+        })
 
-                    dst.write(feature)
+    with fiona.open(output, 'w', **options) as dst:
+        dst.writerecords(features)
 
 def AggregateByAxis(network_shapefile, output):
+    """
+    Merge network segments into one feature per axis source,
+    with NODEB set to the last node downstream along the same axis
+    """
 
-    graph = dict()
-    indegree = Counter()
-    segments = defaultdict(list)
+    features, network, _ = ReadNetwork(network_shapefile)
 
-    with fiona.open(network_shapefile) as fs:
-        
-        with click.progressbar(fs) as iterator:
-            for feature in iterator:
+    axes, edge_axis = np.unique(
+        [feature['properties']['AXIS'] for feature in features],
+        return_inverse=True)
 
-                properties = feature['properties']
-                axis = properties['AXIS']
+    # last node downstream along the same axis
+
+    size = len(network)
+    nodeb = np.full(size, -1, dtype='int64')
+
+    for nodes in network.levels(reverse=True):
 
-                a = properties['NODEA']
-                b = properties['NODEB']
+        nodes = nodes[network.edge[nodes] >= 0]
+        down = network.down[nodes]
+        down_edge = network.edge[down]
+        same = (down_edge >= 0) & (
+            edge_axis[np.maximum(down_edge, 0)] == edge_axis[network.edge[nodes]])
 
-                segments[axis].append(feature['id'])
+        nodeb[nodes] = np.where(same, nodeb[down], down)
 
-                graph[a] = (b, axis, feature['id'])
-                indegree[b] += 1
+    order = np.argsort(edge_axis, kind='stable')
+    splits = np.flatnonzero(np.diff(edge_axis[order])) + 1
+    segments = dict(enumerate(np.split(order, splits))) if order.size else dict()
+    merged = dict()
 
-        sources = [
-            node for node in graph
-            if indegree[node] == 0
-        ]
+    with fiona.open(network_shapefile) as fs:
 
         options = dict(
             driver=fs.driver,
@@ -401,38 +440,28 @@ def AggregateByAxis(network_shapefile, output):
             schema=fs.schema
         )
 
-        def get_nodeb(a, axis):
-
-            node = a
-
-            while node in graph:
-
-                next_node, next_axis, _ = graph[node]
-
-                if next_axis != axis:
-                    break
-
-                node = next_node
+    sources = np.sort(network.edge[network.sources()])
+    records = list()
 
-            return node
+    with click.progressbar(sources) as iterator:
+        for fid in iterator:
 
-        with fiona.open(output, 'w', **options) as dst:
-            with click.progressbar(sources) as iterator:
-                for source in iterator:
+            feature = features[fid]
+            axis = edge_axis[fid]
 
-                    _, axis, fid = graph[source]
-                    feature = fs.get(fid)
-                    properties = feature['properties']
+            if axis not in merged:
+                merged[axis] = linemerge([
+                    asShape(features[k]['geometry'])
+                    for k in segments[axis]
+                ])
 
-                    geometry = linemerge([
-                        asShape(fs.get(fid)['geometry'])
-                        for fid in segments[axis]
-                    ])
+            a = network.node_ids([feature['properties']['NODEA']])[0]
+            b = nodeb[a]
 
-                    a = properties['NODEA']
-                    b = get_nodeb(a, axis)
-                    properties.update({'NODEB': b})
+            feature['properties'].update({'NODEB': int(network.keys[b]) if b >= 0 else None})
+            feature['geometry'] = merged[axis].__geo_interface__
 
-                    feature['geometry'] = geometry.__geo_interface__
+            records.append(feature)
 
-                    dst.write(feature)
+    with fiona.open(output, 'w', **options) as dst:
+        dst.writerecords(records)
@@ -0,0 +1,585 @@
+# coding: utf-8
+
+"""
+Coarse-to-fine multi-resolution drainage
+
+Most of the global spillover structure of a DEM
+is already decided at coarse resolution.
+This module solves depressions and flats on a coarse level
+of the DEM pyramid, in memory, with one priority-flood pass,
+and extracts corridors around coarse flow paths.
+
+The fine level DepressionFill and BorderFlats chain
+then labels only tiles intersecting corridors.
+Tiles outside of corridors take their elevations
+from the coarse filled DEM, and one label per coarse pixel :
+their watershed and flat records are derived from the coarse solution,
+so that the tile spillover graphs still cover every tile,
+and fine watersheds of corridor tiles see coarse elevations
+on their borders with tiles outside of corridors.
+
+Where coarse and fine levels disagree,
+ie. where coarse filled elevations differ from fine elevations
+by more than `max_difference`,
+on more than `max_disagreement` of the tile's pixels,
+the tile falls back to the full resolution solve.
+
+Sequence :
+
+1. BuildCoarseDEM
+2. SolveCoarseDrainage
+3. CoarseWatershedTile on every tile,
+   corridor tiles and failing tiles being left to the fine solve
+4. LabelWatersheds on fine tiles,
+   ResolveWatershedSpillover,
+   DispatchWatershedMinimumZ on every tile
+5. LabelBorderFlats on fine tiles,
+   CoarseFlatTile on coarse tiles,
+   ResolveFlatSpillover,
+   DispatchFlatMinimumZ on every tile
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.ndimage import binary_dilation
+
+import click
+import rasterio as rio
+from affine import Affine
+from rasterio.windows import Window
+from rasterio.warp import Resampling
+
+from .. import speedup
+from ..cli import starcall
+from ..config import (
+    config,
+    DatasourceParameter,
+    DatasetParameter,
+    LiteralParameter
+)
+from ..tileio import DownsampleRasterTile
+from . import (
+    DepressionFill,
+    BorderFlats
+)
+from .IncrementalDrainage import Execute
+
+def tileindex():
+    """
+    Return default tileindex
+    """
+    return config.tileset().tileindex
+
+class Parameters():
+    """
+    Multi-resolution drainage parameters
+    """
+
+    source = DatasourceParameter('elevation datasource (DEM)')
+
+    coarse = DatasetParameter('coarse DEM', type='output')
+    coarse_filled = DatasetParameter('depression-filled coarse DEM', type='output')
+    coarse_flow = DatasetParameter('coarse flow direction', type='output')
+    corridor = DatasetParameter('drainage corridors around coarse flow paths', type='output')
+
+    factor = LiteralParameter('downsampling factor of the coarse level')
+    min_drainage = LiteralParameter(
+        'minimum drainage area of coarse flow paths expressed in square kilometers')
+    corridor_width = LiteralParameter('corridor half-width, in coarse pixels')
+    max_difference = LiteralParameter(
+        'maximum difference between coarse filled and fine elevations, in meters')
+    max_disagreement = LiteralParameter(
+        'maximum proportion of pixels exceeding max_difference, '
+        'beyond which tile falls back to the full resolution solve')
+
+    def __init__(self):
+        """
+        Default parameter values
+        """
+
+        self.source = 'dem1'
+        self.coarse = dict(key='dem-coarse', tiled=False)
+        self.coarse_filled = dict(key='dem-coarse-filled', tiled=False)
+        self.coarse_flow = dict(key='flow-coarse', tiled=False)
+        self.corridor = dict(key='drainage-corridor', tiled=False)
+
+        self.factor = 16
+        self.min_drainage = 5.0
+        self.corridor_width = 2
+        self.max_difference = 10.0
+        self.max_disagreement = 0.05
+
+def CoarseTile(row, col, params):
+    """
+    Downsample DEM tile (row, col),
+    keeping the minimum elevation of each coarse pixel
+    """
+
+    data, profile = DownsampleRasterTile(
+        row, col,
+        params.source,
+        factor=params.factor,
+        resampling=Resampling.min)
+
+    return data, profile
+
+def BuildCoarseDEM(params, processes=1):
+    """
+    Assemble the coarse level of the DEM pyramid
+    from downsampled tiles
+    """
+
+    tile_index = tileindex()
+
+    arguments = [
+        (CoarseTile, row, col, params, dict())
+        for row, col in tile_index
+    ]
+
+    tiles = list()
+
+    click.secho('Downsample DEM tiles', fg='cyan')
+
+    with Pool(processes=processes) as pool:
+
+        pooled = pool.imap_unordered(starcall, arguments)
+
+        with click.progressbar(pooled, length=len(arguments)) as iterator:
+            for data, profile in iterator:
+                tiles.append((data, profile))
+
+    transforms = [profile['transform'] for _, profile in tiles]
+    xres = transforms[0].a
+    yres = transforms[0].e
+
+    minx = min(t.c for t in transforms)
+    maxy = max(t.f for t in transforms)
+    maxx = max(t.c + xres*data.shape[1] for t, (data, _) in zip(transforms, tiles))
+    miny = min(t.f + yres*data.shape[0] for t, (data, _) in zip(transforms, tiles))
+
+    height = int(round((maxy - miny) / -yres))
+    width = int(round((maxx - minx) / xres))
+    nodata = tiles[0][1]['nodata']
+
+    coarse = np.full((height, width), nodata, dtype='float32')
+
+    for data, profile in tiles:
+
+        transform = profile['transform']
+        i = int(round((maxy - transform.f) / -yres))
+        j = int(round((transform.c - minx) / xres))
+        h, w = data.shape
+        coarse[i:i+h, j:j+w] = data
+
+    profile = tiles[0][1].copy()
+    profile.update(
+        driver='GTiff',
+        height=height,
+        width=width,
+        transform=Affine(xres, 0, minx, 0, yres, maxy),
+        dtype='float32',
+        compress='deflate')
+
+    output = params.coarse.filename()
+
+    with rio.open(output, 'w', **profile) as dst:
+        dst.write(coarse, 1)
+
+    click.secho('Coarse DEM (%d x %d) saved to : %s' % (height, width, output), fg='green')
+
+def SolveCoarseDrainage(params):
+    """
+    Fill depressions and calculate flow direction on the coarse DEM,
+    and extract corridors around coarse flow paths
+    """
+
+    with rio.open(params.coarse.filename()) as ds:
+
+        elevations = ds.read(1)
+        profile = ds.profile.copy()
+        nodata = ds.nodata
+        pixel_area = abs(ds.transform.a * ds.transform.e) * 1e-6
+
+    click.secho('Resolve coarse depressions', fg='cyan')
+
+    filled, flow = speedup.priority_flood(elevations, nodata)
+    acc = speedup.flow_accumulation_fast(flow) * pixel_area
+
+    paths = (acc >= params.min_drainage) & (flow != -1)
+    structure = np.ones((3, 3), dtype='bool')
+    corridor = binary_dilation(paths, structure=structure, iterations=params.corridor_width)
+
+    click.secho('Coarse flow paths : %d pixels, corridors : %d pixels' % (
+        np.sum(paths), np.sum(corridor)), fg='green')
+
+    with rio.open(params.coarse_filled.filename(), 'w', **profile) as dst:
+        dst.write(filled, 1)
+
+    profile.update(dtype='int16', nodata=-1)
+
+    with rio.open(params.coarse_flow.filename(), 'w', **profile) as dst:
+        dst.write(flow, 1)
+
+    profile.update(dtype='uint8', nodata=255)
+
+    with rio.open(params.corridor.filename(), 'w', **profile) as dst:
+        dst.write(np.uint8(corridor), 1)
+
+def ReadCoarseBlocks(dataset, transform, shape):
+    """
+    Read global coarse raster `dataset`
+    at the centers of the pixels of the fine grid (`transform`, `shape`)
+
+    Returns
+    -------
+
+    values: array, same shape as fine grid
+        coarse values of fine pixels
+
+    blocks: array, same shape as fine grid
+        index of the coarse pixel containing each fine pixel
+
+    nodata: float
+        no-data value of `dataset`
+    """
+
+    height, width = shape
+
+    with rio.open(dataset.filename()) as ds:
+
+        y = transform.f + (np.arange(height) + 0.5) * transform.e
+        x = transform.c + (np.arange(width) + 0.5) * transform.a
+        ci = np.int64(np.floor((y - ds.transform.f) / ds.transform.e))
+        cj = np.int64(np.floor((x - ds.transform.c) / ds.transform.a))
+
+        window = Window(
+            int(cj[0]), int(ci[0]),
+            int(cj[-1] - cj[0] + 1), int(ci[-1] - ci[0] + 1))
+
+        data = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
+        nodata = ds.nodata
+
+    ci = ci - ci[0]
+    cj = cj - cj[0]
+    values = data[np.ix_(ci, cj)]
+    blocks = ci[:, np.newaxis] * data.shape[1] + cj[np.newaxis, :]
+
+    return values, blocks, nodata
+
+def BlockGraph(labels, elevations):
+    """
+    Spillover graph between labeled regions of a tile.
+
+    Label 0 stands for nodata, ie. the exterior.
+    Link elevation is the minimum over adjacent pixel pairs
+    of the higher pixel of each pair,
+    or of the valid pixel for pairs with a nodata pixel.
+
+    Returns
+    -------
+
+    dict (label1, label2) -> z, with label1 < label2
+    """
+
+    height, width = labels.shape
+    first = list()
+    second = list()
+    linkz = list()
+
+    for di, dj in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+
+        rows1, rows2 = slice(0, height-di), slice(di, height)
+
+        if dj >= 0:
+            cols1, cols2 = slice(0, width-dj), slice(dj, width)
+        else:
+            cols1, cols2 = slice(-dj, width), slice(0, width+dj)
+
+        l1 = labels[rows1, cols1].ravel()
+        l2 = labels[rows2, cols2].ravel()
+        z1 = elevations[rows1, cols1].ravel()
+        z2 = elevations[rows2, cols2].ravel()
+
+        z = np.where(l1 == 0, z2, np.where(l2 == 0, z1, np.maximum(z1, z2)))
+        mask = (l1 != l2)
+
+        first.append(np.minimum(l1, l2)[mask])
+        second.append(np.maximum(l1, l2)[mask])
+        linkz.append(z[mask])
+
+    first = np.uint64(np.concatenate(first))
+    second = np.uint64(np.concatenate(second))
+    linkz = np.concatenate(linkz)
+
+    keys = (first << np.uint64(32)) | second
+    order = np.lexsort((linkz, keys))
+    keys, index = np.unique(keys[order], return_index=True)
+    linkz = linkz[order][index]
+
+    return {
+        (int(key >> np.uint64(32)), int(key & np.uint64(0xFFFFFFFF))): float(z)
+        for key, z in zip(keys, linkz)
+    }
+
+def BorderRecords(elevations, labels):
+    """
+    Elevations and labels along tile borders,
+    clockwise from top-left corner,
+    as recorded by LabelWatersheds and LabelBorderFlats
+    """
+
+    return dict(
+        z=np.array([
+            elevations[0, :],
+            elevations[:, -1],
+            np.flip(elevations[-1, :], axis=0),
+            np.flip(elevations[:, 0], axis=0)]),
+        labels=np.array([
+            labels[0, :],
+            labels[:, -1],
+            np.flip(labels[-1, :], axis=0),
+            np.flip(labels[:, 0], axis=0)])
+    )
+
+def CoarseWatershedTile(row, col, params, fill, **kwargs):
+    """
+    Derive watershed records of tile (row, col)
+    from the coarse drainage solution,
+    in place of DepressionFill.LabelWatersheds,
+    unless tile intersects a drainage corridor
+    or disagrees with the coarse solution.
+
+    Filled elevations are coarse filled elevations,
+    and watershed labels are coarse pixels.
+
+    Returns
+    -------
+
+    tile: tuple (row, col)
+
+    coarse: bool
+        True if tile records were derived from the coarse solution,
+        False if tile is left to the full resolution solve
+
+    disagreement: float
+        proportion of pixels whose coarse filled elevation
+        differs from fine elevation by more than `max_difference`
+    """
+
+    elevation_raster = fill.elevations.tilename(row=row, col=col, **kwargs)
+    output_filled = fill.filled.tilename(row=row, col=col, **kwargs)
+    output_labels = fill.labels.tilename(row=row, col=col, **kwargs)
+    output_graph = fill.graph.tilename(row=row, col=col, **kwargs)
+
+    with rio.open(elevation_raster) as ds:
+
+        elevations = ds.read(1)
+        profile = ds.profile.copy()
+        nodata = ds.nodata
+        transform = ds.transform
+
+    corridor, _, _ = ReadCoarseBlocks(params.corridor, transform, elevations.shape)
+
+    if np.any(corridor == 1):
+        return (row, col), False, 0.0
+
+    coarse, blocks, coarse_nodata = ReadCoarseBlocks(
+        params.coarse_filled,
+        transform,
+        elevations.shape)
+
+    valid = (elevations != nodata)
+    known = valid & (coarse != coarse_nodata)
+    disagree = valid & (
+        ~known |
+        (np.abs(coarse - elevations) > params.max_difference)
+    )
+
+    disagreement = np.sum(disagree) / max(np.sum(valid), 1)
+
+    if disagreement > params.max_disagreement:
+        return (row, col), False, disagreement
+
+    filled = np.float32(np.where(known, coarse, elevations))
+
+    _, labels = np.unique(blocks, return_inverse=True)
+    labels = np.uint32(labels.reshape(blocks.shape) + 1)
+    labels[~valid] = 0
+
+    graph = BlockGraph(labels, filled)
+
+    profile.update(
+        compress='deflate',
+        tiled='yes',
+        dtype='float32'
+    )
+
+    with rio.open(output_filled, 'w', **profile) as dst:
+        dst.write(filled, 1)
+
+    profile.update(
+        dtype=np.uint32,
+        nodata=0)
+
+    with rio.open(output_labels, 'w', **profile) as dst:
+        dst.write(labels, 1)
+
+    np.savez(
+        output_graph,
+        graph=np.array(list(graph.items()), dtype=object),
+        **BorderRecords(filled, labels)
+    )
+
+    return (row, col), True, disagreement
+
+def CoarseFlatTile(row, col, flats, **kwargs):
+    """
+    Derive flat records of coarse tile (row, col),
+    in place of BorderFlats.LabelBorderFlats :
+    flat labels are watershed labels, ie. coarse pixels,
+    linked both ways with their neighbors
+    """
+
+    resolved_raster = flats.resolved.tilename(row=row, col=col, **kwargs)
+    label_raster = flats.labels.tilename(row=row, col=col, **kwargs)
+    output_labels = flats.flat_labels.tilename(row=row, col=col, **kwargs)
+    output_graph = flats.flat_graph.tilename(row=row, col=col, **kwargs)
+
+    with rio.open(resolved_raster) as ds:
+        elevations = ds.read(1)
+
+    with rio.open(label_raster) as ds:
+        labels = ds.read(1)
+        profile = ds.profile.copy()
+
+    graph = dict()
+
+    for (label1, label2), z in BlockGraph(labels, elevations).items():
+
+        if label1 == 0:
+            graph[label2, 0] = z
+        else:
+            graph[label1, label2] = z
+            graph[label2, label1] = z
+
+    with rio.open(output_labels, 'w', **profile) as dst:
+        dst.write(labels, 1)
+
+    np.savez(
+        output_graph,
+        flatindex=np.max(labels),
+        graph=np.array(list(graph.items()), dtype=object),
+        **BorderRecords(elevations, labels)
+    )
+
+def MultiResolutionDrainage(params, fill=None, flats=None, processes=1):
+    """
+    Resolve depressions and flats of the DEM,
+    solving tiles outside of drainage corridors at the coarse level,
+    and running the fine DepressionFill and BorderFlats tile labeling
+    on the other tiles only.
+
+    Output is `flats.output`, ie. the input of FlowDirection.
+
+    Parameters
+    ----------
+
+    params: Parameters
+        Multi-resolution parameters
+
+    fill, flats: Parameters
+        DepressionFill and BorderFlats parameters,
+        defaults to each module's default parameters
+
+    processes: int
+        Number of parallel processes
+
+    Returns
+    -------
+
+    set of (row, col) tiles solved at full resolution
+    """
+
+    fill = fill or DepressionFill.Parameters()
+    flats = flats or BorderFlats.Parameters()
+    tile_index = tileindex()
+
+    BuildCoarseDEM(params, processes)
+    SolveCoarseDrainage(params)
+
+    click.secho('Derive tiles outside of corridors from coarse solution', fg='cyan')
+
+    results = Execute([
+        (CoarseWatershedTile, row, col, params, fill, dict())
+        for row, col in sorted(tile_index)
+    ], processes)
+
+    fine = {tile for tile, coarse, _ in results if not coarse}
+    fallbacks = {
+        tile for tile, coarse, disagreement in results
+        if not coarse and disagreement > params.max_disagreement
+    }
+    coarse = set(tile_index) - fine
+
+    click.secho('%d coarse tiles, %d fine tiles' % (len(coarse), len(fine)), fg='green')
+
+    if fallbacks:
+        click.secho(
+            '%d tiles fell back to full resolution solve' % len(fallbacks),
+            fg='yellow')
+
+    if fill.method == 'breach':
+
+        click.secho('Breach depressions of %d tiles' % len(fine), fg='cyan')
+
+        Execute([
+            (DepressionFill.BreachDepressions, row, col, fill, dict(overwrite=True))
+            for row, col in sorted(fine)
+        ], processes)
+
+    click.secho('Label watersheds of %d tiles' % len(fine), fg='cyan')
+
+    Execute([
+        (DepressionFill.LabelWatersheds, row, col, fill, dict(overwrite=True))
+        for row, col in sorted(fine)
+    ], processes)
+
+    DepressionFill.ResolveWatershedSpillover(fill, overwrite=True)
+
+    click.secho('Dispatch watershed minimum z', fg='cyan')
+
+    Execute([
+        (DepressionFill.DispatchWatershedMinimumZ, row, col, fill, dict(overwrite=True))
+        for row, col in sorted(tile_index)
+    ], processes)
+
+    click.secho('Label border flats of %d tiles' % len(fine), fg='cyan')
+
+    Execute([
+        (BorderFlats.LabelBorderFlats, row, col, flats, dict())
+        for row, col in sorted(fine)
+    ] + [
+        (CoarseFlatTile, row, col, flats, dict())
+        for row, col in sorted(coarse)
+    ], processes)
+
+    BorderFlats.ResolveFlatSpillover(flats)
+
+    click.secho('Dispatch flat minimum z', fg='cyan')
+
+    Execute([
+        (BorderFlats.DispatchFlatMinimumZ, row, col, flats, dict(overwrite=True))
+        for row, col in sorted(tile_index)
+    ], processes)
+
+    return fine
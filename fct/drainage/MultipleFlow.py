@@ -0,0 +1,348 @@
+# coding: utf-8
+
+"""
+Multiple Flow Direction (MFD) and D-infinity routing,
+alongside D8 flow direction.
+
+Flow proportions are stored per tile as a 8-band uint8 raster,
+and accumulated across tiles by exchanging tile outflows
+until no significant contribution is left to propagate.
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+import click
+import rasterio as rio
+
+from .. import speedup
+from ..cli import starcall
+from ..config import (
+    config,
+    DatasetParameter,
+    LiteralParameter
+)
+from ..tileio import PadRaster
+from .TileGraph import EDGE_DTYPE, edges_from_outlets
+
+def tileindex():
+    """
+    Return default tileindex
+    """
+    return config.tileset().tileindex
+
+class Parameters():
+    """
+    Multiple flow direction parameters
+    """
+
+    elevations = DatasetParameter('filled-resolved elevation raster (DEM)', type='input')
+    flow = DatasetParameter('D8 flow direction raster, used on flats', type='input')
+    proportions = DatasetParameter('flow proportions raster (8 bands, uint8)', type='output')
+    acc = DatasetParameter('accumulation raster (drainage area)', type='output')
+
+    method = LiteralParameter('flow partition method, mfd or dinf')
+    exponent = LiteralParameter('MFD slope exponent')
+    resolution = LiteralParameter('raster resolution, ie. pixel size, in real distance unit (eg. meters)')
+    coefficient = LiteralParameter('pixel contribution, eg. pixel area in km^2')
+    tolerance = LiteralParameter('minimum tile inflow to propagate, in output units')
+    max_iterations = LiteralParameter('maximum number of tile exchange iterations')
+
+    def __init__(self):
+        """
+        Default parameter values
+        """
+
+        self.elevations = 'dem-drainage-resolved'
+        self.flow = 'flow'
+        self.proportions = 'flow-partition'
+        self.acc = 'acc-partition'
+
+        self.method = 'mfd'
+        self.exponent = 1.1
+        self.resolution = 5.0
+        self.coefficient = 25e-6
+        self.tolerance = 25e-6
+        self.max_iterations = 100
+
+def FlowPartitionTile(row, col, params, overwrite=True, **kwargs):
+    """
+    Calculate flow proportions from elevations,
+    using D8 flow direction on flats
+    """
+
+    output = params.proportions.tilename(row=row, col=col, **kwargs)
+
+    if os.path.exists(output) and not overwrite:
+        click.secho('Output already exists: %s' % output, fg='yellow')
+        return
+
+    elevations, profile = PadRaster(row, col, params.elevations.name)
+    flow, _ = PadRaster(row, col, params.flow.name)
+
+    proportions = speedup.flow_partition(
+        np.float32(elevations),
+        profile['nodata'],
+        flow,
+        exponent=params.exponent,
+        distance=params.resolution,
+        dinf=(params.method == 'dinf'))
+
+    proportions = proportions[1:-1, 1:-1]
+    height, width, _ = proportions.shape
+    transform = profile['transform'] * profile['transform'].translation(1, 1)
+
+    profile.update(
+        height=height,
+        width=width,
+        count=8,
+        dtype='uint8',
+        nodata=None,
+        transform=transform,
+        compress='deflate')
+
+    with rio.open(output, 'w', **profile) as dst:
+        dst.write(np.moveaxis(proportions, -1, 0))
+
+def ReadProportions(row, col, params, **kwargs):
+    """
+    Read tile flow proportions
+    as a (height, width, 8) uint8 array,
+    and tile profile
+    """
+
+    rasterfile = params.proportions.tilename(row=row, col=col, **kwargs)
+
+    with rio.open(rasterfile) as ds:
+
+        proportions = np.ascontiguousarray(np.moveaxis(ds.read(), 0, -1))
+        profile = ds.profile.copy()
+
+    return proportions, profile
+
+def PartitionAccumulationTile(row, col, params, inlets=None, local=True, write=False, **kwargs):
+    """
+    Accumulate flow according to flow proportions,
+    and return tile outflows as edge records.
+
+    Parameters
+    ----------
+
+    inlets: tuple (i, j, values) or None
+        Contributions flowing into tile
+
+    local: bool
+        Include tile pixels' own contribution
+
+    write: bool
+        Write accumulation raster
+
+    Returns
+    -------
+
+    edges: array of EDGE_DTYPE records
+        outflows to neighbor tiles,
+        with flow amount as edge `area`
+    """
+
+    proportions, profile = ReadProportions(row, col, params, **kwargs)
+    height, width, _ = proportions.shape
+
+    if local:
+        out = np.full((height, width), params.coefficient, dtype='float32')
+    else:
+        out = np.zeros((height, width), dtype='float32')
+
+    if inlets is not None:
+        i, j, values = inlets
+        np.add.at(out, (i, j), np.float32(values))
+
+    speedup.partition_accumulation(proportions, out)
+    outlets, areas = speedup.partition_outflow(proportions, out)
+    edges, _, _ = edges_from_outlets(row, col, outlets, areas, height, width)
+
+    if write:
+
+        output = params.acc.tilename(row=row, col=col, **kwargs)
+
+        profile.update(
+            count=1,
+            dtype='float32',
+            nodata=0,
+            compress='deflate')
+
+        with rio.open(output, 'w', **profile) as dst:
+            dst.write(out, 1)
+
+    return edges
+
+def GroupInlets(edges):
+    """
+    Group edges by target tile,
+    summing up contributions to the same inlet pixel
+
+    Returns
+    -------
+
+    dict: tile gid -> (i, j, values)
+    """
+
+    inlets = dict()
+
+    if len(edges) == 0:
+        return inlets
+
+    keys = np.stack([edges['to_tile'], edges['ti'], edges['tj']], axis=1)
+    keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    values = np.zeros(len(keys), dtype='float64')
+    np.add.at(values, inverse.reshape(-1), edges['area'])
+
+    for gid in np.unique(keys[:, 0]):
+
+        selection = keys[:, 0] == gid
+        inlets[int(gid)] = (
+            keys[selection, 1],
+            keys[selection, 2],
+            values[selection])
+
+    return inlets
+
+def MergeInlets(total, delta):
+    """
+    Add `delta` inlet contributions to `total`
+    """
+
+    for gid, (i, j, values) in delta.items():
+
+        if gid in total:
+
+            ti, tj, tvalues = total[gid]
+            total[gid] = (
+                np.concatenate([ti, i]),
+                np.concatenate([tj, j]),
+                np.concatenate([tvalues, values]))
+
+        else:
+
+            total[gid] = (i, j, values)
+
+def FlowAccumulationPartition(params, processes=1, **kwargs):
+    """
+    Flow accumulation according to multiple flow direction proportions,
+    across tiles.
+
+    Flow proportions split the flow entering a tile
+    between several tile exits, so inter-tile contributions
+    cannot be resolved as a tree like with D8.
+    Tile outflows are rather exchanged between tiles,
+    reprocessing only tiles receiving significant new inflows,
+    until the remaining inflow falls under `params.tolerance`.
+    Flow accumulation is linear,
+    so each iteration only propagates new contributions.
+    """
+
+    tile_index = tileindex()
+    tiles = {tile.gid: tile for tile in tile_index.values()}
+
+    def execute(arguments, length):
+
+        edges = list()
+
+        with Pool(processes=processes) as pool:
+
+            pooled = pool.imap_unordered(starcall, arguments)
+
+            with click.progressbar(pooled, length=length) as iterator:
+                for tile_edges in iterator:
+                    edges.append(tile_edges)
+
+        if edges:
+            return np.concatenate(edges)
+
+        return np.zeros(0, dtype=EDGE_DTYPE)
+
+    click.secho('Accumulate tiles', fg='cyan')
+
+    arguments = [
+        (PartitionAccumulationTile, row, col, params, kwargs)
+        for row, col in tile_index
+    ]
+
+    delta = GroupInlets(execute(arguments, len(arguments)))
+    total = dict()
+    iteration = 0
+
+    while delta:
+
+        # every round of inflows is merged into total,
+        # including the last one when iterations are exhausted
+        MergeInlets(total, delta)
+
+        arguments = [
+            (
+                PartitionAccumulationTile,
+                tiles[gid].row,
+                tiles[gid].col,
+                params,
+                dict(inlets=inlets, local=False, **kwargs)
+            )
+            for gid, inlets in delta.items()
+            if gid in tiles and np.sum(inlets[2]) >= params.tolerance
+        ]
+
+        if not arguments:
+            break
+
+        if iteration == params.max_iterations:
+            click.secho('Maximum number of iterations reached', fg='yellow')
+            break
+
+        iteration += 1
+        click.secho('Propagate inflows, iteration %d (%d tiles)' % (iteration, len(arguments)), fg='cyan')
+        delta = GroupInlets(execute(arguments, len(arguments)))
+
+    click.secho('Write accumulation tiles', fg='cyan')
+
+    arguments = [
+        (
+            PartitionAccumulationTile,
+            row,
+            col,
+            params,
+            dict(inlets=total.get(tile.gid), write=True, **kwargs)
+        )
+        for (row, col), tile in tile_index.items()
+    ]
+
+    execute(arguments, len(arguments))
+
+def FlowPartition(params, processes=1, **kwargs):
+    """
+    Calculate flow proportions for every tile
+    """
+
+    tile_index = tileindex()
+
+    arguments = [
+        (FlowPartitionTile, row, col, params, kwargs)
+        for row, col in tile_index
+    ]
+
+    with Pool(processes=processes) as pool:
+
+        pooled = pool.imap_unordered(starcall, arguments)
+
+        with click.progressbar(pooled, length=len(arguments)) as iterator:
+            for _ in iterator:
+                pass
@@ -0,0 +1,221 @@
+# coding: utf-8
+
+"""
+Network Graph :
+array model of a stream network made of directed segments
+(NODEA -> NODEB), with at most one downstream segment per node.
+
+Node identifiers are mapped to dense integer ids,
+downstream links are stored as one array indexed by node id,
+and upstream links as compressed sparse rows (CSR).
+Nodes are sorted in topological levels,
+so that upstream-to-downstream (and reverse) propagations
+run as one vectorized step per level.
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import numpy as np
+
+class NetworkGraph():
+    """
+    Array model of a network of directed segments
+
+    Parameters
+    ----------
+
+    nodea, nodeb: array-like, dtype=int
+        Upstream and downstream node identifiers of each segment.
+        When several segments leave the same node,
+        only the last one is kept.
+
+    Attributes
+    ----------
+
+    keys: array, shape (n,)
+        Original node identifier of each node id
+
+    edge: array, shape (n,)
+        Index of the segment leaving each node, or -1
+
+    down: array, shape (n,)
+        Downstream node id of each node, or -1
+
+    up_ptr, up_idx: arrays
+        Upstream node ids of node `x` are
+        `up_idx[up_ptr[x]:up_ptr[x+1]]`
+
+    level: array, shape (n,)
+        Topological level of each node,
+        ie. the number of segments along the longest path
+        from a source down to the node,
+        or -1 for nodes on cycles
+    """
+
+    def __init__(self, nodea, nodeb):
+
+        nodea = np.asarray(nodea, dtype='int64')
+        nodeb = np.asarray(nodeb, dtype='int64')
+        count = len(nodea)
+
+        self.keys, inverse = np.unique(np.concatenate([nodea, nodeb]), return_inverse=True)
+        size = len(self.keys)
+        a = inverse[:count]
+        b = inverse[count:]
+
+        # keep last segment leaving each node
+
+        _, last = np.unique(a[::-1], return_index=True)
+        last = count - 1 - last
+
+        self.edge = np.full(size, -1, dtype='int64')
+        self.edge[a[last]] = last
+        self.down = np.full(size, -1, dtype='int64')
+        self.down[a[last]] = b[last]
+
+        nodes = np.flatnonzero(self.down >= 0)
+        order = np.argsort(self.down[nodes], kind='stable')
+        self.up_idx = nodes[order]
+        self.up_ptr = np.zeros(size+1, dtype='int64')
+        self.up_ptr[1:] = np.cumsum(np.bincount(self.down[nodes], minlength=size))
+
+        self.level = self._levels()
+
+    @classmethod
+    def from_endpoints(cls, first, last, precision):
+        """
+        Network of segments from their first and last vertices,
+        with node identifiers hashed from endpoint coordinates
+        (see `endpoint_keys`), so that segments sharing an endpoint
+        are connected without NODEA/NODEB attributes
+
+        Parameters
+        ----------
+
+        first, last: array-like, shape (n, 2)
+            First and last (x, y) vertex of each segment
+
+        precision: float
+            Cell size of the grid endpoints are snapped to
+        """
+
+        return cls(
+            endpoint_keys(first, precision),
+            endpoint_keys(last, precision))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _levels(self):
+        """
+        Kahn's topological sort, one frontier at a time
+        """
+
+        size = len(self.keys)
+        indegree = np.diff(self.up_ptr)
+        level = np.full(size, -1, dtype='int64')
+        frontier = np.flatnonzero(indegree == 0)
+        current = 0
+
+        while frontier.size:
+
+            level[frontier] = current
+            targets = self.down[frontier]
+            targets = targets[targets >= 0]
+            indegree = indegree - np.bincount(targets, minlength=size)
+            targets = np.unique(targets)
+            frontier = targets[indegree[targets] == 0]
+            current += 1
+
+        return level
+
+    def node_ids(self, keys):
+        """
+        Map original node identifiers to node ids,
+        -1 for identifiers not in network
+        """
+
+        keys = np.asarray(keys, dtype='int64')
+
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1)
+
+        ids = np.searchsorted(self.keys, keys)
+        ids = np.minimum(ids, len(self.keys) - 1)
+        found = self.keys[ids] == keys
+
+        return np.where(found, ids, -1)
+
+    def sources(self):
+        """
+        Node ids of sources,
+        ie. nodes with a downstream segment and no upstream segment
+        """
+
+        return np.flatnonzero((self.edge >= 0) & (np.diff(self.up_ptr) == 0))
+
+    def levels(self, reverse=False):
+        """
+        Generator of node id arrays,
+        one per topological level,
+        from sources to outlets, or reverse
+        """
+
+        nodes = np.flatnonzero(self.level >= 0)
+        nodes = nodes[np.argsort(self.level[nodes], kind='stable')]
+        splits = np.flatnonzero(np.diff(self.level[nodes])) + 1
+        groups = np.split(nodes, splits) if nodes.size else []
+
+        if reverse:
+            groups = groups[::-1]
+
+        yield from groups
+
+    def upstream(self, nodes):
+        """
+        Upstream nodes of `nodes`
+
+        Returns
+        -------
+
+        group: array
+            Index in `nodes` of each upstream link, in increasing order
+
+        upstream: array
+            Upstream node id of each link
+        """
+
+        counts = self.up_ptr[nodes+1] - self.up_ptr[nodes]
+        group = np.repeat(np.arange(len(nodes)), counts)
+        offsets = np.arange(group.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        upstream = self.up_idx[np.repeat(self.up_ptr[nodes], counts) + offsets]
+
+        return group, upstream
+
+def endpoint_keys(coordinates, precision):
+    """
+    Hash (x, y) coordinates to integer node identifiers :
+    points within the same cell of a grid of size `precision`
+    share the same identifier.
+    Cell indices must fit in 32 bits.
+    """
+
+    coordinates = np.asarray(coordinates, dtype='float64').reshape(-1, 2)
+    cells = np.int64(np.floor(coordinates / precision))
+
+    return (cells[:, 0] << 32) | (cells[:, 1] & 0xFFFFFFFF)
+
+def last_of_groups(group):
+    """
+    Index of the last item of each run
+    in sorted array `group`
+    """
+
+    return np.flatnonzero(np.append(group[1:] != group[:-1], True))
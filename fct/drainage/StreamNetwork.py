@@ -11,8 +11,9 @@ Vectorize stream network from drainage rasters
 ***************************************************************************
 """
 
-from collections import defaultdict, Counter
+from collections import Counter
 import itertools
+from multiprocessing import Pool
 
 import numpy as np
 
@@ -22,7 +23,7 @@ import fiona
 import fiona.crs
 
 from .. import speedup
-from .. import terrain_analysis as ta
+from ..cli import starcall
 from ..config import (
     config,
     DatasetParameter,
@@ -66,18 +67,80 @@ class Parameters():
         self.drainage_network = 'dem-drainage-network' # 'ax_drainage_network' ?
         self.min_drainage = 5.0
 
-def StreamToFeatureTile(row, col, params):
+def SegmentCoordinates(pixels, transform):
+    """
+    Vectorized conversion of (i, j) pixel coordinates
+    to real world coordinates (pixel centers)
+    """
+
+    x, y = transform * (pixels[:, 1] + 0.5, pixels[:, 0] + 0.5)
+    return np.column_stack([x, y])
+
+def StreamSegmentsTile(row, col, params):
     """
-    DOCME
+    Extract stream segments from tile (row, col)
+    as flat arrays
+
+    Returns
+    -------
+
+    coordinates: array, shape (n, 2)
+        real world coordinates of all segments' vertices
+
+    offsets: array, shape (segments+1,)
+        segment k spans coordinates[offsets[k]:offsets[k+1]]
+
+    heads: array, shape (segments,)
+        1 if segment starts at a stream head, 0 otherwise
     """
 
     flow_raster = params.flow.tilename(row=row, col=col)
     # config.tileset().tilename('flow', row=row, col=col)
     acc_raster = params.acc.tilename(row=row, col=col)
     # config.tileset().tilename('acc', row=row, col=col)
+    min_drainage = params.min_drainage
+
+    with rio.open(flow_raster) as ds:
+
+        flow = ds.read(1)
+        transform = ds.transform
+
+    with rio.open(acc_raster) as ds2:
+        streams = np.int16(ds2.read(1) > min_drainage)
+
+    pixels, offsets, heads = speedup.stream_segments(streams, flow)
+
+    return SegmentCoordinates(pixels, transform), offsets, heads
+
+def SegmentFeatures(coordinates, offsets, heads, row, col, gid):
+    """
+    Generate LineString features from flat segment arrays,
+    numbering features with `gid` counter
+    """
+
+    for k, head in enumerate(heads):
+        yield {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'LineString',
+                'coordinates': coordinates[offsets[k]:offsets[k+1]].tolist()
+            },
+            'properties': {
+                'GID': next(gid),
+                'HEAD': int(head),
+                'ROW': row,
+                'COL': col
+            }
+        }
+
+def StreamToFeatureTile(row, col, params):
+    """
+    Extract stream segments from tile (row, col)
+    and write them to tile shapefile
+    """
+
     output = params.drainage_network.tilename(row=row, col=col)
     # config.tileset().tilename('dem-drainage-network', row=row, col=col)
-    min_drainage = params.min_drainage
 
     driver = 'ESRI Shapefile'
     schema = {
@@ -92,32 +155,26 @@ def StreamToFeatureTile(row, col, params):
     crs = fiona.crs.from_epsg(config.srid)
     options = dict(driver=driver, crs=crs, schema=schema)
 
-    with rio.open(flow_raster) as ds:
+    coordinates, offsets, heads = StreamSegmentsTile(row, col, params)
 
-        flow = ds.read(1)
+    with fiona.open(output, 'w', **options) as dst:
+        dst.writerecords(SegmentFeatures(
+            coordinates, offsets, heads,
+            row, col, itertools.count(0)))
 
-        with rio.open(acc_raster) as ds2:
-            streams = np.int16(ds2.read(1) > min_drainage)
+def StreamSegmentsTileArgs(row, col, params):
+    """
+    Wrapper for pooled execution, returning tile (row, col)
+    along with extracted segments
+    """
 
-        with fiona.open(output, 'w', **options) as dst:
+    return (row, col) + StreamSegmentsTile(row, col, params)
 
-            for current, (segment, head) in enumerate(speedup.stream_to_feature(streams, flow)):
-
-                coords = ta.pixeltoworld(np.fliplr(np.int32(segment)), ds.transform, gdal=False)
-                dst.write({
-                    'type': 'Feature',
-                    'geometry': {'type': 'LineString', 'coordinates': coords},
-                    'properties': {
-                        'GID': current,
-                        'HEAD': 1 if head else 0,
-                        'ROW': row,
-                        'COL': col
-                    }
-                })
-
-def AggregateStreams(params):
+def AggregateStreams(params, processes=1):
     """
-    Aggregate Streams Shapefile
+    Extract stream segments from all tiles
+    and write them into one GeoPackage,
+    with a single bulk write of all features
     """
 
     # tile_index = tileindex()
@@ -125,7 +182,7 @@ def AggregateStreams(params):
     output = params.drainage_network.filename()
     # config.tileset().filename('dem-drainage-network')
 
-    driver = 'ESRI Shapefile'
+    driver = 'GPKG'
     schema = {
         'geometry': 'LineString',
         'properties': [
@@ -140,191 +197,225 @@ def AggregateStreams(params):
 
     gid = itertools.count(1)
 
-    with fiona.open(output, 'w', **options) as dst:
-        with click.progressbar(tileset.tiles(), length=len(tileset)) as iterator:
-            for tile in iterator:
-                row = tile.row
-                col = tile.col
-                
-                network_tile = params.drainage_network.tilename(row=row, col=col)
-                # config.tileset().tilename('dem-drainage-network', row=row, col=col)
-                
-                with fiona.open(network_tile) as fs:
-                    for feature in fs:
-                        feature['properties']['GID'] = next(gid)
-                        dst.write(feature)
+    arguments = [
+        (StreamSegmentsTileArgs, tile.row, tile.col, params, dict())
+        for tile in tileset.tiles()
+    ]
+
+    def features(iterator):
+
+        for row, col, coordinates, offsets, heads in iterator:
+            yield from SegmentFeatures(coordinates, offsets, heads, row, col, gid)
+
+    with Pool(processes=processes) as pool:
+
+        # keep results in tile order,
+        # so that GIDs do not depend on tile completion order
+        pooled = pool.imap(starcall, arguments)
+
+        with click.progressbar(pooled, length=len(arguments)) as iterator:
+            with fiona.open(output, 'w', **options) as dst:
+                dst.writerecords(features(iterator))
 
 # =============================
 # code to be reviewed below ...
 
-def AggregateStreamSegments():
+class SegmentChain():
     """
-    DOCME
+    Open chain of merged segments
     """
 
-    source = '/media/crousson/Backup/PRODUCTION/RGEALTI/RMC/RHT_RGE5M.gpkg'
-    layer = 'RHT_RGE5M_ALL'
-    output = '/media/crousson/Backup/PRODUCTION/RGEALTI/RMC/RHT_RGE5M_REGROUP.shp'
+    __slots__ = ('group', 'properties', 'coordinates', 'nodeb', 'count')
 
-    graph = dict()
-    indegree = Counter()
+    def __init__(self, group, properties, coordinates):
 
-    with fiona.open(source, layer=layer) as fs:
+        self.group = group
+        self.properties = properties
+        self.coordinates = list(coordinates)
+        self.nodeb = properties.get('NODEB')
+        self.count = 1
 
-        length = len(fs)
-
-        with click.progressbar(fs) as processing:
-            for feature in processing:
+class SegmentMerger():
+    """
+    Streaming merge of connected segments sharing the same group,
+    ie. (AXIS, ROW, COL), into chains.
+
+    Segment endpoints are snapped to a grid of size `precision`
+    and hashed together with the segment group,
+    so that a segment is connected in constant time
+    to the open chain ending where it starts,
+    and to the open chain starting where it ends.
+    As groups never span several tiles,
+    open chains are flushed whenever input moves to another tile,
+    and memory is bounded by the number of open chains of one tile.
+    """
 
-                a = feature['properties']['NODEA']
-                b = feature['properties']['NODEB']
-                axis = feature['properties']['AXIS']
-                row = feature['properties']['ROW']
-                col = feature['properties']['COL']
+    def __init__(self, precision=0.01):
 
-                graph[a] = [b, (axis, row, col), feature['id']]
-                indegree[b] += 1
+        self.precision = precision
+        self.heads = dict()
+        self.tails = dict()
+        self.chains = list()
+        self.tile = None
+        self.flushed = set()
+        self.duplicates = 0
+        self.unordered = 0
 
-        # schema['properties'].update(GID='int')
-        driver = 'ESRI Shapefile'
-        options = dict(driver=driver, crs=fs.crs, schema=fs.schema)
+    def snap(self, group, point):
+        """
+        Spatial hash key of `point` within `group`
+        """
 
-        def getgroup(node):
+        return (
+            group,
+            int(round(point[0] / self.precision)),
+            int(round(point[1] / self.precision))
+        )
 
-            if node in graph:
-                return graph[node][1]
+    def add(self, feature):
+        """
+        Add segment `feature`,
+        and yield chains completed before this segment
+        """
 
-            return None
+        properties = feature['properties']
+        coordinates = feature['geometry']['coordinates']
+        tile = (properties['ROW'], properties['COL'])
+        group = (properties['AXIS'],) + tile
 
-        def group_iterator():
+        if tile != self.tile:
 
-            stack = [node for node in graph if indegree[node] == 0]
-            processed = set()
+            yield from self.flush()
 
-            while stack:
+            if tile in self.flushed:
+                self.unordered += 1
 
-                node = stack.pop(0)
+            self.tile = tile
 
-                if not node in graph:
-                    continue
+        start = self.snap(group, coordinates[0])
+        end = self.snap(group, coordinates[-1])
 
-                if node in processed:
-                    continue
+        chain = self.tails.pop(start, None)
+        after = self.heads.pop(end, None)
 
-                processed.add(node)
-                current_nodes = [node]
+        if chain is None:
 
-                # move to downstream node
-                node, current_group, _ = graph[node]
+            chain = SegmentChain(group, dict(properties), coordinates)
+            self.heads[start] = chain
+            self.chains.append(chain)
 
-                while getgroup(node) == current_group:
+        else:
 
-                    current_nodes.append(node)
-                    indegree[node] -= 1
-                    processed.add(node)
+            chain.coordinates.extend(coordinates[1:])
+            chain.nodeb = properties.get('NODEB')
+            chain.count += 1
 
-                    # move to downstream node
-                    node = graph[node][0]
+        if after is not None and after is not chain:
 
-                # add terminal node to current track
-                current_nodes.append(node)
-                yield current_group, current_nodes
+            chain.coordinates.extend(after.coordinates[1:])
+            chain.nodeb = after.nodeb
+            chain.count += after.count
+            after.count = 0
 
-                # append node to stack for further processing
-                # in case we reached a confluence
-                # or a split between two tiles
+            end = self.snap(group, after.coordinates[-1])
 
-                indegree[node] -= 1
-                if indegree[node] == 0:
-                    stack.append(node)
+            if self.tails.get(end) is after:
+                self.tails[end] = chain
 
-        def group_iterator_reverse():
-            """
-            Would it be easier to write the iterator in the reverse order ?
-            """
+        elif after is None and end not in self.tails:
 
-            reverse_graph = defaultdict(list)
-            outdegree = Counter()
+            self.tails[end] = chain
 
-            for a, (b, group, fid) in graph.items():
-                reverse_graph[b].append((a, group, fid))
-                outdegree[a] += 1
+    def flush(self):
+        """
+        Yield open chains, in input order,
+        and count groups split into several chains
+        """
 
-            stack = list()
-            seen_edges = set()
+        groups = Counter()
 
-            for node in reverse_graph:
-                if outdegree[node] == 0:
-                    for upstream, group, _ in reverse_graph[node]:
-                        stack.append((node, group))
+        for chain in self.chains:
 
-            while stack:
+            if chain.count == 0:
+                continue
 
-                node, current_group = stack.pop()
-                current_nodes = [node]
+            groups[chain.group] += 1
+            yield chain
 
-                while node is not None:
+        self.duplicates += sum(1 for count in groups.values() if count > 1)
 
-                    next_node = None
+        if self.tile is not None:
+            self.flushed.add(self.tile)
 
-                    for upstream, group, _ in reverse_graph[node]:
+        self.heads = dict()
+        self.tails = dict()
+        self.chains = list()
 
-                        if group == current_group:
-                            current_nodes.append(upstream)
-                            seen_edges.add((upstream, group))
-                            next_node = upstream
-                        else:
-                            if (node, group) not in seen_edges:
-                                stack.append((node, group))
-                                seen_edges.add((node, group))
+def AggregateStreamSegments(
+        source='/media/crousson/Backup/PRODUCTION/RGEALTI/RMC/RHT_RGE5M.gpkg',
+        layer='RHT_RGE5M_ALL',
+        output='/media/crousson/Backup/PRODUCTION/RGEALTI/RMC/RHT_RGE5M_REGROUP.shp',
+        precision=0.01):
+    """
+    Merge connected segments of the same (AXIS, ROW, COL) group
+    into one LineString, in one streaming pass over `source`,
+    which is expected to list segments tile by tile,
+    as written by `AggregateStreams`.
+
+    Merged features keep the properties of their first segment,
+    with NODEB from their last segment,
+    and are written to `output` in bulk.
+    Groups split into several chains are reported,
+    which replaces a separate pass of `VerifyAggregateSegments`.
+    """
 
-                    node = next_node
+    merger = SegmentMerger(precision)
+    feature_count = 0
 
-                yield current_group, list(reversed(current_nodes))
+    with fiona.open(source, layer=layer) as fs:
 
-        feature_count = 0
+        length = len(fs)
+        driver = 'ESRI Shapefile'
+        options = dict(driver=driver, crs=fs.crs, schema=fs.schema)
 
-        with fiona.open(output, 'w', **options) as dst:
+        def chains(iterator):
 
-            with click.progressbar(group_iterator(), length=length) as processing:
-                for current, (group, nodes) in enumerate(processing):
+            for feature in iterator:
+                yield from merger.add(feature)
 
-                    # axis, row, col = group
-                    a = nodes[0]
-                    b = nodes[-1]
-                    coordinates = list()
+            yield from merger.flush()
 
-                    _, _, fid = graph[a]
-                    feature = fs.get(fid)
-                    properties = feature['properties']
-                    coordinates = feature['geometry']['coordinates']
-                    feature_count += 1
+        def features(iterator):
 
-                    for node in nodes[1:-1]:
+            nonlocal feature_count
 
-                        _, _, fid = graph[node]
-                        feature = fs.get(fid)
-                        coordinates.extend(feature['geometry']['coordinates'][1:])
-                        feature_count += 1
+            for current, chain in enumerate(chains(iterator)):
 
-                        # try:
-                        #     _, _, _, segment = graph[node]
-                        #     coordinates.extend(segment[1:])
-                        # except KeyError:
-                        #     pass
+                feature_count += chain.count
+                properties = chain.properties
+                properties.update(GID=current, NODEB=chain.nodeb)
 
-                    geometry = {
+                yield {
+                    'geometry': {
                         'type': 'LineString',
-                        'coordinates': coordinates
-                    }
+                        'coordinates': chain.coordinates
+                    },
+                    'properties': properties
+                }
+
+        with fiona.open(output, 'w', **options) as dst:
+            with click.progressbar(fs, length=length) as processing:
+                dst.writerecords(features(processing))
 
-                    properties.update(GID=current, NODEB=b)
-                    feature = dict(geometry=geometry, properties=properties)
+    if merger.duplicates:
+        click.secho('%d groups split into several chains' % merger.duplicates, fg='yellow')
 
-                    dst.write(feature)
-                    processing.update(len(nodes)-1)
+    if merger.unordered:
+        click.secho(
+            'Input is not ordered by tile, %d tiles appeared more than once' % merger.unordered,
+            fg='yellow')
 
-    assert(feature_count == length)
+    assert feature_count == length
 
 def VerifyAggregateSegments():
 
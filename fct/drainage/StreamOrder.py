@@ -0,0 +1,364 @@
+# coding: utf-8
+
+"""
+Raster stream order :
+Strahler order, Shreve magnitude, Hack order and upstream length
+of drainage pixels, from D8 flow direction and flow accumulation.
+
+Each tile is processed in one topological pass over its pixels.
+Tiles exchange stream outflows through the tile graph :
+Strahler order, Shreve magnitude and upstream length
+are propagated downstream, tile to tile,
+then Hack order is propagated upstream,
+reprocessing only tiles whose inflows or outflows changed.
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from multiprocessing import Pool
+
+import numpy as np
+
+import click
+import rasterio as rio
+
+from .. import speedup
+from ..cli import starcall
+from ..config import (
+    config,
+    DatasetParameter,
+    LiteralParameter
+)
+from .TileGraph import edges_from_outlets
+
+def tileindex():
+    """
+    Return default tileindex
+    """
+    return config.tileset().tileindex
+
+class Parameters():
+    """
+    Raster stream order parameters
+    """
+
+    flow = DatasetParameter('flow direction raster', type='input')
+    acc = DatasetParameter('accumulation raster (drainage area)', type='input')
+    output = DatasetParameter('stream order raster (strahler, shreve, hack, length)', type='output')
+
+    min_drainage = LiteralParameter(
+        'minimum drainage area for stream extraction expressed in square kilometers')
+    resolution = LiteralParameter('raster resolution, ie. pixel size, in real distance unit (eg. meters)')
+    max_iterations = LiteralParameter('maximum number of tile exchange iterations')
+
+    def __init__(self):
+        """
+        Default parameter values
+        """
+
+        self.flow = 'flow'
+        self.acc = 'acc'
+        self.output = 'stream-order'
+        self.min_drainage = 5.0
+        self.resolution = 5.0
+        self.max_iterations = 100
+
+def StreamOrderTile(row, col, params, inlets=None, exits=None, write=False, **kwargs):
+    """
+    Calculate stream order of tile (row, col)
+
+    Parameters
+    ----------
+
+    inlets: tuple (edges, values) or None
+        Stream outflows of neighbor tiles flowing into this tile,
+        as EDGE_DTYPE records and (strahler, shreve, length, acc, direction) values
+
+    exits: tuple (i, j, hack) or None
+        Known Hack order of tile stream exits
+
+    write: bool
+        Write stream order raster
+
+    Returns
+    -------
+
+    gid: int
+        Tile identifier
+
+    edges: array of EDGE_DTYPE records
+        Stream outflows to neighbor tiles
+
+    values: array (n, 5), dtype=float32
+        (strahler, shreve, length, acc, direction) of `edges`
+
+    inlet_hack: array, dtype=uint16
+        Hack order of the upstream pixel of each inlet record
+    """
+
+    gid = tileindex()[(row, col)].gid
+    flow_raster = params.flow.tilename(row=row, col=col, **kwargs)
+    acc_raster = params.acc.tilename(row=row, col=col, **kwargs)
+
+    with rio.open(flow_raster) as ds:
+
+        flow = ds.read(1)
+        profile = ds.profile.copy()
+        height, width = flow.shape
+
+    with rio.open(acc_raster) as ds:
+        acc = np.float32(ds.read(1))
+
+    if inlets is None:
+
+        inlet_pixels = None
+        inlet_values = None
+
+    else:
+
+        edges, inlet_values = inlets
+        inlet_pixels = np.int32(np.column_stack([edges['ti'], edges['tj']]))
+        inlet_values = np.float32(inlet_values)
+
+    if exits is None:
+
+        exit_pixels = None
+        exit_hack = None
+
+    else:
+
+        i, j, exit_hack = exits
+        exit_pixels = np.int32(np.column_stack([i, j]))
+        exit_hack = np.uint16(exit_hack)
+
+    strahler, shreve, hack, length, inlet_main, outlets, values = speedup.stream_order(
+        flow,
+        acc,
+        params.min_drainage,
+        params.resolution,
+        inlet_pixels,
+        inlet_values,
+        exit_pixels,
+        exit_hack)
+
+    if inlet_pixels is None:
+        inlet_hack = np.zeros(0, dtype='uint16')
+    else:
+        inlet_hack = hack[inlet_pixels[:, 0], inlet_pixels[:, 1]] + (1 - inlet_main)
+
+    edges, values, _ = edges_from_outlets(row, col, outlets, values, height, width)
+
+    if write:
+
+        output = params.output.tilename(row=row, col=col, **kwargs)
+
+        profile.update(
+            count=4,
+            dtype='float32',
+            nodata=0,
+            compress='deflate')
+
+        with rio.open(output, 'w', **profile) as dst:
+            dst.write(np.float32(strahler), 1)
+            dst.write(np.float32(shreve), 2)
+            dst.write(np.float32(hack), 3)
+            dst.write(length, 4)
+            dst.descriptions = ('STRAHLER', 'SHREVE', 'HACK', 'LENGTH')
+
+    return gid, edges, values, inlet_hack
+
+def GroupByTarget(outflows):
+    """
+    Group tile outflows by target tile
+
+    Parameters
+    ----------
+
+    outflows: dict
+        tile gid -> (edges, values)
+
+    Returns
+    -------
+
+    dict: tile gid -> (edges, values)
+    """
+
+    if not outflows:
+        return dict()
+
+    edges = np.concatenate([edges for edges, _ in outflows.values()])
+    values = np.concatenate([values for _, values in outflows.values()])
+
+    inlets = dict()
+
+    for gid in np.unique(edges['to_tile']):
+
+        selection = edges['to_tile'] == gid
+        inlets[int(gid)] = (edges[selection], values[selection])
+
+    return inlets
+
+def ExitHack(inlets, inlet_hack):
+    """
+    Dispatch Hack order of inlet records
+    to the exits of the tiles they come from
+
+    Parameters
+    ----------
+
+    inlets: dict
+        tile gid -> (edges, values) inflows
+
+    inlet_hack: dict
+        tile gid -> Hack order of inflow records
+
+    Returns
+    -------
+
+    dict: tile gid -> (i, j, hack)
+    """
+
+    edges = list()
+    hack = list()
+
+    for gid, (tile_edges, _) in inlets.items():
+        if gid in inlet_hack:
+            edges.append(tile_edges)
+            hack.append(inlet_hack[gid])
+
+    if not edges:
+        return dict()
+
+    edges = np.concatenate(edges)
+    hack = np.concatenate(hack)
+    exits = dict()
+
+    for gid in np.unique(edges['tile']):
+
+        selection = edges['tile'] == gid
+        exits[int(gid)] = (edges['i'][selection], edges['j'][selection], hack[selection])
+
+    return exits
+
+def SameInlets(a, b):
+    """
+    Return True if inflow records `a` and `b` are identical
+    """
+
+    if a is None or b is None:
+        return a is b
+
+    return (
+        np.array_equal(a[0], b[0]) and
+        np.array_equal(a[1], b[1])
+    )
+
+def StreamOrder(params, processes=1, **kwargs):
+    """
+    Calculate raster stream order across tiles
+
+    Tiles are first processed independently.
+    Stream outflows are then exchanged between tiles,
+    reprocessing tiles whose inflows changed,
+    until Strahler order, Shreve magnitude and upstream length
+    are stable. Hack order is then propagated upstream the same way,
+    before the final stream order tiles are written.
+    """
+
+    tile_index = tileindex()
+    tiles = {tile.gid: tile for tile in tile_index.values()}
+
+    def execute(arguments):
+
+        results = list()
+
+        with Pool(processes=processes) as pool:
+
+            pooled = pool.imap_unordered(starcall, arguments)
+
+            with click.progressbar(pooled, length=len(arguments)) as iterator:
+                for result in iterator:
+                    results.append(result)
+
+        return results
+
+    def tile_arguments(gids, inlets, exits, write=False):
+
+        return [
+            (
+                StreamOrderTile,
+                tiles[gid].row,
+                tiles[gid].col,
+                params,
+                dict(
+                    inlets=inlets.get(gid),
+                    exits=exits.get(gid),
+                    write=write,
+                    **kwargs)
+            )
+            for gid in gids
+            if gid in tiles
+        ]
+
+    click.secho('Calculate tile stream order', fg='cyan')
+
+    outflows = {
+        gid: (edges, values)
+        for gid, edges, values, _ in execute(tile_arguments(tiles, dict(), dict()))
+    }
+
+    inlets = GroupByTarget(outflows)
+    changed = set(inlets)
+    iteration = 0
+
+    while changed and iteration < params.max_iterations:
+
+        iteration += 1
+        click.secho('Propagate stream order downstream, iteration %d (%d tiles)' % (iteration, len(changed)), fg='cyan')
+
+        for gid, edges, values, _ in execute(tile_arguments(changed, inlets, dict())):
+            outflows[gid] = (edges, values)
+
+        previous = inlets
+        inlets = GroupByTarget(outflows)
+        changed = {
+            gid for gid in inlets
+            if not SameInlets(inlets[gid], previous.get(gid))
+        }
+
+    exits = dict()
+    inlet_hack = dict()
+    changed = set(tiles)
+    iteration = 0
+
+    while changed and iteration < params.max_iterations:
+
+        iteration += 1
+        click.secho('Propagate Hack order upstream, iteration %d (%d tiles)' % (iteration, len(changed)), fg='cyan')
+
+        for gid, _, _, hack in execute(tile_arguments(changed, inlets, exits)):
+            inlet_hack[gid] = hack
+
+        updated = ExitHack(inlets, inlet_hack)
+        changed = set()
+
+        for gid, (i, j, hack) in updated.items():
+
+            if gid in exits and np.array_equal(exits[gid][2], hack):
+                continue
+
+            exits[gid] = (i, j, hack)
+            changed.add(gid)
+
+    if changed:
+        click.secho('Maximum number of iterations reached', fg='yellow')
+
+    click.secho('Write stream order tiles', fg='cyan')
+    execute(tile_arguments(tiles, inlets, exits, write=True))
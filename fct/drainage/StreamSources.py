@@ -20,9 +20,7 @@ Sequence :
 """
 
 import os
-from collections import defaultdict, Counter
 import itertools
-from operator import itemgetter
 
 import numpy as np
 import click
@@ -35,6 +33,18 @@ from .. import speedup
 from .. import transform as fct
 from .. import terrain_analysis as ta
 from ..config import config
+from ..config.descriptors import DatasetResolver
+from .StreamNetwork import (
+    SegmentCoordinates,
+    SegmentFeatures
+)
+from .TileGraph import (
+    EDGE_DTYPE,
+    links_from_pixels,
+    load_graph,
+    accumulate_graph,
+    group_by_tile
+)
 
 def tileindex():
     """
@@ -42,96 +52,87 @@ def tileindex():
     """
     return config.tileset().tileindex
 
-def CreateSourcesGraph():
-    """
-    DOCME
+def TileSources(row, col):
     """
+    Connect mapped sources falling within tile (row, col)
+    to the tile exit of their flow path.
 
-    tile_index = tileindex()
-    dem_rasterfile = config.tileset().filename('dem')
-    sources = config.datasource('sources').filename
-    # sources = config.filename('sources-cartography') # filename ok
-
-    click.secho('Build sources graph', fg='cyan')
+    Returns
+    -------
 
-    graph = dict()
-    indegree = Counter()
+    edges: array of EDGE_DTYPE records
+        source -> pixel connections, with unit contribution,
+        and pixel -> tile outlet connections
+    """
 
-    dem = rio.open(dem_rasterfile)
+    tile = tileindex()[(row, col)]
+    sources = config.datasource('sources').filename
+    flow_raster = config.tileset().tilename('flow', row=row, col=col)
 
-    with click.progressbar(tile_index) as progress:
-        for row, col in progress:
+    edges = list()
+    links = list()
 
-            tile = tile_index[(row, col)].gid
-            inlet_shapefile = config.tileset().tilename('inlets', row=row, col=col)
-            flow_raster = config.tileset().tilename('flow', row=row, col=col)
+    with fiona.open(sources) as fs:
 
-            with rio.open(flow_raster) as ds:
+        features = list(fs.filter(bbox=tile.bounds))
 
-                flow = ds.read(1)
-                height, width = flow.shape
+    if not features:
+        return np.zeros(0, dtype=EDGE_DTYPE)
 
-                with fiona.open(inlet_shapefile) as fs:
-                    for feature in fs:
+    with rio.open(flow_raster) as ds:
 
-                        # connect outlet->inlet
+        flow = ds.read(1)
+        height, width = flow.shape
 
-                        from_tile = feature['properties']['FROM']
-                        area = 0.0
-                        from_i, from_j = dem.index(feature['properties']['FROMX'], feature['properties']['FROMY'])
-                        i, j = dem.index(*feature['geometry']['coordinates'])
-                        graph[(from_tile, from_i, from_j)] = (tile, i, j, area)
-                        indegree[(tile, i, j)] += 1
+        for feature in features:
 
-                        # connect inlet->tile outlet
+            i, j = ds.index(*feature['geometry']['coordinates'])
 
-                        loci, locj = ds.index(*feature['geometry']['coordinates'])
-                        locti, loctj = ta.outlet(flow, loci, locj)
-                        ti, tj = dem.index(*ds.xy(locti, loctj))
+            if not all([i >= 0, i < height, j >= 0, j < width]):
+                continue
 
-                        if (locti, loctj) == (loci, locj):
-                            continue
-                        
-                        if ti >= 0 and tj >= 0:
-                            graph[(tile, i, j)] = (tile, ti, tj, 0)
-                            indegree[(tile, ti, tj)] += 1
+            # connect exterior->inlet
 
-                with fiona.open(sources) as fs:
-                    for feature in fs:
+            edges.append((-1, -1, -1, tile.gid, i, j, 1.0))
 
-                        loci, locj = ds.index(*feature['geometry']['coordinates'])
+            # connect inlet->tile outlet
 
-                        if not all([loci >= 0, loci < height, locj >= 0, locj < width]):
-                            continue
+            ti, tj = ta.outlet(flow, i, j)
 
-                        # connect exterior->inlet
+            if (ti, tj) != (i, j):
+                links.append((i, j, ti, tj))
 
-                        i, j = dem.index(*feature['geometry']['coordinates'])
-                        area = 1.0
-                        graph[(-2, i-1, j-1)] = (tile, i, j, area)
-                        indegree[(tile, i, j)] += 1
+    return np.concatenate([
+        np.array(edges, dtype=EDGE_DTYPE),
+        links_from_pixels(row, col, np.array(links, dtype=np.int32).reshape(-1, 4))
+    ])
 
-                        # connect inlet->tile outlet
+def CreateSourcesGraph():
+    """
+    Concatenate tile outlets graph records
+    with mapped sources connections
+    """
 
-                        locti, loctj = ta.outlet(flow, loci, locj)
+    tile_index = tileindex()
 
-                        if (locti, loctj) == (loci, locj):
-                            continue
+    click.secho('Build sources graph', fg='cyan')
 
-                        ti, tj = dem.index(*ds.xy(locti, loctj))
-                        
-                        if ti >= 0 and tj >= 0:
-                            graph[(tile, i, j)] = (tile, ti, tj, 0)
-                            indegree[(tile, ti, tj)] += 1
+    edges, _, _ = load_graph(DatasetResolver('outlets'))
+    edges = edges[edges['tile'] >= 0]
+    edges['area'] = 0.0
+    sources = [edges]
 
+    with click.progressbar(tile_index) as progress:
+        for row, col in progress:
+            sources.append(TileSources(row, col))
 
-    dem.close()
+    edges = np.concatenate(sources)
 
-    click.secho('Created graph with %d nodes' % len(graph), fg='green')
+    click.secho('Created graph with %d edges' % len(edges), fg='green')
 
-    return graph, indegree
+    return edges
 
-def TileInletSources(tile, keys, areas):
+def TileInletSources(tile, i, j, areas):
     """
     Output inlet points,
     attributed with the total upstream drained area.
@@ -156,26 +157,22 @@ def TileInletSources(tile, keys, areas):
     }
     options = dict(driver=driver, crs=crs, schema=schema)
 
-    dem_file = config.tileset().filename('dem')
-    dem = rio.open(dem_file)
+    flow_raster = config.tileset().tilename('flow', row=row, col=col)
 
-    cum_areas = defaultdict(lambda: 0.0)
+    with rio.open(flow_raster) as ds:
+        transform = ds.transform
 
-    for key in keys:
-        cum_areas[key[1:]] += areas.get(key[1:], 0)
+    selection = areas > 0.0
+    x, y = transform * (j[selection] + 0.5, i[selection] + 0.5)
 
     with fiona.open(output, 'w', **options) as dst:
-        for i, j in cum_areas:
-
-            x, y = dem.xy(i, j)
-            area = cum_areas[i, j]
-            if area > 0.0:
-                geom = {'type': 'Point', 'coordinates': [x, y]}
-                props = {'TILE': gid}
-                feature = {'geometry': geom, 'properties': props}
-                dst.write(feature)
-
-    dem.close()
+        dst.writerecords(
+            {
+                'geometry': {'type': 'Point', 'coordinates': [float(px), float(py)]},
+                'properties': {'TILE': gid}
+            }
+            for px, py in zip(x, y)
+        )
 
 
 def InletSources():
@@ -188,21 +185,20 @@ def InletSources():
     tile_index = tileindex()
     tiles = {tile.gid: tile for tile in tile_index.values()}
 
-    graph, indegree = CreateSourcesGraph()
+    edges = CreateSourcesGraph()
 
     click.secho('Accumulate areas', fg='cyan')
-    areas, res = speedup.graph_acc(graph)
-
-    keys = sorted(graph.keys() | indegree.keys(), key=itemgetter(0))
-    groups = itertools.groupby(keys, key=itemgetter(0))
+    keys, values = accumulate_graph(edges)
 
     click.secho('Write inlet shapefiles', fg='cyan')
+    groups = group_by_tile(keys, values[:, 0])
+
     with click.progressbar(groups, length=len(tile_index)) as iterator:
-        for tile_gid, keys in iterator:
+        for tile_gid, i, j, areas in iterator:
 
             if tile_gid in tiles:
                 tile = tiles[tile_gid]
-                TileInletSources(tile, keys, areas)
+                TileInletSources(tile, i, j, areas)
 
 def StreamToFeatureFromSources(row, col, min_drainage):
     """
@@ -266,21 +262,13 @@ def StreamToFeatureFromSources(row, col, min_drainage):
                     i = i + ci[n]
                     j = j + cj[n]
 
-        with fiona.open(output, 'w', **options) as dst:
-
-            for current, (segment, head) in enumerate(speedup.stream_to_feature(streams, flow)):
+        pixels, offsets, heads = speedup.stream_segments(streams, flow)
+        coordinates = SegmentCoordinates(pixels, ds.transform)
 
-                coords = ta.pixeltoworld(np.fliplr(np.int32(segment)), ds.transform, gdal=False)
-                dst.write({
-                    'type': 'Feature',
-                    'geometry': {'type': 'LineString', 'coordinates': coords},
-                    'properties': {
-                        'GID': current,
-                        'HEAD': 1 if head else 0,
-                        'ROW': row,
-                        'COL': col
-                    }
-                })
+        with fiona.open(output, 'w', **options) as dst:
+            dst.writerecords(SegmentFeatures(
+                coordinates, offsets, heads,
+                row, col, itertools.count(0)))
 
 def AggregateStreamsFromSources():
     """
@@ -360,18 +348,13 @@ def NoFlowPixels(row, col, min_drainage):
 
                 coordinates = np.array(feature['geometry']['coordinates'], dtype='float32')
                 pixels = fct.worldtopixel(coordinates, ds.transform)
-                
-                for i, j in pixels:
-                    if 0 <= i < height and 0 <= j < width:
-                        streams[i, j] = 1
 
-                # pixels = np.array([
-                #     (i, j)
-                #     for i, j in fct.worldtopixel(coordinates, ds.transform)
-                #     if 0 <= i < height and 0 <= j < width
-                # ])
+                inside = (
+                    (pixels[:, 0] >= 0) & (pixels[:, 0] < height) &
+                    (pixels[:, 1] >= 0) & (pixels[:, 1] < width)
+                )
 
-                # streams[pixels[:, 0], pixels[:, 1]] = 1
+                streams[pixels[inside, 0], pixels[inside, 1]] = 1
 
         with fiona.open(output, 'w', **options) as dst:
 
@@ -0,0 +1,603 @@
+# coding: utf-8
+
+"""
+Tile Graph :
+binary exchange of outlet/inlet connections between tiles.
+
+Each tile stores its connections as compact edge records
+(from-tile, i, j, to-tile, ti, tj, area),
+where (i, j) and (ti, tj) are pixel coordinates
+local to the tile they belong to.
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+import numpy as np
+import click
+
+from .. import speedup
+from ..config import config
+
+EDGE_DTYPE = np.dtype([
+    ('tile', 'int32'),
+    ('i', 'int32'),
+    ('j', 'int32'),
+    ('to_tile', 'int32'),
+    ('ti', 'int32'),
+    ('tj', 'int32'),
+    ('area', 'float32')
+])
+
+#: neighbor tile offsets (di, dj)
+NEIGHBORS = [(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if (di, dj) != (0, 0)]
+
+def tileindex():
+    """
+    Return default tileindex
+    """
+    return config.tileset().tileindex
+
+def tile_shape():
+    """
+    Return (height, width) of tiles in default tileset
+    """
+
+    tileset = config.tileset()
+    return tileset.height, tileset.width
+
+def node_keys(tile, i, j):
+    """
+    Encode (tile, i, j) pixel coordinates
+    into unique int64 node identifiers
+    """
+
+    height, width = tile_shape()
+
+    return (
+        np.int64(tile) * (height * width) +
+        np.int64(i) * width +
+        np.int64(j)
+    )
+
+def decode_keys(keys):
+    """
+    Decode int64 node identifiers
+    into (tile, i, j) pixel coordinates
+    """
+
+    height, width = tile_shape()
+    tile, pixel = np.divmod(keys, height * width)
+    i, j = np.divmod(pixel, width)
+
+    return tile, i, j
+
+def edges_from_outlets(row, col, outlets, areas, height, width, exterior=False):
+    """
+    Translate tile outlets' targets, which lie outside of tile,
+    into inlet pixels of neighbor tiles.
+
+    Parameters
+    ----------
+
+    outlets: array (n, 4)
+        (i, j, ti, tj) as returned by `speedup.tile_outlet_graph`
+
+    areas: array (n, bands)
+        local contributions accumulated at each outlet
+
+    exterior: bool
+        Keep outlets flowing outside of tileset,
+        with a negative `to_tile`
+
+    Returns
+    -------
+
+    edges: array of EDGE_DTYPE records
+        outlet -> inlet connections,
+        with `area` set to the first band of `areas`
+
+    weights: array (m, bands)
+        contributions of each connection
+
+    skipped: int
+        number of outlets flowing outside of tileset
+    """
+
+    tile_index = tileindex()
+    gid = tile_index[(row, col)].gid
+    areas = np.asarray(areas, dtype=np.float32)
+
+    if areas.ndim < 2:
+        # one value per outlet
+        areas = areas.reshape(-1, 1)
+
+    ti = outlets[:, 2]
+    tj = outlets[:, 3]
+    di = np.where(ti < 0, -1, np.where(ti >= height, 1, 0))
+    dj = np.where(tj < 0, -1, np.where(tj >= width, 1, 0))
+
+    edges = np.zeros(len(outlets), dtype=EDGE_DTYPE)
+    edges['tile'] = gid
+    edges['i'] = outlets[:, 0]
+    edges['j'] = outlets[:, 1]
+    edges['to_tile'] = -1
+    edges['ti'] = ti - di*height
+    edges['tj'] = tj - dj*width
+
+    if areas.shape[1] > 0:
+        edges['area'] = areas[:, 0]
+
+    for ni, nj in NEIGHBORS:
+        if (row+ni, col+nj) in tile_index:
+            edges['to_tile'][(di == ni) & (dj == nj)] = tile_index[(row+ni, col+nj)].gid
+
+    connected = edges['to_tile'] >= 0
+
+    if exterior:
+        return edges, areas, np.sum(~connected)
+
+    return edges[connected], areas[connected], np.sum(~connected)
+
+def links_from_pixels(row, col, links):
+    """
+    Convert (i, j, oi, oj) in-tile connections
+    into EDGE_DTYPE records with no contribution
+    """
+
+    gid = tileindex()[(row, col)].gid
+
+    records = np.zeros(len(links), dtype=EDGE_DTYPE)
+    records['tile'] = gid
+    records['i'] = links[:, 0]
+    records['j'] = links[:, 1]
+    records['to_tile'] = gid
+    records['ti'] = links[:, 2]
+    records['tj'] = links[:, 3]
+
+    return records
+
+def write_tile_graph(filename, edges, links, transform, weights=None):
+    """
+    Save tile edge records
+
+    Parameters
+    ----------
+
+    edges: array of EDGE_DTYPE records
+        connections leaving the tile
+
+    links: array of EDGE_DTYPE records
+        in-tile connections from border pixels to tile exits
+
+    transform: rasterio Affine transform
+        tile geotransform
+
+    weights: array (n, bands), optional
+        multiband contributions of `edges`,
+        defaults to edges' `area`
+    """
+
+    if weights is None:
+        weights = edges['area'].reshape(-1, 1)
+
+    np.savez(
+        filename,
+        edges=edges,
+        weights=np.float32(weights),
+        links=links,
+        transform=np.array(transform.to_gdal()))
+
+def load_graph(dataset, tileset='default'):
+    """
+    Load and concatenate tile edge records from `dataset` tiles.
+    Only in-tile links starting from a tile inlet are retained.
+
+    Returns
+    -------
+
+    edges: array of EDGE_DTYPE records
+        outlet -> inlet and inlet -> outlet connections
+
+    weights: array (n, bands), dtype=float64
+        contributions of each connection,
+        in-tile links have no contribution
+
+    transforms: dict
+        tile gid -> tile geotransform (GDAL order)
+    """
+
+    tile_index = config.tileset(tileset).tileindex
+    edges = list()
+    weights = list()
+    transforms = dict()
+
+    with click.progressbar(tile_index) as iterator:
+        for row, col in iterator:
+
+            filename = dataset.tilename(row=row, col=col, tileset=tileset)
+
+            if os.path.exists(filename):
+                with np.load(filename) as data:
+                    edges.append(data['edges'])
+                    weights.append(data['weights'])
+                    transforms[tile_index[(row, col)].gid] = data['transform']
+
+    if not edges:
+        return np.zeros(0, dtype=EDGE_DTYPE), np.zeros((0, 1)), transforms
+
+    edges = np.concatenate(edges)
+    weights = np.float64(np.concatenate(weights))
+    inlets = np.unique(node_keys(edges['to_tile'], edges['ti'], edges['tj']))
+    links = list()
+
+    for row, col in tile_index:
+
+        filename = dataset.tilename(row=row, col=col, tileset=tileset)
+
+        if os.path.exists(filename):
+            with np.load(filename) as data:
+                tile_links = data['links']
+                keys = node_keys(tile_links['tile'], tile_links['i'], tile_links['j'])
+                links.append(tile_links[np.isin(keys, inlets)])
+
+    links = np.concatenate(links)
+    edges = np.concatenate([edges, links])
+    weights = np.concatenate([weights, np.zeros((len(links), weights.shape[1]))])
+
+    return edges, weights, transforms
+
+def accumulate_graph(edges, weights=None):
+    """
+    Accumulate edge contributions along the tile graph,
+    with one array-based topological pass.
+
+    Parameters
+    ----------
+
+    edges: array of EDGE_DTYPE records
+        Records with a negative `tile` are external contributions,
+        and each of them is treated as a distinct source node.
+
+    weights: array (n, bands), optional
+        Edge contributions, defaults to edges' `area`
+
+    Returns
+    -------
+
+    keys: array (nodes,), dtype=int64
+        sorted node identifiers
+
+    values: array (nodes, bands), dtype=float64
+        cumulative contribution received by each node
+    """
+
+    if weights is None:
+        weights = edges['area']
+
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.ndim == 1:
+        weights = weights.reshape(-1, 1)
+
+    sources = node_keys(edges['tile'], edges['i'], edges['j'])
+    external = edges['tile'] < 0
+    sources[external] = -1 - np.arange(np.sum(external), dtype=np.int64)
+    targets = node_keys(edges['to_tile'], edges['ti'], edges['tj'])
+
+    n = len(edges)
+    keys, inverse = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+
+    successors = np.full(len(keys), -1, dtype=np.intp)
+    successors[inverse[:n]] = inverse[n:]
+
+    node_weights = np.zeros((len(keys), weights.shape[1]), dtype=np.float64)
+    node_weights[inverse[:n]] = weights
+
+    values = speedup.tree_acc(successors, node_weights)
+
+    return keys, values
+
+def inlet_contributions(edges, weights=None):
+    """
+    Accumulate edge contributions along the tile graph,
+    and sum what flows into each tile inlet
+    through connections coming from outside of tile.
+
+    Contributions received from other inlets of the same tile
+    through in-tile links are not included,
+    as they are accumulated again within the tile.
+
+    Parameters
+    ----------
+
+    edges: array of EDGE_DTYPE records
+        as for `accumulate_graph`
+
+    weights: array (n, bands), optional
+        Edge contributions, defaults to edges' `area`
+
+    Returns
+    -------
+
+    keys: array (inlets,), dtype=int64
+        sorted inlet node identifiers
+
+    values: array (inlets, bands), dtype=float64
+        contribution flowing into each inlet
+    """
+
+    if weights is None:
+        weights = edges['area']
+
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.ndim == 1:
+        weights = weights.reshape(-1, 1)
+
+    keys, values = accumulate_graph(edges, weights)
+
+    crossing = edges['tile'] != edges['to_tile']
+    edges = edges[crossing]
+    contributions = weights[crossing]
+
+    internal = edges['tile'] >= 0
+    sources = np.searchsorted(keys, node_keys(edges['tile'], edges['i'], edges['j'])[internal])
+    contributions[internal] += values[sources]
+
+    inlets, inverse = np.unique(
+        node_keys(edges['to_tile'], edges['ti'], edges['tj']),
+        return_inverse=True)
+
+    inlet_values = np.zeros((len(inlets), weights.shape[1]), dtype=np.float64)
+    np.add.at(inlet_values, inverse, contributions)
+
+    return inlets, inlet_values
+
+def group_by_tile(keys, values):
+    """
+    Split node values by tile
+
+    Returns
+    -------
+
+    Generator of (tile gid, i, j, values) tuples,
+    with (i, j) pixel coordinates local to tile
+    """
+
+    tiles, i, j = decode_keys(keys)
+    order = np.argsort(tiles, kind='stable')
+    tiles = tiles[order]
+    gids, starts = np.unique(tiles, return_index=True)
+    ends = np.append(starts[1:], len(tiles))
+
+    for gid, start, end in zip(gids, starts, ends):
+
+        if gid < 0:
+            continue
+
+        index = order[start:end]
+        yield int(gid), i[index], j[index], values[index]
+
+def resolve_upstream(edges, keys, values):
+    """
+    Propagate node values upstream along the tile graph :
+    each node without value takes the value
+    of the first node having a value downstream.
+
+    Resolution uses vectorized pointer jumping,
+    which takes a number of steps logarithmic
+    in the length of the longest flow path.
+
+    Parameters
+    ----------
+
+    edges: array of EDGE_DTYPE records
+        Records with a negative `tile` are ignored
+
+    keys: array, dtype=int64
+        node identifiers having a value
+
+    values: array, same length as `keys`
+        non-zero node values
+
+    Returns
+    -------
+
+    nodes: array (nodes,), dtype=int64
+        sorted node identifiers
+
+    node_values: array (nodes,)
+        resolved value of each node, 0 if not resolved
+    """
+
+    edges = edges[edges['tile'] >= 0]
+    sources = node_keys(edges['tile'], edges['i'], edges['j'])
+    targets = node_keys(edges['to_tile'], edges['ti'], edges['tj'])
+
+    n = len(edges)
+    nodes, inverse = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+
+    successors = np.full(len(nodes), -1, dtype=np.intp)
+    successors[inverse[:n]] = inverse[n:]
+
+    node_values = np.zeros(len(nodes), dtype=np.asarray(values).dtype)
+
+    if len(nodes) > 0 and len(keys) > 0:
+
+        index = np.minimum(np.searchsorted(nodes, keys), len(nodes)-1)
+        known = nodes[index] == keys
+        node_values[index[known]] = np.asarray(values)[known]
+
+    pointers = np.where(node_values == 0, successors, -1)
+
+    while True:
+
+        active = np.flatnonzero((node_values == 0) & (pointers >= 0))
+
+        if active.size == 0:
+            break
+
+        next_nodes = pointers[active]
+        next_values = node_values[next_nodes]
+        next_pointers = pointers[next_nodes]
+
+        node_values[active] = next_values
+        pointers[active] = np.where(next_values == 0, next_pointers, -1)
+
+    return nodes, node_values
+
+def resolve_downstream_sum(edges, weights=None, max_steps=64):
+    """
+    Sum edge weights downstream along the tile graph,
+    from each node to the root of its flow path,
+    such as the distance from each node to its outlet.
+
+    Resolution uses vectorized pointer jumping (list ranking),
+    which takes a number of steps logarithmic
+    in the length of the longest flow path.
+
+    Parameters
+    ----------
+
+    edges: array of EDGE_DTYPE records
+        Records with a negative `to_tile` leave the graph :
+        their weight is counted, but their target is not a node.
+
+    weights: array (n,), optional
+        Edge weights, defaults to edges' `area`
+
+    max_steps: int
+        Maximum number of pointer jumping steps,
+        guarding against cycles
+
+    Returns
+    -------
+
+    nodes: array (nodes,), dtype=int64
+        sorted node identifiers
+
+    node_values: array (nodes,), dtype=float64
+        sum of edge weights from each node to its root
+    """
+
+    if weights is None:
+        weights = edges['area']
+
+    weights = np.asarray(weights, dtype=np.float64)
+
+    sources = node_keys(edges['tile'], edges['i'], edges['j'])
+    leaving = edges['to_tile'] < 0
+    targets = node_keys(edges['to_tile'], edges['ti'], edges['tj'])[~leaving]
+
+    n = len(edges)
+    nodes, inverse = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+
+    successors = np.full(len(nodes), -1, dtype=np.intp)
+    successors[inverse[:n][~leaving]] = inverse[n:]
+
+    node_values = np.zeros(len(nodes), dtype=np.float64)
+    node_values[inverse[:n]] = weights
+
+    for _ in range(max_steps):
+
+        active = np.flatnonzero(successors >= 0)
+
+        if active.size == 0:
+            break
+
+        next_nodes = successors[active]
+        node_values[active] += node_values[next_nodes]
+        successors[active] = successors[next_nodes]
+
+    else:
+
+        click.secho('Unresolved nodes, flow graph may contain cycles', fg='yellow')
+
+    return nodes, node_values
+
+def resolve_downstream_reference(edges, weights, nodata, max_steps=64):
+    """
+    Resolve the first reference node downstream of each node
+    along the tile graph, summing path lengths
+    and taking the maximum of path peaks on the way.
+
+    Resolution uses vectorized pointer jumping (list ranking),
+    which takes a number of steps logarithmic
+    in the length of the longest flow path.
+
+    Parameters
+    ----------
+
+    edges: array of EDGE_DTYPE records
+        Records with a negative `to_tile` leave the graph :
+        their target is not a node.
+
+    weights: array (n, 3)
+        (length, peak, value) of each edge,
+        where `value` is the reference value of edge target,
+        or `nodata` if target is not a reference node.
+        Edges with a reference value do not lead to another node.
+
+    nodata: float
+        No data value for reference values
+
+    max_steps: int
+        Maximum number of pointer jumping steps,
+        guarding against cycles
+
+    Returns
+    -------
+
+    nodes: array (nodes,), dtype=int64
+        sorted node identifiers
+
+    node_weights: array (nodes, 3), dtype=float64
+        (length, peak, value) from each node to its reference node,
+        with value set to `nodata` if no reference node
+        is found downstream
+    """
+
+    weights = np.asarray(weights, dtype=np.float64).reshape(-1, 3)
+
+    sources = node_keys(edges['tile'], edges['i'], edges['j'])
+    leaving = (edges['to_tile'] < 0) | (weights[:, 2] != nodata)
+    targets = node_keys(edges['to_tile'], edges['ti'], edges['tj'])[~leaving]
+
+    n = len(edges)
+    nodes, inverse = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+
+    successors = np.full(len(nodes), -1, dtype=np.intp)
+    successors[inverse[:n][~leaving]] = inverse[n:]
+
+    lengths = np.zeros(len(nodes), dtype=np.float64)
+    peaks = np.full(len(nodes), -np.inf, dtype=np.float64)
+    values = np.full(len(nodes), nodata, dtype=np.float64)
+    lengths[inverse[:n]] = weights[:, 0]
+    peaks[inverse[:n]] = weights[:, 1]
+    values[inverse[:n]] = weights[:, 2]
+
+    for _ in range(max_steps):
+
+        active = np.flatnonzero(successors >= 0)
+
+        if active.size == 0:
+            break
+
+        next_nodes = successors[active]
+        lengths[active] += lengths[next_nodes]
+        peaks[active] = np.maximum(peaks[active], peaks[next_nodes])
+        values[active] = values[next_nodes]
+        successors[active] = successors[next_nodes]
+
+    else:
+
+        click.secho('Unresolved nodes, flow graph may contain cycles', fg='yellow')
+        values[successors >= 0] = nodata
+
+    return nodes, np.column_stack([lengths, peaks, values])
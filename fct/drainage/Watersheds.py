@@ -14,8 +14,7 @@ Watershed Analysis
 """
 
 import os
-import itertools
-from operator import itemgetter
+from functools import partial
 from multiprocessing import Pool
 
 import numpy as np
@@ -23,6 +22,7 @@ import click
 
 import rasterio as rio
 from rasterio import features
+from rasterio.transform import rowcol
 import fiona
 import fiona.crs
 from shapely.geometry import asShape
@@ -34,9 +34,19 @@ from ..config import (
     LiteralParameter
 )
 from ..cli import starcall
-from .. import terrain_analysis as ta
 from .. import speedup
 from ..tileio import PadRaster
+from ..spillover import (
+    SpilloverTile,
+    IterateSpillovers,
+    border_pixels
+)
+from .TileGraph import (
+    load_graph,
+    node_keys,
+    decode_keys,
+    resolve_upstream
+)
 
 class Parameters():
     """
@@ -48,6 +58,11 @@ class Parameters():
     watershed_raster = DatasetParameter('watershed raster', type='output')
     watershed_polygon = DatasetParameter('watershed polygons', type='output')
 
+    outlets = DatasetParameter('tile outlets graph records (npz)', type='input')
+    network = DatasetParameter('drainage network with AXIS attribute, for batch labelling', type='input')
+    watershed_labels = DatasetParameter('batch watershed label raster', type='output')
+    watershed_table = DatasetParameter('batch watershed label to axis table (CSV)', type='output')
+
     def __init__(self):
         """
         Default paramater values
@@ -58,98 +73,107 @@ class Parameters():
         self.watershed_raster = 'ax_watershed_raster'
         self.watershed_polygon = 'ax_watershed'
 
+        self.outlets = 'outlets'
+        self.network = 'streams'
+        self.watershed_labels = 'watershed-labels'
+        self.watershed_table = 'watershed-labels-table'
+
 def tileindex():
     """
     Return default tileindex
     """
     return config.tileset().tileindex
 
-def border(height, width):
+class WatershedState(SpilloverTile):
     """
-    Generate a sequence of pixel (row, col)
-    over the border of an array of shape (height, width)
+    Watershed labeling state of one tile,
+    padded with a one-pixel border from neighboring tiles
     """
 
-    offset = 0
-    for i in (0, height-1):
-        for j in range(offset, width+offset-1):
-            yield i, j
-        offset = 1
+    fields = [
+        ('value', 'float32')
+    ]
 
-    offset = 1
-    for j in (0, width-1):
-        for i in range(offset, height+offset-1):
-            yield i, j
-        offset = 0
+    def __init__(self, row, col, axis, params):
 
-def WatershedTile(axis, row, col, params, seeds, tmp=''):
-    """
-    seeds: (x, y, value, distance)
-    """
+        super().__init__(row, col)
+        self.axis = axis
+        self.params = params
 
-    flow, profile = PadRaster(row, col, params.flow.name, padding=1)
-    transform = profile['transform']
-    destination = params.watershed_raster.tilename(axis=axis, row=row, col=col)
-    # config.tileset().tilename('ax_watershed_raster', row=row, col=col, axis=axis)
-    height, width = flow.shape
+    def load(self):
 
-    if os.path.exists(destination):
-        # with rio.open(destination) as ds:
-        #     ds.read(1, out=out[1:-1, 1:-1])
-        data, _ = PadRaster(row, col, params.watershed_raster.name, padding=1, axis=axis)
-    else:
-        data = np.zeros_like(flow, dtype='float32')
-
-    out = np.copy(data)
-    coord = itemgetter(0, 1)
-    value = itemgetter(2)
-    pixels = ta.worldtopixel(np.array([coord(seed) for seed in seeds], dtype='float32'), transform, gdal=False)
-    values = np.array([value(seed) for seed in seeds], dtype='float32')
-    out[pixels[:, 0], pixels[:, 1]] = values
-    # ta.watershed(flow, out, 0)
-    speedup.watershed(flow, out, 0)
-
-    spillover = list()
-    for i, j in border(height, width):
-        if data[i, j] == 0 and out[i, j] != 0:
-            spillover.append((i, j))
-
-    def attribute(p):
-        """
-        Returns value, dest. row, dest. col for pixel (i, j)
-        """
+        row = self.row
+        col = self.col
+        params = self.params
 
-        i, j = p
+        if not os.path.exists(config.tileset().tilename(params.flow.name, row=row, col=col)):
+            return False
 
-        if i == 0:
-            prow = row - 1
-        elif i == height-1:
-            prow = row + 1
-        else:
-            prow = row
+        flow, profile = PadRaster(row, col, params.flow.name, padding=1)
+        destination = params.watershed_raster.tilename(axis=self.axis, row=row, col=col)
+        # config.tileset().tilename('ax_watershed_raster', row=row, col=col, axis=axis)
 
-        if j == 0:
-            pcol = col - 1
-        elif j == width-1:
-            pcol = col + 1
+        if os.path.exists(destination):
+            data, _ = PadRaster(row, col, params.watershed_raster.name, padding=1, axis=self.axis)
         else:
-            pcol = col
+            data = np.zeros_like(flow, dtype='float32')
+
+        self.flow = flow
+        self.data = data
+        self.out = np.copy(data)
+        self.profile = profile
+        self.transform = profile['transform']
+        self.height, self.width = flow.shape
+
+        return True
+
+    def seed(self, seeds):
+
+        pixels, intile = self.seed_pixels(seeds)
+        values = seeds['value'][intile]
 
-        return out[p], prow, pcol
+        changed = self.out[pixels[:, 0], pixels[:, 1]] != values
+        self.out[pixels[:, 0], pixels[:, 1]] = values
 
-    if spillover:
-        points = ta.pixeltoworld(np.array(spillover, dtype='int32'), transform, gdal=False)
-        spillover = [tuple(points[k]) + attribute(p) for k, p in enumerate(spillover)]
+        return int(np.sum(changed))
 
-    out = out[1:-1, 1:-1]
-    height, width = out.shape
-    transform = transform * transform.translation(1, 1)
-    profile.update(dtype='float32', height=height, width=width, transform=transform, nodata=0)
+    def run(self):
 
-    with rio.open(destination + tmp, 'w', **profile) as dst:
-        dst.write(out, 1)
+        data = self.data
+        out = self.out
 
-    return spillover, destination + tmp
+        # ta.watershed(flow, out, 0)
+        speedup.watershed(self.flow, out, 0)
+
+        pixels = border_pixels(self.height, self.width)
+        pixels = pixels[
+            (data[pixels[:, 0], pixels[:, 1]] == 0) &
+            (out[pixels[:, 0], pixels[:, 1]] != 0)
+        ]
+
+        self.data = np.copy(out)
+
+        return self.spillovers(
+            pixels,
+            value=out[pixels[:, 0], pixels[:, 1]])
+
+    def save(self, suffix=''):
+
+        destination = str(self.params.watershed_raster.tilename(
+            axis=self.axis,
+            row=self.row,
+            col=self.col)) + suffix
+
+        out = self.out[1:-1, 1:-1]
+        height, width = out.shape
+        transform = self.transform * self.transform.translation(1, 1)
+        profile = self.profile.copy()
+        profile.update(dtype='float32', height=height, width=width, transform=transform, nodata=0)
+
+        with rio.open(destination, 'w', **profile) as dst:
+            dst.write(out, 1)
+
+        return [destination]
 
 def VectorizeTile(axis, row, col, params):
     """
@@ -247,60 +271,6 @@ def VectorizeWatershed(axis, params, processes=1):
                             }
                             dst.write(feature)
 
-def print_spillover_tiles(spillover):
-
-    tile = itemgetter(3, 4)
-    tiles = set([tile(s) for s in spillover])
-    print(tiles)
-
-def WatershedStep(spillover, axis, params, processes=1):
-
-    xy = itemgetter(0, 1)
-    value = itemgetter(2)
-    tile = itemgetter(3, 4)
-
-    spillover = sorted(spillover, key=tile)
-    tiles = itertools.groupby(spillover, key=tile)
-
-    g_spillover = list()
-    tmpfiles = list()
-
-    if processes == 1:
-
-        for (row, col), seeds in tiles:
-            seeds = [xy(seed) + (value(seed),) for seed in seeds]
-            t_spillover, tmpfile = WatershedTile(axis, row, col, params, seeds, tmp='.tmp')
-            g_spillover.extend(t_spillover)
-            tmpfiles.append(tmpfile)
-
-        for tmpfile in tmpfiles:
-            os.rename(tmpfile, tmpfile.replace('.tif.tmp', '.tif'))
-
-    else:
-
-        kwargs = {'tmp': '.tmp'}
-        arguments = list()
-
-        for (row, col), seeds in tiles:
-            seeds = [xy(seed) + (value(seed),) for seed in seeds]
-            arguments.append((WatershedTile, axis, row, col, params, seeds, kwargs))
-
-        with Pool(processes=processes) as pool:
-
-            pooled = pool.imap_unordered(starcall, arguments)
-            for t_spillover, tmpfile in pooled:
-                g_spillover.extend(t_spillover)
-                tmpfiles.append(tmpfile)
-
-            # with click.progressbar(pooled, length=len(arguments)) as bar:
-            #     for t_spillover in bar:
-            #         g_spillover.extend(t_spillover)
-
-        for tmpfile in tmpfiles:
-            os.rename(tmpfile, tmpfile.replace('.tif.tmp', '.tif'))
-
-    return g_spillover
-
 def Watershed(axis, params, processes=1):
     """
     Delineate watershed
@@ -324,7 +294,7 @@ def Watershed(axis, params, processes=1):
     # y = 6250190.0
     # row, col = config.tileset().index(x, y)
 
-    # seeds = [(x, y, 1, row, col)]
+    # seeds = [(row, col, x, y, 1)]
 
     def generate_seeds(feature):
 
@@ -333,7 +303,7 @@ def Watershed(axis, params, processes=1):
 
         for point in feature['geometry']['coordinates']:
             x, y = point[:2]
-            yield (x, y, axis, row, col)
+            yield (row, col, x, y, axis)
 
 
     drainage_shapefile = params.drainage_network.filename(axis=axis)
@@ -343,24 +313,196 @@ def Watershed(axis, params, processes=1):
 
     with fiona.open(drainage_shapefile) as fs:
 
-        seeds = [
+        seeds = np.array([
             seed
             for feature in fs
             for seed in generate_seeds(feature)
-        ]
-
-    count = 0
-    tile = itemgetter(3, 4)
+        ], dtype=WatershedState.seed_dtype())
 
     click.secho('Watershed ID = %d' % axis, fg='cyan')
     click.secho('Run %d processes' % processes, fg='yellow')
 
-    while seeds:
+    IterateSpillovers(
+        partial(WatershedState, axis=axis, params=params),
+        seeds,
+        processes=processes)
 
-        seeds = WatershedStep(seeds, axis, params, processes)
+    click.secho('Ok', fg='green')
 
-        count += 1
-        tiles = {tile(s) for s in seeds}
-        click.echo('Step %02d -- %d spillovers, %d tiles' % (count, len(seeds), len(tiles)))
+def WatershedSeedsTile(row, col, params, transform, shape):
+    """
+    Rasterize drainage network vertices within tile (row, col),
+    labelling each feature with its feature id + 1.
+    The last vertex of each feature is left
+    to the downstream feature.
+    """
 
-    click.secho('Ok', fg='green')
+    tile = tileindex()[(row, col)]
+    height, width = shape
+    labels = np.zeros(shape, dtype='uint32')
+
+    with fiona.open(params.network.filename(tileset=None)) as fs:
+        for feature in fs.filter(bbox=tile.bounds):
+
+            coordinates = np.array(feature['geometry']['coordinates'], dtype='float64')[:-1, :2]
+            i, j = rowcol(transform, coordinates[:, 0], coordinates[:, 1])
+            i = np.asarray(i)
+            j = np.asarray(j)
+            intile = (i >= 0) & (i < height) & (j >= 0) & (j < width)
+            labels[i[intile], j[intile]] = int(feature['id']) + 1
+
+    return labels
+
+def WatershedLabelsTile(row, col, params, outlets=None, **kwargs):
+    """
+    Label sub-watersheds of all drainage network features
+    within tile (row, col), in one upstream traversal.
+
+    Parameters
+    ----------
+
+    outlets: tuple (i, j, labels) or None
+        Labels resolved at tile outlets from downstream tiles,
+        which propagate upstream of outlets
+
+    Returns
+    -------
+
+    gid, i, j, labels of labelled tile border pixels
+    """
+
+    flow_raster = params.flow.tilename(row=row, col=col, **kwargs)
+    output = params.watershed_labels.tilename(row=row, col=col, **kwargs)
+
+    with rio.open(flow_raster) as ds:
+
+        flow = ds.read(1)
+        transform = ds.transform
+        profile = ds.profile.copy()
+
+    labels = WatershedSeedsTile(row, col, params, transform, flow.shape)
+
+    if outlets is not None:
+
+        i, j, values = outlets
+        unset = labels[i, j] == 0
+        labels[i[unset], j[unset]] = values[unset]
+
+    speedup.watershed_labels(flow, labels)
+
+    profile.update(dtype='uint32', nodata=0, compress='deflate')
+
+    with rio.open(output, 'w', **profile) as dst:
+        dst.write(labels, 1)
+
+    height, width = labels.shape
+    border = np.zeros_like(labels, dtype=np.bool_)
+    border[[0, -1], :] = True
+    border[:, [0, -1]] = True
+    i, j = np.nonzero(border & (labels > 0))
+
+    return tileindex()[(row, col)].gid, i, j, labels[i, j]
+
+def WriteWatershedTable(params):
+    """
+    Write label -> (feature id, axis) table
+    """
+
+    output = params.watershed_table.filename(tileset=None)
+
+    with fiona.open(params.network.filename(tileset=None)) as fs:
+        with open(output, 'w') as fp:
+
+            fp.write('LABEL,FID,AXIS\n')
+
+            for feature in fs:
+                fid = int(feature['id'])
+                axis = feature['properties']['AXIS']
+                fp.write('%d,%d,%s\n' % (fid + 1, fid, '' if axis is None else axis))
+
+def WatershedLabels(params, processes=1, **kwargs):
+    """
+    Delineate sub-watersheds of all drainage network features at once :
+
+    1. label each tile from its own seeds,
+       with one upstream traversal (parallel)
+    2. resolve labels at tile outlets
+       by propagating labels upstream along the tile graph
+    3. relabel tiles whose outlets receive labels
+       from downstream tiles (parallel)
+
+    Output is one label raster (watershed-labels)
+    and a label -> axis table (watershed-labels-table).
+
+    @api    fct-drainage:watershed-labels
+
+    @input  flow: flow
+    @input  outlets: outlets
+    @input  network: streams
+
+    @output watershed_labels: watershed-labels
+    @output watershed_table: watershed-labels-table
+    """
+
+    tile_index = tileindex()
+    tiles = {tile.gid: tile for tile in tile_index.values()}
+
+    def execute(arguments):
+
+        results = list()
+
+        with Pool(processes=processes) as pool:
+
+            pooled = pool.imap_unordered(starcall, arguments)
+
+            with click.progressbar(pooled, length=len(arguments)) as iterator:
+                for result in iterator:
+                    results.append(result)
+
+        return results
+
+    click.secho('Label tiles', fg='cyan')
+
+    arguments = [
+        (WatershedLabelsTile, row, col, params, kwargs)
+        for row, col in tile_index
+    ]
+
+    border = execute(arguments)
+
+    keys = np.concatenate([node_keys(gid, i, j) for gid, i, j, _ in border] + [np.zeros(0, dtype=np.int64)])
+    values = np.concatenate([labels for _, _, _, labels in border] + [np.zeros(0, dtype='uint32')])
+
+    click.secho('Resolve labels over tile graph', fg='cyan')
+
+    edges, _, _ = load_graph(params.outlets)
+    nodes, node_values = resolve_upstream(edges, keys, values)
+
+    # outlet pixels left unlabelled within their own tile
+    # take the label resolved downstream in other tiles,
+    # and seed their tile again to propagate this label upstream
+    outlet_edges = edges[(edges['tile'] >= 0) & (edges['tile'] != edges['to_tile'])]
+    outlet_keys = np.unique(node_keys(outlet_edges['tile'], outlet_edges['i'], outlet_edges['j']))
+    outlet_values = node_values[np.searchsorted(nodes, outlet_keys)]
+
+    # only tiles with newly labelled outlets need to be processed again
+    selection = (outlet_values > 0) & ~np.isin(outlet_keys, keys)
+    gids, i, j = decode_keys(outlet_keys[selection])
+    outlet_values = outlet_values[selection]
+
+    arguments = list()
+
+    for gid in np.unique(gids):
+
+        if gid not in tiles:
+            continue
+
+        tile = tiles[gid]
+        mask = gids == gid
+        outlets = (i[mask], j[mask], outlet_values[mask])
+        arguments.append((WatershedLabelsTile, tile.row, tile.col, params, dict(outlets=outlets, **kwargs)))
+
+    click.secho('Relabel %d tiles from outlets' % len(arguments), fg='cyan')
+    execute(arguments)
+
+    WriteWatershedTable(params)
@@ -5,6 +5,13 @@ Flow Height,
 ie. height relative to nearest connected stream cells
 following flow direction (derived from DEM).
 
+Each tile is read once to connect its border pixels
+to the first drainage pixel downstream or to their local exit,
+then reference elevations are resolved on the tile graph
+with array operations, and each tile is read once again
+to propagate reference elevation upstream,
+in one reverse topological pass over the flow raster.
+
 ***************************************************************************
 *                                                                         *
 *   This program is free software; you can redistribute it and/or modify  *
@@ -16,8 +23,8 @@ following flow direction (derived from DEM).
 """
 
 import os
-import itertools
-from operator import itemgetter
+import math
+from collections import defaultdict
 from multiprocessing import Pool
 
 import numpy as np
@@ -30,32 +37,23 @@ import fiona.crs
 from ..config import config
 from ..cli import starcall
 from .. import transform as fct
-from .. import terrain_analysis as ta
 from .. import speedup
-from ..tileio import PadRaster
-
-def border(height, width):
+from ..drainage.TileGraph import (
+    NEIGHBORS,
+    edges_from_outlets,
+    links_from_pixels,
+    resolve_downstream_reference,
+    group_by_tile
+)
+
+def ReadDrainage(axis):
     """
-    Generate a sequence of pixel (row, col)
-    over the border of an array of shape (height, width)
+    Drainage network vertices (x, y), grouped by tile (row, col)
     """
 
-    offset = 0
-    for i in (0, height-1):
-        for j in range(offset, width+offset-1):
-            yield i, j
-        offset = 1
-
-    offset = 1
-    for j in (0, width-1):
-        for i in range(offset, height+offset-1):
-            yield i, j
-        offset = 0
-
-def ReadSeeds(axis):
-
     # shapefile = config.tileset().filename('streams-tiled')
     shapefile = config.tileset().filename('ax_drainage_network', axis=axis)
+    vertices = defaultdict(list)
 
     def accept(feature):
         properties = feature['properties']
@@ -69,221 +67,197 @@ def ReadSeeds(axis):
                 row = feature['properties']['ROW']
                 col = feature['properties']['COL']
 
-                for x, y, z in feature['geometry']['coordinates']:
-                    yield x, y, None, 0.0, row, col
-
-def FlowHeightTile(axis, row, col, seeds):
-
-    output_flow_height = config.tileset().tilename('ax_flow_height', axis=axis, row=row, col=col)
-    output_flow_distance = config.tileset().tilename('ax_flow_distance', axis=axis, row=row, col=col)
-
-    elevations, profile = PadRaster(row, col, 'dem', padding=1)
-    transform = profile['transform']
-    nodata = profile['nodata']
-    flow, _ = PadRaster(row, col, 'flow', padding=1)
-
-    height, width = elevations.shape
-
-    def intile(i, j):
-        return all([i >= 0, i < height, j >= 0, j < width])
-
-    reference = distance = None
-
-    if os.path.exists(output_flow_height):
-        with rio.open(output_flow_height) as ds:
-            if ds.height == height and ds.width == width:
-                relative = ds.read(1)
-                reference = elevations - relative
-                reference[relative == ds.nodata] = nodata
-                del relative
-
-    if reference is None:
-        reference = np.full_like(elevations, nodata)
+                for x, y, _ in feature['geometry']['coordinates']:
+                    vertices[row, col].append((x, y))
 
-    if os.path.exists(output_flow_distance):
-        with rio.open(output_flow_distance) as ds:
-            if ds.height == height and ds.width == width:
-                distance = ds.read(1)
-                distance[distance == ds.nodata] = 0.0
+    return {
+        tile: np.array(xy, dtype='float32')
+        for tile, xy in vertices.items()
+    }
 
-    if distance is None:
-        distance = np.zeros_like(elevations)
-
-    for x, y, z, dist in seeds:
-
-        i, j = fct.index(x, y, transform)
-
-        if intile(i, j):
+def DrainageTiles(drainage, max_distance):
+    """
+    Tiles to process, ie. tiles holding drainage pixels
+    and tiles within `max_distance` (in pixels) of those tiles
+    """
 
-            if z is None:
-                reference[i, j] = elevations[i, j]
-                distance[i, j] = 0.0
-            else:
-                reference[i, j] = z
-                distance[i, j] = dist
+    tileset = config.tileset()
+    tile_index = tileset.tileindex
 
-    result = np.copy(reference)
-    speedup.valley_bottom_flow(flow, result, elevations, nodata, distance, 15.0, 2000.0)
+    if max_distance <= 0:
+        return sorted(tile_index)
 
-    relative = elevations - result
-    relative[result == nodata] = nodata
-    distance[result == nodata] = nodata
+    rings = int(math.ceil(max_distance / min(tileset.height, tileset.width)))
+    tiles = set()
 
-    spillovers = list()
+    for row, col in drainage:
+        for di in range(-rings, rings+1):
+            for dj in range(-rings, rings+1):
+                if (row+di, col+dj) in tile_index:
+                    tiles.add((row+di, col+dj))
 
-    def attribute(pixel):
-        """
-        Returns value, dest. row, dest. col for pixel (i, j)
-        """
+    return sorted(tiles)
 
-        i, j = pixel
-        x, y = ta.xy(i, j, transform)
+def ReadFlowTile(row, col, vertices):
+    """
+    Read elevations and flow direction of tile (row, col),
+    and set reference elevation of drainage pixels
+    from drainage `vertices` (x, y)
+    """
 
-        if i == 0:
-            prow = row - 1
-        elif i == height-1:
-            prow = row + 1
-        else:
-            prow = row
+    with rio.open(config.tileset().tilename('dem', row=row, col=col)) as ds:
+        elevations = ds.read(1)
+        nodata = ds.nodata
+        profile = ds.profile.copy()
 
-        if j == 0:
-            pcol = col - 1
-        elif j == width-1:
-            pcol = col + 1
-        else:
-            pcol = col
+    with rio.open(config.tileset().tilename('flow', row=row, col=col)) as ds:
+        flow = ds.read(1)
 
-        return x, y, result[pixel], distance[pixel], prow, pcol
+    height, width = elevations.shape
+    reference = np.full_like(elevations, nodata)
 
-    for pixel in border(height, width):
-        if reference[pixel] == nodata and result[pixel] != nodata:
+    if len(vertices):
 
-            spillovers.append(attribute(pixel))
+        pixels = fct.worldtopixel(vertices, profile['transform'])
+        pixels = pixels[
+            (pixels[:, 0] >= 0) & (pixels[:, 0] < height) &
+            (pixels[:, 1] >= 0) & (pixels[:, 1] < width)
+        ]
 
-    output_flow_height += '.tmp'
-    output_flow_distance += '.tmp'
+        reference[pixels[:, 0], pixels[:, 1]] = elevations[pixels[:, 0], pixels[:, 1]]
 
-    with rio.open(output_flow_height, 'w', **profile) as dst:
-        dst.write(relative, 1)
+    return flow, elevations, reference, nodata, profile
 
-    with rio.open(output_flow_distance, 'w', **profile) as dst:
-        dst.write(distance, 1)
-
-    return spillovers, (output_flow_height, output_flow_distance)
+def ConnectTile(row, col, vertices):
+    """
+    Connect every border pixel to the first drainage pixel downstream,
+    or to other tile, with one pass over the flow raster.
 
-def FlowHeightIteration(spillovers, axis, processes=1):
+    Returns
+    -------
 
-    attributes = itemgetter(0, 1, 2, 3)
-    tile = itemgetter(4, 5)
+    edges: array of EDGE_DTYPE records
+        outbound pixels flowing outside of the tileset
+        have a negative `to_tile`
 
-    spillovers = sorted(spillovers, key=tile)
-    tiles = itertools.groupby(spillovers, key=tile)
+    weights: array (n, 3)
+        (length in pixels, peak elevation, reference elevation) of each edge
 
-    g_spillover = list()
+    nodata: float
+        no data value of reference elevation
+    """
 
-    if processes == 1:
+    if not os.path.exists(config.tileset().tilename('dem', row=row, col=col)):
+        return None
 
-        for (row, col), seeds in tiles:
+    flow, elevations, reference, nodata, _ = ReadFlowTile(row, col, vertices)
+    height, width = flow.shape
 
-            seeds = [attributes(seed) for seed in seeds]
-            t_spillover, outputs = FlowHeightTile(axis, row, col, seeds)
-            g_spillover.extend(t_spillover)
+    links, lengths, peaks, values = speedup.tile_exit_reference(
+        flow,
+        elevations,
+        reference,
+        nodata)
 
-            for tmpfile in outputs:
-                os.rename(tmpfile, tmpfile.replace('.tif.tmp', '.tif'))
+    weights = np.column_stack([lengths, peaks, values])
 
-    else:
+    inbound = (
+        (links[:, 2] >= 0) & (links[:, 2] < height) &
+        (links[:, 3] >= 0) & (links[:, 3] < width)
+    )
 
-        kwargs = dict()
-        tmpfiles = list()
+    local = links_from_pixels(row, col, links[inbound])
+    local['area'] = lengths[inbound]
 
-        def arguments():
+    outbound, outbound_weights, _ = edges_from_outlets(
+        row, col,
+        links[~inbound],
+        weights[~inbound],
+        height, width,
+        exterior=True)
 
-            for (row, col), seeds in tiles:
+    return (
+        np.concatenate([local, outbound]),
+        np.concatenate([weights[inbound], outbound_weights]),
+        nodata
+    )
 
-                seeds = [attributes(seed) for seed in seeds]
-                yield (
-                    FlowHeightTile,
-                    axis,
-                    row,
-                    col,
-                    seeds,
-                    kwargs
-                )
+def FlowHeightTile(row, col, axis, vertices, i, j, node_weights, max_height, max_distance):
+    """
+    Propagate reference elevation upstream from drainage pixels
+    and from tile graph nodes resolved to a drainage pixel,
+    and write flow height and flow distance rasters
 
-        with Pool(processes=processes) as pool:
+    Parameters
+    ----------
 
-            pooled = pool.imap_unordered(starcall, arguments())
+    i, j: arrays
+        pixel coordinates of tile graph nodes within tile
 
-            for t_spillover, outputs in pooled:
-                g_spillover.extend(t_spillover)
-                tmpfiles.extend(outputs)
+    node_weights: array (n, 3)
+        (length, peak, reference) of each node
 
-            # with click.progressbar(pooled, length=len(arguments)) as bar:
-            #     for t_spillover in bar:
-            #         g_spillover.extend(t_spillover)
+    Returns
+    -------
 
-        for tmpfile in tmpfiles:
-            os.rename(tmpfile, tmpfile.replace('.tif.tmp', '.tif'))
+    (row, col) if at least one pixel is connected to the drainage network,
+    None otherwise
+    """
 
-    return g_spillover
+    flow, elevations, reference, nodata, profile = ReadFlowTile(row, col, vertices)
 
-def CropAndScaleRasterTile(rasterfile, scale=1.0, padding=1):
+    lengths = np.zeros_like(elevations)
+    peaks = np.copy(elevations)
 
-    with rio.open(rasterfile) as ds:
+    resolved = node_weights[:, 2] != nodata
+    i = i[resolved]
+    j = j[resolved]
+    lengths[i, j] = node_weights[resolved, 0]
+    peaks[i, j] = node_weights[resolved, 1]
+    reference[i, j] = node_weights[resolved, 2]
 
-        profile = ds.profile.copy()
-        transform = ds.transform * ds.transform.translation(padding, padding)
-        height = ds.height - 2*padding
-        width = ds.width - 2*padding
-        data = ds.read(1)
-        mask = (data == ds.nodata)
-        data = scale * data
-        data[mask] = ds.nodata
+    speedup.flow_reference(flow, elevations, reference, lengths, peaks, nodata)
 
-    profile.update(
-        transform=transform,
-        height=height,
-        width=width,
-        compress='deflate')
+    valid = reference != nodata
 
-    with rio.open(rasterfile, 'w', **profile) as dst:
-        dst.write(data[padding:-padding, padding:-padding], 1)
+    if max_height > 0:
+        valid &= (peaks - reference <= max_height)
 
-def CropAndScale(axis, tiles, processes=1):
+    if max_distance > 0:
+        valid &= (lengths <= max_distance)
 
-    def rasters(row, col):
+    if not np.any(valid):
+        return None
 
-        yield config.tileset().tilename('ax_flow_height', axis=axis, row=row, col=col), 1.0
-        yield config.tileset().tilename('ax_flow_distance', axis=axis, row=row, col=col), 5.0
+    relative = elevations - reference
+    relative[~valid] = nodata
+    distance = lengths * profile['transform'].a
+    distance[~valid] = nodata
 
-    if processes == 1:
+    profile.update(compress='deflate')
 
-        with click.progressbar(tiles) as processing:
-            for row, col in processing:
-                for rasterfile, scale in rasters(row, col):
-                    CropAndScaleRasterTile(rasterfile, scale)
+    output_flow_height = config.tileset().tilename('ax_flow_height', axis=axis, row=row, col=col)
+    output_flow_distance = config.tileset().tilename('ax_flow_distance', axis=axis, row=row, col=col)
 
-    else:
+    with rio.open(output_flow_height, 'w', **profile) as dst:
+        dst.write(relative, 1)
 
-        kwargs = dict(padding=1)
-        arguments = [
-            (CropAndScaleRasterTile, rasterfile, scale, kwargs)
-            for row, col in tiles
-            for rasterfile, scale in rasters(row, col)
-        ]
+    with rio.open(output_flow_distance, 'w', **profile) as dst:
+        dst.write(distance, 1)
 
-        with Pool(processes=processes) as pool:
+    return row, col
 
-            pooled = pool.imap_unordered(starcall, arguments)
-            with click.progressbar(pooled, length=len(arguments)) as processing:
-                for _ in processing:
-                    pass
-
-def FlowHeight(axis, processes=1):
+def FlowHeight(axis, processes=1, max_height=15.0, max_distance=2000.0):
     """
     Relative heights based on flow direction
 
+    Every pixel is assigned the elevation of the first drainage pixel
+    on its flow path, if the flow path from this pixel
+    stays within `max_height` above that drainage pixel
+    and within `max_distance` pixels of flow distance.
+    Flow paths crossing tile borders are resolved
+    on the tile graph, without iterating over tiles.
+
     @api    fct-corridor:flow-height
 
     @input  dem: dem
@@ -299,26 +273,71 @@ def FlowHeight(axis, processes=1):
     """
 
     output = config.tileset().filename('ax_flow_tiles', axis=axis)
+    tile_index = config.tileset().tileindex
+    drainage = ReadDrainage(axis)
+    tiles = DrainageTiles(drainage, max_distance)
+    empty = np.zeros((0, 2), dtype='float32')
+
+    def neighborhood(row, col):
+        """
+        Drainage vertices of tile (row, col) and neighbor tiles
+        """
+        return np.concatenate([drainage.get((row, col), empty)] + [
+            drainage.get((row+di, col+dj), empty)
+            for di, dj in NEIGHBORS
+        ])
+
+    def execute(arguments):
+
+        with Pool(processes=processes) as pool:
+
+            pooled = pool.imap_unordered(starcall, arguments)
+
+            with click.progressbar(pooled, length=len(arguments)) as iterator:
+                return list(iterator)
+
+    click.secho('Connect tiles', fg='cyan')
+
+    arguments = [
+        (ConnectTile, row, col, neighborhood(row, col), dict())
+        for row, col in tiles
+    ]
+
+    connections = [result for result in execute(arguments) if result is not None]
+
+    if not connections:
+        return
 
-    g_tiles = set()
-    tile = itemgetter(4, 5)
-    count = 0
+    click.secho('Resolve reference elevation over tile graph', fg='cyan')
 
-    seeds = list(ReadSeeds(axis))
+    edges = np.concatenate([edges for edges, _, _ in connections])
+    weights = np.concatenate([weights for _, weights, _ in connections])
+    nodata = connections[0][2]
 
-    while seeds:
+    nodes, node_weights = resolve_downstream_reference(edges, weights, nodata)
+    values = {gid: (i, j, w) for gid, i, j, w in group_by_tile(nodes, node_weights)}
 
-        tiles = {tile(s) for s in seeds}
-        g_tiles.update(tiles)
-        count += 1
-        click.echo('Step %02d -- %d tiles, %d spillovers' % (count, len(tiles), len(seeds)))
+    click.secho('Propagate reference elevation upstream', fg='cyan')
 
-        seeds = FlowHeightIteration(seeds, axis, processes)
+    empty_nodes = (np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64'), np.zeros((0, 3)))
 
-    click.echo('Done after %d iterations' % count)
+    arguments = [
+        (
+            FlowHeightTile,
+            row,
+            col,
+            axis,
+            neighborhood(row, col),
+            *values.get(tile_index[(row, col)].gid, empty_nodes),
+            max_height,
+            max_distance,
+            dict()
+        )
+        for row, col in tiles
+        if os.path.exists(config.tileset().tilename('dem', row=row, col=col))
+    ]
 
-    click.secho('Crop and scale output tiles', fg='cyan')
-    CropAndScale(axis, g_tiles, processes)
+    g_tiles = [tile for tile in execute(arguments) if tile is not None]
 
     click.secho('Save axis tiles list', fg='cyan')
     with open(output, 'w') as fp:
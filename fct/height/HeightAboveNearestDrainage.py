@@ -17,7 +17,7 @@ aka. detrended DEM
 
 import os
 # from collections import namedtuple
-from operator import itemgetter
+from functools import partial
 from multiprocessing import Pool
 
 import numpy as np
@@ -30,15 +30,23 @@ import fiona.crs
 from .. import terrain_analysis as ta
 from .. import speedup
 from ..config import (
-    config,
     LiteralParameter,
     DatasetParameter
 )
 from ..config.descriptors import DatasetResolver
-from ..rasterize import rasterize_linestringz
 # from ..swath import nearest_value_and_distance
 from ..measure.Measurement import nearest_value_and_distance
+from ..tileio import (
+    SampleRasters,
+    WriteRaster,
+    OpenRaster
+)
 from ..cli import starcall
+from .ReferencePixels import (
+    RasterizeReference,
+    BuildReferenceIndex,
+    LoadReferencePixels
+)
 
 class Parameters:
     """
@@ -52,6 +60,11 @@ class Parameters:
     height = DatasetParameter('height raster (HAND)', type='output')
     distance = DatasetParameter('distance to drainage pixels (raster)', type='output')
     nearest = DatasetParameter('nearest drainage axis (raster)', type='output')
+    reference = DatasetParameter('draped drainage pixels, indexed by tile', type='output')
+    flow_partition = DatasetParameter(
+        'multiple flow direction proportions (raster), '
+        'to follow flow paths instead of euclidean nearest drainage',
+        type='input')
 
     mask_height_max = LiteralParameter(
         'maximum height defining domain mask')
@@ -76,6 +89,7 @@ class Parameters:
             self.height = 'nearest_height'
             self.distance = 'nearest_distance'
             self.nearest = 'nearest_drainage_axis'
+            self.reference = 'reference_pixels_drainage'
 
         else:
 
@@ -85,6 +99,9 @@ class Parameters:
             self.height = dict(key='ax_nearest_height', axis=axis)
             self.distance = dict(key='ax_nearest_distance', axis=axis)
             self.nearest = dict(key='ax_nearest_drainage_axis', axis=axis)
+            self.reference = dict(key='ax_reference_pixels_drainage', axis=axis)
+
+        self.flow_partition = 'off'
 
         self.mask_height_max = 20.0
         self.buffer_width = 0.0
@@ -96,11 +113,37 @@ def DrapeLineString(coordinates: np.ndarray, elevations: DatasetResolver, **kwar
     """
 
     elevation_raster = elevations.filename(**kwargs)
+    (z, _), = SampleRasters(coordinates, elevation_raster)
+    coordinates[:, 2] = z
+
+def FlowPartitionReference(row, col, params, refaxis_pixels, reference, nodata, **kwargs):
+    """
+    Replace nearest drainage reference elevation
+    with the flow-weighted reference elevation of drainage pixels
+    reached by multiple flow direction paths within tile.
+    Pixels draining outside of tile keep their nearest drainage reference.
+    """
+
+    proportions_raster = params.flow_partition.tilename(row=row, col=col, **kwargs)
 
-    with rio.open(elevation_raster) as ds:
+    if not os.path.exists(proportions_raster):
+        return
 
-        z = np.array(list(ds.sample(coordinates[:, :2], 1)))
-        coordinates[:, 2] = z[:, 0]
+    with rio.open(proportions_raster) as ds:
+        proportions = np.ascontiguousarray(np.moveaxis(ds.read(), 0, -1))
+
+    height, width = reference.shape
+    pixels = np.array(refaxis_pixels)
+    i = np.int32(pixels[:, 0])
+    j = np.int32(pixels[:, 1])
+    intile = (i >= 0) & (i < height) & (j >= 0) & (j < width)
+
+    flow_reference = np.full((height, width), nodata, dtype='float32')
+    flow_reference[i[intile], j[intile]] = pixels[intile, 2]
+    speedup.partition_reference(proportions, flow_reference, nodata)
+
+    reached = flow_reference != nodata
+    reference[reached] = flow_reference[reached]
 
 def HeightAboveNearestDrainageTile(
         row: int,
@@ -111,18 +154,8 @@ def HeightAboveNearestDrainageTile(
     Tile processing
     """
 
-    # tileset = config.tileset()
-
     elevation_raster = params.dem.tilename(row=row, col=col, **kwargs)
     # tileset.tilename(params.dem, row=row, col=col, **kwargs)
-    
-    drainage_shapefile = params.drainage.filename(**kwargs)
-    # tileset.filename(params.drainage, axis=axis, **kwargs)
-    
-    if not os.path.exists(drainage_shapefile):
-        drainage_shapefile = params.drainage.filename(tileset=None, **kwargs)
-        # config.filename(params.drainage, axis=axis, **kwargs)
-        assert os.path.exists(drainage_shapefile)
 
     # valley_bottom_rasterfile = tileset.tilename('ax_flow_height', axis=axis, row=row, col=col)
     mask_rasterfile = params.mask.tilename(row=row, col=col, **kwargs)
@@ -131,113 +164,92 @@ def HeightAboveNearestDrainageTile(
     output_height = params.height.tilename(row=row, col=col, **kwargs)
     output_distance = params.distance.tilename(row=row, col=col, **kwargs)
 
-    with rio.open(mask_rasterfile) as ds:
+    refaxis_pixels = LoadReferencePixels(params.reference, row, col, **kwargs)
+
+    with OpenRaster(mask_rasterfile) as ds:
 
         mask = ds.read(1)
+        mask_nodata = ds.nodata
         height, width = mask.shape
 
         if params.mask_height_max > 0:
 
             height_max = params.mask_height_max
-            valid = (mask != ds.nodata) & (mask >= -height_max) & (mask <= height_max)
-            mask[~valid] = ds.nodata
+            valid = (mask != mask_nodata) & (mask >= -height_max) & (mask <= height_max)
+            mask[~valid] = mask_nodata
 
         if params.buffer_width > 0:
             
             speedup.raster_buffer(
                 mask,
-                ds.nodata,
+                mask_nodata,
                 params.buffer_width / params.resolution)
 
         profile = ds.profile.copy()
-        profile.update(compress='deflate')
-
-        refaxis_pixels = list()
-
-        # def accept(feature):
-
-        #     properties = feature['properties']
-        #     return properties['AXIS'] == axis
-
-        # def intile(i, j):
-        #     return all([i >= 0, i < height, j >= 0, j < width])
-
-        def accept_pixel(i, j):
-            return all([i >= -height, i < 2*height, j >= -width, j < 2*width])
-
-        # coord = itemgetter(0, 1, 2)
-        coord = itemgetter(0, 1)
-        unique = set()
+        profile.update(compress='deflate', dtype='float32', nodata=mask_nodata)
 
         with rio.open(elevation_raster) as ds2:
-
             elevations = ds2.read(1)
+            elevation_nodata = ds2.nodata
 
-            with fiona.open(drainage_shapefile) as fs:
-                for feature in fs:
-
-                    # if accept(feature):
-
-                    axis = feature['properties']['AXIS']
-
-                    coordinates = np.array([
-                        coord(p) + (0.0, ) for p in feature['geometry']['coordinates']
-                    ], dtype='float32')
-
-                    # override z from elevation raster
-                    # just in case we forgot to drape stream network on DEM
-                    DrapeLineString(coordinates, params.dem, **kwargs)
-
-                    coordinates[:, :2] = ta.worldtopixel(coordinates[:, :2], ds.transform, gdal=False)
-
-                    for a, b in zip(coordinates[:-1], coordinates[1:]):
-
-                        # if intile(a[0], a[1]):
-                        #     a[2] = elevations[a[0], a[1]]
-
-                        # if intile(b[0], b[1]):
-                        #     b[2] = elevations[b[0], b[1]]
-
-                        for i, j, z in rasterize_linestringz(a, b):
-                            if accept_pixel(i, j) and (i, j) not in unique:
-                                # distance[i, j] = 0
-                                # measure[i, j] = m
-                                # z = elevations[i, j]
-                                refaxis_pixels.append((i, j, z, axis))
-                                unique.add((i, j))
-
-        if refaxis_pixels:
+        if refaxis_pixels is not None and len(refaxis_pixels) > 0:
 
             nearest, reference, distance = nearest_value_and_distance(
                 np.array(refaxis_pixels),
                 mask,
-                ds.nodata)
+                mask_nodata)
 
             distance = distance * params.resolution
-            distance[mask == ds.nodata] = ds.nodata
+            distance[mask == mask_nodata] = mask_nodata
+
+            if not params.flow_partition.none:
+                FlowPartitionReference(row, col, params, refaxis_pixels, reference, mask_nodata, **kwargs)
 
             hand = elevations - reference
-            hand[(mask == ds.nodata) | (elevations == ds2.nodata)] = ds.nodata
+            hand[(mask == mask_nodata) | (elevations == elevation_nodata)] = mask_nodata
 
         else:
 
-            hand = distance = np.full((height, width), ds.nodata, dtype='float32')
-
-        with rio.open(output_distance, 'w', **profile) as dst:
-            dst.write(distance, 1)
+            hand = distance = np.full((height, width), mask_nodata, dtype='float32')
 
-        with rio.open(output_height, 'w', **profile) as dst:
-            dst.write(hand, 1)
+        WriteRaster(output_distance, distance, profile, params.distance.storage)
+        WriteRaster(output_height, hand, profile, params.height.storage)
 
         if not params.nearest.none:
 
-            output_nearest = params.nearest.tilename(axis=axis, row=row, col=col, **kwargs)
+            output_nearest = params.nearest.tilename(row=row, col=col, **kwargs)
 
             profile.update(dtype='uint32', nodata=0)
 
             with rio.open(output_nearest, 'w', **profile) as dst:
                 dst.write(nearest, 1)
 
+def DrainageReferenceIndex(params: Parameters, tiles, **kwargs):
+    """
+    Drape and rasterize the drainage network once,
+    and save drainage pixels by tile
+    """
+
+    drainage_shapefile = params.drainage.filename(**kwargs)
+    # tileset.filename(params.drainage, axis=axis, **kwargs)
+
+    if not os.path.exists(drainage_shapefile):
+        drainage_shapefile = params.drainage.filename(tileset=None, **kwargs)
+        # config.filename(params.drainage, axis=axis, **kwargs)
+        assert os.path.exists(drainage_shapefile)
+
+    click.secho('Index drainage pixels by tile', fg='cyan')
+
+    # override z from elevation raster
+    # just in case we forgot to drape stream network on DEM
+    pixels = RasterizeReference(
+        drainage_shapefile,
+        params.resolution,
+        partial(ta.worldtopixel, gdal=False),
+        elevations=params.dem.filename(**kwargs))
+
+    BuildReferenceIndex(params.reference, pixels, params.resolution, tiles, **kwargs)
+
 def HeightAboveNearestDrainage(
         params: Parameters,
         processes: int = 1,
@@ -295,6 +307,11 @@ def HeightAboveNearestDrainage(
         Drainage network for reference.
         streams-tiled | ax_drainage_network | ax_talweg
 
+    reference: str, logical name
+
+        Draped drainage pixels, indexed by tile,
+        built once before tile processing
+
     mask: str, logical name
 
         Mask raster,
@@ -317,20 +334,21 @@ def HeightAboveNearestDrainage(
 
     tilefile = params.tiles.filename(**kwargs)
 
-    def arguments():
-
-        with open(tilefile) as fp:
-            for line in fp:
-                row, col = tuple(int(x) for x in line.split(','))
-                yield (
-                    HeightAboveNearestDrainageTile,
-                    row,
-                    col,
-                    params,
-                    kwargs
-                )
-
-    arguments = list(arguments())
+    with open(tilefile) as fp:
+        tiles = [tuple(int(x) for x in line.split(',')) for line in fp]
+
+    DrainageReferenceIndex(params, tiles, **kwargs)
+
+    arguments = [
+        (
+            HeightAboveNearestDrainageTile,
+            row,
+            col,
+            params,
+            kwargs
+        )
+        for row, col in tiles
+    ]
 
     with Pool(processes=processes) as pool:
 
@@ -15,7 +15,6 @@ aka. detrended DEM
 ***************************************************************************
 """
 
-from operator import itemgetter
 from multiprocessing import Pool
 
 import numpy as np
@@ -31,10 +30,19 @@ from ..config import (
     LiteralParameter,
     DatasetParameter
 )
-from ..rasterize import rasterize_linestringz
 # from ..swath import nearest_value_and_distance
 from ..measure.Measurement import nearest_value_and_distance
+from ..tileio import (
+    SampleRasters,
+    WriteRaster,
+    OpenRaster
+)
 from ..cli import starcall
+from .ReferencePixels import (
+    RasterizeReference,
+    BuildReferenceIndex,
+    LoadReferencePixels
+)
 
 class Parameters:
     """
@@ -48,6 +56,13 @@ class Parameters:
     height = DatasetParameter('height above valley bottom', type='output')
     distance = DatasetParameter('distance to drainage pixels (raster)', type='output')
     nearest = DatasetParameter('nearest drainage axis (raster)', type='output')
+    reference = DatasetParameter('elevation profile pixels, indexed by tile', type='output')
+    nearest_axis = DatasetParameter('nearest drainage axis (raster)', type='input')
+    measure = DatasetParameter(
+        'location along reference axis (raster), '
+        'to interpolate reference elevation by axis measure '
+        'instead of searching nearest profile pixel',
+        type='input')
 
     mask_height_max = LiteralParameter(
         'maximum height defining domain mask')
@@ -74,6 +89,8 @@ class Parameters:
             self.height = 'height_above_valley_bottom'
             self.distance = 'off' # 'nearest_distance'
             self.nearest = 'off' # 'nearest_drainage_axis'
+            self.reference = 'reference_pixels_valley_bottom'
+            self.nearest_axis = 'nearest_drainage_axis'
 
         else:
 
@@ -86,27 +103,55 @@ class Parameters:
             self.height = dict(key='ax_height_above_valley_bottom', axis=axis)
             self.distance = 'off' # dict(key='ax_nearest_distance', axis=axis)
             self.nearest = 'off' # dict(key='ax_nearest_drainage_axis', axis=axis)
+            self.reference = dict(key='ax_reference_pixels_valley_bottom', axis=axis)
+            self.nearest_axis = dict(key='ax_nearest_drainage_axis', axis=axis)
+
+        self.measure = 'off'
 
         self.mask_height_max = 20.0
         self.buffer_width = 0.0
         self.resolution = 5.0
 
+def MeasureReference(row, col, params, profiles, mask, nodata, **kwargs):
+    """
+    Reference elevation interpolated along elevation profiles
+    from pixels' nearest axis and axis measure
+    """
+
+    with rio.open(params.nearest_axis.tilename(row=row, col=col, **kwargs)) as ds:
+        nearest = ds.read(1)
+
+    with OpenRaster(params.measure.tilename(row=row, col=col, **kwargs)) as ds:
+        measure = ds.read(1)
+        measure_nodata = ds.nodata
+        domain = (mask != nodata) & (measure != measure_nodata)
+
+    reference = np.full(mask.shape, nodata, dtype='float32')
+
+    for axis in np.unique(nearest[domain]):
+
+        if axis not in profiles:
+            continue
+
+        selection = domain & (nearest == axis)
+        profile_measure, profile_z = profiles[axis]
+        reference[selection] = np.interp(measure[selection], profile_measure, profile_z)
+
+    nearest[reference == nodata] = 0
+
+    return nearest, reference
+
 def HeightAboveReferenceTile(
         row: int,
         col: int,
         params: Parameters,
+        profiles=None,
         **kwargs):
     """
     Tile processing
     """
 
     elevation_raster = params.dem.tilename(row=row, col=col, **kwargs)
-    profile_shapefile = params.elevation_profile.filename(**kwargs)
-
-    if not profile_shapefile.exists():
-        profile_shapefile = params.elevation_profile.filename(tileset=None, **kwargs)
-        # config.filename(params.drainage, axis=axis, **kwargs)
-        assert profile_shapefile.exists()
 
     # valley_bottom_rasterfile = tileset.tilename('ax_flow_height', axis=axis, row=row, col=col)
     mask_rasterfile = params.mask.tilename(row=row, col=col, **kwargs)
@@ -114,148 +159,210 @@ def HeightAboveReferenceTile(
 
     output_height = params.height.tilename(row=row, col=col, **kwargs)
 
+    if profiles is None:
+        refaxis_pixels = LoadReferencePixels(params.reference, row, col, **kwargs)
+
     with rio.open(elevation_raster) as ds:
 
         elevations = ds.read(1)
         elevation_nodata = ds.nodata
         profile = ds.profile.copy()
 
-    with rio.open(mask_rasterfile) as ds:
+    with OpenRaster(mask_rasterfile) as ds:
 
         mask = ds.read(1)
-        height, width = mask.shape
         mask_nodata = ds.nodata
+        height, width = mask.shape
 
         if params.mask_height_max > 0:
 
             height_max = params.mask_height_max
-            valid = (mask != ds.nodata) & (mask >= -height_max) & (mask <= height_max)
-            mask[~valid] = ds.nodata
+            valid = (mask != mask_nodata) & (mask >= -height_max) & (mask <= height_max)
+            mask[~valid] = mask_nodata
 
         if params.buffer_width > 0:
 
             speedup.raster_buffer(
                 mask,
-                ds.nodata,
+                mask_nodata,
                 params.buffer_width / params.resolution)
 
-        refaxis_pixels = list()
-
-        # def accept(feature):
-
-        #     properties = feature['properties']
-        #     return properties['AXIS'] == axis
-
-        # def intile(i, j):
-        #     return all([i >= 0, i < height, j >= 0, j < width])
-
-        def accept_pixel(i, j):
-            return all([i >= -height, i < 2*height, j >= -width, j < 2*width])
-
-        # coord = itemgetter(0, 1, 2)
-        # coord = itemgetter(0, 1)
-        unique = set()
+        if profiles is not None:
 
-        with fiona.open(profile_shapefile) as fs:
-            for feature in fs:
-
-                # if accept(feature):
-
-                axis = feature['properties']['AXIS']
-
-                coordinates = np.array(
-                    feature['geometry']['coordinates'],
-                    dtype='float32')
-
-                coordinates[:, :2] = fct.worldtopixel(coordinates[:, :2], ds.transform)
-
-                for a, b in zip(coordinates[:-1], coordinates[1:]):
-
-                    # if intile(a[0], a[1]):
-                    #     a[2] = elevations[a[0], a[1]]
+            nearest, reference = MeasureReference(
+                row, col,
+                params,
+                profiles,
+                mask,
+                mask_nodata,
+                **kwargs)
 
-                    # if intile(b[0], b[1]):
-                    #     b[2] = elevations[b[0], b[1]]
+            # distance to reference is not available in measure mode
+            distance = np.full((height, width), mask_nodata, dtype='float32')
 
-                    for i, j, z in rasterize_linestringz(a, b):
-                        if accept_pixel(i, j) and (i, j) not in unique:
-                            # distance[i, j] = 0
-                            # measure[i, j] = m
-                            # z = elevations[i, j]
-                            refaxis_pixels.append((i, j, z, axis))
-                            unique.add((i, j))
+            hand = elevations - reference
+            hand[(reference == mask_nodata) | (elevations == elevation_nodata)] = mask_nodata
 
-        if refaxis_pixels:
+        elif refaxis_pixels is not None and len(refaxis_pixels) > 0:
 
             nearest, reference, distance = nearest_value_and_distance(
-                np.array(refaxis_pixels),
+                refaxis_pixels,
                 mask,
                 mask_nodata)
 
             distance = distance * params.resolution
-            distance[mask == ds.nodata] = ds.nodata
+            distance[mask == mask_nodata] = mask_nodata
 
             hand = elevations - reference
-            hand[(mask == ds.nodata) | (elevations == elevation_nodata)] = mask_nodata
+            hand[(mask == mask_nodata) | (elevations == elevation_nodata)] = mask_nodata
 
         else:
 
-            hand = distance = np.full((height, width), ds.nodata, dtype='float32')
+            hand = distance = np.full((height, width), mask_nodata, dtype='float32')
+            nearest = np.zeros((height, width), dtype='uint32')
 
-        profile.update(compress='deflate')
+        profile.update(compress='deflate', nodata=mask_nodata)
 
-        with rio.open(output_height, 'w', **profile) as dst:
-            dst.write(hand, 1)
+        WriteRaster(output_height, hand, profile, params.height.storage)
 
         if not params.distance.none:
 
             output_distance = params.distance.tilename(row=row, col=col, **kwargs)
-
-            with rio.open(output_distance, 'w', **profile) as dst:
-                dst.write(distance, 1)
+            WriteRaster(output_distance, distance, profile, params.distance.storage)
 
         if not params.nearest.none:
 
-            output_nearest = params.nearest.tilename(axis=axis, row=row, col=col, **kwargs)
+            output_nearest = params.nearest.tilename(row=row, col=col, **kwargs)
 
             profile.update(dtype='uint32', nodata=0)
 
             with rio.open(output_nearest, 'w', **profile) as dst:
                 dst.write(nearest, 1)
 
+def ProfileReferenceIndex(params: Parameters, tiles, **kwargs):
+    """
+    Rasterize elevation profiles once,
+    and save profile pixels by tile
+    """
+
+    profile_shapefile = params.elevation_profile.filename(**kwargs)
+
+    if not profile_shapefile.exists():
+        profile_shapefile = params.elevation_profile.filename(tileset=None, **kwargs)
+        # config.filename(params.drainage, axis=axis, **kwargs)
+        assert profile_shapefile.exists()
+
+    click.secho('Index elevation profile pixels by tile', fg='cyan')
+
+    pixels = RasterizeReference(
+        str(profile_shapefile),
+        params.resolution,
+        fct.worldtopixel)
+
+    BuildReferenceIndex(params.reference, pixels, params.resolution, tiles, **kwargs)
+
+def ProfileMeasures(params: Parameters, **kwargs):
+    """
+    Elevation profiles as functions of axis measure,
+    with profile vertices located by sampling the measure raster
+
+    Returns
+    -------
+
+    Dict of axis -> (measure, z) arrays,
+    in order of increasing measure
+    """
+
+    profile_shapefile = params.elevation_profile.filename(**kwargs)
+
+    if not profile_shapefile.exists():
+        profile_shapefile = params.elevation_profile.filename(tileset=None, **kwargs)
+        assert profile_shapefile.exists()
+
+    click.secho('Locate elevation profile vertices by axis measure', fg='cyan')
+
+    axes = list()
+    vertices = list()
+
+    with fiona.open(str(profile_shapefile)) as fs:
+        for feature in fs:
+
+            coordinates = np.array(feature['geometry']['coordinates'], dtype='float64')
+            axes.append(np.full(len(coordinates), feature['properties']['AXIS'], dtype='uint32'))
+            vertices.append(coordinates)
+
+    if not vertices:
+        return dict()
+
+    axes = np.concatenate(axes)
+    vertices = np.concatenate(vertices)
+    (measure, nodata), = SampleRasters(vertices, params.measure.filename(**kwargs))
+
+    valid = measure != nodata
+    axes = axes[valid]
+    measure = measure[valid]
+    z = vertices[valid, 2]
+
+    order = np.lexsort((measure, axes))
+    axes = axes[order]
+    measure = measure[order]
+    z = z[order]
+    splits = np.flatnonzero(np.diff(axes)) + 1
+
+    return {
+        int(axis[0]): (np.float64(m), np.float64(zm))
+        for axis, m, zm in zip(
+            np.split(axes, splits),
+            np.split(measure, splits),
+            np.split(z, splits))
+        if axis.size
+    }
+
 def HeightAboveReference(
         params: Parameters,
         processes: int = 1,
         **kwargs):
     """
     Calculate distance and height above nearest drainage
+
+    If `params.measure` is set, reference elevation is interpolated
+    along elevation profiles from the axis measure of each pixel,
+    in one vectorized pass per tile,
+    instead of searching the nearest profile pixel.
+
     Other keywords are passed to dataset filename templates.
     """
 
     tilefile = params.tiles.filename(**kwargs)
 
-    def length():
+    with open(tilefile) as fp:
+        tiles = [tuple(int(x) for x in line.split(',')) for line in fp]
+
+    if params.measure.none:
+
+        ProfileReferenceIndex(params, tiles, **kwargs)
+        profiles = None
 
-        with open(tilefile) as fp:
-            return sum(1 for line in fp)
+    else:
 
-    def arguments():
+        profiles = ProfileMeasures(params, **kwargs)
 
-        with open(tilefile) as fp:
-            for line in fp:
-                row, col = (int(x) for x in line.split(','))
-                yield (
-                    HeightAboveReferenceTile,
-                    row,
-                    col,
-                    params,
-                    kwargs
-                )
+    arguments = [
+        (
+            HeightAboveReferenceTile,
+            row,
+            col,
+            params,
+            profiles,
+            kwargs
+        )
+        for row, col in tiles
+    ]
 
     with Pool(processes=processes) as pool:
 
-        pooled = pool.imap_unordered(starcall, arguments())
+        pooled = pool.imap_unordered(starcall, arguments)
 
-        with click.progressbar(pooled, length=length()) as iterator:
+        with click.progressbar(pooled, length=len(arguments)) as iterator:
             for _ in iterator:
                 pass
@@ -0,0 +1,230 @@
+# coding: utf-8
+
+"""
+Tile index of reference pixels,
+ie. rasterized (and draped) reference linestrings
+such as the drainage network or elevation profiles,
+for HeightAboveNearestDrainage and HeightAboveReference.
+
+Reference linestrings are rasterized once
+on the global pixel grid of the tileset,
+then reference pixels (i, j, z, axis) are bucketed by tile,
+including a one-tile halo around each tile,
+and saved as one npz file per tile,
+so that tile processing only loads its own reference pixels.
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+
+import numpy as np
+
+import click
+from rasterio.transform import Affine
+import fiona
+
+from ..config import config
+from ..tileio import SampleRasters
+from ..rasterize import rasterize_linestringz
+from ..drainage.TileGraph import NEIGHBORS
+
+def GlobalTransform(resolution):
+    """
+    Transform of the global pixel grid of the default tileset
+    """
+
+    minx, _, _, maxy = config.tileset().bounds
+    return Affine(resolution, 0, minx, 0, -resolution, maxy)
+
+def TileOrigins(resolution):
+    """
+    Pixel offsets (i0, j0) of tiles on the global pixel grid,
+    indexed by tile (row, col)
+    """
+
+    minx, _, _, maxy = config.tileset().bounds
+
+    return {
+        (row, col): (
+            int(round((maxy - tile.bounds[3]) / resolution)),
+            int(round((tile.bounds[0] - minx) / resolution))
+        )
+        for (row, col), tile in config.tileset().tileindex.items()
+    }
+
+def RasterizeReference(shapefile, resolution, topixel, elevations=None):
+    """
+    Rasterize reference linestrings on the global pixel grid
+
+    Parameters
+    ----------
+
+    shapefile: str
+        Reference linestrings, with an AXIS attribute
+
+    resolution: float
+        Pixel size
+
+    topixel: callable
+        Conversion of (x, y) real world coordinates
+        to (i, j) pixel coordinates, `topixel(coordinates, transform)`
+
+    elevations: str, optional
+        Elevation raster used to drape linestrings,
+        or None to keep linestrings' z
+
+    Returns
+    -------
+
+    pixels: array, shape (n, 4)
+        (i, j, z, axis) reference pixels,
+        in order of first appearance along linestrings
+    """
+
+    transform = GlobalTransform(resolution)
+    pixels = list()
+    lines = list()
+
+    with fiona.open(shapefile) as fs:
+        for feature in fs:
+
+            axis = feature['properties']['AXIS']
+
+            if elevations is None:
+
+                coordinates = np.array(
+                    feature['geometry']['coordinates'],
+                    dtype='float32')
+
+            else:
+
+                coordinates = np.array([
+                    (p[0], p[1], 0.0) for p in feature['geometry']['coordinates']
+                ], dtype='float32')
+
+            lines.append((axis, coordinates))
+
+    if elevations and lines:
+
+        # drape all linestrings at once
+        (z, _), = SampleRasters(
+            np.concatenate([coordinates for _, coordinates in lines]),
+            elevations)
+
+        offsets = np.cumsum([len(coordinates) for _, coordinates in lines])[:-1]
+
+        for (_, coordinates), line_z in zip(lines, np.split(z, offsets)):
+            coordinates[:, 2] = line_z
+
+    with click.progressbar(lines) as iterator:
+        for axis, coordinates in iterator:
+
+            coordinates[:, :2] = topixel(coordinates[:, :2], transform)
+
+            for a, b in zip(coordinates[:-1], coordinates[1:]):
+                for i, j, z in rasterize_linestringz(a, b):
+                    pixels.append((i, j, z, axis))
+
+    if not pixels:
+        return np.zeros((0, 4), dtype='float64')
+
+    pixels = np.array(pixels, dtype='float64')
+    _, first = np.unique(pixels[:, :2], axis=0, return_index=True)
+
+    return pixels[np.sort(first)]
+
+def BuildReferenceIndex(dataset, pixels, resolution, tiles, **kwargs):
+    """
+    Bucket global reference `pixels` by tile,
+    keeping pixels within one tile around each tile,
+    and save one npz file per tile in `tiles`,
+    with pixel coordinates local to the tile
+    """
+
+    tileset = config.tileset()
+    origins = TileOrigins(resolution)
+    grid = {
+        (i0 // tileset.height, j0 // tileset.width): (row, col)
+        for (row, col), (i0, j0) in origins.items()
+    }
+
+    cells = np.column_stack([
+        np.int64(pixels[:, 0]) // tileset.height,
+        np.int64(pixels[:, 1]) // tileset.width
+    ])
+
+    tile_keys = sorted(grid.values())
+    tile_ids = {tile: k for k, tile in enumerate(tile_keys)}
+    targets = list()
+    sources = list()
+
+    for di, dj in [(0, 0)] + NEIGHBORS:
+
+        keys, inverse = np.unique(cells + (di, dj), axis=0, return_inverse=True)
+        ids = np.array([
+            tile_ids[grid[key]] if key in grid else -1
+            for key in map(tuple, keys)
+        ], dtype='int64')
+        target = ids[inverse.reshape(-1)]
+        valid = target >= 0
+
+        targets.append(target[valid])
+        sources.append(np.flatnonzero(valid))
+
+    targets = np.concatenate(targets) if targets else np.zeros(0, dtype='int64')
+    sources = np.concatenate(sources) if sources else np.zeros(0, dtype='int64')
+    order = np.lexsort((sources, targets))
+    targets = targets[order]
+    sources = sources[order]
+    splits = np.flatnonzero(np.diff(targets)) + 1
+
+    buckets = {
+        tile_keys[selected_targets[0]]: selected
+        for selected_targets, selected in zip(
+            np.split(targets, splits),
+            np.split(sources, splits))
+        if len(selected)
+    }
+
+    for row, col in tiles:
+
+        output = dataset.tilename(row=row, col=col, **kwargs)
+        i0, j0 = origins.get((row, col), (0, 0))
+
+        selected = buckets.get((row, col), np.zeros(0, dtype='int64'))
+
+        np.savez(
+            output,
+            i=np.int32(pixels[selected, 0] - i0),
+            j=np.int32(pixels[selected, 1] - j0),
+            z=np.float32(pixels[selected, 2]),
+            axis=np.uint32(pixels[selected, 3]))
+
+def LoadReferencePixels(dataset, row, col, **kwargs):
+    """
+    Load reference pixels of tile (row, col),
+    as a (n, 4) array of (i, j, z, axis) records,
+    or None if the tile has no index
+    """
+
+    filename = dataset.tilename(row=row, col=col, **kwargs)
+
+    if not os.path.exists(filename):
+        return None
+
+    with np.load(filename) as data:
+
+        return np.column_stack([
+            data['i'],
+            data['j'],
+            data['z'],
+            data['axis']
+        ]).astype('float64')
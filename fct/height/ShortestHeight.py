@@ -14,15 +14,15 @@ Valley bottom extraction procedure - shortest path exploration
 """
 
 import os
-from collections import namedtuple
-import itertools
-from operator import itemgetter
+import tempfile
+from functools import partial
 from multiprocessing import Pool
 
 import numpy as np
 import click
 
 import rasterio as rio
+from rasterio.transform import Affine
 import fiona
 
 from ..config import (
@@ -35,7 +35,13 @@ from .. import transform as fct
 from .. import speedup
 from ..tileio import (
     PadRaster,
-    border
+    WriteRaster,
+    OpenRaster
+)
+from ..spillover import (
+    SpilloverTile,
+    IterateSpillovers,
+    border_pixels
 )
 
 class Parameters:
@@ -66,6 +72,9 @@ class Parameters:
         'apply jitter on performing shortest path exploration')
     tmp_suffix = LiteralParameter(
         'temporary files suffix')
+    mosaic = LiteralParameter(
+        'explore domain tiles as one memory-mapped mosaic, '
+        'instead of iterating tile spillovers')
 
     def __init__(self, axis=None):
         """
@@ -99,243 +108,420 @@ class Parameters:
         self.distance_max = 2000
         self.jitter = 0.4
         self.tmp_suffix = '.tmp'
+        self.mosaic = False
 
 
-def ShortestHeightTile(row, col, seeds, params, **kwargs):
+class ShortestHeightState(SpilloverTile):
     """
-    Valley bottom shortest path exploration
+    Valley bottom shortest path exploration state of one tile,
+    padded with a one-pixel border from neighboring tiles
     """
 
-    elevations, profile = PadRaster(row, col, params.dem, padding=1, **params.dem.arguments(kwargs))
-    transform = profile['transform']
-    nodata = profile['nodata']
-    height, width = elevations.shape
+    fields = [
+        ('height', 'float32'),
+        ('distance', 'float32')
+    ]
 
-    # if not params.mask.none:
+    def __init__(self, row, col, params, **kwargs):
 
-    #     mask, mask_profile = PadRaster(row, col, params.mask.name, padding=1)
-    #     mask_nodata = mask_profile['nodata']
-    #     elevations[mask == mask_nodata] = nodata
+        super().__init__(row, col)
+        self.params = params
+        self.kwargs = kwargs
 
-    #     del mask
+    def load(self):
 
-    output_height = str(params.height.tilename(row=row, col=col, **kwargs))
-    # config.tileset().tilename('shortest_height', row=row, col=col)
-    output_distance = str(params.distance.tilename(row=row, col=col, **kwargs))
-    # config.tileset().tilename('shortest_distance', row=row, col=col)
-    output_state = str(params.state.tilename(row=row, col=col, **kwargs))
-    # config.tileset().tilename('shortest_state', row=row, col=col)
+        row = self.row
+        col = self.col
+        params = self.params
+        kwargs = self.kwargs
 
-    if os.path.exists(output_height):
+        if not os.path.exists(params.dem.tilename(row=row, col=col, **kwargs)):
+            return False
 
-        heights, _ = PadRaster(row, col, params.height, padding=1, **params.height.arguments(kwargs))
-        distance, _ = PadRaster(row, col, params.distance, padding=1, **params.distance.arguments(kwargs))
-        state, _ = PadRaster(row, col, params.state, padding=1, **params.state.arguments(kwargs))
+        elevations, profile = PadRaster(row, col, params.dem, padding=1, **params.dem.arguments(kwargs))
+        nodata = profile['nodata']
+        height, width = elevations.shape
 
-    else:
+        output_height = str(params.height.tilename(row=row, col=col, **kwargs))
 
-        heights = np.full((height, width), nodata, dtype='float32')
-        distance = np.full((height, width), nodata, dtype='float32')
-        state = np.zeros((height, width), dtype='uint8')
-        state[elevations == nodata] = 255
+        if os.path.exists(output_height):
 
-        if not params.mask.none:
+            heights, _ = PadRaster(row, col, params.height, padding=1, **params.height.arguments(kwargs))
+            distance, _ = PadRaster(row, col, params.distance, padding=1, **params.distance.arguments(kwargs))
+            state, _ = PadRaster(row, col, params.state, padding=1, **params.state.arguments(kwargs))
 
-            mask, mask_profile = PadRaster(row, col, params.mask.name, padding=1, **params.mask.arguments(kwargs))
-            mask_nodata = mask_profile['nodata']
+        else:
 
-            if params.mask_height_max > 0:
+            heights = np.full((height, width), nodata, dtype='float32')
+            distance = np.full((height, width), nodata, dtype='float32')
+            state = np.zeros((height, width), dtype='uint8')
+            state[elevations == nodata] = 255
 
-                height_max = params.mask_height_max
-                valid = (mask != mask_nodata) & (mask >= -height_max) & (mask <= height_max)
-                state[~valid] = 255
-                del valid
+            if not params.mask.none:
 
-            else:
+                mask, mask_profile = PadRaster(row, col, params.mask.name, padding=1, **params.mask.arguments(kwargs))
+                mask_nodata = mask_profile['nodata']
 
-                state[mask == mask_nodata] = 255
+                if params.mask_height_max > 0:
 
-            del mask
+                    height_max = params.mask_height_max
+                    valid = (mask != mask_nodata) & (mask >= -height_max) & (mask <= height_max)
+                    state[~valid] = 255
+                    del valid
 
-    coord = itemgetter(0, 1)
-    pixels = fct.worldtopixel(np.array([coord(seed) for seed in seeds], dtype='float32'), transform)
-    intile = np.array([0 <= i < height and 0 <= j < width for i, j in pixels])
+                else:
 
-    seed_heights = np.array([seed[2] for seed in seeds], dtype='float32')
-    seed_distance = np.array([seed[3] for seed in seeds], dtype='float32')
+                    state[mask == mask_nodata] = 255
 
-    pixels = pixels[intile]
-    seed_heights = seed_heights[intile]
-    seed_distance = seed_distance[intile]
+                del mask
 
-    recorded_distance = distance[pixels[:, 0], pixels[:, 1]]
-    shortest = (recorded_distance == nodata) | (seed_distance < recorded_distance)
+        self.elevations = elevations
+        self.heights = heights
+        self.distance = distance
+        self.state = state
+        self.profile = profile
+        self.nodata = nodata
+        self.transform = profile['transform']
+        self.height = height
+        self.width = width
 
-    pixels = pixels[shortest]
-    heights[pixels[:, 0], pixels[:, 1]] = seed_heights[shortest]
-    distance[pixels[:, 0], pixels[:, 1]] = seed_distance[shortest]
+        return True
 
-    state[pixels[:, 0], pixels[:, 1]] = 1
-    control = np.copy(state)
+    def seed(self, seeds):
 
-    reference = elevations - heights
-    del heights
+        pixels, intile = self.seed_pixels(seeds)
+        seed_heights = seeds['height'][intile]
+        seed_distance = seeds['distance'][intile]
 
-    speedup.valley_bottom_shortest(
-        elevations,
-        state,
-        reference,
-        distance,
-        max_dz=params.height_max,
-        min_distance=params.distance_min,
-        max_distance=params.distance_max,
-        jitter=params.jitter)
+        # when several seeds hit the same pixel,
+        # apply shortest seed last
 
-    spillovers = [
-        (i, j) for i, j in border(height, width)
-        if control[i, j] != 2 and state[i, j] == 2
-    ]
+        order = np.argsort(-seed_distance, kind='stable')
+        pixels = pixels[order]
+        seed_heights = seed_heights[order]
+        seed_distance = seed_distance[order]
 
-    del control
+        recorded_distance = self.distance[pixels[:, 0], pixels[:, 1]]
+        shortest = (recorded_distance == self.nodata) | (seed_distance < recorded_distance)
 
-    # restore unresolved cells' state
-    state[state == 1] = 2
+        pixels = pixels[shortest]
+        self.heights[pixels[:, 0], pixels[:, 1]] = seed_heights[shortest]
+        self.distance[pixels[:, 0], pixels[:, 1]] = seed_distance[shortest]
+        self.state[pixels[:, 0], pixels[:, 1]] = 1
 
-    heights = elevations - reference
-    heights[(state == 0) | (state == 255)] = nodata
-    distance[(state == 0) | (state == 255)] = nodata
+        return int(np.sum(shortest))
 
-    if spillovers:
+    def run(self):
 
-        xy = fct.pixeltoworld(np.array(spillovers, dtype='int32'), transform)
+        params = self.params
+        nodata = self.nodata
+        elevations = self.elevations
+        distance = self.distance
+        state = self.state
 
-        def attributes(k, ij):
-            """
-            Returns (row, col, x, y, height, distance)
-            """
+        control = np.copy(state)
+        reference = elevations - self.heights
 
-            i, j = ij
+        speedup.valley_bottom_shortest(
+            elevations,
+            state,
+            reference,
+            distance,
+            max_dz=params.height_max,
+            min_distance=params.distance_min,
+            max_distance=params.distance_max,
+            jitter=params.jitter)
 
-            if i == 0:
-                prow = row - 1
-            elif i == height-1:
-                prow = row + 1
-            else:
-                prow = row
+        pixels = border_pixels(self.height, self.width)
+        pixels = pixels[
+            (control[pixels[:, 0], pixels[:, 1]] != 2) &
+            (state[pixels[:, 0], pixels[:, 1]] == 2)
+        ]
 
-            if j == 0:
-                pcol = col - 1
-            elif j == width-1:
-                pcol = col + 1
-            else:
-                pcol = col
+        del control
 
-            return (prow, pcol) + tuple(xy[k]) + (heights[i, j], distance[i, j])
+        # restore unresolved cells' state
+        state[state == 1] = 2
 
-        spillovers = [
-            attributes(k, ij)
-            for k, ij in enumerate(spillovers)
-        ]
+        heights = elevations - reference
+        heights[(state == 0) | (state == 255)] = nodata
+        distance[(state == 0) | (state == 255)] = nodata
+        self.heights = heights
 
-    del elevations
-    del reference
+        return self.spillovers(
+            pixels,
+            height=heights[pixels[:, 0], pixels[:, 1]],
+            distance=distance[pixels[:, 0], pixels[:, 1]])
 
-    heights = heights[1:-1, 1:-1]
-    distance = distance[1:-1, 1:-1]
-    state = state[1:-1, 1:-1]
+    def save(self, suffix=''):
 
-    height, width = heights.shape
-    transform = transform * transform.translation(1, 1)
-    profile.update(
-        dtype='float32',
-        height=height,
-        width=width,
-        transform=transform,
-        compress='deflate')
+        params = self.params
+        kwargs = self.kwargs
+        row = self.row
+        col = self.col
 
-    output_height += params.tmp_suffix
-    output_distance += params.tmp_suffix
-    output_state += params.tmp_suffix
+        output_height = str(params.height.tilename(row=row, col=col, **kwargs)) + suffix
+        output_distance = str(params.distance.tilename(row=row, col=col, **kwargs)) + suffix
+        output_state = str(params.state.tilename(row=row, col=col, **kwargs)) + suffix
 
-    with rio.open(output_height, 'w', **profile) as dst:
-        dst.write(heights, 1)
+        heights = self.heights[1:-1, 1:-1]
+        distance = self.distance[1:-1, 1:-1]
+        state = self.state[1:-1, 1:-1]
 
-    with rio.open(output_distance, 'w', **profile) as dst:
-        dst.write(distance, 1)
+        height, width = heights.shape
+        transform = self.transform * self.transform.translation(1, 1)
+        profile = self.profile.copy()
+        profile.update(
+            dtype='float32',
+            height=height,
+            width=width,
+            transform=transform,
+            compress='deflate')
 
-    profile.update(dtype='uint8', nodata=255)
+        # intermediate outputs are read again by next round,
+        # and distance is encoded after scaling,
+        # so they are kept at full precision
+        encode = not suffix
+        encode_distance = encode and params.scale_distance == 1.0
 
-    with rio.open(output_state, 'w', **profile) as dst:
-        dst.write(state, 1)
+        WriteRaster(output_height, heights, profile, params.height.storage if encode else None)
+        WriteRaster(output_distance, distance, profile, params.distance.storage if encode_distance else None)
 
-    return spillovers, (output_height, output_distance, output_state)
+        profile.update(dtype='uint8', nodata=255)
 
-def ShortestHeightIteration(params, spillovers, ntiles, processes=1, **kwargs):
+        with rio.open(output_state, 'w', **profile) as dst:
+            dst.write(state, 1)
+
+        return [output_height, output_distance, output_state]
+
+def MosaicTiles(params, seeds):
     """
-    Multiprocessing wrapper for ValleyBottomTile
+    Tiles which can be reached from seed tiles
+    within `params.distance_max` pixels
     """
 
-    tile = itemgetter(0, 1)
-    coordxy = itemgetter(2, 3)
-    values = itemgetter(4, 5)
+    tileset = config.tileset()
+    tile_index = tileset.tileindex
+    seed_tiles = set(zip(seeds['row'].tolist(), seeds['col'].tolist()))
 
-    spillovers = sorted(spillovers, key=tile)
-    tiles = itertools.groupby(spillovers, key=tile)
+    if params.distance_max <= 0:
+        return sorted(tile_index)
 
-    g_spillover = list()
-    tmpfiles = list()
+    radius = int(np.ceil(params.distance_max / min(tileset.height, tileset.width)))
 
-    if processes == 1:
+    return sorted(
+        (row + di, col + dj)
+        for row, col in seed_tiles
+        for di in range(-radius, radius+1)
+        for dj in range(-radius, radius+1)
+        if (row + di, col + dj) in tile_index
+    )
 
-        for (row, col), seeds in tiles:
-            seeds = [coordxy(seed) + values(seed) for seed in seeds]
-            t_spillover, tmps = ShortestHeightTile(row, col, seeds, params, **kwargs)
-            g_spillover.extend(t_spillover)
-            tmpfiles.extend(tmps)
+def ShortestHeightMosaic(params, seeds, **kwargs):
+    """
+    Valley bottom shortest path exploration
+    over one memory-mapped mosaic of domain tiles,
+    with a single priority-queue exploration,
+    instead of iterating spillovers from tile to tile.
 
-        for tmpfile in tmpfiles:
-            os.rename(tmpfile, tmpfile.replace('.tif' + params.tmp_suffix, '.tif'))
+    Returns the list of tiles with explored pixels,
+    which are the only tiles written.
+    """
 
-    else:
+    tile_index = config.tileset().tileindex
+    tiles = [
+        (row, col) for row, col in MosaicTiles(params, seeds)
+        if os.path.exists(params.dem.tilename(row=row, col=col, **kwargs))
+    ]
 
-        def arguments():
+    if not tiles:
+        return list()
 
-            for (row, col), seeds in tiles:
+    with rio.open(params.dem.tilename(row=tiles[0][0], col=tiles[0][1], **kwargs)) as ds:
+        resolution = ds.transform.a
+        nodata = ds.nodata
+        template = ds.profile.copy()
 
-                seeds = [coordxy(seed) + values(seed) for seed in seeds]
-                yield (ShortestHeightTile, row, col, seeds, params, kwargs)
+    minx = min(tile_index[tile].bounds[0] for tile in tiles)
+    maxy = max(tile_index[tile].bounds[3] for tile in tiles)
+    transform = Affine(resolution, 0, minx, 0, -resolution, maxy)
 
-        with Pool(processes=processes) as pool:
+    windows = dict()
 
-            pooled = pool.imap_unordered(starcall, arguments())
-            with click.progressbar(pooled, length=ntiles) as iterator:
-                for t_spillover, tmps in iterator:
-                    g_spillover.extend(t_spillover)
-                    tmpfiles.extend(tmps)
+    for row, col in tiles:
+
+        tile_minx, tile_miny, tile_maxx, tile_maxy = tile_index[row, col].bounds
+        i0 = int(round((maxy - tile_maxy) / resolution))
+        j0 = int(round((tile_minx - minx) / resolution))
+        i1 = int(round((maxy - tile_miny) / resolution))
+        j1 = int(round((tile_maxx - minx) / resolution))
+        windows[row, col] = (i0, j0, i1, j1)
+
+    height = max(w[2] for w in windows.values())
+    width = max(w[3] for w in windows.values())
+
+    click.secho(
+        'Build %d x %d mosaic from %d tiles' % (height, width, len(tiles)),
+        fg='cyan')
+
+    with tempfile.TemporaryDirectory(prefix='shortest') as tmpdir:
+
+        def memmap(name, dtype):
+            return np.lib.format.open_memmap(
+                os.path.join(tmpdir, name + '.npy'),
+                mode='w+',
+                dtype=dtype,
+                shape=(height, width))
+
+        # state is the only mosaic filled everywhere,
+        # elevations, reference and distance are only read
+        # where state != 255, and stay sparse elsewhere
+
+        elevations = memmap('elevations', 'float32')
+        reference = memmap('reference', 'float32')
+        distance = memmap('distance', 'float32')
+        state = memmap('state', 'uint8')
+        state[:] = 255
+
+        with click.progressbar(tiles) as iterator:
+            for row, col in iterator:
+
+                i0, j0, i1, j1 = windows[row, col]
+
+                with rio.open(params.dem.tilename(row=row, col=col, **kwargs)) as ds:
+                    tile_elevations = ds.read(1)
+
+                tile_state = np.zeros_like(tile_elevations, dtype='uint8')
+                tile_state[tile_elevations == nodata] = 255
+
+                if not params.mask.none:
+
+                    mask_raster = params.mask.tilename(row=row, col=col, **kwargs)
 
-            # with click.progressbar(pooled, length=len(arguments)) as bar:
-            #     for t_spillover in bar:
-            #         g_spillover.extend(t_spillover)
+                    if os.path.exists(mask_raster):
 
-        for tmpfile in tmpfiles:
-            os.rename(tmpfile, tmpfile.replace('.tif' + params.tmp_suffix, '.tif'))
+                        with OpenRaster(mask_raster) as ds:
 
-    return g_spillover
+                            mask = ds.read(1)
+                            mask_nodata = ds.nodata
+
+                            if params.mask_height_max > 0:
+
+                                height_max = params.mask_height_max
+                                valid = (mask != mask_nodata) & (mask >= -height_max) & (mask <= height_max)
+                                tile_state[~valid] = 255
+
+                            else:
+
+                                tile_state[mask == mask_nodata] = 255
+
+                    else:
+
+                        tile_state[:] = 255
+
+                elevations[i0:i1, j0:j1] = tile_elevations
+                reference[i0:i1, j0:j1] = tile_elevations
+                state[i0:i1, j0:j1] = tile_state
+
+        pixels = fct.worldtopixel(
+            np.column_stack([seeds['x'], seeds['y']]).astype('float32'),
+            transform)
+
+        inside = (
+            (pixels[:, 0] >= 0) & (pixels[:, 0] < height) &
+            (pixels[:, 1] >= 0) & (pixels[:, 1] < width)
+        )
+        pixels = pixels[inside]
+        seed_heights = seeds['height'][inside]
+        seed_distance = seeds['distance'][inside]
+
+        reference[pixels[:, 0], pixels[:, 1]] = \
+            elevations[pixels[:, 0], pixels[:, 1]] - seed_heights
+        distance[pixels[:, 0], pixels[:, 1]] = seed_distance
+        state[pixels[:, 0], pixels[:, 1]] = 1
+
+        click.secho('Explore %d seeds' % len(pixels), fg='cyan')
+
+        speedup.valley_bottom_shortest(
+            elevations,
+            state,
+            reference,
+            distance,
+            max_dz=params.height_max,
+            min_distance=params.distance_min,
+            max_distance=params.distance_max,
+            jitter=params.jitter)
+
+        click.secho('Write tiles', fg='cyan')
+
+        explored = list()
+        template.update(dtype='float32', compress='deflate')
+
+        with click.progressbar(tiles) as iterator:
+            for row, col in iterator:
+
+                i0, j0, i1, j1 = windows[row, col]
+                tile_state = np.array(state[i0:i1, j0:j1])
+                # restore unresolved cells' state
+                tile_state[tile_state == 1] = 2
+                unexplored = (tile_state == 0) | (tile_state == 255)
+
+                if np.all(unexplored):
+                    continue
+
+                explored.append((row, col))
+
+                heights = elevations[i0:i1, j0:j1] - reference[i0:i1, j0:j1]
+                heights[unexplored] = nodata
+                tile_distance = params.scale_distance * distance[i0:i1, j0:j1]
+                tile_distance[unexplored] = nodata
+
+                profile = template.copy()
+                profile.update(
+                    height=i1 - i0,
+                    width=j1 - j0,
+                    transform=transform * transform.translation(j0, i0))
+
+                WriteRaster(
+                    params.height.tilename(row=row, col=col, **kwargs),
+                    heights,
+                    profile,
+                    params.height.storage)
+
+                WriteRaster(
+                    params.distance.tilename(row=row, col=col, **kwargs),
+                    tile_distance,
+                    profile,
+                    params.distance.storage)
+
+                profile.update(dtype='uint8', nodata=255)
+
+                with rio.open(params.state.tilename(row=row, col=col, **kwargs), 'w', **profile) as dst:
+                    dst.write(tile_state, 1)
+
+        del elevations
+        del reference
+        del distance
+        del state
+
+    return explored
 
 def ScaleShortestDistanceTile(row, col, params, **kwargs):
 
     distance_raster = params.distance.tilename(row=row, col=col, **kwargs)
 
-    with rio.open(distance_raster) as ds:
+    with OpenRaster(distance_raster) as ds:
 
-        distance = params.scale_distance * ds.read(1)
+        distance = ds.read(1)
+        nodata = ds.nodata
         profile = ds.profile.copy()
 
-    profile.update(compress='deflate')
-
-    with rio.open(distance_raster, 'w', **profile) as dst:
+    nodata_mask = distance == nodata
+    distance = params.scale_distance * distance
+    distance[nodata_mask] = nodata
+    profile.update(compress='deflate', dtype='float32', nodata=nodata)
 
-        dst.write(distance, 1)
+    WriteRaster(distance_raster, distance, profile, params.distance.storage)
 
 def ShortestHeight(params, processes=1, **kwargs):
     """
@@ -355,27 +541,23 @@ def ShortestHeight(params, processes=1, **kwargs):
 
     with fiona.open(network_shapefile) as fs:
 
-        seeds = [
+        seeds = np.array([
             seed
             for feature in fs
             for seed in generate_seeds(feature)
-        ]
-
-    count = 0
-    tile = itemgetter(0, 1)
-    g_tiles = set()
+        ], dtype=ShortestHeightState.seed_dtype())
 
-    while seeds:
+    if params.mosaic:
 
-        count += 1
-        tiles = {tile(s) for s in seeds}
-        g_tiles.update(tiles)
-        click.echo('Iteration %02d -- %d spillovers, %d tiles' % (count, len(seeds), len(tiles)))
+        g_tiles = ShortestHeightMosaic(params, seeds, **kwargs)
 
-        seeds = ShortestHeightIteration(params, seeds, len(tiles), processes, **kwargs)
+    else:
 
-    tiles = {tile(s) for s in seeds}
-    g_tiles.update(tiles)
+        g_tiles = IterateSpillovers(
+            partial(ShortestHeightState, params=params, **kwargs),
+            seeds,
+            processes=processes,
+            suffix=params.tmp_suffix)
 
     click.secho('Ok', fg='green')
 
@@ -386,7 +568,7 @@ def ShortestHeight(params, processes=1, **kwargs):
         for row, col in sorted(g_tiles):
             fp.write('%d,%d\n' % (row, col))
 
-    if params.scale_distance != 1.0:
+    if params.scale_distance != 1.0 and not params.mosaic:
 
         click.echo('Scaling distance output ...')
 
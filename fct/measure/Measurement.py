@@ -21,7 +21,6 @@ from collections import namedtuple
 from multiprocessing import Pool
 
 import numpy as np
-from scipy.spatial import cKDTree
 
 import click
 import xarray as xr
@@ -41,7 +40,11 @@ from ..config import (
     DatasetParameter
 )
 # from ..tileio import ReadRasterTile
-from ..tileio import as_window
+from ..tileio import (
+    as_window,
+    WriteRaster,
+    OpenRaster
+)
 from ..rasterize import rasterize_linestring, rasterize_linestringz
 from .. import transform as fct
 from .. import speedup
@@ -51,81 +54,44 @@ from ..metadata import set_metadata
 
 def nearest_value_and_distance(refpixels, domain, nodata):
     """
-    Returns distance in pixels !
-    """
-
-    height, width = domain.shape
-    midpoints = 0.5*(refpixels + np.roll(refpixels, 1, axis=0))
-    midpoints_valid = (refpixels[:-1, 3] == refpixels[1:, 3])
-    # midpoints = midpoints[1:, :2][midpoints_valid]
-    midpoints = midpoints[1:, :2]
-    midpoints[~midpoints_valid, 0] = -999999.0
-    midpoints[~midpoints_valid, 1] = -999999.0
-
-    midpoints_index = cKDTree(midpoints, balanced_tree=True)
-    distance = np.zeros_like(domain)
-    values = np.copy(distance)
-    nearest_axes = np.zeros_like(domain, dtype='uint32')
-
-    # semi-vectorized code, easier to understand
-
-    # for i in range(height):
+    Nearest reference value and signed distance
+    for every pixel of `domain`,
+    using an exact Euclidean feature transform
+    of reference pixels (see `speedup.nearest_reference`),
+    instead of querying a KD-tree of segment midpoints
+    for every domain pixel.
 
-    #     js = np.arange(width)
-    #     row = np.column_stack([np.full_like(js, i), js])
-    #     valid = domain[row[:, 0], row[:, 1]] != nodata
-    #     query_pixels = row[valid]
-    #     nearest_dist, nearest_idx = midpoints_index.query(query_pixels, k=1, jobs=4)
-    #     nearest_a = np.take(refpixels, nearest_idx, axis=0, mode='wrap')
-    #     nearest_b = np.take(refpixels, nearest_idx+1, axis=0, mode='wrap')
-    #     nearest_m = np.take(midpoints[:, 2], nearest_idx+1, axis=0, mode='wrap')
-    #     # same as
-    #     # nearest_value = 0.5*(nearest_a[:, 2] + nearest_b[:, 2])
-    #     dist, signed_dist, pos = ta.signed_distance(
-    #         np.float32(nearest_a),
-    #         np.float32(nearest_b),
-    #         np.float32(query_pixels))
+    Parameters
+    ----------
 
-    # faster fully-vectorized code
+    refpixels: array-like, shape (n, 4)
+        (i, j, z, axis) reference pixels,
+        ordered along reference linestrings
 
-    pixi, pixj = np.meshgrid(np.arange(height), np.arange(width), indexing='ij')
-    valid = domain != nodata
-    query_pixels = np.column_stack([pixi[valid], pixj[valid]])
+    domain: array-like, ndims=2
+        Domain raster, pixels to process are `domain != nodata`
 
-    del pixi
-    del pixj
-    del valid
+    nodata: float
+        No-data value in `domain`
 
-    _, nearest_idx = midpoints_index.query(query_pixels, k=1)
+    Returns
+    -------
 
-    # nearest_a = np.take(refpixels, nearest_idx, axis=0, mode='wrap')
-    # nearest_b = np.take(refpixels, nearest_idx+1, axis=0, mode='wrap')
+    nearest_axes: array, dtype=uint32
+        Axis of nearest reference segment
 
-    nearest_p = np.take(refpixels, np.column_stack([nearest_idx, nearest_idx+1]), axis=0, mode='wrap')
-    nearest_a = nearest_p[:, 0, :]
-    nearest_b = nearest_p[:, 1, :]
+    values: array, dtype=float32
+        Reference z interpolated along nearest reference segment
 
-    dist, signed_dist, pos = ta.signed_distance(
-        np.float32(nearest_a),
-        np.float32(nearest_b),
-        np.float32(query_pixels))
-
-    # interpolate between points A and B
-    nearest_value = nearest_a[:, 2] + pos*(nearest_b[:, 2] - nearest_a[:, 2])
-
-    nearest_axis = np.copy(nearest_a[:, 3])
-    nearest_axis[nearest_axis != nearest_b[:, 3]] = 0
-
-    # almost same as
-    # nearest_m = 0.5*(nearest_a[:, 2] + nearest_b[:, 2])
-    # same as
-    # nearest_m = np.take(midpoints[:, 2], nearest_idx+1, axis=0, mode='wrap')
-
-    distance[query_pixels[:, 0], query_pixels[:, 1]] = dist * np.sign(signed_dist)
-    values[query_pixels[:, 0], query_pixels[:, 1]] = nearest_value
-    nearest_axes[query_pixels[:, 0], query_pixels[:, 1]] = nearest_axis
+    distance: array, dtype=float32
+        Signed distance to nearest reference segment,
+        in pixels !
+    """
 
-    return nearest_axes, values, distance
+    return speedup.nearest_reference(
+        np.asarray(refpixels, dtype='float64'),
+        np.asarray(domain, dtype='float32'),
+        nodata)
 
 class Parameters:
     """
@@ -191,12 +157,13 @@ def MeasureTile(row, col, params, **kwargs):
     if not os.path.exists(mask_raster):
         return {}
 
-    with rio.open(mask_raster) as ds:
+    with OpenRaster(mask_raster) as ds:
 
         # click.echo('Read Valley Bottom')
 
         # valley_bottom = speedup.raster_buffer(ds.read(1), ds.nodata, 6.0)
         mask = ds.read(1)
+        mask_nodata = ds.nodata
         height, width = mask.shape
 
         # distance = np.full_like(valley_bottom, ds.nodata)
@@ -282,23 +249,20 @@ def MeasureTile(row, col, params, **kwargs):
         nearest, measure, distance = nearest_value_and_distance(
             np.flip(np.array(refaxis_pixels), axis=0),
             np.float32(mask),
-            ds.nodata)
+            mask_nodata)
 
         nodata = -99999.0
         distance = 5.0 * distance
-        distance[mask == ds.nodata] = nodata
-        measure[mask == ds.nodata] = nodata
+        distance[mask == mask_nodata] = nodata
+        measure[mask == mask_nodata] = nodata
 
         # click.echo('Write output')
 
         profile = ds.profile.copy()
         profile.update(compress='deflate', dtype='float32', nodata=nodata)
 
-        with rio.open(output_distance, 'w', **profile) as dst:
-            dst.write(distance, 1)
-
-        with rio.open(output_measure, 'w', **profile) as dst:
-            dst.write(measure, 1)
+        WriteRaster(output_distance, distance, profile, params.output_distance.storage)
+        WriteRaster(output_measure, measure, profile, params.output_measure.storage)
 
         profile.update(dtype='uint32', nodata=0)
 
@@ -41,7 +41,11 @@ from ..config import (
     DatasetParameter
 )
 # from ..tileio import ReadRasterTile
-from ..tileio import as_window
+from ..tileio import (
+    as_window,
+    WriteRaster,
+    OpenRaster
+)
 from ..rasterize import rasterize_linestring, rasterize_linestringz
 from .. import transform as fct
 from .. import speedup
@@ -204,12 +208,13 @@ def MeasureTile(row, col, params, **kwargs):
         nearest = ds.read(1)
         axis_list = set(x for x in np.unique(nearest))
 
-    with rio.open(mask_raster) as ds:
+    with OpenRaster(mask_raster) as ds:
 
         # click.echo('Read Valley Bottom')
 
         # valley_bottom = speedup.raster_buffer(ds.read(1), ds.nodata, 6.0)
         mask = ds.read(1)
+        mask_nodata = ds.nodata
         height, width = mask.shape
 
         # distance = np.full_like(valley_bottom, ds.nodata)
@@ -273,12 +278,12 @@ def MeasureTile(row, col, params, **kwargs):
                 # nearest using KD Tree
 
                 axis_mask = np.float32(np.copy(mask))
-                axis_mask[nearest != axis] = ds.nodata
+                axis_mask[nearest != axis] = mask_nodata
 
                 _, axis_measure, axis_distance = nearest_value_and_distance(
                     np.flip(np.array(refaxis_pixels), axis=0),
                     axis_mask,
-                    ds.nodata)
+                    mask_nodata)
 
                 axis_distance = 5.0 * axis_distance
                 distance[nearest == axis] = axis_distance[nearest == axis]
@@ -289,11 +294,8 @@ def MeasureTile(row, col, params, **kwargs):
         profile = ds.profile.copy()
         profile.update(compress='deflate', dtype='float32', nodata=nodata)
 
-        with rio.open(output_distance, 'w', **profile) as dst:
-            dst.write(distance, 1)
-
-        with rio.open(output_measure, 'w', **profile) as dst:
-            dst.write(measure, 1)
+        WriteRaster(output_distance, distance, profile, params.output_distance.storage)
+        WriteRaster(output_measure, measure, profile, params.output_measure.storage)
 
         # profile.update(dtype='uint32', nodata=0)
 
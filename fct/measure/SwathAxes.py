@@ -25,7 +25,7 @@ from shapely.geometry import asShape
 
 # from .. import transform as fct
 from ..config import config
-from ..tileio import as_window
+from ..tileio import as_window, OpenRaster
 from ..cli import starcall
 from .SwathMedialAxis import SwathMedialPoints
 
@@ -93,7 +93,7 @@ def UnitSwathAxis(axis, k, gid, m0, bounds):
     long_length = 200.0
     resolution = 5.0
 
-    with rio.open(measure_raster) as ds:
+    with OpenRaster(measure_raster) as ds:
         window = as_window(bounds, ds.transform)
         measure = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
 
@@ -106,7 +106,7 @@ def UnitSwathAxis(axis, k, gid, m0, bounds):
         valleybottom = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
         mask = mask & (valleybottom < 2)
 
-    with rio.open(distance_raster) as ds:
+    with OpenRaster(distance_raster) as ds:
 
         window = as_window(bounds, ds.transform)
         distance = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
@@ -38,7 +38,7 @@ from ..config import (
     DatasetParameter
 )
 # from ..tileio import ReadRasterTile
-from ..tileio import as_window
+from ..tileio import as_window, OpenRaster
 from ..rasterize import rasterize_linestring, rasterize_linestringz
 from .. import transform as fct
 from .. import speedup
@@ -241,7 +241,7 @@ def DisaggregateTileIntoSwaths(row, col, params, **kwargs):
     if not os.path.exists(mask_raster):
         return {}
 
-    with rio.open(mask_raster) as ds:
+    with OpenRaster(mask_raster) as ds:
 
         # click.echo('Read Valley Bottom')
 
@@ -568,7 +568,7 @@ def VectorizeOneSwathPolygon(axis, gid, measure, bounds, params, **kwargs):
         window = as_window(bounds, ds.transform)
         swath = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
 
-    with rio.open(distance_raster) as ds:
+    with OpenRaster(distance_raster) as ds:
 
         window = as_window(bounds, ds.transform)
         distance = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
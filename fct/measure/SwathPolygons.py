@@ -24,7 +24,7 @@ from ..config import (
     DatasetParameter
 )
 # from ..tileio import ReadRasterTile
-from ..tileio import as_window
+from ..tileio import as_window, OpenRaster
 
 from .. import transform as fct
 from .. import speedup
@@ -130,7 +130,7 @@ def SwathsTile(row, col, params, **kwargs):
 
         del valley_bottom
 
-    with rio.open(measure_raster) as ds:
+    with OpenRaster(measure_raster) as ds:
 
         measure = ds.read(1)
         measure[~valley_bottom_mask] = ds.nodata
@@ -283,7 +283,7 @@ def VectorizeOneSwath(axis, gid, measure, bounds, params, **kwargs):
         # swaths = np.uint32(np.round((swaths - measure_min) / params.swath_length) + 1)
         swaths = measure_to_swath_identifier(swaths, params.swath_length)
 
-    with rio.open(distance_raster) as ds:
+    with OpenRaster(distance_raster) as ds:
 
         window = as_window(bounds, ds.transform)
         distance = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
@@ -15,6 +15,7 @@ import xarray as xr
 from .. import speedup
 from .. import transform as fct
 from ..cli import starcall
+from ..tileio import OpenRaster
 from ..config import (
     DatasetParameter,
     LiteralParameter
@@ -79,7 +80,7 @@ def ElevationDistroTile(
         measure_max: float,
         **kwargs) -> Union[np.ndarray, None]:
 
-    with rio.open(params.measure.tilename(row=row, col=col, **kwargs)) as ds:
+    with OpenRaster(params.measure.tilename(row=row, col=col, **kwargs)) as ds:
 
         measure = ds.read(1)
         mask = (
@@ -143,10 +144,10 @@ def ElevationDistroTile(
     with rio.open(params.slope.tilename(row=row, col=col, **kwargs)) as ds:
         slope = ds.read(1)
 
-    with rio.open(params.distance.tilename(row=row, col=col, **kwargs)) as ds:
+    with OpenRaster(params.distance.tilename(row=row, col=col, **kwargs)) as ds:
         distance = ds.read(1)
 
-    with rio.open(params.height.tilename(row=row, col=col, **kwargs)) as ds:
+    with OpenRaster(params.height.tilename(row=row, col=col, **kwargs)) as ds:
         height = ds.read(1)
 
     if params.include_xy:
@@ -29,7 +29,7 @@ from shapely.geometry import (
 
 from .. import transform as fct
 from ..rasterize import rasterize_linestringz
-from ..tileio import as_window
+from ..tileio import as_window, OpenRaster
 from ..config import config
 
 # def MetricSwathSlope(axis, distance):
@@ -76,7 +76,7 @@ def MetricSlopes(axis, **kwargs):
     talweg_fids = list()
     segments = list()
 
-    with rio.open(measure_raster) as ds:
+    with OpenRaster(measure_raster) as ds:
         with fiona.open(talweg_feature) as fs:
             for feature in fs:
 
@@ -101,7 +101,7 @@ def MetricSlopes(axis, **kwargs):
 
                 z = np.concatenate([z, this_z], axis=0)
 
-            with rio.open(measure_raster) as ds:
+            with OpenRaster(measure_raster) as ds:
 
                 this_m = np.array(list(ds.sample(coordinates[:, :2], 1)))
                 this_m = this_m[:, 0]
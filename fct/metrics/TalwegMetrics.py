@@ -24,11 +24,11 @@ import click
 import xarray as xr
 import rasterio as rio
 import fiona
-from shapely.geometry import asShape
 
 from .. import transform as fct
 from ..rasterize import rasterize_linestring
 from ..config import config
+from ..tileio import SampleRasters
 from ..metadata import set_metadata
 
 def InterpolateMissingValues(measures, values, kind='slinear'):
@@ -95,70 +95,54 @@ def TalwegMetrics(axis):
 
     # talweg => vertices (x, y, z, swath, axis m)
 
-    swathid = np.array([])
-    coordz = np.array([])
-    coordm = np.array([])
     coords = np.array([])
-    # coordxy = np.zeros((0, 2), dtype='float32')
+    coordxy = list()
     s0 = 0.0
 
+    with rio.open(swath_raster) as ds:
+        transform = ds.transform
+
     with fiona.open(talweg_shapefile) as fs:
         with click.progressbar(fs, length=len(fs)) as iterator:
             for feature in iterator:
 
                 coordinates = np.array(feature['geometry']['coordinates'], dtype='float32')
-                length = asShape(feature['geometry']).length
-
-                with rio.open(swath_raster) as ds:
-
-                    coordij = fct.worldtopixel(coordinates[:, :2], ds.transform)
-                    pixels = list()
-                    # segment_s = list()
-
-                    # we must interpolate segments between vertices
-                    # otherwise we may miss out swaths that fit between 2 vertices
-
-                    for a, b in zip(coordij[:-1], coordij[1:]):
-                        for i, j in rasterize_linestring(a, b):
-
-                            pixels.append((i, j))
-                            # segment_s.append(s0 + s*length)
-
-                    segment_xy = fct.pixeltoworld(
-                        np.array(pixels, dtype='int32'),
-                        ds.transform)
-
-                    # coordxy = np.concatenate([
-                    #     coordxy,
-                    #     segment_xy
-                    # ], axis=0)
-
-                    # calculate s coordinate
-                    segment_s = s0 + np.cumsum(np.linalg.norm(
-                        # segment_xy[:0:-1] - segment_xy[-2::-1],
-                        segment_xy[1:] - segment_xy[:-1],
-                        axis=1))
-
-                    coords = np.concatenate([
-                        coords,
-                        [s0],
-                        segment_s
-                    ])
-
-                    s0 = segment_s[-1]
-
-                    segment_swathid = np.array(list(ds.sample(segment_xy, 1)))
-                    swathid = np.concatenate([swathid, segment_swathid[:, 0]], axis=0)
-
-                with rio.open(measure_raster) as measure_ds:
-
-                    segment_m = np.array(list(measure_ds.sample(segment_xy, 1)))
-                    coordm = np.concatenate([coordm, segment_m[:, 0]], axis=0)
-
-                with rio.open(elevation_raster) as ds:
-
-                    segment_z = np.array(list(ds.sample(segment_xy, 1)))
-                    coordz = np.concatenate([coordz, segment_z[:, 0]], axis=0)
+                coordij = fct.worldtopixel(coordinates[:, :2], transform)
+                pixels = list()
+
+                # we must interpolate segments between vertices
+                # otherwise we may miss out swaths that fit between 2 vertices
+
+                for a, b in zip(coordij[:-1], coordij[1:]):
+                    for i, j in rasterize_linestring(a, b):
+                        pixels.append((i, j))
+
+                segment_xy = fct.pixeltoworld(
+                    np.array(pixels, dtype='int32'),
+                    transform)
+
+                # calculate s coordinate
+                segment_s = s0 + np.cumsum(np.linalg.norm(
+                    segment_xy[1:] - segment_xy[:-1],
+                    axis=1))
+
+                coords = np.concatenate([
+                    coords,
+                    [s0],
+                    segment_s
+                ])
+
+                s0 = segment_s[-1]
+                coordxy.append(segment_xy)
+
+    # sample swath, measure and elevation
+    # for all talweg pixels at once
+
+    (swathid, _), (coordm, _), (coordz, _) = SampleRasters(
+        np.concatenate(coordxy),
+        swath_raster,
+        measure_raster,
+        elevation_raster)
 
     indices = sorted(enumerate(swathid), key=itemgetter(1))
     groups = itertools.groupby(indices, key=itemgetter(1))
@@ -15,9 +15,7 @@ according to D8 flow raster.
 """
 
 import os
-import itertools
-from operator import itemgetter
-
+from functools import partial
 from multiprocessing import Pool
 import numpy as np
 import xarray as xr
@@ -26,148 +24,140 @@ import click
 import rasterio as rio
 import fiona
 
-from .. import transform as fct
 from .. import speedup
 from ..tileio import PadRaster
 from ..cli import starcall
 from ..config import config
-from ..drainage.ValleyBottom import border
+from ..spillover import (
+    SpilloverTile,
+    IterateSpillovers,
+    border_pixels
+)
 from .BufferDistance import BufferMeasure
 
-def SampleWatershedsTile(tileset, axis, row, col, samples):
-    
-    # distance_raster = config.tileset(tileset).tilename(
-    #     'ax_buffer_distance',
-    #     row=row,
-    #     col=col,
-    #     axis=axis)
+class SampleWatershedsState(SpilloverTile):
+    """
+    Sample watersheds exploration state of one tile,
+    padded with a one-pixel border from neighboring tiles
+    """
 
-    output = config.tileset(tileset).tilename(
-        'ax_subgrid_watershed',
-        row=row,
-        col=col,
-        axis=axis)
+    fields = [
+        ('gid', 'uint32')
+    ]
 
-    flow, profile = PadRaster(
-        row,
-        col,
-        dataset='flow',
-        tileset='landcover',
-        padding=1)
+    def __init__(self, row, col, axis, tileset='landcover'):
 
-    height, width = flow.shape
-    nodata = profile['nodata']
-    transform = profile['transform']
+        super().__init__(row, col)
+        self.axis = axis
+        self.tileset = tileset
 
-    if os.path.exists(output):
-        with rio.open(output) as ds:
-            control = ds.read(1)
-    else:
-        control = np.zeros_like(flow, dtype='uint32')
+    def load(self):
 
-    watersheds = np.copy(control)
+        row = self.row
+        col = self.col
+        tileset = self.tileset
 
-    def intile(i, j):
+        if not os.path.exists(config.tileset(tileset).tilename('flow', row=row, col=col)):
+            return False
 
-        return all([
-            i >= 0,
-            i < height,
-            j >= 0,
-            j < width
-        ])
+        output = config.tileset(tileset).tilename(
+            'ax_subgrid_watershed',
+            row=row,
+            col=col,
+            axis=self.axis)
 
-    for gid, x, y in samples:
+        flow, profile = PadRaster(
+            row,
+            col,
+            dataset='flow',
+            tileset=tileset,
+            padding=1)
 
-        i, j = fct.index(x, y, transform)
-        if intile(i, j):
-            watersheds[i, j] = gid
+        height, width = flow.shape
+        control = None
 
-    speedup.watershed(flow, watersheds)
+        if os.path.exists(output):
+            with rio.open(output) as ds:
+                if ds.height == height and ds.width == width:
+                    control = ds.read(1)
 
-    distance, dist_profile = PadRaster(
-        row,
-        col,
-        axis=axis,
-        dataset='ax_buffer_distance',
-        tileset='landcover',
-        padding=1)
+        if control is None:
+            control = np.zeros_like(flow, dtype='uint32')
 
-    watersheds[(flow == nodata) | (distance == dist_profile['nodata'])] = 0
+        distance, dist_profile = PadRaster(
+            row,
+            col,
+            axis=self.axis,
+            dataset='ax_buffer_distance',
+            tileset=tileset,
+            padding=1)
 
-    del distance
-    del flow
+        self.flow = flow
+        self.mask = (flow == profile['nodata']) | (distance == dist_profile['nodata'])
+        self.control = control
+        self.watersheds = np.copy(control)
+        self.profile = profile
+        self.transform = profile['transform']
+        self.height = height
+        self.width = width
 
-    profile.update(
-        dtype='uint32',
-        nodata=0,
-        compress='deflate'
-    )
-
-    output += '.tmp'
+        del distance
 
-    with rio.open(output, 'w', **profile) as dst:
-        dst.write(watersheds, 1)
+        return True
 
-    spillovers = list()
+    def seed(self, seeds):
 
-    def attribute(pixel):
-        """
-        Returns value, dest. row, dest. col for pixel (i, j)
-        """
+        pixels, intile = self.seed_pixels(seeds)
+        i = pixels[:, 0]
+        j = pixels[:, 1]
+        gid = seeds['gid'][intile]
 
-        i, j = pixel
-        x, y = fct.xy(i, j, transform)
+        changed = self.watersheds[i, j] != gid
+        self.watersheds[i, j] = gid
 
-        if i == 0:
-            prow = row - 1
-        elif i == height-1:
-            prow = row + 1
-        else:
-            prow = row
+        return int(np.sum(changed))
 
-        if j == 0:
-            pcol = col - 1
-        elif j == width-1:
-            pcol = col + 1
-        else:
-            pcol = col
+    def run(self):
 
-        return watersheds[pixel], x, y, prow, pcol
+        watersheds = self.watersheds
+        control = self.control
 
-    for pixel in border(height, width):
-        if control[pixel] <= 0 < watersheds[pixel]:
-            spillovers.append(attribute(pixel))
+        speedup.watershed(self.flow, watersheds)
+        watersheds[self.mask] = 0
 
-    # print(output)
-    return spillovers, output
+        pixels = border_pixels(self.height, self.width)
+        pixels = pixels[
+            (control[pixels[:, 0], pixels[:, 1]] <= 0) &
+            (watersheds[pixels[:, 0], pixels[:, 1]] > 0)
+        ]
 
-def SampleWatershedsIteration(axis, spillovers, processes=1, **kwargs):
+        self.control = np.copy(watersheds)
 
-    attributes = itemgetter(0, 1, 2)
-    tile = itemgetter(3, 4)
-    spillovers = sorted(spillovers, key=tile)
-    tiles = itertools.groupby(spillovers, key=tile)
+        return self.spillovers(
+            pixels,
+            gid=watersheds[pixels[:, 0], pixels[:, 1]])
 
-    g_spillover = list()
-    tmpfiles = list()
-
-    def arguments():
+    def save(self, suffix=''):
 
-        for (row, col), samples in tiles:
-            samples = [attributes(sample) for sample in samples]
-            yield (SampleWatershedsTile, 'landcover', axis, row, col, samples, kwargs)
+        output = config.tileset(self.tileset).tilename(
+            'ax_subgrid_watershed',
+            row=self.row,
+            col=self.col,
+            axis=self.axis)
 
-    with Pool(processes=processes) as pool:
+        output = str(output) + suffix
 
-        pooled = pool.imap_unordered(starcall, arguments())
-        for t_spillover, output in pooled:
-            g_spillover.extend(t_spillover)
-            tmpfiles.append(output)
+        profile = self.profile.copy()
+        profile.update(
+            dtype='uint32',
+            nodata=0,
+            compress='deflate'
+        )
 
-    for tmpfile in tmpfiles:
-        os.rename(tmpfile, tmpfile.replace('.tif.tmp', '.tif'))
+        with rio.open(output, 'w', **profile) as dst:
+            dst.write(self.watersheds, 1)
 
-    return g_spillover
+        return [output]
 
 def CropRasterTile(axis, row, col, tileset='default', dataset='ax_subgrid_watershed', padding=1):
 
@@ -222,20 +212,16 @@ def DefineSampleWatersheds(axis, processes=1):
             col = feature['properties']['COL']
             x, y = feature['geometry']['coordinates']
 
-            return gid, x, y, row, col
-
-        spillovers = [as_sample(feature) for feature in fs]
-
-    tile = itemgetter(3, 4)
-    iteration = 1
-    g_tiles = set()
+            return row, col, x, y, gid
 
-    while spillovers:
+        seeds = np.array(
+            [as_sample(feature) for feature in fs],
+            dtype=SampleWatershedsState.seed_dtype())
 
-        tiles = set([tile(s) for s in spillovers])
-        g_tiles.update(tiles)
-        iteration += 1
-        spillovers = SampleWatershedsIteration(axis, spillovers, processes)
+    g_tiles = IterateSpillovers(
+        partial(SampleWatershedsState, axis=axis, tileset='landcover'),
+        seeds,
+        processes=processes)
 
     CropRasterTiles(
         axis,
@@ -17,7 +17,7 @@ import fiona
 from shapely.geometry import asShape
 
 from ..measure.SwathPolygons import measure_to_swath_identifier
-from ..tileio import as_window
+from ..tileio import as_window, OpenRaster
 from ..cli import starcall
 from ..metadata import set_metadata
 
@@ -139,7 +139,7 @@ def SwathProfileUnit(
     swath_length = params.swath_length
     swath = measure_to_swath_identifier(measure, swath_length)
 
-    with rio.open(params.values.filename(**kwargs)) as ds:
+    with OpenRaster(params.values.filename(**kwargs)) as ds:
 
         window = as_window(bounds, ds.transform)
         values = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
@@ -151,13 +151,13 @@ def SwathProfileUnit(
         nearest = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
         # nearest_nodata = ds.nodata
 
-    with rio.open(params.axis_distance.filename(**kwargs)) as ds:
+    with OpenRaster(params.axis_distance.filename(**kwargs)) as ds:
 
         window = as_window(bounds, ds.transform)
         distance = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
         # distance_nodata = ds.nodata
 
-    with rio.open(params.talweg_distance.filename(**kwargs)) as ds:
+    with OpenRaster(params.talweg_distance.filename(**kwargs)) as ds:
 
         window = as_window(bounds, ds.transform)
         talweg_distance = ds.read(1, window=window, boundless=True, fill_value=ds.nodata)
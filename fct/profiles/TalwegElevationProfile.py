@@ -16,7 +16,7 @@ from shapely.geometry import LineString, asShape
 import xarray as xr
 
 from ..cli import starcall
-from ..tileio import as_window
+from ..tileio import as_window, OpenRaster, SampleRasters
 from ..config import (
     DatasetParameter,
     LiteralParameter
@@ -106,25 +106,15 @@ def extract_talweg_data(axis, talweg, params: Parameters) -> xr.Dataset:
         talweg_measure = np.cumsum(np.linalg.norm(talweg_samples[1:] - talweg_samples[:-1], axis=1))
         talweg_measure = np.concatenate([np.zeros(1), talweg_measure])
 
-    with rio.open(params.nearest.filename()) as ds:
+    (nearest, _), (measure, measure_nodata), (z, z_nodata) = SampleRasters(
+        talweg_xy,
+        params.nearest.filename(),
+        params.measure.filename(),
+        params.dem.filename())
 
-        nearest = np.array(list(ds.sample(talweg_xy, 1)))
-        nearest = nearest.squeeze()
-        valid = (nearest == axis)
-
-    with rio.open(params.measure.filename()) as ds:
-
-        measure = np.array(list(ds.sample(talweg_xy, 1)), dtype='float32')
-        # measure = measure[:, 0]
-        measure = measure.squeeze()
-        valid = valid & (measure != ds.nodata)
-
-    with rio.open(params.dem.filename()) as ds:
-
-        z = np.array(list(ds.sample(talweg_xy, 1)), dtype='float32')
-        # z = z[:, 0]
-        z = z.squeeze()
-        valid = valid & (z != ds.nodata)
+    measure = np.float32(measure)
+    z = np.float32(z)
+    valid = (nearest == axis) & (measure != measure_nodata) & (z != z_nodata)
 
     return xr.Dataset(
         {
@@ -283,7 +273,7 @@ def fit_swath_elevations(
             fill_value=ds.nodata)
         mask = (dem != ds.nodata)
 
-    with rio.open(measure_raster) as ds:
+    with OpenRaster(measure_raster) as ds:
 
         window = as_window(bounds, ds.transform)
         measures = ds.read(
@@ -17,7 +17,7 @@ from shapely.geometry import LineString, asShape
 import xarray as xr
 
 from ..cli import starcall
-from ..tileio import as_window
+from ..tileio import as_window, OpenRaster
 from ..config import DatasetParameter
 from ..corridor.ValleyBottomFeatures import MASK_VALLEY_BOTTOM
 from ..metadata import set_metadata
@@ -105,7 +105,7 @@ def SwathValleyBottomHeight(
         # profile = ds.profile.copy()
         # nodata = ds.nodata
 
-    with rio.open(params.measure.filename(**kwargs)) as ds:
+    with OpenRaster(params.measure.filename(**kwargs)) as ds:
 
         window = as_window(bounds, ds.transform)
         measures = ds.read(
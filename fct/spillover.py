@@ -0,0 +1,498 @@
+# coding: utf-8
+
+"""
+Spillover Iteration Engine :
+propagate a tile-wise raster exploration across tile borders
+
+A tile exploration (shortest path, watershed, flow path ...)
+runs on a tile padded with a one-pixel border ;
+pixels of the padding border reached during exploration
+are spillovers, which seed the exploration of neighboring tiles.
+The engine repeats rounds of exploration until no tile
+receives improved seeds anymore.
+
+Seeds are exchanged as numpy structured arrays,
+with fields (row, col, x, y) plus value fields defined by each exploration.
+Tile state is kept resident in worker processes between rounds,
+each tile being always processed by the same worker,
+and tiles are only explored again when they accept new or improved seeds.
+Outputs are written once, after the last round.
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+import logging
+import traceback
+from multiprocessing import Process, Pipe
+
+import numpy as np
+import click
+
+from . import transform as fct
+
+SEED_FIELDS = [
+    ('row', 'int32'),
+    ('col', 'int32'),
+    ('x', 'float64'),
+    ('y', 'float64')
+]
+
+def border_pixels(height, width):
+    """
+    Pixels (i, j) of the border of an array of shape (height, width),
+    as an array of shape (n, 2)
+    """
+
+    i = np.arange(height, dtype='int32')
+    j = np.arange(1, width-1, dtype='int32')
+
+    return np.concatenate([
+        np.column_stack([i, np.zeros_like(i)]),
+        np.column_stack([i, np.full_like(i, width-1)]),
+        np.column_stack([np.zeros_like(j), j]),
+        np.column_stack([np.full_like(j, height-1), j])
+    ])
+
+class SpilloverTile():
+    """
+    Base class of tile explorations driven by `IterateSpillovers`.
+
+    Subclasses define the value fields carried by seeds,
+    and implement `load`, `seed`, `run` and `save`.
+    Rasters are padded with a one-pixel border
+    of neighboring tiles, and `transform`, `height` and `width`
+    refer to the padded rasters.
+    """
+
+    #: value fields carried by seeds, as (name, dtype) pairs
+    fields = []
+
+    def __init__(self, row, col):
+
+        self.row = row
+        self.col = col
+        self.transform = None
+        self.height = 0
+        self.width = 0
+
+    @classmethod
+    def seed_dtype(cls):
+        """
+        Structured dtype of seed arrays
+        """
+        return np.dtype(SEED_FIELDS + list(cls.fields))
+
+    @classmethod
+    def empty_seeds(cls, size=0):
+        """
+        New seed array of given size
+        """
+        return np.zeros(size, dtype=cls.seed_dtype())
+
+    def load(self):
+        """
+        Read input rasters and previous outputs if any.
+        Returns False if the tile cannot be processed,
+        in which case seeds sent to this tile are dropped.
+        """
+        raise NotImplementedError
+
+    def seed(self, seeds):
+        """
+        Apply `seeds` to tile state,
+        and return the number of seeds
+        which improved tile state
+        """
+        raise NotImplementedError
+
+    def run(self):
+        """
+        Explore tile from current state,
+        and return spillover seeds (see `spillovers`)
+        """
+        raise NotImplementedError
+
+    def save(self, suffix=''):
+        """
+        Write tile outputs,
+        appending `suffix` to output filenames,
+        and return the list of written files
+        """
+        raise NotImplementedError
+
+    def seed_pixels(self, seeds):
+        """
+        Pixel coordinates (i, j) of `seeds` in padded tile rasters
+
+        Returns
+        -------
+
+        pixels: array, shape (n, 2)
+            Pixel coordinates of seeds within tile
+
+        intile: array, shape (len(seeds),), dtype=bool
+            Seeds within tile
+        """
+
+        pixels = fct.worldtopixel(
+            np.column_stack([seeds['x'], seeds['y']]).astype('float32'),
+            self.transform)
+
+        intile = (
+            (pixels[:, 0] >= 0) & (pixels[:, 0] < self.height) &
+            (pixels[:, 1] >= 0) & (pixels[:, 1] < self.width)
+        )
+
+        return pixels[intile], intile
+
+    def spillovers(self, pixels, **values):
+        """
+        Seed array for border `pixels` (i, j),
+        with destination tile derived from pixel position,
+        and value fields given as keyword arrays
+        """
+
+        pixels = np.ascontiguousarray(pixels, dtype='int32').reshape(-1, 2)
+        seeds = self.empty_seeds(len(pixels))
+
+        if not len(pixels):
+            return seeds
+
+        i = pixels[:, 0]
+        j = pixels[:, 1]
+        xy = fct.pixeltoworld(pixels, self.transform)
+
+        seeds['row'] = self.row + (i == self.height-1) - (i == 0)
+        seeds['col'] = self.col + (j == self.width-1) - (j == 0)
+        seeds['x'] = xy[:, 0]
+        seeds['y'] = xy[:, 1]
+
+        for name, value in values.items():
+            seeds[name] = value
+
+        return seeds
+
+def group_seeds(seeds):
+    """
+    Split seed array by destination tile
+
+    Returns
+    -------
+
+    Dict of (row, col) -> seed array
+    """
+
+    if not len(seeds):
+        return dict()
+
+    order = np.lexsort((seeds['col'], seeds['row']))
+    seeds = seeds[order]
+    keys = np.column_stack([seeds['row'], seeds['col']])
+    splits = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+
+    return {
+        (int(group['row'][0]), int(group['col'][0])): group
+        for group in np.split(seeds, splits)
+    }
+
+class SpilloverWorker():
+    """
+    Tile states owned by one worker
+    """
+
+    def __init__(self, factory, resident=True, suffix='.tmp'):
+
+        self.factory = factory
+        self.resident = resident
+        self.suffix = suffix
+        self.tiles = dict()
+        self.visited = set()
+        self.void = set()
+
+    def process(self, batches):
+        """
+        Process one round of seed batches,
+        as a list of ((row, col), seeds)
+
+        Returns
+        -------
+
+        spillovers: list of seed arrays
+        explored: list of explored tiles
+        stats: (accepted seeds, void tiles)
+        tmpfiles: files written with temporary suffix
+        """
+
+        spillovers = list()
+        explored = list()
+        tmpfiles = list()
+        accepted = void = 0
+
+        for key, seeds in batches:
+
+            if key in self.void:
+                void += 1
+                continue
+
+            tile = self.tiles.get(key)
+
+            if tile is None:
+
+                tile = self.factory(*key)
+
+                if not tile.load():
+                    self.void.add(key)
+                    void += 1
+                    continue
+
+            improved = tile.seed(seeds) if len(seeds) else 0
+            accepted += improved
+
+            if improved > 0 or key not in self.visited:
+
+                spillovers.append(tile.run())
+                explored.append(key)
+                self.visited.add(key)
+
+                if not self.resident:
+                    tmpfiles.extend(tile.save(self.suffix))
+
+            if self.resident:
+                self.tiles[key] = tile
+
+        return spillovers, explored, (accepted, void), tmpfiles
+
+    def save(self):
+        """
+        Write outputs of resident tiles
+        """
+
+        for tile in self.tiles.values():
+            tile.save()
+
+        self.tiles.clear()
+        return len(self.visited)
+
+def serve(factory, resident, suffix, connection):
+    """
+    Worker process loop
+    """
+
+    worker = SpilloverWorker(factory, resident, suffix)
+
+    while True:
+
+        message, payload = connection.recv()
+
+        try:
+
+            if message == 'round':
+                connection.send(('ok', worker.process(payload)))
+            elif message == 'save':
+                connection.send(('ok', worker.save()))
+            else:
+                break
+
+        except Exception:
+
+            connection.send(('error', traceback.format_exc()))
+
+    connection.close()
+
+class SpilloverWorkerPool():
+    """
+    Worker processes with tile affinity,
+    so that tile state stays resident between rounds
+    """
+
+    def __init__(self, factory, processes, resident=True, suffix='.tmp'):
+
+        self.processes = processes
+        self.owner = dict()
+
+        if processes == 1:
+
+            self.local = SpilloverWorker(factory, resident, suffix)
+            self.workers = []
+
+        else:
+
+            self.local = None
+            self.workers = list()
+
+            for _ in range(processes):
+
+                connection, child = Pipe()
+                process = Process(target=serve, args=(factory, resident, suffix, child))
+                process.start()
+                self.workers.append((process, connection))
+
+    def assign(self, key):
+        """
+        Worker index of tile `key`
+        """
+
+        if key not in self.owner:
+            self.owner[key] = len(self.owner) % self.processes
+
+        return self.owner[key]
+
+    def broadcast(self, message, payloads):
+
+        results = list()
+
+        for (_, connection), payload in zip(self.workers, payloads):
+            connection.send((message, payload))
+
+        for _, connection in self.workers:
+
+            status, result = connection.recv()
+
+            if status == 'error':
+                raise RuntimeError('Spillover worker failed:\n%s' % result)
+
+            results.append(result)
+
+        return results
+
+    def process(self, batches):
+
+        if self.local is not None:
+            return [self.local.process(list(batches.items()))]
+
+        payloads = [list() for _ in range(self.processes)]
+
+        for key, seeds in batches.items():
+            payloads[self.assign(key)].append((key, seeds))
+
+        return self.broadcast('round', payloads)
+
+    def save(self):
+
+        if self.local is not None:
+            return self.local.save()
+
+        return sum(self.broadcast('save', [None]*self.processes))
+
+    def close(self):
+
+        for process, connection in self.workers:
+            connection.send(('stop', None))
+            process.join()
+
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def IterateSpillovers(
+        factory,
+        seeds,
+        tiles=(),
+        processes=1,
+        resident=True,
+        maxiter=0,
+        tileindex=None,
+        suffix='.tmp'):
+    """
+    Iterate tile explorations until no spillover remains
+
+    Parameters
+    ----------
+
+    factory: callable
+        `factory(row, col)` returns a new `SpilloverTile`,
+        it must be picklable when `processes` > 1,
+        eg. a `functools.partial` of a module-level class
+
+    seeds: array
+        Initial seed array, see `SpilloverTile.seed_dtype`
+
+    tiles: iterable of (row, col)
+        Tiles to explore in the first round,
+        even if they do not receive any seed
+
+    processes: int
+        Number of worker processes
+
+    resident: bool
+        Keep tile state in memory between rounds,
+        and write outputs once, after the last round.
+        Otherwise, outputs are written after each round
+        with temporary `suffix`, then renamed,
+        and tiles are read again at the next round.
+
+    maxiter: int
+        Maximum number of rounds, or 0 for no limit
+
+    tileindex: dict-like, optional
+        Drop seeds whose destination tile is not in `tileindex`
+
+    Returns
+    -------
+
+    Set of explored tiles
+    """
+
+    logger = logging.getLogger(__name__)
+
+    batches = group_seeds(seeds)
+
+    for tile in tiles:
+        if tile not in batches:
+            batches[tile] = seeds[:0]
+
+    explored_tiles = set()
+    count = 0
+
+    with SpilloverWorkerPool(factory, processes, resident, suffix) as pool:
+
+        while batches:
+
+            count += 1
+
+            if maxiter and count > maxiter:
+                logger.warning('Stopping after %d iterations', maxiter)
+                break
+
+            if tileindex is not None:
+                batches = {key: value for key, value in batches.items() if key in tileindex}
+
+            nseeds = sum(len(value) for value in batches.values())
+            results = pool.process(batches)
+
+            spillovers = [s for result in results for s in result[0]]
+            explored = [key for result in results for key in result[1]]
+            accepted = sum(result[2][0] for result in results)
+            void = sum(result[2][1] for result in results)
+            tmpfiles = [f for result in results for f in result[3]]
+
+            for tmpfile in tmpfiles:
+                os.rename(tmpfile, tmpfile[:-len(suffix)])
+
+            explored_tiles.update(explored)
+
+            click.echo(
+                'Round %02d -- %d tiles, %d seeds, %d improved, %d explored, %d void' % (
+                    count, len(batches), nseeds, accepted, len(explored), void))
+
+            if spillovers:
+                batches = group_seeds(np.concatenate(spillovers))
+            else:
+                batches = dict()
+
+        if resident:
+            click.secho('Write %d tiles' % pool.save(), fg='cyan')
+
+    return explored_tiles
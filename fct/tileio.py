@@ -7,6 +7,7 @@ import math
 import subprocess
 from typing import Union
 from glob import glob
+from xml.etree import ElementTree
 
 import numpy as np
 import rasterio as rio
@@ -93,7 +94,7 @@ def ReadRasterTile(
     tile_height = tileset.height + 2*padding
     tile_width = tileset.width + 2*padding
 
-    with rio.open(file1) as ds:
+    with OpenRaster(file1) as ds:
 
         row_offset, col_offset = ds.index(tile.x0, tile.y0)
 
@@ -114,7 +115,7 @@ def ReadRasterTile(
             xres = config.datasource(dataset2).resolution
             yres = config.datasource(dataset2).resolution
 
-            with rio.open(file2) as ds2:
+            with OpenRaster(file2) as ds2:
 
                 i2, j2 = ds2.index(*ds.xy(window1.row_off, window1.col_off))
                 window2 = Window(j2, i2, tile_width//xres, tile_height//yres)
@@ -130,24 +131,38 @@ def ReadRasterTile(
 
     return data, profile
 
-def DownsampleRasterTile(row, col, dataset1, dataset2=None, factor=2):
+def DownsampleRasterTile(
+        row: int,
+        col: int,
+        dataset1: Union[str, DatasourceResolver],
+        dataset2: Union[str, DatasourceResolver] = None,
+        factor: int = 2,
+        resampling: Resampling = Resampling.nearest):
+    """
+    Read tile (row, col) from datasource `dataset1`
+    downsampled by `factor`,
+    filling nodata with values from `dataset2` if provided.
+    Tile size in pixels is derived from tile bounds
+    and from the resolution of the datasources themselves.
+    """
 
-    tile_index = tileindex()
-    tile = tile_index[row, col]
+    if isinstance(dataset1, DatasourceResolver):
+        dataset1 = dataset1.name
 
+    if isinstance(dataset2, DatasourceResolver):
+        dataset2 = dataset2.name
+
+    tile = config.tileset('default').tileindex[row, col]
     file1 = config.datasource(dataset1).filename
-    # tile_height = int(parameter('input.height'))
-    # tile_width = int(parameter('input.width'))
-    # xres = float(parameter('input.xres'))
-    # yres = float(parameter('input.yres'))
 
-    tile_height = tile_width = 800
-    xres = yres = 49.950637774860638
+    with OpenRaster(file1) as ds:
 
-    height = math.ceil(tile_height / factor)
-    width = math.ceil(tile_width / factor)
+        minx, miny, maxx, maxy = tile.bounds
+        tile_height = int(round((maxy - miny) / ds.res[1]))
+        tile_width = int(round((maxx - minx) / ds.res[0]))
 
-    with rio.open(file1) as ds:
+        height = math.ceil(tile_height / factor)
+        width = math.ceil(tile_width / factor)
 
         row_offset, col_offset = ds.index(tile.x0, tile.y0)
         window1 = Window(col_offset, row_offset, tile_width, tile_height)
@@ -155,7 +170,8 @@ def DownsampleRasterTile(row, col, dataset1, dataset2=None, factor=2):
         data = ds.read(
             1, window=window1,
             boundless=True, fill_value=ds.nodata,
-            out_shape=(height, width))
+            out_shape=(height, width),
+            resampling=resampling)
 
         transform = ds.transform * ds.transform.translation(col_offset, row_offset) * \
             ds.transform.scale(
@@ -172,10 +188,13 @@ def DownsampleRasterTile(row, col, dataset1, dataset2=None, factor=2):
 
             file2 = config.datasource(dataset2).filename
 
-            with rio.open(file2) as ds2:
+            with OpenRaster(file2) as ds2:
+
+                xres = ds.res[0] / ds2.res[0]
+                yres = ds.res[1] / ds2.res[1]
 
                 i2, j2 = ds2.index(*ds.xy(window1.row_off, window1.col_off))
-                window2 = Window(j2, i2, tile_width//xres, tile_height//yres)
+                window2 = Window(j2, i2, tile_width*xres, tile_height*yres)
 
                 data2 = ds2.read(
                     1,
@@ -188,6 +207,241 @@ def DownsampleRasterTile(row, col, dataset1, dataset2=None, factor=2):
 
     return data, profile
 
+def EncodeRaster(data: np.ndarray, nodata: float, storage):
+    """
+    Encode float `data` as scaled integers
+    according to `storage` codec
+    (see `config.Dataset.storage`).
+    Values out of the range of the storage type are clipped.
+
+    Returns
+    -------
+
+    Encoded array, of type `storage.dtype`,
+    with no-data encoded as `storage.nodata`
+    """
+
+    info = np.iinfo(storage.dtype)
+    low = info.min + (storage.nodata == info.min)
+    high = info.max - (storage.nodata == info.max)
+
+    valid = (data != nodata) & ~np.isnan(data)
+    encoded = np.full(data.shape, storage.nodata, dtype=storage.dtype)
+    encoded[valid] = np.clip(
+        np.rint((data[valid] - storage.offset) / storage.scale),
+        low, high)
+
+    return encoded
+
+def decode_band(ds, data: np.ndarray, band: int = 1):
+    """
+    Decode scaled-integer `data` read from band `band` of dataset `ds`,
+    using band scale and offset metadata.
+    Data without scale and offset are returned as is.
+
+    Returns
+    -------
+
+    data: array
+        float32 decoded values, or `data` if not encoded
+
+    nodata: float
+        no-data value of returned data,
+        as recorded by `WriteRaster`,
+        or the decoded value of the encoded no-data value
+    """
+
+    scale = ds.scales[band-1]
+    offset = ds.offsets[band-1]
+    nodata = ds.nodatavals[band-1]
+
+    if (scale == 1.0 and offset == 0.0) or not np.issubdtype(data.dtype, np.integer):
+        return data, nodata
+
+    decoded = np.float32(data * scale + offset)
+
+    if nodata is not None:
+        decoded_nodata = ds.tags(band).get('DECODED_NODATA', nodata * scale + offset)
+        nodata = float(np.float32(decoded_nodata))
+        decoded[data == ds.nodatavals[band-1]] = nodata
+
+    return decoded, nodata
+
+class DecodedRaster():
+    """
+    Read-only view of an open rasterio dataset,
+    decoding scaled-integer bands to float32 (see `WriteRaster`).
+
+    `read()` and `sample()` return decoded values,
+    and `dtypes`, `nodata`, `nodatavals` and `profile`
+    describe decoded values ;
+    other attributes are those of the wrapped dataset.
+    Bands without scale and offset are read as is.
+    """
+
+    def __init__(self, ds):
+
+        self.dataset = ds
+        self._dtypes = list()
+        self._nodatavals = list()
+
+        for band, dtype in enumerate(ds.dtypes, 1):
+
+            decoded, nodata = decode_band(ds, np.zeros(1, dtype=dtype), band)
+            self._dtypes.append(decoded.dtype.name)
+            self._nodatavals.append(nodata)
+
+    def __getattr__(self, name):
+        return getattr(self.dataset, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.dataset.close()
+        return False
+
+    @property
+    def dtypes(self):
+        return tuple(self._dtypes)
+
+    @property
+    def nodatavals(self):
+        return tuple(self._nodatavals)
+
+    @property
+    def nodata(self):
+        return self._nodatavals[0]
+
+    @property
+    def profile(self):
+
+        profile = self.dataset.profile.copy()
+        profile.update(dtype=self._dtypes[0], nodata=self._nodatavals[0])
+
+        return profile
+
+    def encoded_fill_value(self, band, fill_value):
+        """
+        Translate decoded no-data `fill_value`
+        to the encoded no-data value of band `band`
+        """
+
+        if fill_value is not None and fill_value == self._nodatavals[band-1]:
+            return self.dataset.nodatavals[band-1]
+
+        return fill_value
+
+    def read(self, indexes=None, **kwargs):
+        """
+        Read and decode bands, see rasterio's `read()`.
+        Boundless reads are filled with the band's no-data value
+        by default.
+        """
+
+        bands = indexes
+
+        if bands is None:
+            bands = list(range(1, self.dataset.count + 1))
+        elif isinstance(bands, int):
+            bands = [bands]
+
+        if kwargs.get('boundless', False):
+            kwargs['fill_value'] = self.encoded_fill_value(
+                bands[0],
+                kwargs.get('fill_value', self._nodatavals[bands[0]-1]))
+
+        data = self.dataset.read(indexes, **kwargs)
+
+        if isinstance(indexes, int):
+            return decode_band(self.dataset, data, indexes)[0]
+
+        return np.stack([
+            decode_band(self.dataset, data[k], band)[0]
+            for k, band in enumerate(bands)
+        ])
+
+    def sample(self, xy, indexes=None, **kwargs):
+        """
+        Sample and decode band values at points (x, y),
+        see rasterio's `sample()`
+        """
+
+        bands = indexes
+
+        if bands is None:
+            bands = list(range(1, self.dataset.count + 1))
+        elif isinstance(bands, int):
+            bands = [bands]
+
+        for values in self.dataset.sample(xy, indexes, **kwargs):
+
+            yield np.array([
+                decode_band(self.dataset, values[k:k+1], band)[0][0]
+                for k, band in enumerate(bands)
+            ], dtype=np.result_type(*[self._dtypes[band-1] for band in bands]))
+
+def OpenRaster(filename):
+    """
+    Open raster `filename` for reading,
+    with transparent decoding of scaled-integer bands
+    (see `DecodedRaster`)
+    """
+
+    return DecodedRaster(rio.open(filename))
+
+def ReadRaster(filename, band: int = 1, **kwargs):
+    """
+    Read band `band` of raster `filename`,
+    decoding scaled-integer values to float32 (see `WriteRaster`).
+    Other keyword arguments are passed to rasterio's `read()` ;
+    boundless reads are filled with the raster's no-data value.
+
+    Returns
+    -------
+
+    data: array
+        decoded band values
+
+    profile: dict
+        raster profile, with data type and no-data value
+        of decoded values
+    """
+
+    with OpenRaster(filename) as ds:
+
+        data = ds.read(band, **kwargs)
+
+        profile = ds.profile
+        profile.update(dtype=ds.dtypes[band-1], nodata=ds.nodatavals[band-1])
+
+    return data, profile
+
+def WriteRaster(filename, data: np.ndarray, profile: dict, storage=None):
+    """
+    Write single-band raster `data` to `filename`,
+    encoded as scaled integers if `storage` codec is not None,
+    with scale, offset and original no-data value recorded in band metadata,
+    so that tile readers in this module decode values transparently.
+    """
+
+    if storage is None:
+
+        with rio.open(filename, 'w', **profile) as dst:
+            dst.write(data, 1)
+
+        return
+
+    profile_nodata = profile['nodata']
+    encoded = EncodeRaster(data, profile_nodata, storage)
+    profile = dict(profile, dtype=storage.dtype, nodata=storage.nodata)
+
+    with rio.open(filename, 'w', **profile) as dst:
+        dst.write(encoded, 1)
+        dst.scales = (storage.scale,)
+        dst.offsets = (storage.offset,)
+        dst.update_tags(1, DECODED_NODATA=repr(float(profile_nodata)))
+
 def PadRaster(
         row: int,
         col: int,
@@ -198,6 +452,7 @@ def PadRaster(
     """
     Assemble a n-pixels padded raster,
     with borders from neighboring tiles.
+    Scaled-integer tiles are decoded to float32 (see `WriteRaster`).
     """
 
     if isinstance(dataset, DatasetResolver):
@@ -351,28 +606,174 @@ def PadRaster(
 
             padded[height+padding:, width+padding:] = ds.nodata
 
+        padded, nodata = decode_band(ds, padded)
+
         transform = ds.transform * ds.transform.translation(-padding, -padding)
         profile = ds.profile.copy()
         profile.update(
             transform=transform,
             height=height+2*padding,
-            width=width+2*padding)
+            width=width+2*padding,
+            dtype=padded.dtype.name,
+            nodata=nodata)
 
     return padded, profile
 
+def group_by_block(x, y, transform, height, width, block_height, block_width):
+    """
+    Group points (x, y) by raster block,
+    for a raster of shape (height, width)
+    with blocks of shape (block_height, block_width)
+
+    Returns
+    -------
+
+    List of ((block row, block col), point indices, rows, cols),
+    with (rows, cols) pixel coordinates of points within block.
+    Points outside of raster are not included.
+    """
+
+    cols, rows = ~transform * (x, y)
+    rows = np.int64(np.floor(rows))
+    cols = np.int64(np.floor(cols))
+
+    inside = np.flatnonzero(
+        (rows >= 0) & (rows < height) &
+        (cols >= 0) & (cols < width))
+
+    if inside.size == 0:
+        return []
+
+    rows = rows[inside]
+    cols = cols[inside]
+    block_rows = rows // block_height
+    block_cols = cols // block_width
+
+    order = np.lexsort((block_cols, block_rows))
+    splits = np.flatnonzero(
+        (np.diff(block_rows[order]) != 0) |
+        (np.diff(block_cols[order]) != 0)) + 1
+
+    return [
+        (
+            (int(block_rows[group[0]]), int(block_cols[group[0]])),
+            inside[group],
+            rows[group] - block_rows[group] * block_height,
+            cols[group] - block_cols[group] * block_width
+        )
+        for group in np.split(order, splits)
+    ]
+
+def SampleRasters(coordinates, *rasters, band: int = 1, blocksize: int = 512):
+    """
+    Sample raster values at points,
+    for one or several rasters at once.
+
+    Points are grouped by raster block,
+    and each block holding at least one point is read once,
+    rather than reading one window per point
+    as `rasterio`'s `sample()` does.
+    Rasters sharing the same grid share the same grouping.
+
+    Parameters
+    ----------
+
+    coordinates: array-like, shape (n, 2) or (n, 3)
+        Points (x, y) in real world coordinates,
+        other columns are ignored
+
+    rasters: str
+        Raster filenames (GeoTiff, VRT ...)
+
+    band: int
+        Band to sample, defaults to first band
+
+    blocksize: int
+        Size in pixels of windows read at once,
+        rounded up to a multiple of the raster's internal block shape
+
+    Returns
+    -------
+
+    List of (values, nodata), one per raster,
+    with values an array of shape (n,) and of the raster's data type,
+    and nodata the raster's no-data value (or 0),
+    which is also the value of points outside of the raster.
+    Scaled-integer rasters are decoded to float32 (see `WriteRaster`).
+    """
+
+    coordinates = np.asarray(coordinates, dtype='float64')
+    x = coordinates[:, 0]
+    y = coordinates[:, 1]
+
+    grids = dict()
+    values = list()
+
+    for raster in rasters:
+
+        with rio.open(raster) as ds:
+
+            nodata = ds.nodatavals[band-1]
+            if nodata is None:
+                nodata = 0
+
+            out = np.full(len(coordinates), nodata, dtype=ds.dtypes[band-1])
+
+            block_height, block_width = ds.block_shapes[band-1]
+            block_height *= max(1, math.ceil(blocksize / block_height))
+            block_width *= max(1, math.ceil(blocksize / block_width))
+
+            grid = (tuple(ds.transform), ds.height, ds.width, block_height, block_width)
+
+            if grid not in grids:
+                grids[grid] = group_by_block(
+                    x, y,
+                    ds.transform,
+                    ds.height,
+                    ds.width,
+                    block_height,
+                    block_width)
+
+            for (block_row, block_col), points, rows, cols in grids[grid]:
+
+                row_offset = block_row * block_height
+                col_offset = block_col * block_width
+
+                window = Window(
+                    col_offset,
+                    row_offset,
+                    min(block_width, ds.width - col_offset),
+                    min(block_height, ds.height - row_offset))
+
+                data = ds.read(band, window=window)
+                out[points] = data[rows, cols]
+
+            out, decoded_nodata = decode_band(ds, out, band)
+
+            if decoded_nodata is not None:
+                nodata = decoded_nodata
+
+        values.append((out, nodata))
+
+    return values
+
 def buildvrt(tileset: str, dataset: Union[str, DatasetResolver], suffix:bool = True, **kwargs):
     """
-    Build GDAL Virtual Raster from tile dataset
+    Build GDAL Virtual Raster from tile dataset.
+    Tiles of datasets with a scaled-integer storage codec
+    are decoded to float32 by the virtual raster.
     """
 
     if isinstance(dataset, DatasetResolver):
 
         vrt = dataset.filename(tileset=None, **kwargs)
+        storage = dataset.storage
         # vrt = config.filename(dataset.name, **dataset.arguments(kwargs))
 
     else:
 
         vrt = config.filename(dataset, **kwargs)
+        storage = config.dataset(dataset).storage
 
     tiledir = config.tileset(tileset).tiledir
     workdir = os.path.dirname(vrt)
@@ -385,6 +786,12 @@ def buildvrt(tileset: str, dataset: Union[str, DatasetResolver], suffix:bool = T
     searchpath = os.path.join(workdir, tiledir, prefix)
     tiles = glob(os.path.join(searchpath, f'{prefix}_*.tif'))
     
+    if storage is not None:
+        # build an intermediate virtual raster of scaled integers,
+        # then a float32 virtual raster decoding values
+        encoded = output
+        output = os.path.join(workdir, ''.join(['.', os.path.basename(output)]))
+
     command = ['gdalbuildvrt', 
                '-a_srs', f'EPSG:{config.srid}', 
                '-overwrite', 
@@ -393,6 +800,40 @@ def buildvrt(tileset: str, dataset: Union[str, DatasetResolver], suffix:bool = T
     
     subprocess.call(command)
 
+    if storage is not None and tiles:
+
+        # decoded tiles use the no-data value recorded by WriteRaster
+        with rio.open(tiles[0]) as ds:
+            nodata = ds.tags(1).get(
+                'DECODED_NODATA',
+                storage.nodata * storage.scale + storage.offset)
+
+        command = ['gdal_translate',
+                   '-of', 'VRT',
+                   '-ot', 'Float32',
+                   '-unscale',
+                   '-a_nodata', str(nodata),
+                   output,
+                   encoded]
+
+        subprocess.call(command)
+
+        # encoded no-data pixels must not be unscaled into valid values :
+        # mark them as source no-data, so that they are left
+        # to the no-data value of the decoded band
+        tree = ElementTree.parse(encoded)
+
+        for source in tree.iter('ComplexSource'):
+
+            source_nodata = source.find('NODATA')
+
+            if source_nodata is None:
+                source_nodata = ElementTree.SubElement(source, 'NODATA')
+
+            source_nodata.text = str(storage.nodata)
+
+        tree.write(encoded)
+
 def translate(dataset, driver='gtiff', suffix=None, **kwargs):
     """
     Translate virtual raster dataset to GeoTiff or NetCDF 4
@@ -0,0 +1,66 @@
+# coding: utf-8
+
+"""
+Shared test fixtures
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from collections import namedtuple
+
+import pytest
+
+Tile = namedtuple('Tile', ('row', 'col', 'gid'))
+
+@pytest.fixture
+def tileset(monkeypatch):
+    """
+    Patch the tile graph module with an in-memory tileset :
+    returns a function (rows, cols, height, width) -> tile index
+    """
+
+    from fct.drainage import TileGraph
+
+    def setup(rows, cols, height, width):
+
+        tile_index = {
+            (row, col): Tile(row, col, row*cols + col)
+            for row in range(rows)
+            for col in range(cols)
+        }
+
+        monkeypatch.setattr(TileGraph, 'tileindex', lambda: tile_index)
+        monkeypatch.setattr(TileGraph, 'tile_shape', lambda: (height, width))
+
+        return tile_index
+
+    return setup
+
+@pytest.fixture
+def workspace(tmp_path):
+    """
+    Configure an on-disk workspace in a temporary directory :
+    returns a function (**tilesets) -> config,
+    each tileset being given as a dict of `tiles.write_tileset` arguments.
+    The first tileset is also the default tileset.
+    """
+
+    pytest.importorskip('rasterio')
+    pytest.importorskip('fiona')
+
+    from fct.config import config
+    from tiles import write_config
+
+    def setup(**tilesets):
+
+        config.from_file(write_config(tmp_path, tilesets))
+        return config
+
+    return setup
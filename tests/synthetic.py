@@ -0,0 +1,55 @@
+# coding: utf-8
+
+"""
+Synthetic D8 flow rasters for tests
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import numpy as np
+
+#: D8 neighbor offsets, indexed by log2(direction)
+ci = np.array([-1, -1, 0, 1, 1, 1, 0, -1])
+cj = np.array([0, 1, 1, 1, 0, -1, -1, -1])
+
+def synthetic_dem(height, width, seed=0):
+    """
+    Tilted plane with random noise
+    """
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+
+    return np.float32(0.3*x + 0.2*y + 3.0*rng.random((height, width)))
+
+def d8_flow(elevations):
+    """
+    Steepest descent D8 flow direction,
+    border pixels without lower neighbor flow outside of raster,
+    pits have no flow (0)
+    """
+
+    height, width = elevations.shape
+    padded = np.pad(elevations, 1, constant_values=-np.inf)
+    slopes = np.zeros((8, height, width), dtype=np.float32)
+
+    for k in range(8):
+
+        neighbors = padded[1+ci[k]:1+ci[k]+height, 1+cj[k]:1+cj[k]+width]
+        distance = np.sqrt(2) if k % 2 else 1.0
+        slopes[k] = np.where(
+            np.isinf(neighbors),
+            1e-3,
+            (elevations - neighbors) / distance)
+
+    flow = np.int16(1) << np.int16(np.argmax(slopes, axis=0))
+    flow[np.max(slopes, axis=0) <= 0] = 0
+
+    return flow
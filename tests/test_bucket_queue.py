@@ -0,0 +1,153 @@
+# coding: utf-8
+
+"""
+Bucket queue option of shortest path kernels :
+results must match the binary heap within tolerance
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import numpy as np
+import pytest
+
+from fct import speedup
+from synthetic import synthetic_dem
+
+QUANTA = [0.1, 0.5, 1.0]
+
+# cells at exactly equal distance from two origins
+# may take their value from either origin
+MAX_TIES = 0.005
+
+def origins(height, width, count, seed):
+
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, height, count), rng.integers(0, width, count)
+
+def valley_bottom(quantum, max_dz):
+
+    height, width = 120, 150
+    elevations = synthetic_dem(height, width, seed=5)
+    state = np.zeros((height, width), dtype=np.uint8)
+    state[origins(height, width, 12, seed=5)] = 1
+    reference = np.copy(elevations)
+    distance = np.zeros((height, width), dtype=np.float32)
+
+    speedup.valley_bottom_shortest(
+        elevations, state,
+        reference=reference,
+        distance=distance,
+        max_dz=max_dz,
+        jitter=0.0,
+        quantum=quantum)
+
+    return state, reference, distance
+
+@pytest.mark.parametrize('quantum', QUANTA)
+@pytest.mark.parametrize('max_dz', [0.0, 2.0])
+def test_valley_bottom_shortest_matches_heap(quantum, max_dz):
+
+    state0, reference0, distance0 = valley_bottom(0.0, max_dz)
+    state, reference, distance = valley_bottom(quantum, max_dz)
+
+    assert np.array_equal(state, state0)
+    assert np.allclose(distance, distance0, atol=1e-4)
+    assert np.mean(reference != reference0) < MAX_TIES
+
+def value(quantum):
+
+    height, width = 120, 150
+    nodata = -1.0
+    domain = np.zeros((height, width), dtype=np.float32)
+    domain[:10, :10] = nodata
+    domain[origins(height, width, 12, seed=6)] = 1.0
+
+    values = np.zeros((height, width), dtype=np.float32)
+    values[domain == 1.0] = np.arange(1, np.sum(domain == 1.0) + 1)
+    distance = np.zeros((height, width), dtype=np.float32)
+
+    # same jitter for both queues
+    np.random.seed(6)
+
+    values = speedup.shortest_value(
+        domain, values, nodata, 1.0,
+        distance=distance,
+        quantum=quantum)
+
+    return np.asarray(values), distance
+
+@pytest.mark.parametrize('quantum', QUANTA)
+def test_shortest_value_matches_heap(quantum):
+
+    values0, distance0 = value(0.0)
+    values, distance = value(quantum)
+
+    # jittered path lengths may select another path
+    # within a few pixel steps
+    assert np.max(np.abs(distance - distance0)) < 2.5
+    assert np.mean(values != values0) < MAX_TIES
+
+def continuity(quantum):
+
+    height, width = 120, 150
+    rng = np.random.default_rng(7)
+
+    # classes <= 1 reset distance to 0,
+    # and cells at zero distance are settled in arbitrary order
+    # by both queues
+    landcover = np.uint8(rng.integers(2, 4, (height, width)))
+    out = np.copy(landcover)
+    state = np.zeros((height, width), dtype=np.uint8)
+    state[origins(height, width, 12, seed=7)] = 1
+    distance = np.zeros((height, width), dtype=np.float32)
+
+    # same jitter for both queues
+    np.random.seed(7)
+
+    speedup.continuity_analysis(
+        landcover, out, distance, state,
+        max_class=2,
+        quantum=quantum)
+
+    return out, state
+
+@pytest.mark.parametrize('quantum', QUANTA)
+def test_continuity_analysis_matches_heap(quantum):
+
+    out0, state0 = continuity(0.0)
+    out, state = continuity(quantum)
+
+    assert np.array_equal(state, state0)
+    assert np.mean(out != out0) < MAX_TIES
+
+def buffer(quantum):
+
+    height, width = 120, 150
+    nodata = -99999.0
+    data = np.full((height, width), nodata, dtype=np.float32)
+    data[origins(height, width, 12, seed=8)] = 1.0
+
+    # raster_buffer always jitters grid locations
+    np.random.seed(8)
+
+    return np.asarray(speedup.raster_buffer(data, nodata, 20.0, quantum=quantum))
+
+@pytest.mark.parametrize('quantum', QUANTA)
+def test_raster_buffer_matches_heap(quantum):
+
+    distance0 = buffer(0.0)
+    distance = buffer(quantum)
+
+    # buffer footprint may differ at its outer edge only,
+    # and path lengths by less than a few pixel steps
+    both = (distance > 0) & (distance0 > 0)
+
+    assert np.mean((distance > 0) != (distance0 > 0)) < MAX_TIES
+    assert np.max(np.abs(distance[both] - distance0[both])) < 2.5
@@ -0,0 +1,184 @@
+# coding: utf-8
+
+"""
+Scaled-integer storage codec tests :
+rasters written with a storage codec
+must read back as float32 within precision
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+pytest.importorskip('rasterio')
+
+from rasterio.windows import Window
+
+from fct.tileio import (
+    OpenRaster,
+    ReadRaster,
+    WriteRaster,
+    PadRaster,
+    SampleRasters,
+    buildvrt
+)
+from synthetic import synthetic_dem
+from tiles import tile_slices, SRID
+
+NODATA = -99999.0
+DATASET = 'shortest_height'
+
+def write_encoded(config, dataset, data):
+    """
+    Write mosaic `data` as encoded tiles of `dataset`,
+    in the default tileset of workspace `config`
+    """
+
+    tileset = config.tileset()
+    storage = config.dataset(dataset).storage
+
+    for (row, col), tile in tileset.tileindex.items():
+
+        resolution = (tile.bounds[2] - tile.bounds[0]) / tileset.width
+        profile = dict(
+            driver='GTiff',
+            height=tileset.height,
+            width=tileset.width,
+            count=1,
+            dtype='float32',
+            crs='EPSG:%d' % SRID,
+            transform=(resolution, 0.0, tile.x0, 0.0, -resolution, tile.y0),
+            nodata=NODATA,
+            compress='deflate')
+
+        filename = tileset.tilename(dataset, row=row, col=col)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        WriteRaster(filename, data[tile_slices(tile, tileset)], profile, storage)
+
+def heights(height, width):
+    """
+    Synthetic heights with no-data
+    """
+
+    data = synthetic_dem(height, width, seed=11) - 100.0
+    data[:5, :5] = NODATA
+
+    return data
+
+@pytest.fixture
+def encoded(workspace):
+
+    config = workspace(default=dict(rows=2, cols=2, height=20, width=20))
+    data = heights(40, 40)
+    write_encoded(config, DATASET, data)
+
+    return config, data
+
+def test_storage_codec_is_enabled(workspace):
+
+    config = workspace(default=dict(rows=1, cols=1, height=20, width=20))
+    storage = config.dataset(DATASET).storage
+
+    assert storage is not None
+    assert storage.dtype == 'int16'
+
+def test_write_read_round_trip(encoded):
+
+    config, data = encoded
+    storage = config.dataset(DATASET).storage
+    tileset = config.tileset()
+    tile = tileset.tileindex[0, 0]
+    filename = tileset.tilename(DATASET, row=0, col=0)
+    expected = data[tile_slices(tile, tileset)]
+
+    with OpenRaster(filename) as ds:
+        assert ds.dataset.dtypes[0] == 'int16'
+
+    values, profile = ReadRaster(filename)
+
+    assert values.dtype == np.float32
+    assert profile['dtype'] == 'float32'
+    assert profile['nodata'] == NODATA
+    assert np.array_equal(values == NODATA, expected == NODATA)
+
+    valid = (expected != NODATA)
+    assert np.max(np.abs(values[valid] - expected[valid])) <= 0.5*storage.scale + 1e-4
+
+def test_boundless_read_fills_decoded_nodata(encoded):
+
+    config, _ = encoded
+    filename = config.tileset().tilename(DATASET, row=1, col=1)
+
+    with OpenRaster(filename) as ds:
+
+        values = ds.read(
+            1,
+            window=Window(-5, -5, 30, 30),
+            boundless=True,
+            fill_value=ds.nodata)
+
+        assert ds.nodata == NODATA
+        assert values.dtype == np.float32
+        assert np.all(values[25:, :] == NODATA)
+        assert np.all(values[5:25, 5:25] != NODATA)
+
+def test_padded_and_sampled_values_are_decoded(encoded):
+
+    config, data = encoded
+    storage = config.dataset(DATASET).storage
+    tileset = config.tileset()
+
+    padded, profile = PadRaster(1, 1, DATASET, padding=2)
+
+    assert padded.dtype == np.float32
+    assert profile['nodata'] == NODATA
+    assert np.allclose(padded[:-2, :-2], data[18:, 18:], atol=0.5*storage.scale + 1e-4)
+
+    minx, _, _, maxy = tileset.bounds
+    i, j = np.array([10, 30, 35]), np.array([30, 12, 25])
+    coordinates = np.column_stack([minx + (j + 0.5) * 5.0, maxy - (i + 0.5) * 5.0])
+
+    filenames = [tileset.tilename(DATASET, row=row, col=col) for row, col in [(0, 1), (1, 0), (1, 1)]]
+    sampled = [SampleRasters(coordinates[k:k+1], filenames[k])[0][0][0] for k in range(3)]
+
+    assert np.allclose(sampled, data[i, j], atol=0.5*storage.scale + 1e-4)
+
+    with OpenRaster(filenames[2]) as ds:
+        values = np.array(list(ds.sample(coordinates[2:, :2], 1)))
+
+    assert values.dtype == np.float32
+    assert np.allclose(values[:, 0], data[i[2:], j[2:]], atol=0.5*storage.scale + 1e-4)
+
+@pytest.mark.skipif(
+    shutil.which('gdalbuildvrt') is None or shutil.which('gdal_translate') is None,
+    reason='GDAL command line tools are not available')
+def test_virtual_raster_decodes_tiles(encoded):
+
+    config, data = encoded
+    storage = config.dataset(DATASET).storage
+
+    buildvrt('default', DATASET, suffix=False)
+    vrt = config.filename(DATASET)
+
+    with OpenRaster(vrt) as ds:
+
+        assert ds.dtypes[0] == 'float32'
+        values = ds.read(1)
+        nodata = ds.nodata
+
+    assert nodata == NODATA
+    assert np.array_equal(values == NODATA, data == NODATA)
+
+    valid = (data != NODATA)
+    assert np.max(np.abs(values[valid] - data[valid])) <= 0.5*storage.scale + 1e-4
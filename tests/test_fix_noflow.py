@@ -0,0 +1,120 @@
+# coding: utf-8
+
+"""
+Batch no-flow pixels fix tests
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('rasterio')
+pytest.importorskip('fiona')
+pytest.importorskip('fct.terrain_analysis')
+
+import fiona
+
+from fct.drainage import FixNoFlow
+from tiles import write_tiles, read_tiles
+
+EAST = 4
+NORTH_EAST = 2
+SOUTH_EAST = 8
+SOUTH = 16
+
+def write_drainage(tileset, flow, streams):
+
+    write_tiles('flow', np.int16(flow), -1, tileset=tileset)
+    write_tiles('acc', np.float32(np.cumsum(streams, axis=1)), -99999.0, tileset=tileset)
+    write_tiles('drainage-raster-from-sources', np.int16(streams), -1, tileset=tileset)
+
+def test_fix_noflow_batch_follows_second_drainage(workspace):
+
+    # same 20 x 40 pixels extent, tiled differently
+    config = workspace(
+        a=dict(rows=1, cols=2, height=20, width=20),
+        b=dict(rows=2, cols=4, height=10, width=10))
+
+    height, width = 20, 40
+
+    # drainage 1 : stream along row 10, flowing east,
+    # broken by a no-flow pixel at (10, 15) in tile (0, 0)
+
+    flow1 = np.full((height, width), SOUTH, dtype='int16')
+    flow1[10, :] = EAST
+    flow1[10, 15] = 0
+    streams1 = np.zeros((height, width), dtype='int16')
+    streams1[10, :] = 1
+
+    # drainage 2 : detour along row 11,
+    # going back to drainage 1 at (10, 25) in tile (0, 1)
+
+    flow2 = np.full((height, width), SOUTH, dtype='int16')
+    flow2[10, :] = EAST
+    flow2[10, 15] = SOUTH_EAST
+    flow2[11, 16:24] = EAST
+    flow2[11, 24] = NORTH_EAST
+    streams2 = np.zeros((height, width), dtype='int16')
+    streams2[10, :16] = 1
+    streams2[11, 16:25] = 1
+    streams2[10, 25:] = 1
+
+    write_drainage('a', flow1, streams1)
+    write_drainage('b', flow2, streams2)
+
+    params = FixNoFlow.Parameters()
+    FixNoFlow.FixNoFlowBatch(params, 'a', 'b', processes=1, fix=True)
+
+    expected = np.copy(flow1)
+    expected[10, 15] = SOUTH_EAST
+    expected[11, 16:24] = EAST
+    expected[11, 24] = NORTH_EAST
+
+    assert np.array_equal(read_tiles('flow', tileset='a'), expected)
+
+    with fiona.open(params.fixed.filename(tileset='a')) as fs:
+        features = list(fs)
+
+    assert len(features) == 1
+
+    # target is the pixel where the fixed path gets back on drainage 1
+    x, y = features[0]['geometry']['coordinates']
+    minx, _, _, maxy = config.tileset('a').bounds
+    resolution = 5.0
+
+    assert int((maxy - y) // resolution) == 10
+    assert int((x - minx) // resolution) == 25
+    assert features[0]['properties']['COL'] == 0
+
+def test_tile_cache_evicts_unmodified_tiles_left_behind(workspace):
+
+    workspace(a=dict(rows=1, cols=2, height=20, width=20))
+
+    flow = np.full((20, 40), SOUTH, dtype='int16')
+    write_drainage('a', flow, np.zeros((20, 40), dtype='int16'))
+
+    params = FixNoFlow.Parameters()
+    transform = FixNoFlow.GlobalTransform(params, 'a')
+    cache = FixNoFlow.TileCache(params.flow, 'a', transform)
+
+    assert cache(5, 5) == SOUTH
+    cache.set(5, 25, EAST)
+
+    # both tiles were accessed since last call
+    assert cache.evict() == 0
+    assert set(cache.tiles) == {(0, 0), (0, 1)}
+
+    # tile (0, 1) is modified, and kept until written
+    assert cache.evict() == 1
+    assert set(cache.tiles) == {(0, 1)}
+
+    assert cache.write() == 1
+    assert read_tiles('flow', tileset='a')[5, 25] == EAST
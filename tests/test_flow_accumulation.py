@@ -0,0 +1,90 @@
+# coding: utf-8
+
+"""
+Flow accumulation and flow path length tests
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import numpy as np
+import pytest
+
+from fct import speedup
+from synthetic import ci, cj, synthetic_dem, d8_flow
+
+def flow_paths(flow):
+    """
+    Generate (i, j, step) along the flow path of every pixel,
+    `step` being the length of the step from (i, j) downstream,
+    and None at the last pixel within the raster
+    """
+
+    height, width = flow.shape
+
+    for i0 in range(height):
+        for j0 in range(width):
+
+            path = list()
+            i, j = i0, j0
+
+            while True:
+
+                direction = flow[i, j]
+
+                if direction <= 0:
+                    path.append((i, j, None))
+                    break
+
+                k = int(np.log2(direction))
+                ik, jk = i + ci[k], j + cj[k]
+
+                if not (0 <= ik < height and 0 <= jk < width):
+                    path.append((i, j, None))
+                    break
+
+                path.append((i, j, np.sqrt(2) if k % 2 else 1.0))
+                i, j = ik, jk
+
+            yield path
+
+@pytest.mark.parametrize('width', [1, 2, 3, 7])
+def test_upstream_length_matches_brute_force(width):
+
+    flow = d8_flow(synthetic_dem(30, width, seed=width))
+    _, lengths = speedup.flow_accumulation_fast(flow, upstream_length=True)
+
+    expected = np.zeros(flow.shape, dtype=np.float32)
+
+    for path in flow_paths(flow):
+
+        length = 0.0
+
+        for i, j, step in path:
+
+            expected[i, j] = max(expected[i, j], length)
+
+            if step is not None:
+                length += step
+
+    assert np.allclose(lengths, expected, atol=1e-4)
+
+@pytest.mark.parametrize('width', [1, 2, 3, 7])
+def test_flow_distance_matches_brute_force(width):
+
+    flow = d8_flow(synthetic_dem(30, width, seed=width))
+    distance = speedup.flow_distance(flow, np.zeros(flow.shape, dtype=np.float32))
+
+    expected = np.zeros(flow.shape, dtype=np.float32)
+
+    for path in flow_paths(flow):
+        i, j, _ = path[0]
+        expected[i, j] = sum(step for _, _, step in path[:-1])
+
+    assert np.allclose(distance, expected, atol=1e-4)
@@ -0,0 +1,109 @@
+# coding: utf-8
+
+"""
+Incremental drainage update tests
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('rasterio')
+pytest.importorskip('fct.terrain_analysis')
+
+from fct.drainage import (
+    DepressionFill,
+    BorderFlats,
+    FlowDirection,
+    Accumulate,
+    IncrementalDrainage
+)
+from synthetic import synthetic_dem
+from tiles import write_tiles, read_tiles
+
+NODATA = -99999.0
+
+def drainage_parameters(method):
+
+    fill = DepressionFill.Parameters()
+    fill.method = method
+    fill.max_breach_length = 5
+
+    flats = BorderFlats.Parameters()
+    direction = FlowDirection.Parameters()
+    direction.exterior = 'off'
+    accumulate = Accumulate.Parameters()
+
+    return fill, flats, direction, accumulate
+
+def full_drainage(tiles, fill, flats, direction, accumulate):
+    """
+    Full DepressionFill -> BorderFlats -> FlowDirection -> Accumulate chain
+    """
+
+    if fill.method == 'breach':
+        for row, col in tiles:
+            DepressionFill.BreachDepressions(row, col, fill, overwrite=True)
+
+    for row, col in tiles:
+        DepressionFill.LabelWatersheds(row, col, fill, overwrite=True)
+
+    DepressionFill.ResolveWatershedSpillover(fill, overwrite=True)
+
+    for row, col in tiles:
+        DepressionFill.DispatchWatershedMinimumZ(row, col, fill, overwrite=True)
+
+    for row, col in tiles:
+        BorderFlats.LabelBorderFlats(row, col, flats)
+
+    BorderFlats.ResolveFlatSpillover(flats)
+
+    for row, col in tiles:
+        BorderFlats.DispatchFlatMinimumZ(row, col, flats, overwrite=True)
+
+    for row, col in tiles:
+        FlowDirection.FlowDirectionTile(row, col, direction, overwrite=True)
+
+    for row, col in tiles:
+        Accumulate.TileOutlets(row, col, accumulate)
+
+    IncrementalDrainage.RemoveInletAreas(accumulate)
+    Accumulate.InletAreas(accumulate)
+
+    for row, col in tiles:
+        Accumulate.FlowAccumulationTile(row, col, accumulate, overwrite=True)
+
+@pytest.mark.parametrize('method', ['fill', 'breach'])
+def test_incremental_drainage_matches_full_rerun(workspace, method):
+
+    config = workspace(default=dict(rows=2, cols=2, height=40, width=40))
+    tiles = sorted(config.tileset().tileindex)
+    params = drainage_parameters(method)
+
+    dem = synthetic_dem(80, 80, seed=4)
+    write_tiles('dem', dem, NODATA)
+    full_drainage(tiles, *params)
+
+    # dam across tile (0, 0), close to its border with tile (0, 1),
+    # creating a depression upstream
+
+    edited = np.copy(dem)
+    edited[5:35, 36] += 20.0
+    write_tiles('dem', edited, NODATA, tiles=[(0, 0)])
+
+    IncrementalDrainage.IncrementalDrainage([(0, 0)], 1, *params)
+    incremental_flow = read_tiles('flow')
+    incremental_acc = read_tiles('acc')
+
+    full_drainage(tiles, *params)
+
+    assert np.array_equal(incremental_flow, read_tiles('flow'))
+    assert np.allclose(incremental_acc, read_tiles('acc'))
@@ -0,0 +1,119 @@
+# coding: utf-8
+
+"""
+Network attribution tests,
+with network nodes identified from segment endpoints
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import pytest
+
+pytest.importorskip('fiona')
+
+import fiona
+import fiona.crs
+
+from fct.drainage import JoinNetworkAttributes
+
+SRID = 2154
+
+def write_segments(filename, segments):
+
+    schema = {
+        'geometry': 'LineString',
+        'properties': [
+            ('GID', 'int'),
+            ('HEAD', 'int:1'),
+            ('ROW', 'int:4'),
+            ('COL', 'int:4')
+        ]
+    }
+
+    options = dict(driver='ESRI Shapefile', crs=fiona.crs.from_epsg(SRID), schema=schema)
+
+    with fiona.open(filename, 'w', **options) as dst:
+        for gid, coordinates in enumerate(segments, 1):
+            dst.write({
+                'geometry': {'type': 'LineString', 'coordinates': coordinates},
+                'properties': {'GID': gid, 'HEAD': 0, 'ROW': 0, 'COL': 0}
+            })
+
+def write_sources(filename, sources):
+
+    schema = {
+        'geometry': 'Point',
+        'properties': [
+            ('GID', 'int'),
+            ('CDENTITEHY', 'str:8'),
+            ('TOPONYME', 'str:254'),
+            ('AXIS', 'int'),
+            ('HACK', 'float')
+        ]
+    }
+
+    options = dict(driver='GPKG', crs=fiona.crs.from_epsg(SRID), schema=schema)
+
+    with fiona.open(filename, 'w', **options) as dst:
+        for gid, (point, code, name, axis, hack) in enumerate(sources, 1):
+            dst.write({
+                'geometry': {'type': 'Point', 'coordinates': point},
+                'properties': {
+                    'GID': gid,
+                    'CDENTITEHY': code,
+                    'TOPONYME': name,
+                    'AXIS': axis,
+                    'HACK': hack
+                }
+            })
+
+def test_join_attributes_from_segment_endpoints(tmp_path):
+
+    # tributary (segment 2) joins main stem (segments 1 and 3),
+    # segment 3 being split at a tile border (segments 3 and 4),
+    # with pixel-center vertices of a 5 m grid
+    segments = [
+        [(2.5, 52.5), (7.5, 47.5), (12.5, 42.5)],
+        [(22.5, 52.5), (17.5, 47.5), (12.5, 42.5)],
+        [(12.5, 42.5), (12.5, 37.5), (12.5, 32.5)],
+        [(12.5 + 1e-8, 32.5), (12.5, 27.5)]
+    ]
+
+    # mapped sources are located within the head pixel
+    # of their stream, not at pixel centers
+    sources = [
+        ((1.0, 54.0), 'V---0010', 'Main River', 10, 1.0),
+        ((24.0, 51.0), 'V---0020', 'Tributary', 20, 2.0)
+    ]
+
+    network = str(tmp_path / 'network.shp')
+    sources_file = str(tmp_path / 'sources.gpkg')
+    output = str(tmp_path / 'joined.shp')
+
+    write_segments(network, segments)
+    write_sources(sources_file, sources)
+
+    JoinNetworkAttributes.JoinNetworkAttributes(sources_file, network, output, precision=5.0)
+
+    with fiona.open(output) as fs:
+        features = {
+            feature['properties']['GID']: dict(feature['properties'])
+            for feature in fs
+        }
+
+    assert len(features) == 4
+
+    assert features[1]['NODEB'] == features[2]['NODEB'] == features[3]['NODEA']
+    assert features[3]['NODEB'] == features[4]['NODEA']
+
+    assert [features[gid]['AXIS'] for gid in (1, 2, 3, 4)] == [10, 20, 10, 10]
+    assert features[2]['TOPONYME'] == 'Tributary'
+    assert features[4]['CDENTITEHY'] == 'V---0010'
+
@@ -0,0 +1,184 @@
+# coding: utf-8
+
+"""
+Multi-resolution drainage tests
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('rasterio')
+pytest.importorskip('fct.terrain_analysis')
+
+import rasterio as rio
+from affine import Affine
+
+from fct import speedup
+from fct.drainage import (
+    DepressionFill,
+    BorderFlats,
+    MultiResolution
+)
+from tiles import write_tiles, read_tiles, SRID
+
+NODATA = -99999.0
+FACTOR = 8
+
+def valley_dem(height, width, seed=0):
+    """
+    Noisy valley along the middle row, draining west
+    """
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+
+    return np.float32(0.2*x + 0.5*np.abs(y - height // 2) + 3.0*rng.random((height, width)))
+
+def multi_resolution_parameters():
+
+    params = MultiResolution.Parameters()
+    params.factor = FACTOR
+    params.min_drainage = 0.01
+    params.corridor_width = 1
+    params.max_difference = 10.0
+    params.max_disagreement = 0.05
+
+    return params
+
+def coarse_dem_writer(dem):
+    """
+    Replacement for BuildCoarseDEM,
+    downsampling `dem` with minimum resampling
+    """
+
+    def BuildCoarseDEM(params, processes=1):
+
+        height, width = dem.shape
+        coarse = dem.reshape(height // FACTOR, FACTOR, width // FACTOR, FACTOR).min(axis=(1, 3))
+        output = params.coarse.filename()
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+
+        profile = dict(
+            driver='GTiff',
+            height=coarse.shape[0],
+            width=coarse.shape[1],
+            count=1,
+            dtype='float32',
+            crs='EPSG:%d' % SRID,
+            transform=Affine(5.0*FACTOR, 0, 0.0, 0, -5.0*FACTOR, 0.0),
+            nodata=NODATA)
+
+        with rio.open(output, 'w', **profile) as dst:
+            dst.write(coarse, 1)
+
+    return BuildCoarseDEM
+
+def test_block_graph_links_adjacent_labels():
+
+    labels = np.uint32([
+        [1, 1, 2],
+        [1, 1, 2],
+        [0, 3, 3]
+    ])
+
+    elevations = np.float32([
+        [5.0, 4.0, 6.0],
+        [3.0, 2.0, 7.0],
+        [NODATA, 8.0, 1.0]
+    ])
+
+    graph = MultiResolution.BlockGraph(labels, elevations)
+
+    assert graph == {
+        (0, 1): 2.0,
+        (0, 3): 8.0,
+        (1, 2): 6.0,
+        (1, 3): 2.0,
+        (2, 3): 7.0
+    }
+
+def test_tiles_outside_corridors_take_coarse_solution(workspace):
+
+    config = workspace(default=dict(rows=3, cols=3, height=32, width=32))
+    params = multi_resolution_parameters()
+    fill = DepressionFill.Parameters()
+
+    dem = valley_dem(96, 96, seed=3)
+
+    # ridges narrower than coarse pixels,
+    # disagreeing with the coarse solution
+    dem[8:24, 72:88:2] += 30.0
+
+    write_tiles('dem', dem, NODATA)
+
+    coarse_dem_writer(dem)(params)
+    MultiResolution.SolveCoarseDrainage(params)
+
+    results = {
+        (row, col): MultiResolution.CoarseWatershedTile(row, col, params, fill)[1:]
+        for row, col in config.tileset().tileindex
+    }
+
+    # valley tiles intersect corridors
+    assert all(not results[1, col][0] for col in range(3))
+    assert results[1, 0][1] == 0.0
+
+    # ridges tile falls back to the full resolution solve
+    assert not results[0, 2][0]
+    assert results[0, 2][1] > params.max_disagreement
+
+    assert results[0, 0][0] and results[2, 1][0]
+
+    with rio.open(fill.labels.tilename(row=2, col=1)) as ds:
+        labels = ds.read(1)
+
+    # one label per coarse pixel
+    assert np.max(labels) == (32 // FACTOR)**2
+    assert np.all(labels[:FACTOR, :FACTOR] == labels[0, 0])
+
+    with rio.open(fill.filled.tilename(row=2, col=1)) as ds:
+        filled = ds.read(1)
+
+    with rio.open(params.coarse_filled.filename()) as ds:
+        coarse_filled = ds.read(1)
+
+    assert np.array_equal(filled[::FACTOR, ::FACTOR], coarse_filled[8:12, 4:8])
+
+def test_multi_resolution_drainage_is_depression_free(workspace, monkeypatch):
+
+    config = workspace(default=dict(rows=3, cols=3, height=32, width=32))
+    params = multi_resolution_parameters()
+    fill = DepressionFill.Parameters()
+    flats = BorderFlats.Parameters()
+
+    dem = valley_dem(96, 96, seed=3)
+    dem[8:24, 72:88:2] += 30.0
+    write_tiles('dem', dem, NODATA)
+
+    monkeypatch.setattr(MultiResolution, 'BuildCoarseDEM', coarse_dem_writer(dem))
+
+    fine = MultiResolution.MultiResolutionDrainage(params, fill, flats)
+
+    assert fine == {(1, 0), (1, 1), (1, 2), (0, 2)}
+    assert fine < set(config.tileset().tileindex)
+
+    resolved = read_tiles(flats.output.name)
+    filled, _ = speedup.priority_flood(resolved, NODATA)
+
+    # fine tiles are only raised,
+    # coarse tiles take coarse filled elevations
+    assert np.all(resolved[32:64] >= dem[32:64])
+    # depression-free, up to pits of a few flat epsilon gradients
+    # on tile borders, as left by the full resolution chain
+    assert np.max(filled - resolved) < 0.002
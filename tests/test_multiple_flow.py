@@ -0,0 +1,128 @@
+# coding: utf-8
+
+"""
+Multiple flow direction tests
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from fct import speedup
+from fct.drainage import MultipleFlow
+from synthetic import synthetic_dem, d8_flow
+
+class SerialPool():
+    """
+    In-process replacement of multiprocessing.Pool
+    """
+
+    def __init__(self, processes=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def imap_unordered(self, fun, iterable):
+        return map(fun, iterable)
+
+def tiled_partition_accumulation(monkeypatch, tile_index, proportions, height, width, max_iterations):
+    """
+    Run `FlowAccumulationPartition` over tiles of global `proportions`,
+    and return the mosaic of written accumulation tiles
+    """
+
+    out = np.zeros(proportions.shape[:2], dtype=np.float32)
+
+    def ReadProportions(row, col, params, **kwargs):
+        tile = proportions[row*height:(row+1)*height, col*width:(col+1)*width]
+        return np.ascontiguousarray(tile), dict()
+
+    class Writer():
+
+        def __init__(self, tile, mode, **profile):
+            self.row, self.col = tile
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def write(self, data, band):
+            out[
+                self.row*height:(self.row+1)*height,
+                self.col*width:(self.col+1)*width
+            ] = data
+
+    monkeypatch.setattr(MultipleFlow, 'tileindex', lambda: tile_index)
+    monkeypatch.setattr(MultipleFlow, 'ReadProportions', ReadProportions)
+    monkeypatch.setattr(MultipleFlow, 'Pool', SerialPool)
+    monkeypatch.setattr(MultipleFlow, 'rio', SimpleNamespace(open=Writer))
+
+    params = SimpleNamespace(
+        acc=SimpleNamespace(tilename=lambda row, col, **kwargs: (row, col)),
+        coefficient=1.0,
+        tolerance=1e-3,
+        max_iterations=max_iterations)
+
+    MultipleFlow.FlowAccumulationPartition(params)
+
+    return out
+
+@pytest.mark.parametrize('dinf', [False, True])
+def test_flow_partition_proportions_sum_to_255(dinf):
+
+    elevations = synthetic_dem(40, 50, seed=2)
+    flow = d8_flow(elevations)
+
+    proportions = speedup.flow_partition(elevations, -99999.0, flow, dinf=dinf)
+    total = np.sum(proportions, axis=-1, dtype='int32')
+
+    assert np.all((total == 0) | (total == 255))
+    assert np.all(total[flow > 0] == 255)
+
+def test_tiled_partition_accumulation_matches_single_tile(monkeypatch, tileset):
+
+    rows, cols, height, width = 3, 3, 20, 25
+    tile_index = tileset(rows, cols, height, width)
+
+    elevations = synthetic_dem(rows*height, cols*width, seed=3)
+    proportions = speedup.flow_partition(elevations, -99999.0, d8_flow(elevations))
+    expected = speedup.partition_accumulation(proportions)
+
+    tiled = tiled_partition_accumulation(
+        monkeypatch, tile_index, proportions, height, width, max_iterations=100)
+
+    assert np.allclose(tiled, expected, rtol=1e-4)
+
+def test_last_iteration_inflows_are_accumulated(monkeypatch, tileset):
+
+    # flow crosses tiles (0, 2) -> (0, 1) -> (0, 0),
+    # which takes 2 exchange rounds after the first pass
+
+    rows, cols, height, width = 1, 3, 10, 10
+    tile_index = tileset(rows, cols, height, width)
+
+    y, x = np.mgrid[0:rows*height, 0:cols*width]
+    elevations = np.float32(x + 0.01*y)
+    proportions = speedup.flow_partition(elevations, -99999.0)
+    expected = speedup.partition_accumulation(proportions)
+
+    tiled = tiled_partition_accumulation(
+        monkeypatch, tile_index, proportions, height, width, max_iterations=1)
+
+    assert np.allclose(tiled, expected, rtol=1e-4)
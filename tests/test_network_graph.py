@@ -0,0 +1,61 @@
+# coding: utf-8
+
+"""
+Network graph tests
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import numpy as np
+
+from fct.drainage.NetworkGraph import NetworkGraph, endpoint_keys
+
+def test_node_ids():
+
+    # 10 -> 20 -> 40 <- 30
+    graph = NetworkGraph([10, 20, 30], [20, 40, 40])
+
+    ids = graph.node_ids([40, 10, 25, 50])
+
+    assert np.all(graph.keys[ids[:2]] == [40, 10])
+    assert np.all(ids[2:] == -1)
+
+def test_node_ids_empty_network():
+
+    graph = NetworkGraph([], [])
+
+    ids = graph.node_ids([1, 2, 3])
+
+    assert ids.shape == (3,)
+    assert np.all(ids == -1)
+
+def test_from_endpoints_connects_snapped_vertices():
+
+    # 1 -> 3 <- 2, 3 -> 4,
+    # with shared endpoints computed from different tile origins
+    first = [(2.5, 12.5), (12.5, 12.5), (7.5 + 1e-9, 7.5)]
+    last = [(7.5, 7.5 - 1e-9), (7.5, 7.5), (7.5, 2.5)]
+
+    graph = NetworkGraph.from_endpoints(first, last, 5.0)
+
+    assert len(graph) == 4
+
+    a = graph.node_ids(endpoint_keys(first, 5.0))
+    b = graph.node_ids(endpoint_keys(last, 5.0))
+
+    assert np.all(graph.down[a] == b)
+    assert b[0] == b[1] == a[2]
+    assert graph.level[b[2]] == 2
+
+def test_endpoint_keys_negative_cells():
+
+    keys = endpoint_keys([(-2.5, 2.5), (2.5, -2.5), (-2.5, -2.5), (2.5, 2.5)], 5.0)
+
+    assert len(np.unique(keys)) == 4
@@ -0,0 +1,108 @@
+# coding: utf-8
+
+"""
+Tile graph tests
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import numpy as np
+
+from fct import speedup
+from fct.drainage import TileGraph
+from synthetic import synthetic_dem, d8_flow
+
+def tiled_flow_accumulation(flow, tile_index, height, width):
+    """
+    Flow accumulation tile by tile,
+    with inlet contributions resolved over the tile graph,
+    as in `fct.drainage.Accumulate.FlowAccumulation`
+    """
+
+    def tile_flow(row, col):
+        return np.ascontiguousarray(
+            flow[row*height:(row+1)*height, col*width:(col+1)*width])
+
+    edges = list()
+    weights = list()
+    links = list()
+
+    for (row, col) in tile_index:
+
+        values = np.ones((1, height, width), dtype=np.float32)
+        outlets, areas, tile_links = speedup.tile_outlet_graph(tile_flow(row, col), values)
+        tile_edges, tile_weights, _ = TileGraph.edges_from_outlets(
+            row, col, outlets, areas, height, width)
+
+        edges.append(tile_edges)
+        weights.append(tile_weights)
+        links.append(TileGraph.links_from_pixels(row, col, tile_links))
+
+    # same graph as TileGraph.load_graph
+
+    edges = np.concatenate(edges)
+    weights = np.float64(np.concatenate(weights))
+    inlets = TileGraph.node_keys(edges['to_tile'], edges['ti'], edges['tj'])
+    links = np.concatenate(links)
+    links = links[np.isin(TileGraph.node_keys(links['tile'], links['i'], links['j']), inlets)]
+    edges = np.concatenate([edges, links])
+    weights = np.concatenate([weights, np.zeros((len(links), 1))])
+
+    keys, values = TileGraph.inlet_contributions(edges, weights)
+    contributions = {
+        gid: (i, j, tile_values)
+        for gid, i, j, tile_values
+        in TileGraph.group_by_tile(keys, values)
+    }
+
+    out = np.zeros_like(flow, dtype=np.float32)
+
+    for (row, col), tile in tile_index.items():
+
+        acc = np.ones((1, height, width), dtype=np.float32)
+
+        if tile.gid in contributions:
+            i, j, tile_values = contributions[tile.gid]
+            np.add.at(acc[0], (i, j), tile_values[:, 0])
+
+        speedup.flow_accumulation_multiband(tile_flow(row, col), acc)
+        out[row*height:(row+1)*height, col*width:(col+1)*width] = acc[0]
+
+    return out
+
+def test_inlet_contributions_match_global_accumulation(tileset):
+
+    rows, cols, height, width = 3, 3, 40, 50
+    tile_index = tileset(rows, cols, height, width)
+
+    flow = d8_flow(synthetic_dem(rows*height, cols*width, seed=1))
+    expected = speedup.flow_accumulation_fast(flow)
+    tiled = tiled_flow_accumulation(flow, tile_index, height, width)
+
+    assert np.allclose(tiled, expected)
+
+def test_inlet_contributions_exclude_in_tile_links(tileset):
+
+    tileset(1, 2, 4, 4)
+
+    # inlet (1, 0, 0) receives 5 from tile 0
+    # and flows through tile 1 to outlet (1, 3, 3),
+    # which is also an inlet receiving 2 from tile 0
+
+    edges = np.array([
+        (0, 0, 3, 1, 0, 0, 5.0),
+        (0, 3, 3, 1, 3, 3, 2.0),
+        (1, 0, 0, 1, 3, 3, 0.0)
+    ], dtype=TileGraph.EDGE_DTYPE)
+
+    keys, values = TileGraph.inlet_contributions(edges)
+
+    assert np.all(keys == TileGraph.node_keys([1, 1], [0, 3], [0, 3]))
+    assert np.allclose(values[:, 0], [5.0, 2.0])
@@ -0,0 +1,198 @@
+# coding: utf-8
+
+"""
+Synthetic on-disk workspaces and raster tiles for tests
+
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 3 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+
+import numpy as np
+import rasterio as rio
+from rasterio.transform import Affine
+import fiona
+import fiona.crs
+
+from fct.config import config
+
+SRID = 2154
+
+def write_tileset(
+        filename,
+        rows,
+        cols,
+        height,
+        width,
+        resolution=5.0,
+        x0=0.0,
+        y0=0.0):
+    """
+    Write tileset index of `rows` x `cols` tiles
+    of `height` x `width` pixels,
+    with top-left corner (x0, y0)
+    """
+
+    schema = {
+        'geometry': 'Polygon',
+        'properties': [
+            ('GID', 'int'),
+            ('ROW', 'int'),
+            ('COL', 'int'),
+            ('X0', 'float'),
+            ('Y0', 'float')
+        ]
+    }
+
+    options = dict(driver='GPKG', crs=fiona.crs.from_epsg(SRID), schema=schema)
+
+    with fiona.open(filename, 'w', **options) as dst:
+        for row in range(rows):
+            for col in range(cols):
+
+                minx = x0 + col*width*resolution
+                maxy = y0 - row*height*resolution
+                maxx = minx + width*resolution
+                miny = maxy - height*resolution
+
+                dst.write({
+                    'geometry': {
+                        'type': 'Polygon',
+                        'coordinates': [[
+                            (minx, maxy), (maxx, maxy), (maxx, miny),
+                            (minx, miny), (minx, maxy)
+                        ]]
+                    },
+                    'properties': {
+                        'GID': row*cols + col + 1,
+                        'ROW': row,
+                        'COL': col,
+                        'X0': minx,
+                        'Y0': maxy
+                    }
+                })
+
+def write_config(workdir, tilesets):
+    """
+    Write workspace configuration file in `workdir`,
+    with tilesets `name -> write_tileset arguments`,
+    and return its filename
+    """
+
+    lines = [
+        '[Workspace]',
+        'workdir=%s' % os.path.join(workdir, 'outputs'),
+        'srs=EPSG:%d' % SRID,
+        '',
+        '[Tilesets]'
+    ]
+
+    names = list(tilesets)
+
+    if 'default' not in tilesets:
+        lines.append('default = %s_TILESET' % names[0].upper())
+
+    for name in names:
+        lines.append('%s = %s_TILESET' % (name, name.upper()))
+
+    for name, arguments in tilesets.items():
+
+        index = os.path.join(workdir, '%s_tileset.gpkg' % name)
+        write_tileset(index, **arguments)
+
+        lines.extend([
+            '',
+            '[%s_TILESET]' % name.upper(),
+            'type=tileset',
+            'index=%s' % index,
+            'height=%d' % arguments['height'],
+            'width=%d' % arguments['width'],
+            'tiledir=%s' % name.upper(),
+            'resolution=%f' % (arguments['height'] * arguments.get('resolution', 5.0))
+        ])
+
+    filename = os.path.join(workdir, 'config.ini')
+
+    with open(filename, 'w') as fp:
+        fp.write('\n'.join(lines) + '\n')
+
+    return filename
+
+def tile_slices(tile, tileset):
+    """
+    Row and column slices of `tile` within the tileset mosaic
+    """
+
+    height = tileset.height
+    width = tileset.width
+    row0 = min(row for row, _ in tileset.tileindex)
+    col0 = min(col for _, col in tileset.tileindex)
+
+    return (
+        slice((tile.row-row0)*height, (tile.row-row0+1)*height),
+        slice((tile.col-col0)*width, (tile.col-col0+1)*width)
+    )
+
+def write_tiles(dataset, data, nodata, tileset='default', tiles=None):
+    """
+    Write mosaic `data` as tiles of `dataset`,
+    or only `tiles` (row, col) if given
+    """
+
+    ts = config.tileset(tileset)
+
+    for (row, col), tile in ts.tileindex.items():
+
+        if tiles is not None and (row, col) not in tiles:
+            continue
+
+        rows, cols = tile_slices(tile, ts)
+        resolution = (tile.bounds[2] - tile.bounds[0]) / ts.width
+
+        profile = dict(
+            driver='GTiff',
+            height=ts.height,
+            width=ts.width,
+            count=1,
+            dtype=data.dtype.name,
+            crs='EPSG:%d' % SRID,
+            transform=Affine(resolution, 0, tile.x0, 0, -resolution, tile.y0),
+            nodata=nodata)
+
+        with rio.open(ts.tilename(dataset, row=row, col=col), 'w', **profile) as dst:
+            dst.write(data[rows, cols], 1)
+
+def read_tiles(dataset, tileset='default'):
+    """
+    Read tiles of `dataset` as one mosaic
+    """
+
+    ts = config.tileset(tileset)
+    rows = [row for row, _ in ts.tileindex]
+    cols = [col for _, col in ts.tileindex]
+    shape = (
+        (max(rows) - min(rows) + 1) * ts.height,
+        (max(cols) - min(cols) + 1) * ts.width
+    )
+    mosaic = None
+
+    for tile in ts.tileindex.values():
+
+        with rio.open(ts.tilename(dataset, row=tile.row, col=tile.col)) as ds:
+
+            data = ds.read(1)
+
+            if mosaic is None:
+                nodata = ds.nodata if ds.nodata is not None else 0
+                mosaic = np.full(shape, nodata, dtype=data.dtype)
+
+        mosaic[tile_slices(tile, ts)] = data
+
+    return mosaic
@@ -55,16 +55,17 @@ for tile in FlowDirection.config.tileset().tiles():
 from fct.drainage import Accumulate
 Accumulate.config.from_file('./tutorials/dem_to_dgo/config.ini')
 params = Accumulate.Parameters()
-params.elevations = 'dem-drainage-resolved'
 
 for tile in Accumulate.config.tileset().tiles():
     Accumulate.TileOutlets(row=tile.row, col=tile.col, params=params)
 
-Accumulate.AggregateOutlets(params)
-
 # Resolve inlets/outlets graph
 Accumulate.InletAreas(params=params)
 
+# Optional, for QA : export outlets and inlets as point shapefiles
+# Accumulate.ExportOutlets(params)
+# Accumulate.ExportInletAreas(params)
+
 # Flow accumulation
 for tile in Accumulate.config.tileset().tiles():
     Accumulate.FlowAccumulationTile(row=tile.row, col=tile.col, params=params, overwrite=True) 
@@ -93,10 +94,7 @@ StreamSources.AggregateNoFlowPixels()
 # StreamNetwork.config.from_file('./tutorials/dem_to_dgo/config.ini')
 # params = StreamNetwork.Parameters()
 
-# for tile in StreamNetwork.config.tileset().tiles():
-#     StreamNetwork.StreamToFeatureTile(row=tile.row, col=tile.col, params=params)
-
-# StreamNetwork.AggregateStreams(params)
+# StreamNetwork.AggregateStreams(params, processes=4)
 
 ##################################
 # Fix NoFlow pixels (needs a second tileset)
@@ -119,44 +117,34 @@ for tile in FixNoFlow.config.tileset().tiles():
 ##############################
 
 
-for tile in FixNoFlow.config.tileset().tiles():
-    FixNoFlow.NoFlowPixels(row=tile.row, col=tile.col, params=params)
-    
-FixNoFlow.AggregateNoFlowPixels(params)
+# Find and fix all no-flow pixels in one pass,
+# reading each tile once and writing fixed flow tiles in bulk
 
-from fct.drainage import FixNoFlow
-FixNoFlow.config.from_file('./tutorials/dem_to_dgo/config.ini')
-params = FixNoFlow.Parameters()
+FixNoFlow.FixNoFlowBatch(params, '10k', '10kbis', processes=4, fix=True)
 
-import fiona
-with fiona.open(params.noflow.filename(), 'r') as src:
-    
-    options = dict(driver=src.driver, crs=src.crs, schema=src.schema)
-    
-    with fiona.open(params.fixed.filename(), 'w', **options) as dst:
-            for f in src:
-
-                x, y = f['geometry']['coordinates']
-
-                try:
-
-                    tox, toy = FixNoFlow.FixNoFlow(x, y, '10k', '10kbis', params, fix=True)
-                    f['geometry']['coordinates'] = [tox, toy]
-                    dst.write(f)
-
-                except ValueError as error:
-
-                    print(f['properties']['GID'], error)
-                    continue
-        
 ################
 # Restart the process from flow accumulation and skip FixNoFlow part
 ################
 
-# Run identify Network Nodes with the QGIS Toolbox on RHTS_10K_NOATTR.shp and save the result in outputs/RHTS_Network.gpkg
+# Raster stream order (Strahler, Shreve, Hack, upstream length),
+# calculated from flow and accumulation tiles without any vector round trip
+
+from fct.drainage import StreamOrder
+StreamOrder.config.from_file('./tutorials/dem_to_dgo/config.ini')
+params = StreamOrder.Parameters()
+StreamOrder.StreamOrder(params, processes=4)
+
+# Join sources attributes to the stream network,
+# network nodes are identified from segment endpoints
+# snapped to the 5 m DEM grid
 
 from fct.drainage import JoinNetworkAttributes
-JoinNetworkAttributes.JoinNetworkAttributes('./tutorials/dem_to_dgo/inputs/sources.gpkg', './tutorials/dem_to_dgo/outputs/RHTS_Network.gpkg', './tutorials/dem_to_dgo/outputs/RHTS.shp')
+JoinNetworkAttributes.config.from_file('./tutorials/dem_to_dgo/config.ini')
+JoinNetworkAttributes.JoinNetworkAttributes(
+    './tutorials/dem_to_dgo/inputs/sources.gpkg',
+    JoinNetworkAttributes.config.tileset().filename('streams-from-sources'),
+    './tutorials/dem_to_dgo/outputs/RHTS.shp',
+    precision=5.0)
 JoinNetworkAttributes.AggregateByAxis('./tutorials/dem_to_dgo/outputs/RHTS.shp', './tutorials/dem_to_dgo/outputs/GLOBAL/MEASURE/REFAXIS.shp')
 
 ################